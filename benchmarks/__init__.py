@@ -0,0 +1 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
@@ -0,0 +1,259 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+"""
+Local stand-in for an OpenAI compatible chat completions API, used by the
+load test. Responses are generated at a configurable time to first token and
+token rate, requests offering tools get scripted tool calls before the final
+answer. Nothing is sent over the network.
+
+    python -m benchmarks.fake_llm_server --port 8765 --ttft 0.3 --tokens-per-second 50
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+import itertools
+import json
+import threading
+import time
+from typing import Optional
+
+from tornado import httpserver, netutil, web
+
+@dataclass
+class FakeLLMConfig:
+    # seconds until the first token of a response
+    ttft: float = 0.2
+    # output rate of responses, 0 for no delay between tokens
+    tokens_per_second: float = 100
+    # tokens in a chat response
+    response_tokens: int = 64
+    # tokens in an inline completion response (requests with max_tokens set)
+    inline_response_tokens: int = 16
+    # tool calls requested in turn when a request offers tools, one per
+    # round: {"name": <tool name, first offered tool if missing>, "arguments": {...}}
+    tool_calls: list[dict] = field(default_factory=list)
+
+class FakeLLMStats:
+    def __init__(self):
+        self.requests = 0
+        self.streamed_requests = 0
+        self.tool_call_responses = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, stream: bool, tool_call: bool, tokens: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.streamed_requests += 1 if stream else 0
+            self.tool_call_responses += 1 if tool_call else 0
+            self.output_tokens += tokens
+
+class ChatCompletionsHandler(web.RequestHandler):
+    _completion_ids = itertools.count(1)
+
+    def initialize(self, config: FakeLLMConfig, stats: FakeLLMStats):
+        self.config = config
+        self.stats = stats
+
+    async def post(self):
+        body = json.loads(self.request.body)
+        messages = body.get("messages", [])
+        stream = body.get("stream", False)
+        completion_id = f"chatcmpl-{next(ChatCompletionsHandler._completion_ids)}"
+        tool_call = self._next_tool_call(messages, body.get("tools") or [])
+        if tool_call is not None:
+            output_tokens = 0
+        elif body.get("max_tokens") is not None:
+            output_tokens = self.config.inline_response_tokens
+        else:
+            output_tokens = self.config.response_tokens
+        self.stats.record(stream, tool_call is not None, output_tokens)
+
+        started_at = time.monotonic()
+        await self._sleep_until(started_at + self.config.ttft)
+        if stream:
+            await self._stream_response(body["model"], completion_id, started_at, output_tokens, tool_call)
+        else:
+            await self._sleep_until(self._token_time(started_at, output_tokens - 1))
+            self._write_response(body["model"], completion_id, output_tokens, tool_call)
+
+    def _next_tool_call(self, messages: list[dict], tools: list[dict]) -> Optional[dict]:
+        if len(tools) == 0 or len(self.config.tool_calls) == 0:
+            return None
+        # one scripted tool call per round since the last user message
+        tool_round = 0
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                break
+            if message.get("role") == "assistant" and message.get("tool_calls"):
+                tool_round += 1
+        if tool_round >= len(self.config.tool_calls):
+            return None
+        scripted_call = self.config.tool_calls[tool_round]
+        return {
+            "id": f"call_{tool_round}_{next(ChatCompletionsHandler._completion_ids)}",
+            "type": "function",
+            "function": {
+                "name": scripted_call.get("name") or tools[0]["function"]["name"],
+                "arguments": json.dumps(scripted_call.get("arguments", {}))
+            }
+        }
+
+    def _token_time(self, started_at: float, token_index: int) -> float:
+        if self.config.tokens_per_second <= 0:
+            return started_at + self.config.ttft
+        return started_at + self.config.ttft + max(0, token_index) / self.config.tokens_per_second
+
+    async def _sleep_until(self, deadline: float) -> None:
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _stream_response(self, model: str, completion_id: str, started_at: float, output_tokens: int, tool_call: Optional[dict]) -> None:
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        if tool_call is not None:
+            delta = {"role": "assistant", "content": None, "tool_calls": [dict(tool_call, index=0)]}
+            self._write_event(self._chunk(model, completion_id, delta))
+        for i in range(output_tokens):
+            await self._sleep_until(self._token_time(started_at, i))
+            delta = {"role": "assistant", "content": FakeLLMServer.token(i)} if i == 0 else {"content": FakeLLMServer.token(i)}
+            self._write_event(self._chunk(model, completion_id, delta))
+            await self.flush()
+        self._write_event(self._chunk(model, completion_id, {}, "tool_calls" if tool_call is not None else "stop"))
+        self.write("data: [DONE]\n\n")
+        await self.finish()
+
+    def _write_event(self, data: dict) -> None:
+        self.write(f"data: {json.dumps(data)}\n\n")
+
+    def _chunk(self, model: str, completion_id: str, delta: dict, finish_reason: Optional[str] = None) -> dict:
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+
+    def _write_response(self, model: str, completion_id: str, output_tokens: int, tool_call: Optional[dict]) -> None:
+        message = {"role": "assistant", "content": "".join(FakeLLMServer.token(i) for i in range(output_tokens))}
+        if tool_call is not None:
+            message = {"role": "assistant", "content": None, "tool_calls": [tool_call]}
+        self.finish({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call is not None else "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": output_tokens, "total_tokens": output_tokens}
+        })
+
+class ModelsHandler(web.RequestHandler):
+    def get(self):
+        self.finish({"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "nbi"}]})
+
+class FakeLLMServer:
+    """
+    Serves the fake API on a local port from a background thread.
+
+    Usage:
+        with FakeLLMServer(FakeLLMConfig(ttft=0.1)) as server:
+            client = OpenAI(base_url=server.base_url, api_key="fake")
+    """
+    def __init__(self, config: FakeLLMConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeLLMConfig()
+        self.stats = FakeLLMStats()
+        self.host = host
+        self.port = port
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[httpserver.HTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    @staticmethod
+    def token(index: int) -> str:
+        return f"tok{index} "
+
+    def make_app(self) -> web.Application:
+        handler_args = {"config": self.config, "stats": self.stats}
+        return web.Application([
+            (r"/(?:v1/)?chat/completions", ChatCompletionsHandler, handler_args),
+            (r"/(?:v1/)?models", ModelsHandler),
+        ])
+
+    def start(self) -> "FakeLLMServer":
+        sockets = netutil.bind_sockets(self.port, self.host)
+        self.port = sockets[0].getsockname()[1]
+        started = threading.Event()
+
+        def _serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = httpserver.HTTPServer(self.make_app())
+            self._server.add_sockets(sockets)
+            self._loop.call_soon(started.set)
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=_serve, name="fake-llm-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._server.stop)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop = None
+
+    def __enter__(self) -> "FakeLLMServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--ttft", type=float, default=FakeLLMConfig.ttft, help="seconds until the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=FakeLLMConfig.tokens_per_second, help="output token rate, 0 for no delay")
+    parser.add_argument("--response-tokens", type=int, default=FakeLLMConfig.response_tokens, help="tokens in a chat response")
+    parser.add_argument("--inline-response-tokens", type=int, default=FakeLLMConfig.inline_response_tokens, help="tokens in an inline completion")
+    parser.add_argument("--tool-script", default=None, help="JSON file with the list of tool calls to request, one per round")
+    parser.add_argument("--tool-rounds", type=int, default=2, help="tool calls of the first offered tool to request when no tool script is given")
+
+def config_from_arguments(args: argparse.Namespace) -> FakeLLMConfig:
+    if args.tool_script is not None:
+        with open(args.tool_script, "r") as file:
+            tool_calls = json.load(file)
+    else:
+        tool_calls = [{"arguments": {}} for _ in range(args.tool_rounds)]
+    return FakeLLMConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        inline_response_tokens=args.inline_response_tokens,
+        tool_calls=tool_calls
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeLLMServer(config_from_arguments(args), args.host, args.port).start()
+    print(f"Fake LLM server listening on {server.base_url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+"""
+Load test of the chat websocket. Runs the websocket handler of the extension
+with the OpenAI compatible provider pointed at a local fake LLM server and
+drives simulated clients through chats, agent tool loops and inline
+completions. Reports throughput, latency percentiles, thread count and
+memory usage. No network access or Jupyter server is needed.
+
+    python -m benchmarks.load_test --clients 20 --requests 10 --mix chat=2,agent=1,inline=4
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Optional
+import uuid
+
+from tornado import httpserver, netutil, web, websocket
+
+# keep request logs out of the report, set NBI_LOG_LEVEL=INFO to see them
+os.environ.setdefault("NBI_LOG_LEVEL", "WARNING")
+
+from benchmarks.fake_llm_server import FakeLLMServer, add_config_arguments, config_from_arguments
+from notebook_intelligence.api import ChatRequest, ChatResponse, NotebookIntelligenceExtension, Tool, Toolset
+
+SCENARIOS = ["chat", "agent", "inline"]
+LOAD_TEST_EXTENSION_ID = "nbi-load-test"
+LOAD_TEST_TOOLSET_ID = "load-test"
+LOAD_TEST_TOOL_NAME = "simulate_work"
+# chat participants report failures to the user as a message starting with this
+FAILURE_MESSAGE_PREFIX = "Oops!"
+
+class FailedResponseError(Exception):
+    pass
+
+@dataclass
+class ScenarioStats:
+    latencies: list[float] = field(default_factory=list)
+    first_response_latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def percentile(self, values: list[float], p: float) -> float:
+        if len(values) == 0:
+            return 0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1)]
+
+    def summary(self, duration: float) -> dict:
+        return {
+            "completed": len(self.latencies),
+            "errors": self.errors,
+            "throughput": len(self.latencies) / duration if duration > 0 else 0,
+            "latency": {f"p{p}": self.percentile(self.latencies, p) for p in (50, 95, 99)},
+            "first_response": {f"p{p}": self.percentile(self.first_response_latencies, p) for p in (50, 95, 99)},
+        }
+
+class ResourceSampler:
+    """Samples the thread count and resident memory of the process"""
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss = 0
+
+    def sample(self) -> None:
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+        self.peak_rss = max(self.peak_rss, ResourceSampler.rss())
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            self.sample()
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+        self.sample()
+
+    @staticmethod
+    def rss() -> int:
+        """Resident set size in bytes"""
+        try:
+            with open("/proc/self/statm", "r") as file:
+                return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            pass
+        try:
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # kilobytes on Linux, bytes on macOS
+            return max_rss if sys.platform == "darwin" else max_rss * 1024
+        except ImportError:
+            return 0
+
+class NBIServer:
+    """
+    Runs the websocket handler of the extension on a local port from a
+    background thread, as the Jupyter server would. The user config is read
+    from a temporary home directory so that the load test does not use or
+    modify the real one.
+    """
+    def __init__(self, llm_base_url: str, chat_workers: int, inline_workers: int, tool_latency: float):
+        self.llm_base_url = llm_base_url
+        self.chat_workers = chat_workers
+        self.inline_workers = inline_workers
+        self.tool_latency = tool_latency
+        self.port = 0
+        self._temp_dir = tempfile.TemporaryDirectory(prefix="nbi-load-test-")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[httpserver.HTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def websocket_url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/notebook-intelligence/copilot"
+
+    def _write_config(self, home_dir: str) -> None:
+        properties = [
+            {"id": "api_key", "value": "fake"},
+            {"id": "model_id", "value": "fake-model"},
+            {"id": "base_url", "value": self.llm_base_url},
+            {"id": "context_window", "value": "32000"},
+        ]
+        config_dir = os.path.join(home_dir, ".jupyter", "nbi")
+        os.makedirs(config_dir, exist_ok=True)
+        with open(os.path.join(config_dir, "config.json"), "w") as file:
+            json.dump({
+                "chat_model": {"provider": "openai-compatible", "model": "openai-compatible-chat-model", "properties": properties},
+                "inline_completion_model": {"provider": "openai-compatible", "model": "openai-compatible-inline-completion-model", "properties": properties},
+            }, file)
+
+    def _setup(self) -> web.Application:
+        home_dir = os.path.join(self._temp_dir.name, "home")
+        root_dir = os.path.join(self._temp_dir.name, "root")
+        os.makedirs(root_dir, exist_ok=True)
+        self._write_config(home_dir)
+        os.environ["HOME"] = home_dir
+
+        import notebook_intelligence.extension as extension
+        from notebook_intelligence.ai_service_manager import AIServiceManager
+        from notebook_intelligence.request_scheduler import RequestScheduler
+        from notebook_intelligence.util import set_jupyter_root_dir
+
+        extension.NotebookIntelligence.root_dir = root_dir
+        set_jupyter_root_dir(root_dir)
+        extension.request_scheduler.stop()
+        extension.request_scheduler = RequestScheduler(chat_workers=self.chat_workers, interactive_workers=self.inline_workers)
+        ai_service_manager = AIServiceManager({"server_root_dir": root_dir})
+        ai_service_manager.websocket_connector = extension.websocket_hub
+        extension.ai_service_manager = ai_service_manager
+        extension_provider = _LoadTestExtension()
+        ai_service_manager.register_toolset(Toolset(LOAD_TEST_TOOLSET_ID, "Load test", "Tools of the load test", extension_provider, [_SimulateWorkTool(self.tool_latency)]))
+
+        return web.Application([
+            (r"/notebook-intelligence/copilot", extension.WebsocketCopilotHandler),
+        ])
+
+    def start(self) -> "NBIServer":
+        app = self._setup()
+        sockets = netutil.bind_sockets(0, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        started = threading.Event()
+
+        def _serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = httpserver.HTTPServer(app)
+            self._server.add_sockets(sockets)
+            self._loop.call_soon(started.set)
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=_serve, name="nbi-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self) -> None:
+        import notebook_intelligence.extension as extension
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.stop)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+            self._loop = None
+        extension.request_scheduler.stop()
+        extension.ai_service_manager.handle_stop_request()
+        self._temp_dir.cleanup()
+
+class _LoadTestExtension(NotebookIntelligenceExtension):
+    @property
+    def id(self) -> str:
+        return LOAD_TEST_EXTENSION_ID
+
+class _SimulateWorkTool(Tool):
+    """Agent tool that waits for `latency` seconds, as a notebook or file tool would"""
+    def __init__(self, latency: float):
+        self._latency = latency
+
+    @property
+    def name(self) -> str:
+        return LOAD_TEST_TOOL_NAME
+
+    @property
+    def title(self) -> str:
+        return "Simulate work"
+
+    @property
+    def tags(self) -> list[str]:
+        return []
+
+    @property
+    def description(self) -> str:
+        return "Simulates the work of a tool"
+
+    @property
+    def schema(self) -> dict:
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "strict": False,
+                "parameters": {"type": "object", "properties": {}, "required": []}
+            }
+        }
+
+    async def handle_tool_call(self, request: ChatRequest, response: ChatResponse, tool_context: dict, tool_args: dict) -> str:
+        await asyncio.sleep(self._latency)
+        return "done"
+
+class SimulatedClient:
+    """A browser tab sending one request at a time over its own websocket"""
+    def __init__(self, index: int, url: str, scenarios: list[str], stats: dict[str, ScenarioStats], timeout: float):
+        self.index = index
+        self.url = url
+        self.scenarios = scenarios
+        self.stats = stats
+        self.timeout = timeout
+        self.chat_id = uuid.uuid4().hex
+        self._connection: Optional[websocket.WebSocketClientConnection] = None
+
+    async def run(self) -> None:
+        self._connection = await websocket.websocket_connect(self.url)
+        try:
+            for i, scenario in enumerate(self.scenarios):
+                started_at = time.monotonic()
+                try:
+                    first_response_at = await asyncio.wait_for(self._send_request(scenario, i), self.timeout)
+                except (asyncio.TimeoutError, websocket.WebSocketClosedError, ConnectionError, FailedResponseError):
+                    self.stats[scenario].errors += 1
+                    if self._connection.protocol is None:
+                        self._connection = await websocket.websocket_connect(self.url)
+                    continue
+                self.stats[scenario].latencies.append(time.monotonic() - started_at)
+                self.stats[scenario].first_response_latencies.append(first_response_at - started_at)
+        finally:
+            self._connection.close()
+
+    async def _send_request(self, scenario: str, request_index: int) -> float:
+        message_id = uuid.uuid4().hex
+        if scenario == "inline":
+            await self._write("inline-completion-request", message_id, {
+                "chatId": self.chat_id,
+                # distinct prefixes so that completions are not served from cache
+                "prefix": f"def client_{self.index}_request_{request_index}(a, b):\n    ",
+                "suffix": "",
+                "language": "python",
+                "filename": f"client_{self.index}.py",
+            })
+        else:
+            tool_selections = {"extensions": {LOAD_TEST_EXTENSION_ID: {LOAD_TEST_TOOLSET_ID: [LOAD_TEST_TOOL_NAME]}}} if scenario == "agent" else {}
+            await self._write("chat-request", message_id, {
+                "chatId": self.chat_id,
+                "prompt": f"Request {request_index} of client {self.index}",
+                "language": "python",
+                "filename": f"client_{self.index}.py",
+                "currentDirectory": "",
+                "chatMode": "agent" if scenario == "agent" else "ask",
+                "toolSelections": tool_selections,
+            })
+
+        first_response_at = None
+        failed = False
+        while True:
+            message = await self._connection.read_message()
+            if message is None:
+                raise websocket.WebSocketClosedError()
+            if first_response_at is None:
+                first_response_at = time.monotonic()
+            msg = json.loads(message)
+            if msg.get("id") != message_id:
+                continue
+            if msg.get("type") == "stream-end":
+                if failed:
+                    raise FailedResponseError()
+                return first_response_at
+            failed = failed or FAILURE_MESSAGE_PREFIX in message
+            if msg.get("type") == "stream-message":
+                await self._confirm_tool_calls(msg)
+
+    async def _confirm_tool_calls(self, msg: dict) -> None:
+        data = msg.get("data")
+        if not isinstance(data, dict):
+            return
+        for choice in data.get("choices", []):
+            nbi_content = choice.get("delta", {}).get("nbiContent") or {}
+            if nbi_content.get("type") == "confirmation":
+                confirm_args = nbi_content["content"]["confirmArgs"]
+                await self._write("chat-user-input", confirm_args["id"], confirm_args["data"])
+
+    async def _write(self, message_type: str, message_id: str, data: dict) -> None:
+        await self._connection.write_message(json.dumps({"id": message_id, "type": message_type, "data": data}))
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        weights[name] = int(weight) if weight.strip() != "" else 1
+    return weights
+
+async def run_clients(url: str, clients: int, requests: int, weights: dict[str, int], timeout: float, seed: int) -> tuple[dict[str, ScenarioStats], float, ResourceSampler]:
+    stats = {scenario: ScenarioStats() for scenario in SCENARIOS}
+    rng = random.Random(seed)
+    population = [scenario for scenario, weight in weights.items() for _ in range(weight)]
+    simulated_clients = [
+        SimulatedClient(i, url, [rng.choice(population) for _ in range(requests)], stats, timeout)
+        for i in range(clients)
+    ]
+    sampler = ResourceSampler()
+    stop_sampling = asyncio.Event()
+    sampler_task = asyncio.create_task(sampler.run(stop_sampling))
+    started_at = time.monotonic()
+    await asyncio.gather(*[client.run() for client in simulated_clients])
+    duration = time.monotonic() - started_at
+    stop_sampling.set()
+    await sampler_task
+    return stats, duration, sampler
+
+def format_report(results: dict) -> str:
+    lines = [
+        f"clients: {results['clients']}, duration: {results['duration']:.2f}s, "
+        f"threads: {results['threads']['start']} at start, {results['threads']['peak']} peak, "
+        f"rss: {results['rss_mb']['start']:.1f} MB at start, {results['rss_mb']['peak']:.1f} MB peak",
+        "",
+        f"{'scenario':<10}{'done':>7}{'errors':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'first p50':>11}{'first p95':>11}",
+    ]
+    for scenario, summary in results["scenarios"].items():
+        latency = summary["latency"]
+        first_response = summary["first_response"]
+        lines.append(
+            f"{scenario:<10}{summary['completed']:>7}{summary['errors']:>8}{summary['throughput']:>9.2f}"
+            f"{latency['p50']:>9.3f}{latency['p95']:>9.3f}{latency['p99']:>9.3f}"
+            f"{first_response['p50']:>11.3f}{first_response['p95']:>11.3f}"
+        )
+    llm = results["llm_server"]
+    lines.append("")
+    lines.append(f"fake LLM server: {llm['requests']} requests, {llm['tool_call_responses']} tool calls, {llm['output_tokens']} tokens")
+    return "\n".join(lines)
+
+def run(args: argparse.Namespace) -> dict:
+    weights = parse_mix(args.mix)
+    start_threads = threading.active_count()
+    start_rss = ResourceSampler.rss()
+    with FakeLLMServer(config_from_arguments(args)) as llm_server:
+        nbi_server = NBIServer(llm_server.base_url, args.chat_workers, args.inline_workers, args.tool_latency).start()
+        try:
+            stats, duration, sampler = asyncio.run(run_clients(nbi_server.websocket_url, args.clients, args.requests, weights, args.timeout, args.seed))
+        finally:
+            nbi_server.stop()
+
+    return {
+        "clients": args.clients,
+        "duration": duration,
+        "threads": {"start": start_threads, "peak": sampler.peak_threads},
+        "rss_mb": {"start": start_rss / 2**20, "peak": sampler.peak_rss / 2**20},
+        "scenarios": {scenario: stats[scenario].summary(duration) for scenario in weights.keys()},
+        "llm_server": {
+            "requests": llm_server.stats.requests,
+            "tool_call_responses": llm_server.stats.tool_call_responses,
+            "output_tokens": llm_server.stats.output_tokens,
+        },
+    }
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test of the Notebook Intelligence chat websocket")
+    parser.add_argument("--clients", type=int, default=10, help="simulated clients, each with its own websocket")
+    parser.add_argument("--requests", type=int, default=10, help="requests sent by each client, one at a time")
+    parser.add_argument("--mix", default="chat=1,agent=1,inline=2", help="relative weights of the chat, agent and inline scenarios")
+    parser.add_argument("--tool-latency", type=float, default=0.05, help="seconds each agent tool call takes")
+    parser.add_argument("--chat-workers", type=int, default=8, help="chat request worker threads")
+    parser.add_argument("--inline-workers", type=int, default=4, help="inline completion worker threads")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds before a request is counted as failed")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the scenario order")
+    parser.add_argument("--json", dest="json_output", default=None, help="file to write the results to as JSON")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    print(format_report(results))
+    if args.json_output is not None:
+        with open(args.json_output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    errors = sum(summary["errors"] for summary in results["scenarios"].values())
+    return 1 if errors > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
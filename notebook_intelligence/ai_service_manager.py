@@ -18,9 +18,11 @@ from notebook_intelligence.llm_providers.litellm_compatible_llm_provider import
 from notebook_intelligence.llm_providers.ollama_llm_provider import OllamaLLMProvider
 from notebook_intelligence.llm_providers.openai_compatible_llm_provider import OpenAICompatibleLLMProvider
 from notebook_intelligence.mcp_manager import MCPManager
+from notebook_intelligence.metrics import Observation, chat_request_duration, chat_requests_in_flight, observe
 from notebook_intelligence.rule_manager import RuleManager
 from notebook_intelligence.skill_manager import SkillManager
 from notebook_intelligence.skill_reconciler import SkillReconciler
+from notebook_intelligence.tracing import tracer
 from notebook_intelligence.util import ThreadSafeWebSocketConnector, get_jupyter_root_dir
 
 log = logging.getLogger(__name__)
@@ -405,8 +407,14 @@ class AIServiceManager(Host):
         return self.chat_participants.get(prompt_parts.participant, DEFAULT_CHAT_PARTICIPANT_ID)
 
     async def handle_chat_request(self, request: ChatRequest, response: ChatResponse, options: dict = {}) -> None:
+        with tracer.span("chat.handle_request", chat_mode=request.chat_mode.id), \
+             observe(chat_request_duration, chat_requests_in_flight, request.cancel_token, participant="") as observation:
+            return await self._handle_chat_request(request, response, options, observation)
+
+    async def _handle_chat_request(self, request: ChatRequest, response: ChatResponse, options: dict, observation: Observation) -> None:
         is_claude_code_mode = self.is_claude_code_mode
         if not is_claude_code_mode and self.chat_model is None:
+            observation.outcome = "not_configured"
             response.stream(MarkdownData("Chat model is not set!"))
             response.stream(ButtonData("Configure", "notebook-intelligence:open-configuration-dialog"))
             response.finish()
@@ -416,7 +424,8 @@ class AIServiceManager(Host):
 
         # add MCP server prompt messages to chat history
         if prompt_parts.mcp_prompt_name != "":
-            mcp_server_prompt_messages = request.host.get_mcp_server_prompt_value(prompt_parts.mcp_server_name, prompt_parts.mcp_prompt_name, prompt_parts.mcp_arguments)
+            with tracer.span("mcp.get_prompt", server=prompt_parts.mcp_server_name, prompt=prompt_parts.mcp_prompt_name):
+                mcp_server_prompt_messages = request.host.get_mcp_server_prompt_value(prompt_parts.mcp_server_name, prompt_parts.mcp_prompt_name, prompt_parts.mcp_arguments)
             if mcp_server_prompt_messages is not None:
                 for message in mcp_server_prompt_messages:
                     request.chat_history.append(message)
@@ -425,6 +434,8 @@ class AIServiceManager(Host):
             request.chat_history.append({"role": "user", "content": prompt_parts.input})
     
         participant = self.chat_participants.get(prompt_parts.participant, DEFAULT_CHAT_PARTICIPANT_ID)
+        observation.labels["participant"] = participant.id
+        tracer.current_span().set_attribute("participant", participant.id)
         request.command = prompt_parts.command
         request.prompt = prompt_parts.input
         response.participant_id  = prompt_parts.participant
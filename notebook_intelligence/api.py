@@ -1,8 +1,9 @@
 # Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
 
 import asyncio
+from contextlib import aclosing
 import json
-from typing import Any, Callable, Dict, Union, Optional
+from typing import Any, AsyncIterator, Callable, Dict, Union, Optional
 from dataclasses import asdict, dataclass
 from enum import Enum
 import uuid
@@ -11,7 +12,12 @@ import logging
 from mcp.server.fastmcp.tools import Tool as MCPToolClass
 
 from notebook_intelligence.config import NBIConfig
+from notebook_intelligence.metrics import observe, tool_call_duration, tool_calls_in_flight
 from notebook_intelligence.ruleset import RuleContext
+from notebook_intelligence.streaming_aggregator import ContentDelta, StreamingResponseAggregator
+from notebook_intelligence.tokenizer import tokenizer
+from notebook_intelligence.tool_result_store import tool_result_store
+from notebook_intelligence.tracing import tracer
 from notebook_intelligence.util import ThreadSafeWebSocketConnector
 
 log = logging.getLogger(__name__)
@@ -25,10 +31,12 @@ class RequestDataType(str, Enum):
     CancelChatRequest = 'cancel-chat-request'
     InlineCompletionRequest = 'inline-completion-request'
     CancelInlineCompletionRequest = 'cancel-inline-completion-request'
+    ResumeStream = 'resume-stream'
 
 class BackendMessageType(str, Enum):
     StreamMessage = 'stream-message'
     StreamEnd = 'stream-end'
+    StreamHeader = 'stream-header'
     RunUICommand = 'run-ui-command'
     GitHubCopilotLoginStatusChange = 'github-copilot-login-status-change'
     MCPServerStatusChange = 'mcp-server-status-change'
@@ -88,7 +96,8 @@ class SignalImpl(Signal):
         super().__init__()
 
     def emit(self, *args, **kwargs) -> None:
-        for listener in self._listeners:
+        # listeners may disconnect while the signal is emitted
+        for listener in list(self._listeners):
             listener(*args, **kwargs)
 
 class CancelToken:
@@ -254,10 +263,14 @@ class ContextItem:
 class CompletionContext:
     items: list[ContextItem]
 
+class ChatResponseClosedError(Exception):
+    """Raised when waiting for a response from a client that has disconnected."""
+
 class ChatResponse:
     def __init__(self):
         self._user_input_signal: SignalImpl = SignalImpl()
         self._run_ui_command_response_signal: SignalImpl = SignalImpl()
+        self._closed = False
         self.participant_id = ''
 
     @property
@@ -269,6 +282,14 @@ class ChatResponse:
     
     def finish(self) -> None:
         raise NotImplemented
+
+    @property
+    def is_closed(self) -> bool:
+        """True once the client receiving the response has disconnected"""
+        return self._closed
+
+    def close(self) -> None:
+        self._closed = True
     
     @property
     def user_input_signal(self) -> Signal:
@@ -290,6 +311,10 @@ class ChatResponse:
             if resp["data"] is not None:
                 response.user_input_signal.disconnect(_on_user_input)
                 return resp["data"]
+            if response.is_closed:
+                # nobody is left to answer, treat as declined
+                response.user_input_signal.disconnect(_on_user_input)
+                return {"confirmed": False}
             await asyncio.sleep(0.1)
 
     async def run_ui_command(self, command: str, args: dict = {}) -> None:
@@ -315,6 +340,9 @@ class ChatResponse:
             if resp["result"] is not None:
                 response.run_ui_command_response_signal.disconnect(_on_ui_command_response)
                 return resp["result"]
+            if response.is_closed:
+                response.run_ui_command_response_signal.disconnect(_on_ui_command_response)
+                raise ChatResponseClosedError("Client disconnected before responding to UI command")
             await asyncio.sleep(0.1)
 
 @dataclass
@@ -350,6 +378,22 @@ class Tool:
     def schema(self) -> dict:
         raise NotImplemented
 
+    @property
+    def read_only(self) -> bool:
+        """
+        Read-only tools don't change any state, so their calls can run
+        concurrently with the other read-only calls of a model response.
+        """
+        return False
+
+    @property
+    def result_token_budget(self) -> Union[int, None]:
+        """
+        Tokens of a call result passed to the model, longer results are
+        truncated. None uses ChatParticipant.tool_result_token_budget.
+        """
+        return None
+
     def pre_invoke(self, request: ChatRequest, tool_args: dict) -> Union[ToolPreInvokeResponse, None]:
         return None
 
@@ -372,7 +416,7 @@ class Toolset:
         self.tools.remove(tool)
 
 class SimpleTool(Tool):
-    def __init__(self, tool_function: Callable, name: str, description: str, schema: dict, title: str = None, auto_approve: bool = False, has_var_args: bool = False):
+    def __init__(self, tool_function: Callable, name: str, description: str, schema: dict, title: str = None, auto_approve: bool = False, has_var_args: bool = False, read_only: bool = False):
         super().__init__()
         self._tool_function = tool_function
         self._name = name
@@ -381,6 +425,7 @@ class SimpleTool(Tool):
         self._title = title
         self._auto_approve = auto_approve
         self._has_var_args = has_var_args
+        self._read_only = read_only
 
     @property
     def name(self) -> str:
@@ -402,6 +447,10 @@ class SimpleTool(Tool):
     def schema(self) -> dict:
         return self._schema
 
+    @property
+    def read_only(self) -> bool:
+        return self._read_only
+
     def pre_invoke(self, request: ChatRequest, tool_args: dict) -> Union[ToolPreInvokeResponse, None]:
         confirmationTitle = None
         confirmationMessage = None
@@ -495,6 +544,13 @@ def auto_approve(tool: SimpleTool):
     tool._auto_approve = True
     return tool
 
+def read_only(tool: SimpleTool):
+    """
+    Decorator to mark a tool as read-only, its calls can run concurrently.
+    """
+    tool._read_only = True
+    return tool
+
 def tool(tool_function: Callable) -> SimpleTool:
     mcp_tool = MCPToolClass.from_function(tool_function)
     has_var_args = False
@@ -522,7 +578,55 @@ class ChatMode:
         self.name = name
         self.instructions = instructions
 
+# tokens added per message for role and separators
+MESSAGE_TOKEN_OVERHEAD = 4
+
+async def _message_token_count(message: dict) -> int:
+    content = message.get('content') or ''
+    if not isinstance(content, str):
+        content = json.dumps(content)
+    token_count = await tokenizer.acount_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+    if message.get('tool_calls'):
+        token_count += await tokenizer.acount_tokens(json.dumps(message['tool_calls']))
+    return token_count
+
+async def _tool_call_result_message(tool_call: dict, tool: Tool, tool_call_response: Any) -> dict:
+    token_budget = tool.result_token_budget
+    if token_budget is None:
+        token_budget = ChatParticipant.tool_result_token_budget
+    return {
+        "role": "tool",
+        "content": await tool_result_store.atruncate(str(tool_call_response), token_budget),
+        "tool_call_id": tool_call['id']
+    }
+
+@dataclass
+class _PreparedToolCall:
+    tool_call: dict
+    tool: Tool
+    args: dict
+    pre_invoke_response: Optional[ToolPreInvokeResponse]
+    # set once a call that runs concurrently is started
+    task: Optional[asyncio.Task] = None
+
+    @property
+    def runs_concurrently(self) -> bool:
+        # read-only tool calls that need no confirmation
+        return self.tool.read_only and (self.pre_invoke_response is None or self.pre_invoke_response.confirmationMessage is None)
+
 class ChatParticipant:
+    # maximum number of read-only tool calls of a model response run concurrently
+    tool_call_concurrency = 4
+    # maximum number of model calls made for a chat request with tools
+    max_tool_call_rounds = 25
+    # results of earlier tool calls are compacted once messages exceed this ratio of the context window
+    tool_context_compaction_ratio = 0.75
+    # tool call results up to this many tokens are not compacted
+    MIN_COMPACTED_TOOL_RESULT_TOKENS = 100
+    # tokens of a tool call result passed to the model, the full result of
+    # a longer one is kept in tool_result_store. 0 disables truncation
+    tool_result_token_budget = 8000
+
     @property
     def id(self) -> str:
         raise NotImplemented
@@ -556,6 +660,10 @@ class ChatParticipant:
         raise NotImplemented
     
     async def handle_chat_request_with_tools(self, request: ChatRequest, response: ChatResponse, options: dict = {}, tool_context: dict = {}, tool_choice = 'auto') -> None:
+        with tracer.span("chat.handle_request_with_tools", participant=self.id):
+            await self._handle_chat_request_with_tools(request, response, options, tool_context, tool_choice)
+
+    async def _handle_chat_request_with_tools(self, request: ChatRequest, response: ChatResponse, options: dict, tool_context: dict, tool_choice) -> None:
         tools = self.tools
 
         messages = request.chat_history.copy()
@@ -567,137 +675,249 @@ class ChatParticipant:
             ] + messages
 
         if len(tools) == 0:
-            request.host.chat_model.completions(messages, tools=None, cancel_token=request.cancel_token, response=response)
+            await request.host.chat_model.astream_completions(messages, response, cancel_token=request.cancel_token)
             return
 
+        # the model can page through tool call results that were truncated
+        tools = tools + [read_tool_result]
         openai_tools = [tool.schema for tool in tools]
 
 
-        tool_call_rounds = []
         # TODO overrides options arg
         options = {'tool_choice': tool_choice}
 
-        async def _tool_call_loop(tool_call_rounds: list):
-            try:
+        try:
+            # token counts of messages, counted once as they are added
+            token_counts = []
+            tools_token_count = await tokenizer.acount_tokens(json.dumps(openai_tools))
+
+            for _ in range(ChatParticipant.max_tool_call_rounds):
                 if request.cancel_token.is_cancel_requested:
                     return
 
-                tool_response = request.host.chat_model.completions(messages, openai_tools, cancel_token=request.cancel_token, options=options)
-                # after first call, set tool_choice to auto
-                options['tool_choice'] = 'auto'
-
-                for choice in tool_response['choices']:
-                    message = choice['message']
-                    # Some models use 'reasoning', some use 'reasoning_content'
-                    raw_reasoning = message.get('reasoning') or message.get('reasoning_content') or ''
-                    
-                    reasoning = ''
-                    if isinstance(raw_reasoning, dict):
-                        reasoning = (raw_reasoning.get('text') or 
-                                     raw_reasoning.get('content') or 
-                                     raw_reasoning.get('thought') or 
-                                     str(raw_reasoning))
-                    else:
-                        reasoning = str(raw_reasoning)
-                    
-                    content = message.get('content') or ''
-                    if not isinstance(content, str):
-                        content = str(content)
-                    
-                    if reasoning or content:
-                        response.stream(MarkdownData(content=content, reasoning_content=reasoning))
-
-                    if message.get('tool_calls', None) is not None:
-                        for tool_call in message['tool_calls']:
-                            tool_call_rounds.append(tool_call)
-
-                    messages.append(message)
-
-                had_tool_call = len(tool_call_rounds) > 0
-
-                # handle first tool calls
-                while len(tool_call_rounds) > 0:
+                await self._compact_tool_results(request, messages, token_counts, tools_token_count)
+
+                # assistant text is streamed as it arrives while tool calls are built up.
+                # read-only tool calls that need no confirmation run concurrently, the
+                # ones before any other call are started as soon as their arguments
+                # are complete
+                aggregator = StreamingResponseAggregator()
+                semaphore = asyncio.Semaphore(max(1, ChatParticipant.tool_call_concurrency))
+                prepared_calls: dict[str, _PreparedToolCall] = {}
+                start_early = True
+                try:
+                    # closed here on cancel, not finalized later in another context
+                    async with aclosing(request.host.chat_model.acompletions(messages, openai_tools, request.cancel_token, options)) as stream:
+                        async for data in stream:
+                            if request.cancel_token.is_cancel_requested:
+                                break
+                            if not isinstance(data, dict):
+                                response.stream(data)
+                                continue
+                            for event in aggregator.add(data):
+                                if isinstance(event, ContentDelta):
+                                    if event.reasoning_content:
+                                        response.stream(MarkdownPartData(reasoning_content=event.reasoning_content))
+                                    if event.content:
+                                        response.stream(MarkdownPartData(content=event.content))
+                                elif start_early:
+                                    prepared = self._prepare_tool_call(request, event.tool_call)
+                                    if prepared is None or not prepared.runs_concurrently:
+                                        start_early = False
+                                    else:
+                                        self._start_tool_call(request, response, tool_context, prepared, semaphore)
+                                    if prepared is not None:
+                                        prepared_calls[prepared.tool_call['id']] = prepared
                     if request.cancel_token.is_cancel_requested:
                         return
+                    aggregator.finish()
+                    # after first call, set tool_choice to auto
+                    options['tool_choice'] = 'auto'
 
-                    tool_call = tool_call_rounds[0]
-                    if "id" not in tool_call:
-                        tool_call['id'] = uuid.uuid4().hex
-                    tool_call_rounds = tool_call_rounds[1:]
+                    message = aggregator.message()
+                    messages.append(message)
 
-                    tool_name = tool_call['function']['name']
-                    tool_to_call = self._get_tool_by_name(tool_name)
-                    if tool_to_call is None:
-                        log.error(f"Tool not found: {tool_name}, args: {tool_call['function']['arguments']}")
-                        response.stream(MarkdownData("Oops! Failed to find requested tool. Please try again with a different prompt."))
+                    if message['tool_calls'] is None:
                         response.finish()
                         return
 
-                    if type(tool_call['function']['arguments']) is dict:
-                        args = tool_call['function']['arguments']
-                    elif not tool_call['function']['arguments'].startswith('{'):
-                        args = tool_call['function']['arguments']
-                    else:
-                        args = fuzzy_json_loads(tool_call['function']['arguments'])
-
-                    tool_properties = tool_to_call.schema["function"]["parameters"]["properties"]
-                    if type(args) is str:
-                        if len(tool_properties) == 1 and tool_call['function']['arguments'] is not None:
-                            tool_property = list(tool_properties.keys())[0]
-                            args = {tool_property: args}
-                        else:
-                            args = {}
-
-                    tool_pre_invoke_response = tool_to_call.pre_invoke(request, args)
-                    if tool_pre_invoke_response is not None:
-                        if tool_pre_invoke_response.message is not None:
-                            response.stream(MarkdownData(f"&#x2713; {tool_pre_invoke_response.message}...", tool_pre_invoke_response.detail))
-                        if tool_pre_invoke_response.confirmationMessage is not None:
-                            response.stream(ConfirmationData(
-                                title=tool_pre_invoke_response.confirmationTitle,
-                                message=tool_pre_invoke_response.confirmationMessage,
-                                confirmArgs={"id": response.message_id, "data": { "callback_id": tool_call['id'], "data": {"confirmed": True}}},
-                                cancelArgs={"id": response.message_id, "data": { "callback_id": tool_call['id'], "data": {"confirmed": False}}},
-                            ))
-                            user_input = await ChatResponse.wait_for_chat_user_input(response, tool_call['id'])
-                            if user_input['confirmed'] == False:
-                                response.finish()
-                                return
-
-                    tool_call_response = await tool_to_call.handle_tool_call(request, response, tool_context, args)
-
-                    function_call_result_message = {
-                        "role": "tool",
-                        "content": str(tool_call_response),
-                        "tool_call_id": tool_call['id']
-                    }
-
-                    messages.append(function_call_result_message)
-
-                if had_tool_call:
-                    await _tool_call_loop(tool_call_rounds)
-                    return
+                    # results are appended in the order of the calls
+                    concurrent_calls = []
+
+                    async def _run_concurrent_calls():
+                        results = await asyncio.gather(*[prepared.task for prepared in concurrent_calls], return_exceptions=True)
+                        for result in results:
+                            if isinstance(result, BaseException):
+                                raise result
+                        for prepared, tool_call_response in zip(concurrent_calls, results):
+                            messages.append(await _tool_call_result_message(prepared.tool_call, prepared.tool, tool_call_response))
+                        concurrent_calls.clear()
+
+                    for tool_call in message['tool_calls']:
+                        if request.cancel_token.is_cancel_requested:
+                            return
+
+                        if "id" not in tool_call:
+                            tool_call['id'] = uuid.uuid4().hex
+
+                        prepared = prepared_calls.get(tool_call['id'])
+                        if prepared is None:
+                            prepared = self._prepare_tool_call(request, tool_call)
+                        if prepared is None:
+                            log.error(f"Tool not found: {tool_call['function']['name']}, args: {tool_call['function']['arguments']}")
+                            response.stream(MarkdownData("Oops! Failed to find requested tool. Please try again with a different prompt."))
+                            response.finish()
+                            return
+
+                        if prepared.runs_concurrently:
+                            if prepared.task is None:
+                                self._start_tool_call(request, response, tool_context, prepared, semaphore)
+                            concurrent_calls.append(prepared)
+                            continue
+
+                        # the calls before this one are completed first
+                        if len(concurrent_calls) > 0:
+                            await _run_concurrent_calls()
+
+                        tool_pre_invoke_response = prepared.pre_invoke_response
+                        if tool_pre_invoke_response is not None:
+                            if tool_pre_invoke_response.message is not None:
+                                response.stream(MarkdownData(f"&#x2713; {tool_pre_invoke_response.message}...", tool_pre_invoke_response.detail))
+                            if tool_pre_invoke_response.confirmationMessage is not None:
+                                response.stream(ConfirmationData(
+                                    title=tool_pre_invoke_response.confirmationTitle,
+                                    message=tool_pre_invoke_response.confirmationMessage,
+                                    confirmArgs={"id": response.message_id, "data": { "callback_id": tool_call['id'], "data": {"confirmed": True}}},
+                                    cancelArgs={"id": response.message_id, "data": { "callback_id": tool_call['id'], "data": {"confirmed": False}}},
+                                ))
+                                with tracer.span("tool.confirmation_wait", tool=prepared.tool.name):
+                                    user_input = await ChatResponse.wait_for_chat_user_input(response, tool_call['id'])
+                                if user_input['confirmed'] == False:
+                                    response.finish()
+                                    return
+
+                        tool_call_response = await self._call_tool(request, response, tool_context, prepared.tool, prepared.args)
+                        messages.append(await _tool_call_result_message(tool_call, prepared.tool, tool_call_response))
+
+                    if len(concurrent_calls) > 0:
+                        if request.cancel_token.is_cancel_requested:
+                            return
+                        await _run_concurrent_calls()
+                finally:
+                    # calls still running when the round stops early (cancel, error) are
+                    # cancelled, errors of the others are retrieved
+                    started = [prepared.task for prepared in prepared_calls.values() if prepared.task is not None]
+                    for task in started:
+                        task.cancel()
+                    await asyncio.gather(*started, return_exceptions=True)
+
+            log.warning(f"Tool call loop stopped after {ChatParticipant.max_tool_call_rounds} rounds")
+            response.stream(MarkdownData(f"Stopped after {ChatParticipant.max_tool_call_rounds} rounds of tool calls. Send a new message to continue."))
+            response.finish()
+        except Exception as e:
+            log.error(f"Error in tool call loop: {str(e)}")
+            response.stream(MarkdownData(f"Oops! I am sorry, there was a problem generating response with tools. Please try again. You can check server logs for more details."))
+            response.finish()
+
+    async def _compact_tool_results(self, request: ChatRequest, messages: list[dict], token_counts: list[int], tools_token_count: int) -> None:
+        """
+        Replaces the results of tool calls before the latest round with
+        stubs naming their handle in tool_result_store, oldest first, while
+        the messages take more than tool_context_compaction_ratio of the
+        context window of the model. token_counts keeps the counts of the
+        messages between rounds.
+        """
+        while len(token_counts) < len(messages):
+            token_counts.append(await _message_token_count(messages[len(token_counts)]))
+
+        try:
+            context_window = request.host.chat_model.context_window
+        except Exception:
+            return
+        if not isinstance(context_window, int) or context_window <= 0:
+            return
 
-                if len(tool_call_rounds) > 0:
-                    await _tool_call_loop(tool_call_rounds)
-                    return
-                else:
-                    response.finish()
-                    return
-            except Exception as e:
-                log.error(f"Error in tool call loop: {str(e)}")
-                response.stream(MarkdownData(f"Oops! I am sorry, there was a problem generating response with tools. Please try again. You can check server logs for more details."))
-                response.finish()
-                return
+        token_budget = int(ChatParticipant.tool_context_compaction_ratio * context_window) - tools_token_count
+        token_count = sum(token_counts)
+        if token_count <= token_budget:
+            return
 
-        await _tool_call_loop(tool_call_rounds)
+        # results of the latest round are kept as they are
+        latest_round_start = max((i for i, message in enumerate(messages) if message.get('role') == 'assistant'), default=0)
+        for i in range(latest_round_start):
+            if token_count <= token_budget:
+                break
+            message = messages[i]
+            if message.get('role') != 'tool' or token_counts[i] <= ChatParticipant.MIN_COMPACTED_TOOL_RESULT_TOKENS + MESSAGE_TOKEN_OVERHEAD:
+                continue
+            # messages are replaced, not changed, they may be shared with the chat history
+            messages[i] = {**message, 'content': tool_result_store.compact(message['content'])}
+            compacted_token_count = await _message_token_count(messages[i])
+            token_count -= token_counts[i] - compacted_token_count
+            token_counts[i] = compacted_token_count
+
+        log.debug(f"Compacted tool results to {token_count} tokens, budget: {token_budget}")
     
+    async def _call_tool(self, request: ChatRequest, response: ChatResponse, tool_context: dict, tool_to_call: Tool, args: dict) -> Any:
+        with tracer.span("tool.call", tool=tool_to_call.name), \
+             observe(tool_call_duration, tool_calls_in_flight, request.cancel_token, tool=tool_to_call.name):
+            return await tool_to_call.handle_tool_call(request, response, tool_context, args)
+
+    def _prepare_tool_call(self, request: ChatRequest, tool_call: dict) -> Optional['_PreparedToolCall']:
+        """Finds the tool of a tool call and parses its arguments, None if the tool is not found"""
+        tool_name = tool_call['function']['name']
+        tool_to_call = read_tool_result if tool_name == read_tool_result.name else self._get_tool_by_name(tool_name)
+        if tool_to_call is None:
+            return None
+
+        if type(tool_call['function']['arguments']) is dict:
+            args = tool_call['function']['arguments']
+        elif not tool_call['function']['arguments'].startswith('{'):
+            args = tool_call['function']['arguments']
+        else:
+            args = fuzzy_json_loads(tool_call['function']['arguments'])
+
+        tool_properties = tool_to_call.schema["function"]["parameters"]["properties"]
+        if type(args) is str:
+            if len(tool_properties) == 1 and tool_call['function']['arguments'] is not None:
+                tool_property = list(tool_properties.keys())[0]
+                args = {tool_property: args}
+            else:
+                args = {}
+
+        return _PreparedToolCall(tool_call, tool_to_call, args, tool_to_call.pre_invoke(request, args))
+
+    def _start_tool_call(self, request: ChatRequest, response: ChatResponse, tool_context: dict, prepared: '_PreparedToolCall', semaphore: asyncio.Semaphore) -> None:
+        """Starts a tool call that runs concurrently, at most tool_call_concurrency of them run at a time"""
+        tool_pre_invoke_response = prepared.pre_invoke_response
+        if tool_pre_invoke_response is not None and tool_pre_invoke_response.message is not None:
+            response.stream(MarkdownData(f"&#x2713; {tool_pre_invoke_response.message}...", tool_pre_invoke_response.detail))
+
+        async def _call():
+            async with semaphore:
+                return await self._call_tool(request, response, tool_context, prepared.tool, prepared.args)
+
+        prepared.task = asyncio.ensure_future(_call())
+
     def _get_tool_by_name(self, name: str) -> Tool:
         for tool in self.tools:
             if tool.name == name:
                 return tool
         return None
 
+@auto_approve
+@read_only
+@tool
+async def read_tool_result(handle: str, start_line: int = 1, line_count: int = 200) -> str:
+    """Reads lines of a tool call result that was too long and was truncated. Use it only when the omitted lines are needed.
+
+    Args:
+        handle: Handle of the stored result, given in the note of the truncated result
+        start_line: 1-based line to start reading at
+        line_count: Maximum number of lines to read
+    """
+    return tool_result_store.read_lines(handle, int(start_line), int(line_count), ChatParticipant.tool_result_token_budget)
+
 class CompletionContextProvider:
     @property
     def id(self) -> str:
@@ -761,14 +981,75 @@ class AIModel(LLMPropertyProvider):
     def supports_tools(self) -> bool:
         return False
 
+_STREAM_FINISHED = object()
+
+class _ThreadedChatResponse(ChatResponse):
+    """Passes the parts streamed by completions in a worker thread to an event loop queue"""
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        super().__init__()
+        self._loop = loop
+        self._queue = queue
+
+    def stream(self, data: ResponseStreamData, finish: bool = False) -> None:
+        self._put(data)
+        if finish:
+            self.finish()
+
+    def finish(self) -> None:
+        self._put(_STREAM_FINISHED)
+
+    def _put(self, data) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, data)
+        except RuntimeError:
+            # the consumer stopped iterating and its loop is closed
+            pass
+
 class ChatModel(AIModel):
     def completions(self, messages: list[dict], tools: list[dict] = None, response: ChatResponse = None, cancel_token: CancelToken = None, options: dict = {}) -> Any:
         raise NotImplemented
 
+    async def acompletions(self, messages: list[dict], tools: list[dict] = None, cancel_token: CancelToken = None, options: dict = {}) -> AsyncIterator[Union[dict, ResponseStreamData]]:
+        """
+        Async counterpart of streamed completions, yields the parts that
+        completions would pass to ChatResponse.stream as they arrive. Providers
+        override it with a native implementation, the default one runs
+        completions in a worker thread so that third-party models keep working.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        response = _ThreadedChatResponse(loop, queue)
+        completions_task = asyncio.ensure_future(asyncio.to_thread(self.completions, messages, tools, response, cancel_token, options))
+        # completions may return without finishing the response
+        completions_task.add_done_callback(lambda _: queue.put_nowait(_STREAM_FINISHED))
+        while True:
+            data = await queue.get()
+            if data is _STREAM_FINISHED:
+                break
+            yield data
+        result = await completions_task
+        # models that don't stream tool call rounds return the response instead
+        if result is not None:
+            yield result
+
+    async def astream_completions(self, messages: list[dict], response: ChatResponse, tools: list[dict] = None, cancel_token: CancelToken = None, options: dict = {}) -> None:
+        """Streams acompletions to response and finishes it, like completions with a response"""
+        async for data in self.acompletions(messages, tools, cancel_token, options):
+            response.stream(data)
+        response.finish()
+
 class InlineCompletionModel(AIModel):
     def inline_completions(prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
         raise NotImplemented
 
+    async def ainline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
+        """
+        Async counterpart of inline_completions. Providers override it with a
+        native implementation, the default one runs inline_completions in a
+        worker thread.
+        """
+        return await asyncio.to_thread(self.inline_completions, prefix, suffix, language, filename, context, cancel_token)
+
 class EmbeddingModel(AIModel):
     def embeddings(self, inputs: list[str]) -> Any:
         raise NotImplemented
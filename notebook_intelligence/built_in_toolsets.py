@@ -1,5 +1,6 @@
 # Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
 
+import asyncio
 from time import time
 from notebook_intelligence.api import ChatResponse, MarkdownPartData, Toolset
 import logging
@@ -60,6 +61,7 @@ async def add_code_cell(source: str, **args) -> str:
     return "Added code cell to notebook"
 
 @nbapi.auto_approve
+@nbapi.read_only
 @nbapi.tool
 async def get_number_of_cells(**args) -> str:
     """Get number of cells for the active notebook.
@@ -70,6 +72,7 @@ async def get_number_of_cells(**args) -> str:
     return str(ui_cmd_response)
 
 @nbapi.auto_approve
+@nbapi.read_only
 @nbapi.tool
 async def get_cell_type_and_source(cell_index: int, **args) -> str:
     """Get cell type and source for the cell at index for the active notebook.
@@ -84,6 +87,7 @@ async def get_cell_type_and_source(cell_index: int, **args) -> str:
 
 
 @nbapi.auto_approve
+@nbapi.read_only
 @nbapi.tool
 async def get_cell_output(cell_index: int, **args) -> str:
     """Get cell output for the cell at index for the active notebook.
@@ -178,6 +182,7 @@ async def create_new_python_file(code: str, **args) -> str:
     return f"Created new Python file at {file_path}"
 
 @nbapi.auto_approve
+@nbapi.read_only
 @nbapi.tool
 async def get_file_content(**args) -> str:
     """Returns the content of the current file.
@@ -233,24 +238,7 @@ def _get_safe_path(path: str) -> Path:
     
     return target_path
 
-@nbapi.tool
-async def search_files(
-    pattern: str,
-    directory: str = ".",
-    file_pattern: str = None,
-    **args
-) -> str:
-    """
-    Search for file content within all files matching a pattern in jupyter_root_dir.
-    Returns line matches with some context.
-
-    Args:
-        pattern: Glob pattern to search for files (e.g., "*.py", "**/*.txt")
-        directory: Directory to search in (relative to jupyter_root_dir, default is root)
-        file_pattern (optional): Additional glob pattern to filter files (e.g., "*.py").
-        content_pattern (optional): Text or regex pattern to search for inside files.
-        context_lines (optional): Lines of context around each match (default=2).
-    """
+def _search_files(pattern: str, directory: str, file_pattern: str, args: dict) -> str:
     import re
 
     jupyter_root_dir = get_jupyter_root_dir()
@@ -341,26 +329,28 @@ async def search_files(
     except Exception as e:
         return f"Error searching files: {str(e)}"
 
+@nbapi.read_only
 @nbapi.tool
-async def list_files(
-    pattern: str = "*",
-    directory: str = ".", 
-    recursive: bool = False, 
-    include_files: bool = True, 
-    include_dirs: bool = True, 
-    max_depth: int = 5, 
+async def search_files(
+    pattern: str,
+    directory: str = ".",
+    file_pattern: str = None,
     **args
 ) -> str:
-    """List files and/or directories within a directory in jupyter_root_dir.
+    """
+    Search for file content within all files matching a pattern in jupyter_root_dir.
+    Returns line matches with some context.
 
     Args:
-        pattern: Glob pattern to filter files (e.g., "*.py", "**/*.txt")
-        directory: Directory to list (relative to jupyter_root_dir, default is root)
-        recursive: Whether to list contents recursively (default False)
-        include_files: Whether to include files (default True)
-        include_dirs: Whether to include directories (default True)
-        max_depth: Maximum recursion depth (only applies if recursive=True, default 5)
+        pattern: Glob pattern to search for files (e.g., "*.py", "**/*.txt")
+        directory: Directory to search in (relative to jupyter_root_dir, default is root)
+        file_pattern (optional): Additional glob pattern to filter files (e.g., "*.py").
+        content_pattern (optional): Text or regex pattern to search for inside files.
+        context_lines (optional): Lines of context around each match (default=2).
     """
+    return await asyncio.to_thread(_search_files, pattern, directory, file_pattern, args)
+
+def _list_files(pattern: str, directory: str, recursive: bool, include_files: bool, include_dirs: bool, max_depth: int) -> str:
     try:
         list_dir = _get_safe_path(directory)
 
@@ -418,15 +408,30 @@ async def list_files(
     except Exception as e:
         return f"Error listing files: {str(e)}"
 
+@nbapi.read_only
 @nbapi.tool
-async def read_file(file_path: str, start_line: int = 1, end_line: int = -1, **args) -> str:
-    """Read lines from a file within jupyter_root_dir between start_line and end_line (inclusive).
-    
+async def list_files(
+    pattern: str = "*",
+    directory: str = ".", 
+    recursive: bool = False, 
+    include_files: bool = True, 
+    include_dirs: bool = True, 
+    max_depth: int = 5, 
+    **args
+) -> str:
+    """List files and/or directories within a directory in jupyter_root_dir.
+
     Args:
-        file_path: Path to the file (relative to jupyter_root_dir)
-        start_line: 1-based line number to start reading from (default = 1)
-        end_line: 1-based line number to stop reading at (inclusive, default = -1 for end of file)
+        pattern: Glob pattern to filter files (e.g., "*.py", "**/*.txt")
+        directory: Directory to list (relative to jupyter_root_dir, default is root)
+        recursive: Whether to list contents recursively (default False)
+        include_files: Whether to include files (default True)
+        include_dirs: Whether to include directories (default True)
+        max_depth: Maximum recursion depth (only applies if recursive=True, default 5)
     """
+    return await asyncio.to_thread(_list_files, pattern, directory, recursive, include_files, include_dirs, max_depth)
+
+def _read_file(file_path: str, start_line: int, end_line: int) -> str:
     try:
         target_file = _get_safe_path(file_path)
         
@@ -454,6 +459,18 @@ async def read_file(file_path: str, start_line: int = 1, end_line: int = -1, **a
     except Exception as e:
         return f"Error reading file: {str(e)}"
 
+@nbapi.read_only
+@nbapi.tool
+async def read_file(file_path: str, start_line: int = 1, end_line: int = -1, **args) -> str:
+    """Read lines from a file within jupyter_root_dir between start_line and end_line (inclusive).
+    
+    Args:
+        file_path: Path to the file (relative to jupyter_root_dir)
+        start_line: 1-based line number to start reading from (default = 1)
+        end_line: 1-based line number to stop reading at (inclusive, default = -1 for end of file)
+    """
+    return await asyncio.to_thread(_read_file, file_path, start_line, end_line)
+
 @nbapi.tool
 async def insert_content(file_path: str, line_number: int, content: str, **args) -> str:
     """Insert content at a specific line in a file within jupyter_root_dir.
@@ -0,0 +1,75 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Optional
+
+from notebook_intelligence.config import NBIConfig
+
+@dataclass
+class _Snapshot:
+    version: int
+    config_fingerprint: tuple
+    etag: str
+    body: str
+
+class CapabilitiesSnapshot:
+    """
+    Serialized capabilities response, rebuilt only when its inputs change.
+    Changes to the config files are detected from their modification time
+    and size, other changes (MCP server and Claude status, model lists) are
+    reported with invalidate(). The ETag is a hash of the serialized response.
+    """
+    def __init__(self):
+        self._version = 0
+        self._snapshot: Optional[_Snapshot] = None
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+
+    def get(self, nbi_config: NBIConfig, build: Callable[[], dict]) -> tuple[str, str]:
+        """Returns (etag, body) of the current capabilities, calling build() if they are outdated"""
+        config_fingerprint = CapabilitiesSnapshot.config_fingerprint(nbi_config)
+        with self._lock:
+            version = self._version
+            snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version and snapshot.config_fingerprint == config_fingerprint:
+            return snapshot.etag, snapshot.body
+
+        # invalidations during the build are picked up by the next call
+        body = json.dumps(build())
+        etag = '"' + hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest() + '"'
+        with self._lock:
+            self.builds += 1
+            if self._snapshot is None or self._snapshot.version <= version:
+                self._snapshot = _Snapshot(version, config_fingerprint, etag, body)
+        return etag, body
+
+    @staticmethod
+    def config_fingerprint(nbi_config: NBIConfig) -> tuple:
+        config_files = [
+            nbi_config.env_config_file,
+            nbi_config.user_config_file,
+            nbi_config.env_mcp_file,
+            nbi_config.user_mcp_file,
+            nbi_config.deprecated_env_config_file,
+            nbi_config.deprecated_user_config_file
+        ]
+        fingerprint = []
+        for config_file in config_files:
+            try:
+                stat = os.stat(config_file)
+                fingerprint.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append(None)
+        return tuple(fingerprint)
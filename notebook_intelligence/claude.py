@@ -8,19 +8,23 @@ from enum import Enum
 from queue import Queue
 import threading
 import time
-from typing import Any
+from typing import Any, AsyncIterator
 import uuid
 import re
 from anyio.abc import Process
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic, DefaultAsyncHttpxClient
 from notebook_intelligence.api import AskUserQuestionData, BackendMessageType, CancelToken, ChatCommand, ChatModel, ChatRequest, ChatResponse, ClaudeToolType, CompletionContext, ConfirmationData, Host, InlineCompletionModel, MarkdownData, ProgressData, SignalImpl
 from notebook_intelligence.base_chat_participant import BaseChatParticipant
+from notebook_intelligence.client_cache import client_cache, loop_client_cache
+from notebook_intelligence.connection_aborter import ConnectionAborter
 from notebook_intelligence._version import __version__ as NBI_VERSION
 import base64
 import logging
 from claude_agent_sdk import AssistantMessage, PermissionResultAllow, PermissionResultDeny, TextBlock, UserMessage, create_sdk_mcp_server, ClaudeAgentOptions, ClaudeSDKClient, tool
 from anthropic.types.text_block import TextBlock as AnthropicTextBlock
 
+from notebook_intelligence.metrics import claude_queries_in_flight, claude_query_duration, instrument_acompletions, instrument_ainline_completions, instrument_completions, instrument_inline_completions, observe
+from notebook_intelligence.tracing import tracer
 from notebook_intelligence.util import ThreadSafeWebSocketConnector, get_jupyter_root_dir
 
 log = logging.getLogger(__name__)
@@ -157,6 +161,33 @@ def fetch_claude_models(api_key: str = None, base_url: str = None) -> list[dict]
         log.warning(f"Failed to fetch Claude models: {e}")
         return _claude_models_cache
 
+def _cached_anthropic_client(api_key: str | None, base_url: str | None):
+    """Anthropic client for the credentials, shared between models and requests"""
+    return client_cache.client(
+        "claude", base_url, api_key,
+        lambda: Anthropic(base_url=base_url, api_key=api_key,
+                          default_headers={"User-Agent": f"NotebookIntelligence/{NBI_VERSION}"})
+    )
+
+def _async_cached_anthropic_client(api_key: str | None, base_url: str | None):
+    """Async Anthropic client for the credentials, shared within the running event loop"""
+    return loop_client_cache().client(
+        "claude", base_url, api_key,
+        lambda: AsyncAnthropic(base_url=base_url, api_key=api_key,
+                               default_headers={"User-Agent": f"NotebookIntelligence/{NBI_VERSION}"},
+                               http_client=DefaultAsyncHttpxClient(event_hooks=ConnectionAborter.shared_async_httpx_event_hooks()))
+    )
+
+CLAUDE_INLINE_COMPLETION_SYSTEM_PROMPT = """You are a code completion assistant. Your task is to generate intelligent autocomplete suggestions for the code at the cursor position for given language and active file type. This is not an interactive session, don't ask for clarifying questions, always generate a suggestion. Don't include any explanations for your response, just generate the code. Don't return any thinking or reasoning, just generate the code. You are given a code snippet with a prefix and a suffix. You need to generate a suggestion for the code that fits best in place of <CURSOR/>. You should return only the code that fits best in place of <CURSOR/>. You should provide multiline code if needed. Enclose the code in triple backticks, just return the code in language. You should not return any other text, just the code. DO NOT INCLUDE THE PREFIX OR SUFFIX IN THE RESPONSE. .ipynb files are Jupyter notebook files and for notebook files, you generate suggestions for a cell within the notebook. A cell can be a code cell with code or a markdown cell with markdown text. If the language is markdown, only return markdown text. If you need to install a Python package within a notebook cell code (for .ipynb files), use %pip install <package_name> instead of !pip install <package_name>. Follow the tags very carefully for proper spacing and indentations."""
+
+def _inline_completion_messages(prefix: str, suffix: str, language: str, filename: str) -> list[dict]:
+    return [
+        {"role": "user", "content": f"""Generate a single suggestion that fits best in place of cursor. The code is below in between <CODE> tags and <CURSOR/> is the placeholder for the code to be filled in. Current language is {language} and the active file is {filename}.
+
+<CODE><PREFIX>{prefix}</PREFIX><CURSOR/><SUFFIX>{suffix}</SUFFIX></CODE>
+"""}
+    ]
+
 class ClaudeChatModel(ChatModel):
     def __init__(self, model_id: str, api_key: str = None, base_url: str = None):
         super().__init__(provider=None)
@@ -168,9 +199,8 @@ class ClaudeChatModel(ChatModel):
         self._model_name = model_info["name"]
         self._context_window = model_info["context_window"]
         self._supports_tools = True
-        self._client = Anthropic(base_url=_normalize_anthropic_credential(base_url),
-                                 api_key=_normalize_anthropic_credential(api_key),
-                                 default_headers={"User-Agent": f"NotebookIntelligence/{NBI_VERSION}"})
+        self._api_key = _normalize_anthropic_credential(api_key)
+        self._base_url = _normalize_anthropic_credential(base_url)
 
     @property
     def id(self) -> str:
@@ -188,12 +218,14 @@ class ClaudeChatModel(ChatModel):
     def supports_tools(self) -> bool:
         return self._supports_tools
 
+    @instrument_completions(provider_id="claude")
     def completions(self, messages: list[dict], tools: list[dict] = None, response: ChatResponse = None, cancel_token: CancelToken = None, options: dict = {}) -> Any:
-        resp = self._client.messages.create(
-            model=self._model_id,
-            max_tokens=10000,
-            messages=messages
-        )
+        with _cached_anthropic_client(self._api_key, self._base_url) as client:
+            resp = client.messages.create(
+                model=self._model_id,
+                max_tokens=10000,
+                messages=messages
+            )
 
         for block in resp.content:
             if isinstance(block, AnthropicTextBlock):
@@ -208,6 +240,26 @@ class ClaudeChatModel(ChatModel):
 
         response.finish()
 
+    @instrument_acompletions(provider_id="claude")
+    async def acompletions(self, messages: list[dict], tools: list[dict] = None, cancel_token: CancelToken = None, options: dict = {}) -> AsyncIterator[dict]:
+        with ConnectionAborter(cancel_token) as aborter, _async_cached_anthropic_client(self._api_key, self._base_url) as client:
+            try:
+                async with client.messages.stream(model=self._model_id, max_tokens=10000, messages=messages) as stream:
+                    async for text in stream.text_stream:
+                        if aborter.aborted:
+                            break
+                        yield {
+                            "choices": [{
+                                "delta": {
+                                    "role": "assistant",
+                                    "content": text
+                                }
+                            }]
+                        }
+            except Exception:
+                if not aborter.aborted:
+                    raise
+
 class ClaudeCodeInlineCompletionModel(InlineCompletionModel):
     def __init__(self, model_id: str, api_key: str = None, base_url: str = None):
         super().__init__(provider=None)
@@ -218,8 +270,8 @@ class ClaudeCodeInlineCompletionModel(InlineCompletionModel):
         self._model_id = model_id
         self._model_name = model_info["name"]
         self._context_window = model_info["context_window"]
-        self._client = Anthropic(base_url=_normalize_anthropic_credential(base_url),
-                                 api_key=_normalize_anthropic_credential(api_key))
+        self._api_key = _normalize_anthropic_credential(api_key)
+        self._base_url = _normalize_anthropic_credential(base_url)
 
     @property
     def id(self) -> str:
@@ -257,20 +309,18 @@ class ClaudeCodeInlineCompletionModel(InlineCompletionModel):
         # No code blocks found, return original with basic cleanup
         return text
 
+    @instrument_inline_completions(provider_id="claude")
     def inline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
         if cancel_token.is_cancel_requested:
             return ''
 
-        message = self._client.messages.create(
-            model=self._model_id,
-            max_tokens=10000,
-            system=f"""You are a code completion assistant. Your task is to generate intelligent autocomplete suggestions for the code at the cursor position for given language and active file type. This is not an interactive session, don't ask for clarifying questions, always generate a suggestion. Don't include any explanations for your response, just generate the code. Don't return any thinking or reasoning, just generate the code. You are given a code snippet with a prefix and a suffix. You need to generate a suggestion for the code that fits best in place of <CURSOR/>. You should return only the code that fits best in place of <CURSOR/>. You should provide multiline code if needed. Enclose the code in triple backticks, just return the code in language. You should not return any other text, just the code. DO NOT INCLUDE THE PREFIX OR SUFFIX IN THE RESPONSE. .ipynb files are Jupyter notebook files and for notebook files, you generate suggestions for a cell within the notebook. A cell can be a code cell with code or a markdown cell with markdown text. If the language is markdown, only return markdown text. If you need to install a Python package within a notebook cell code (for .ipynb files), use %pip install <package_name> instead of !pip install <package_name>. Follow the tags very carefully for proper spacing and indentations.""",
-            messages=[
-                {"role": "user", "content": f"""Generate a single suggestion that fits best in place of cursor. The code is below in between <CODE> tags and <CURSOR/> is the placeholder for the code to be filled in. Current language is {language} and the active file is {filename}.
-
-<CODE><PREFIX>{prefix}</PREFIX><CURSOR/><SUFFIX>{suffix}</SUFFIX></CODE>
-"""}]
-        )
+        with _cached_anthropic_client(self._api_key, self._base_url) as client:
+            message = client.messages.create(
+                model=self._model_id,
+                max_tokens=10000,
+                system=CLAUDE_INLINE_COMPLETION_SYSTEM_PROMPT,
+                messages=_inline_completion_messages(prefix, suffix, language, filename)
+            )
         code = ''
         for block in message.content:
             if cancel_token.is_cancel_requested:
@@ -282,6 +332,29 @@ class ClaudeCodeInlineCompletionModel(InlineCompletionModel):
             return ''
         return self._extract_llm_generated_code(code)
 
+    @instrument_ainline_completions(provider_id="claude")
+    async def ainline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
+        if cancel_token.is_cancel_requested:
+            return ''
+
+        with ConnectionAborter(cancel_token) as aborter, _async_cached_anthropic_client(self._api_key, self._base_url) as client:
+            try:
+                message = await client.messages.create(
+                    model=self._model_id,
+                    max_tokens=10000,
+                    system=CLAUDE_INLINE_COMPLETION_SYSTEM_PROMPT,
+                    messages=_inline_completion_messages(prefix, suffix, language, filename)
+                )
+            except Exception:
+                if aborter.aborted:
+                    return ''
+                raise
+
+        if cancel_token.is_cancel_requested:
+            return ''
+        code = ''.join(block.text for block in message.content if isinstance(block, AnthropicTextBlock))
+        return self._extract_llm_generated_code(code)
+
 
 class ClaudeCodeClient():
     def __init__(self, host: Host, client_options: ClaudeAgentOptions):
@@ -397,13 +470,14 @@ class ClaudeCodeClient():
         self._server_info = None
 
     def _mark_as_disconnected(self):
-        self._set_status(ClaudeAgentClientStatus.NotConnected)
+        server_info_changed = self._server_info is not None
+        self._server_info = None
+        self._set_status(ClaudeAgentClientStatus.NotConnected, server_info_changed=server_info_changed)
 
         self._client_queue = None
         self._client_thread_signal = None
         self._client_thread = None
         self._client = None
-        self._server_info = None
 
     def _update_server_info_async(self):
         thread = threading.Thread(target=self._update_server_info, args=())
@@ -413,13 +487,15 @@ class ClaudeCodeClient():
         with self._server_info_lock:
             self.update_server_info()
     
-    def _set_status(self, status: ClaudeAgentClientStatus):
+    def _set_status(self, status: ClaudeAgentClientStatus, server_info_changed: bool = False):
         self._status = status
         if self._websocket_connector is not None:
             try:
-                self._websocket_connector.write_message({
+                # only server info changes (participant commands) affect the
+                # capabilities. bursts are merged
+                self._websocket_connector.write_message_debounced(BackendMessageType.ClaudeCodeStatusChange, {
                         "type": BackendMessageType.ClaudeCodeStatusChange,
-                        "data": {}
+                        "data": {"status": status, "serverInfoChanged": server_info_changed}
                     })
             except Exception as e:
                 log.error(f"Error occurred while sending status message to websocket: {str(e)}")
@@ -641,11 +717,13 @@ class ClaudeCodeClient():
             return
         self._set_status(ClaudeAgentClientStatus.UpdatingServerInfo)
         response = self._send_claude_agent_request(ClaudeAgentEventType.GetServerInfo)
+        server_info_changed = False
         if response["success"]:
+            server_info_changed = response["data"] != self._server_info
             self._server_info = response["data"]
         else:
             log.error(f"Claude agent client failed to update server info: {response['error']}")
-        self._set_status(ClaudeAgentClientStatus.UpdatedServerInfo)
+        self._set_status(ClaudeAgentClientStatus.UpdatedServerInfo, server_info_changed=server_info_changed)
 
     @property
     def server_info(self) -> dict[str, Any] | None:
@@ -1044,13 +1122,16 @@ class ClaudeCodeChatParticipant(BaseChatParticipant):
 
         try:
             response.stream(ProgressData("Thinking..."))
-            result = self._client.query(request, response)
-            # query() returns a string when it bails early without dispatching —
-            # e.g. the agent isn't connected, a response timeout elapsed, or the
-            # worker thread died. Surface it so the user sees why instead of a
-            # silent spinner stop.
-            if isinstance(result, str) and result:
-                response.stream(MarkdownData(f"**Claude agent error:** {result}"))
+            with tracer.span("claude.query"), \
+                 observe(claude_query_duration, claude_queries_in_flight, request.cancel_token) as observation:
+                result = self._client.query(request, response)
+                # query() returns a string when it bails early without dispatching —
+                # e.g. the agent isn't connected, a response timeout elapsed, or the
+                # worker thread died. Surface it so the user sees why instead of a
+                # silent spinner stop.
+                if isinstance(result, str) and result:
+                    observation.outcome = "error"
+                    response.stream(MarkdownData(f"**Claude agent error:** {result}"))
         except Exception as e:
             log.error(f"Error while handling Claude chat request: {e}", exc_info=True)
             try:
@@ -1075,7 +1156,7 @@ class ClaudeCodeChatParticipant(BaseChatParticipant):
                 claude_settings.get('base_url', None)
             )
             messages = request.chat_history.copy()
-            chat_model.completions(messages, response=response, cancel_token=request.cancel_token)
+            await chat_model.astream_completions(messages, response, cancel_token=request.cancel_token)
         except Exception as e:
             log.error(f"Error while handling chat request!\n{e}")
             response.stream(MarkdownData(f"Oops! There was a problem handling chat request. Please try again with a different prompt."))
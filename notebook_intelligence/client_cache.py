@@ -0,0 +1,146 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+import asyncio
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import inspect
+import logging
+import threading
+from typing import Any, Callable, Iterator, Optional
+import weakref
+
+log = logging.getLogger(__name__)
+
+class _ClientEntry:
+    def __init__(self, key: tuple, client: Any):
+        self.key = key
+        self.client = client
+        self.in_use = 0
+        self.evicted = False
+
+class ClientCache:
+    """
+    Process wide cache of LLM SDK clients (OpenAI, Anthropic), keyed by
+    provider, base URL and a hash of the API key, so that requests reuse the
+    connection pool of a client instead of opening new connections each time.
+    Clients evicted while a request is using them are closed once the last
+    request releases them.
+
+    Connections of async clients are bound to the event loop that opened
+    them, they are cached per event loop, see loop_client_cache().
+
+    Usage:
+        with client_cache.client("openai-compatible", base_url, api_key, lambda: OpenAI(...)) as client:
+            client.chat.completions.create(...)
+    """
+    def __init__(self, max_clients: int = 16, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._max_clients = max_clients
+        # weak, the cache of a loop is dropped with the loop
+        self._loop_ref = weakref.ref(loop) if loop is not None else None
+        self._entries: OrderedDict[tuple, _ClientEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(provider_id: str, base_url: Optional[str], api_key: Optional[str]) -> tuple:
+        api_key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+        return (provider_id, base_url or "", api_key_hash)
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @contextmanager
+    def client(self, provider_id: str, base_url: Optional[str], api_key: Optional[str], factory: Callable[[], Any]) -> Iterator[Any]:
+        entry = self._acquire(ClientCache.key(provider_id, base_url, api_key), factory)
+        try:
+            yield entry.client
+        finally:
+            self._release(entry)
+
+    def invalidate(self, provider_id: str, base_url: Optional[str], api_key: Optional[str]) -> None:
+        key = ClientCache.key(provider_id, base_url, api_key)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            to_close = self._evict(entry) if entry is not None else None
+        self._close(to_close)
+
+    def clear(self) -> None:
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            to_close = [self._evict(entry) for entry in entries]
+        for client in to_close:
+            self._close(client)
+
+    def _acquire(self, key: tuple, factory: Callable[[], Any]) -> _ClientEntry:
+        to_close = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = _ClientEntry(key, factory())
+                self._entries[key] = entry
+                self.misses += 1
+                if len(self._entries) > self._max_clients:
+                    _, oldest = self._entries.popitem(last=False)
+                    to_close = self._evict(oldest)
+            entry.in_use += 1
+        self._close(to_close)
+        return entry
+
+    def _release(self, entry: _ClientEntry) -> None:
+        with self._lock:
+            entry.in_use -= 1
+            close = entry.evicted and entry.in_use == 0
+        if close:
+            self._close(entry.client)
+
+    def _evict(self, entry: _ClientEntry) -> Optional[Any]:
+        """Marks entry as evicted, returns its client if it can be closed now"""
+        entry.evicted = True
+        return entry.client if entry.in_use == 0 else None
+
+    def _close(self, client: Optional[Any]) -> None:
+        if client is None:
+            return
+        try:
+            # httpx.AsyncClient only has aclose()
+            close = getattr(client, "close", None) or client.aclose
+            result = close()
+            if inspect.isawaitable(result):
+                # async client, closed on its event loop (may be called from another thread)
+                loop = self._loop_ref() if self._loop_ref is not None else None
+                if loop is None or loop.is_closed():
+                    result.close()
+                else:
+                    loop.call_soon_threadsafe(loop.create_task, result)
+        except Exception as e:
+            log.debug(f"Failed to close cached client: {e}")
+
+client_cache = ClientCache()
+
+_loop_client_caches: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_loop_client_caches_lock = threading.Lock()
+
+def loop_client_cache() -> ClientCache:
+    """Cache of async clients for the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _loop_client_caches_lock:
+        cache = _loop_client_caches.get(loop)
+        if cache is None:
+            cache = ClientCache(loop=loop)
+            _loop_client_caches[loop] = cache
+        return cache
+
+def invalidate_clients(provider_id: str, base_url: Optional[str], api_key: Optional[str]) -> None:
+    """Drops the sync and async clients of the settings from all caches"""
+    with _loop_client_caches_lock:
+        caches = [client_cache] + list(_loop_client_caches.values())
+    for cache in caches:
+        cache.invalidate(provider_id, base_url, api_key)
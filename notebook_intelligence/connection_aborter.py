@@ -0,0 +1,208 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+from asyncio.trsock import TransportSocket
+from contextvars import ContextVar
+import logging
+import socket
+import threading
+from typing import Optional
+
+import httpx
+
+from notebook_intelligence.api import CancelToken
+
+log = logging.getLogger(__name__)
+
+# httpcore trace events returning the network stream of a new connection
+_CONNECT_TRACE_EVENTS = set(["connection.connect_tcp.complete", "connection.connect_unix_socket.complete"])
+
+# aborter of the provider call running in the current context, used by the
+# event hooks of httpx clients shared between calls
+_active_aborter: ContextVar = ContextVar("nbi_connection_aborter", default=None)
+
+class ConnectionAborter:
+    """
+    Aborts the HTTP connections of a provider call as soon as its cancel
+    token is cancelled. Closing a response from another thread doesn't unblock
+    a read that is waiting for the server, so the sockets of the call are
+    shut down instead, which makes the pending read fail right away.
+    Connections of tracked responses are only shut down while the response
+    holds them, once released to a connection pool they may be in use by
+    another request.
+
+    Usage:
+        with ConnectionAborter(cancel_token) as aborter:
+            client = httpx.Client(event_hooks=aborter.httpx_event_hooks())
+            ...
+            if aborter.aborted: ...
+
+    A client that is shared between calls uses
+    ConnectionAborter.shared_httpx_event_hooks() (or
+    shared_async_httpx_event_hooks() for an httpx.AsyncClient) instead, which
+    track the connections for the aborter entered in the calling context.
+    """
+    def __init__(self, cancel_token: Optional[CancelToken]):
+        self._cancel_token = cancel_token
+        self._sockets: list[socket.socket] = []
+        self._responses: list = []
+        self._lock = threading.Lock()
+        self._aborted = False
+        self._context_token = None
+
+    @property
+    def aborted(self) -> bool:
+        return self._aborted
+
+    def __enter__(self) -> "ConnectionAborter":
+        self._context_token = _active_aborter.set(self)
+        if self._cancel_token is not None:
+            self._cancel_token.cancellation_signal.connect(self.abort)
+            if self._cancel_token.is_cancel_requested:
+                self.abort()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            _active_aborter.reset(self._context_token)
+        except ValueError:
+            # exited in another context, e.g. an async generator finalized
+            # by the event loop
+            pass
+        if self._cancel_token is not None:
+            try:
+                self._cancel_token.cancellation_signal.disconnect(self.abort)
+            except ValueError:
+                pass
+        with self._lock:
+            self._sockets.clear()
+            self._responses.clear()
+
+    def abort(self) -> None:
+        with self._lock:
+            if self._aborted:
+                return
+            self._aborted = True
+            sockets = list(self._sockets)
+            responses = list(self._responses)
+        for response in responses:
+            sock = ConnectionAborter._get_response_socket(response)
+            if sock is not None:
+                sockets.append(sock)
+        for sock in sockets:
+            ConnectionAborter._shutdown(sock)
+
+    def track_socket(self, sock: Optional[socket.socket]) -> None:
+        if sock is None:
+            return
+        with self._lock:
+            if not self._aborted:
+                self._sockets.append(sock)
+                return
+        ConnectionAborter._shutdown(sock)
+
+    def track_response(self, response) -> None:
+        """Tracks the connection of a streaming requests or httpx response"""
+        sock = ConnectionAborter._get_response_socket(response)
+        with self._lock:
+            if not self._aborted:
+                # from now on the connection is tracked through the response,
+                # which stops tracking it once released to the pool
+                if sock is not None and sock in self._sockets:
+                    self._sockets.remove(sock)
+                self._responses.append(response)
+                return
+        if sock is not None:
+            ConnectionAborter._shutdown(sock)
+
+    def httpx_event_hooks(self) -> dict:
+        """Event hooks for an httpx client, tracking the connections its requests use"""
+        return {
+            "request": [self._on_httpx_request],
+            "response": [self.track_response],
+        }
+
+    @staticmethod
+    def shared_httpx_event_hooks() -> dict:
+        """Event hooks for an httpx client shared between calls"""
+        return {
+            "request": [ConnectionAborter._on_shared_httpx_request],
+            "response": [ConnectionAborter._on_shared_httpx_response],
+        }
+
+    @staticmethod
+    def shared_async_httpx_event_hooks() -> dict:
+        """Event hooks for an httpx.AsyncClient shared between calls"""
+        async def _on_request(request) -> None:
+            aborter = _active_aborter.get()
+            if aborter is not None:
+                aborter._on_httpx_request(request)
+                request.extensions["trace"] = aborter._on_async_httpx_trace
+
+        async def _on_response(response) -> None:
+            ConnectionAborter._on_shared_httpx_response(response)
+
+        return {
+            "request": [_on_request],
+            "response": [_on_response],
+        }
+
+    @staticmethod
+    def _on_shared_httpx_request(request) -> None:
+        aborter = _active_aborter.get()
+        if aborter is not None:
+            aborter._on_httpx_request(request)
+
+    @staticmethod
+    def _on_shared_httpx_response(response) -> None:
+        aborter = _active_aborter.get()
+        if aborter is not None:
+            aborter.track_response(response)
+
+    def _on_httpx_request(self, request) -> None:
+        # don't open new connections (e.g. client retries) once aborted
+        if self._aborted:
+            raise httpx.RequestError("Request aborted", request=request)
+        # new connections are tracked as soon as they are opened so that the
+        # wait for response headers can be aborted too
+        request.extensions["trace"] = self._on_httpx_trace
+
+    def _on_httpx_trace(self, event_name: str, info: dict) -> None:
+        if event_name in _CONNECT_TRACE_EVENTS:
+            network_stream = info.get("return_value")
+            if network_stream is not None:
+                self.track_socket(network_stream.get_extra_info("socket"))
+
+    async def _on_async_httpx_trace(self, event_name: str, info: dict) -> None:
+        self._on_httpx_trace(event_name, info)
+
+    @staticmethod
+    def _get_response_socket(response) -> Optional[socket.socket]:
+        try:
+            extensions = getattr(response, "extensions", None)
+            if extensions is not None:
+                # httpx
+                if response.is_closed:
+                    return None
+                network_stream = extensions.get("network_stream")
+                return network_stream.get_extra_info("socket") if network_stream is not None else None
+            raw = getattr(response, "raw", None)
+            if raw is not None:
+                # requests (urllib3), the connection is unset once released
+                connection = getattr(raw, "connection", None)
+                return getattr(connection, "sock", None)
+        except Exception as e:
+            log.debug(f"Failed to get socket of response: {e}")
+        return None
+
+    @staticmethod
+    def _shutdown(sock: socket.socket) -> None:
+        try:
+            if isinstance(sock, TransportSocket):
+                # socket of an asyncio transport, TLS is handled by the transport
+                sock.shutdown(socket.SHUT_RDWR)
+            else:
+                # bypass SSLSocket.shutdown which tears down the TLS state that
+                # may be in use by the reading thread
+                socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
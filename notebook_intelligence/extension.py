@@ -2,55 +2,63 @@
 
 import asyncio
 import atexit
+from collections import deque
 from dataclasses import asdict, dataclass
 import json
 from os import path
 import datetime as dt
+import itertools
 import os
 import shutil
 import tempfile
-from typing import Union
-import uuid
 import threading
+import time
+from typing import Optional, Union
+import uuid
 import logging
-import tiktoken
 
 from jupyter_server.extension.application import ExtensionApp
 from jupyter_server.base.handlers import APIHandler
-from jupyter_server.utils import url_path_join
+from jupyter_server.utils import ensure_async, url_path_join
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 import tornado
-from tornado import websocket
-from traitlets import Bool, Int, List, Unicode
-from notebook_intelligence.api import CancelToken, ChatMode, ChatResponse, ChatRequest, ContextRequest, ContextRequestType, RequestDataType, RequestToolSelection, ResponseStreamData, ResponseStreamDataType, BackendMessageType, SignalImpl
+from tornado import ioloop, websocket
+from traitlets import Bool, Float, Int, List, Unicode
+from notebook_intelligence.api import CancelToken, ChatMode, ChatParticipant, ChatResponse, ChatRequest, ContextRequest, ContextRequestType, MarkdownData, RequestDataType, RequestToolSelection, ResponseStreamData, ResponseStreamDataType, BackendMessageType, SignalImpl
 from notebook_intelligence.ai_service_manager import AIServiceManager
 from notebook_intelligence.claude import ClaudeCodeChatParticipant, fetch_claude_models
 from notebook_intelligence.claude_sessions import list_sessions as list_claude_sessions
 import notebook_intelligence.github_copilot as github_copilot
 from notebook_intelligence.built_in_toolsets import built_in_toolsets
-from notebook_intelligence.util import ThreadSafeWebSocketConnector, get_jupyter_root_dir, set_jupyter_root_dir, is_builtin_tool_enabled_in_env, is_provider_enabled_in_env
+from notebook_intelligence.capabilities_snapshot import CapabilitiesSnapshot
+from notebook_intelligence.client_cache import client_cache
+from notebook_intelligence.util import WebSocketHub, get_jupyter_root_dir, set_jupyter_root_dir, is_builtin_tool_enabled_in_env, is_provider_enabled_in_env
 from notebook_intelligence.context_factory import RuleContextFactory
+from notebook_intelligence.inline_completion_cache import InlineCompletionCache
+from notebook_intelligence.mcp_manager import describe_prompts, describe_tools
+import notebook_intelligence.metrics as metrics
+from notebook_intelligence.request_scheduler import RequestLane, RequestRejectedError, RequestScheduler
+from notebook_intelligence.single_flight import SingleFlight
+from notebook_intelligence.tokenizer import TRUNCATION_SUFFIX, tokenizer
+from notebook_intelligence.tool_result_store import ToolResultStore
+from notebook_intelligence.tracing import JsonlSpanExporter, OTLPSpanExporter, tracer
+from notebook_intelligence.upload_store import UploadQuotaExceededError, UploadStore
 from notebook_intelligence.skillset import SKILL_NAME_REGEX
 
 ai_service_manager: AIServiceManager = None
 log = logging.getLogger(__name__)
-tiktoken_encoding = tiktoken.encoding_for_model('gpt-4o')
-thread_safe_websocket_connector: ThreadSafeWebSocketConnector = None
-
+websocket_hub = WebSocketHub()
+request_scheduler = RequestScheduler()
+inline_completion_cache = InlineCompletionCache()
+inline_completion_single_flight = SingleFlight()
+capabilities_snapshot = CapabilitiesSnapshot()
 
-def _truncate_context_content(content: str, token_budget: int) -> str:
-    if token_budget <= 0 or content == '':
-        return ''
-
-    encoded = tiktoken_encoding.encode(content)
-    if len(encoded) <= token_budget:
-        return content
-
-    truncated = tiktoken_encoding.decode(encoded[:token_budget]).rstrip()
-    if truncated == '':
-        return ''
-
-    return truncated + "\n...[truncated]"
 
+def _invalidate_capabilities_on_status_change(message: dict):
+    # MCP server and Claude status changes alter the tools, prompts and
+    # participants the capabilities list
+    if message.get("type") in (BackendMessageType.MCPServerStatusChange, BackendMessageType.ClaudeCodeStatusChange):
+        capabilities_snapshot.invalidate()
 
 def _build_additional_context_message(
     file_path: str,
@@ -82,6 +90,17 @@ class GetCapabilitiesHandler(APIHandler):
 
     @tornado.web.authenticated
     def get(self):
+        etag, body = capabilities_snapshot.get(ai_service_manager.nbi_config, self._build_capabilities)
+        self.set_header("ETag", etag)
+        # clients revalidate with If-None-Match and get a 304 while unchanged
+        self.set_header("Cache-Control", "no-cache")
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return
+        self.finish(body)
+
+    def _build_capabilities(self) -> dict:
         ai_service_manager.nbi_config.load()
         ai_service_manager.update_models_from_config()
         nbi_config = ai_service_manager.nbi_config
@@ -100,8 +119,8 @@ class GetCapabilitiesHandler(APIHandler):
         mcp_server_tools = [{
             "id": mcp_server.name,
             "status": mcp_server.status,
-            "tools": [{"name": tool.name, "description": tool.description} for tool in mcp_server.get_tools()],
-            "prompts": [{"name": prompt.name, "description": prompt.description, "arguments": [{"name": argument.name, "description": argument.description, "required": argument.required} for argument in prompt.arguments]} for prompt in mcp_server.get_prompts()]
+            "tools": describe_tools(mcp_server.get_tools()),
+            "prompts": describe_prompts(mcp_server.get_prompts())
         } for mcp_server in mcp_servers]
         # sort by server id
         mcp_server_tools.sort(key=lambda server: server["id"])
@@ -169,7 +188,7 @@ class GetCapabilitiesHandler(APIHandler):
                 "iconPath": participant.icon_path,
                 "commands": [command.name for command in participant.commands]
             })
-        self.finish(json.dumps(response))
+        return response
 
 class ConfigHandler(APIHandler):
     @tornado.web.authenticated
@@ -201,6 +220,7 @@ class ConfigHandler(APIHandler):
                         default_chat_participant.update_client_debounced()
 
         ai_service_manager.nbi_config.save()
+        capabilities_snapshot.invalidate()
         if has_model_change or has_claude_settings_change:
             ai_service_manager.update_models_from_config()
         if has_claude_settings_change:
@@ -223,6 +243,7 @@ class UpdateProviderModelsHandler(APIHandler):
                 api_key=claude_settings.get('api_key', None),
                 base_url=claude_settings.get('base_url', None)
             )
+        capabilities_snapshot.invalidate()
         self.finish(json.dumps({}))
 
 class MCPConfigFileHandler(APIHandler):
@@ -242,6 +263,7 @@ class MCPConfigFileHandler(APIHandler):
             ai_service_manager.nbi_config.save()
             ai_service_manager.nbi_config.load()
             ai_service_manager.update_mcp_servers()
+            capabilities_snapshot.invalidate()
             self.finish(json.dumps({"status": "ok"}))
         except Exception as e:
             self.finish(json.dumps({"status": "error", "message": str(e)}))
@@ -252,6 +274,7 @@ class ReloadMCPServersHandler(APIHandler):
     def post(self):
         ai_service_manager.nbi_config.load()
         ai_service_manager.update_mcp_servers()
+        capabilities_snapshot.invalidate()
         self.finish(json.dumps({
             "mcpServers": [{"id": server.name} for server in ai_service_manager.get_mcp_servers()]
         }))
@@ -261,8 +284,10 @@ class EmitTelemetryEventHandler(APIHandler):
     def post(self):
         event = json.loads(self.request.body)
         log.debug(f"Telemetry event received: type={event.get('type')}, data={json.dumps(event.get('data', {}))}")
-        thread = threading.Thread(target=asyncio.run, args=(ai_service_manager.emit_telemetry_event(event),))
-        thread.start()
+        try:
+            request_scheduler.submit(ai_service_manager.emit_telemetry_event(event), lane=RequestLane.Background)
+        except RequestRejectedError as e:
+            log.warning(f"Dropped telemetry event: {e}")
         self.finish(json.dumps({}))
 
 class GetGitHubLoginStatusHandler(APIHandler):
@@ -616,6 +641,7 @@ class SkillBundleFileRenameHandler(SkillsBaseHandler):
 
 
 _upload_dir: str | None = None
+_upload_store: UploadStore | None = None
 
 def _get_upload_dir() -> str:
     """Return a temp directory for uploaded files, creating it on first call."""
@@ -625,8 +651,15 @@ def _get_upload_dir() -> str:
         atexit.register(lambda d=_upload_dir: shutil.rmtree(d, ignore_errors=True))
     return _upload_dir
 
+def _get_upload_store() -> UploadStore:
+    global _upload_store
+    upload_dir = _get_upload_dir()
+    if _upload_store is None or _upload_store.root_dir != upload_dir:
+        _upload_store = UploadStore(upload_dir)
+    return _upload_store
+
 class FileUploadHandler(APIHandler):
-    """Accepts a file upload and stores it in a temp directory.
+    """Accepts a multipart file upload and stores it in the upload store.
 
     Returns the absolute server-side path so the frontend can reference it
     in chat context and Claude Code can read it natively.
@@ -641,23 +674,65 @@ class FileUploadHandler(APIHandler):
             return
 
         upload = fileinfo[0]
-        original_name = upload.get("filename", "upload")
-        # Sanitise filename: keep only the basename to prevent path traversal.
-        safe_name = path.basename(original_name)
-        if not safe_name:
-            safe_name = "upload"
+        safe_name = UploadStore.safe_filename(upload.get("filename", "upload"))
+        try:
+            dest_path = _get_upload_store().put(safe_name, upload["body"])
+        except UploadQuotaExceededError as e:
+            self.set_status(413)
+            self.finish(json.dumps({"error": str(e)}))
+            return
 
-        upload_id = uuid.uuid4().hex[:12]
-        dest_dir = path.join(_get_upload_dir(), upload_id)
-        os.makedirs(dest_dir, exist_ok=True)
-        dest_path = path.join(dest_dir, safe_name)
+        self.finish(json.dumps({
+            "serverPath": dest_path,
+            "filename": safe_name,
+        }))
+
+@tornado.web.stream_request_body
+class StreamingFileUploadHandler(APIHandler):
+    """Accepts a file as the raw request body (filename in the `filename`
+    query argument) and writes it to the upload store as it arrives, so
+    large files are never held in memory.
+    """
+
+    async def prepare(self):
+        self._writer = None
+        await ensure_async(super().prepare())
+        # the body is consumed before post() runs, check access up front
+        if self.current_user is None:
+            raise tornado.web.HTTPError(403)
+        if self.request.method != "POST":
+            return
+        store = _get_upload_store()
+        content_length = int(self.request.headers.get("Content-Length", 0))
+        if content_length > store.quota:
+            raise tornado.web.HTTPError(413, f"File is larger than the upload quota of {store.quota} bytes")
+        self.request.connection.set_max_body_size(store.quota)
+        self._writer = store.begin(self.get_query_argument("filename", "upload"))
+
+    def data_received(self, chunk: bytes):
+        # the body of other methods, or of an upload that was rejected, is
+        # not stored
+        if self._writer is None:
+            return
+        try:
+            self._writer.write(chunk)
+        except UploadQuotaExceededError as e:
+            self._writer = None
+            raise tornado.web.HTTPError(413, str(e))
 
-        with open(dest_path, "wb") as fh:
-            fh.write(upload["body"])
+    def on_connection_close(self):
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+        super().on_connection_close()
 
+    @tornado.web.authenticated
+    def post(self):
+        writer, self._writer = self._writer, None
+        dest_path = writer.commit()
         self.finish(json.dumps({
             "serverPath": dest_path,
-            "filename": safe_name,
+            "filename": writer.filename,
         }))
 
 
@@ -720,57 +795,219 @@ class ClaudeSessionsResumeHandler(APIHandler):
 
         self.finish(json.dumps({"success": True, "session_id": session_id}))
 
+class ExtensionStatsCollector:
+    """Reports the state of the extension's queues and caches when metrics are scraped"""
+    def collect(self):
+        lane_metrics = {
+            "workers": GaugeMetricFamily("nbi_scheduler_workers", "Worker threads of request scheduler lanes", labels=["lane"]),
+            "queued": GaugeMetricFamily("nbi_scheduler_queued_requests", "Requests waiting for a worker", labels=["lane"]),
+            "running": GaugeMetricFamily("nbi_scheduler_running_requests", "Requests running on a worker", labels=["lane"]),
+            "completed": CounterMetricFamily("nbi_scheduler_completed_requests", "Requests completed by request scheduler lanes", labels=["lane"]),
+            "rejected": CounterMetricFamily("nbi_scheduler_rejected_requests", "Requests rejected because a lane queue was full", labels=["lane"]),
+        }
+        for lane, lane_stats in request_scheduler.stats().items():
+            for key, metric in lane_metrics.items():
+                metric.add_metric([lane], lane_stats[key])
+        yield from lane_metrics.values()
+
+        cache_stats = inline_completion_cache.stats()
+        yield GaugeMetricFamily("nbi_inline_completion_cache_entries", "Entries in the inline completion cache", value=cache_stats["entries"])
+        yield CounterMetricFamily("nbi_inline_completion_cache_hits", "Inline completion cache hits", value=cache_stats["hits"])
+        yield CounterMetricFamily("nbi_inline_completion_cache_misses", "Inline completion cache misses", value=cache_stats["misses"])
+        yield CounterMetricFamily("nbi_inline_completion_merged_requests", "Inline completion requests that shared an identical in-flight provider call", value=inline_completion_single_flight.merged)
+        yield GaugeMetricFamily("nbi_llm_client_cache_clients", "LLM SDK clients in the client cache", value=client_cache.size)
+        yield CounterMetricFamily("nbi_llm_client_cache_hits", "Provider calls that reused a cached LLM SDK client", value=client_cache.hits)
+        yield CounterMetricFamily("nbi_llm_client_cache_misses", "Provider calls that created an LLM SDK client", value=client_cache.misses)
+        yield GaugeMetricFamily("nbi_websocket_connections", "Open websocket connections", value=websocket_hub.connection_count)
+        yield GaugeMetricFamily("nbi_detached_chat_requests", "Chat requests waiting for their client to reconnect", value=len(detached_requests))
+        yield CounterMetricFamily("nbi_capabilities_builds", "Rebuilds of the capabilities response", value=capabilities_snapshot.builds)
+        if _upload_store is not None:
+            yield GaugeMetricFamily("nbi_upload_store_bytes", "Total size of stored uploads", value=_upload_store.total_size)
+            yield CounterMetricFamily("nbi_upload_store_deduplicated", "Uploads deduplicated by content", value=_upload_store.deduplicated)
+
+metrics.registry.register(ExtensionStatsCollector())
+
+class MetricsHandler(APIHandler):
+    """Serves the extension's metrics in the Prometheus text format."""
+
+    @tornado.web.authenticated
+    def get(self):
+        body, content_type = metrics.generate()
+        self.set_header("Content-Type", content_type)
+        self.finish(body)
+
+@dataclass
+class _ChatMessageInfo:
+    token_count: int
+    # participant id for user messages, None for others
+    participant: str = None
+
 class ChatHistory:
     """
-    History of chat messages, key is chat id, value is list of messages
-    keep the last 10 messages in the same chat participant
+    History of chat messages, key is chat id, value is list of messages.
+    Keeps the most recent messages of the same chat participant that fit in
+    the token budget of the current chat model. Token count and participant
+    of each message are computed once and cached.
     """
-    MAX_MESSAGES = 10
+    # upper bound on number of messages kept, regardless of token budget
+    MAX_MESSAGES = 100
+    # fraction of the chat model context window that history can use
+    CONTEXT_WINDOW_RATIO = 0.5
+    # fraction of the context window history, attached context and prompt of
+    # a request can use together, the rest is left for the response
+    REQUEST_CONTEXT_WINDOW_RATIO = 0.8
+    DEFAULT_CONTEXT_WINDOW = 4096
+    # approximate token overhead of message role and formatting
+    MESSAGE_TOKEN_OVERHEAD = 4
 
     def __init__(self):
         self.messages = {}
+        self._message_info: dict[str, list[_ChatMessageInfo]] = {}
 
     def clear(self, chatId = None):
         if chatId is None:
             self.messages = {}
+            self._message_info = {}
             return True
         elif chatId in self.messages:
             del self.messages[chatId]
+            self._message_info.pop(chatId, None)
             return True
 
         return False
 
     def add_message(self, chatId, message):
+        self._add_message(chatId, message, ChatHistory._create_message_info(message))
+
+    async def aadd_message(self, chatId, message):
+        """add_message counting the tokens of the message on the tokenizer worker pool"""
+        self._add_message(chatId, message, await ChatHistory._acreate_message_info(message))
+
+    def _add_message(self, chatId, message, info: _ChatMessageInfo):
         if chatId not in self.messages:
             self.messages[chatId] = []
+            self._message_info[chatId] = []
+
+        messages = self.messages[chatId]
+        message_info = self._message_info[chatId]
+        # messages appended to the list returned by get_history
+        self._update_message_info(messages, message_info)
 
         # clear the chat history if participant changed
-        if message["role"] == "user":
-            existing_messages = self.messages[chatId]
-            prev_user_message = next((m for m in reversed(existing_messages) if m["role"] == "user"), None)
-            if prev_user_message is not None:
-                current_prompt_parts = AIServiceManager.parse_prompt(message["content"])
-                prev_prompt_parts = AIServiceManager.parse_prompt(prev_user_message["content"])
-                if current_prompt_parts.participant != prev_prompt_parts.participant:
-                    self.messages[chatId] = []
-
-        self.messages[chatId].append(message)
-        # limit number of messages kept in history
-        if len(self.messages[chatId]) > ChatHistory.MAX_MESSAGES:
-            self.messages[chatId] = self.messages[chatId][-ChatHistory.MAX_MESSAGES:]
+        if info.participant is not None:
+            prev_user_info = next((i for i in reversed(message_info) if i.participant is not None), None)
+            if prev_user_info is not None and prev_user_info.participant != info.participant:
+                messages.clear()
+                message_info.clear()
+
+        messages.append(message)
+        message_info.append(info)
+        self._evict(messages, message_info)
 
     def get_history(self, chatId):
         return self.messages.get(chatId, [])
 
+    def get_token_count(self, chatId) -> int:
+        messages = self.messages.get(chatId)
+        if messages is None:
+            return 0
+        message_info = self._message_info[chatId]
+        self._update_message_info(messages, message_info)
+        return sum(info.token_count for info in message_info)
+
+    def get_token_budget(self) -> int:
+        chat_model = ai_service_manager.chat_model if ai_service_manager is not None else None
+        context_window = chat_model.context_window if chat_model is not None else ChatHistory.DEFAULT_CONTEXT_WINDOW
+        return int(ChatHistory.CONTEXT_WINDOW_RATIO * context_window)
+
+    def _evict(self, messages: list, message_info: list[_ChatMessageInfo]):
+        token_budget = self.get_token_budget()
+        total_tokens = sum(info.token_count for info in message_info)
+        evicted = False
+        # always keep the latest message
+        while len(messages) > 1 and (total_tokens > token_budget or len(messages) > ChatHistory.MAX_MESSAGES):
+            total_tokens -= message_info[0].token_count
+            del messages[0]
+            del message_info[0]
+            evicted = True
+        # after eviction, history should not start in the middle of an exchange
+        while evicted and len(messages) > 1 and messages[0].get("role") != "user":
+            del messages[0]
+            del message_info[0]
+
+    @staticmethod
+    def _update_message_info(messages: list, message_info: list[_ChatMessageInfo]):
+        for message in messages[len(message_info):]:
+            message_info.append(ChatHistory._create_message_info(message))
+
+    @staticmethod
+    def _create_message_info(message: dict) -> _ChatMessageInfo:
+        content = ChatHistory._message_content(message)
+        token_count = tokenizer.count_tokens(content) + tokenizer.count_tokens(message.get("reasoning_content") or "") + ChatHistory.MESSAGE_TOKEN_OVERHEAD
+        return _ChatMessageInfo(token_count, ChatHistory._message_participant(message, content))
+
+    @staticmethod
+    async def _acreate_message_info(message: dict) -> _ChatMessageInfo:
+        content = ChatHistory._message_content(message)
+        token_count = await tokenizer.acount_tokens(content) + await tokenizer.acount_tokens(message.get("reasoning_content") or "") + ChatHistory.MESSAGE_TOKEN_OVERHEAD
+        return _ChatMessageInfo(token_count, ChatHistory._message_participant(message, content))
+
+    @staticmethod
+    def _message_content(message: dict) -> str:
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        return content
+
+    @staticmethod
+    def _message_participant(message: dict, content: str) -> Optional[str]:
+        return AIServiceManager.parse_prompt(content).participant if message.get("role") == "user" else None
+
+# latest stream protocol supported by the websocket handler
+STREAM_PROTOCOL_VERSION = 2
+
+# frame kinds of stream protocol v2 text deltas
+STREAM_FRAME_KINDS = {
+    (ResponseStreamDataType.MarkdownPart, "content"): "md",
+    (ResponseStreamDataType.MarkdownPart, "reasoning_content"): "md-r",
+    (ResponseStreamDataType.LLMRaw, "content"): "raw",
+    (ResponseStreamDataType.LLMRaw, "reasoning_content"): "raw-r",
+}
+
 class WebsocketCopilotResponseEmitter(ChatResponse):
-    def __init__(self, chatId, messageId, websocket_handler, chat_history):
+    # coalescing of consecutive MarkdownPart / LLMRaw text deltas into a single
+    # frame. disabled when interval is 0. set from NotebookIntelligence config
+    coalesce_interval: float = 0
+    coalesce_max_bytes: int = 1024
+    # number of recent frames kept for replay to a client resuming the
+    # stream after reconnecting. set from NotebookIntelligence config
+    replay_buffer_size: int = 256
+
+    _stream_ids = itertools.count(1)
+
+    def __init__(self, chatId, messageId, websocket_handler, chat_history, protocol_version: int = 1):
         super().__init__()
         self.chatId = chatId
         self.messageId = messageId
         self.websocket_handler = websocket_handler
         self.chat_history = chat_history
+        # with stream protocol v2, text deltas are sent as compact
+        # {sid, seq, kind, text} frames after a single stream header
+        self.protocol_version = protocol_version
+        self._stream_id = None
+        self._stream_header = None
+        # every frame of the response is numbered, recent ones are kept for replay
+        self._seq = 0
+        self._replay_buffer = deque(maxlen=self.replay_buffer_size)
+        self._write_lock = threading.RLock()
         self.streamed_contents = []
         self.streamed_reasoning_contents = []
+        self._pending_delta = None
+        self._pending_delta_lock = threading.RLock()
+        self._flush_scheduled = False
+        # flushes of stalled streams are scheduled on the server IOLoop since
+        # the request worker loop can be blocked by synchronous provider calls
+        self._io_loop = ioloop.IOLoop.current() if self.coalesce_interval > 0 else None
 
     @property
     def chat_id(self) -> str:
@@ -783,6 +1020,24 @@ class WebsocketCopilotResponseEmitter(ChatResponse):
     def stream(self, data: Union[ResponseStreamData, dict]):
         data_type = ResponseStreamDataType.LLMRaw if type(data) is dict else data.data_type
 
+        text_delta = None
+        if self.coalesce_interval > 0 or self.protocol_version >= 2:
+            text_delta = WebsocketCopilotResponseEmitter._extract_text_delta(data_type, data)
+        if text_delta is not None:
+            field, text = text_delta
+            if field == "content":
+                self.streamed_contents.append(text)
+            else:
+                self.streamed_reasoning_contents.append(text)
+            if self.coalesce_interval > 0:
+                self._coalesce_delta(data_type, field, text)
+            else:
+                self._write_text_delta(data_type, field, text, dt.datetime.now().isoformat())
+            return
+
+        # anything that cannot be merged is sent after the pending deltas to preserve ordering
+        self.flush()
+
         if data_type == ResponseStreamDataType.Markdown:
             self.chat_history.add_message(self.chatId, {"role": "assistant", "content": data.content, "reasoning_content": data.reasoning_content})
             data = {
@@ -964,7 +1219,7 @@ class WebsocketCopilotResponseEmitter(ChatResponse):
                 if reasoning_content is not None:
                     self.streamed_reasoning_contents.append(reasoning_content)
 
-        self.websocket_handler.write_message({
+        self._send({
             "id": self.messageId,
             "participant": self.participant_id,
             "type": BackendMessageType.StreamMessage,
@@ -972,11 +1227,178 @@ class WebsocketCopilotResponseEmitter(ChatResponse):
             "created": dt.datetime.now().isoformat()
         })
 
+    def attach(self, websocket_handler, chat_history, last_seq: int) -> int:
+        """
+        Continue the response on a new connection. Frames sent after last_seq
+        are replayed before live streaming continues. Returns the number of
+        missed frames that are no longer buffered.
+        """
+        with self._write_lock:
+            self.websocket_handler = websocket_handler
+            self.chat_history = chat_history
+            frames = [frame for frame in self._replay_buffer if frame["seq"] > last_seq]
+            first_seq = frames[0]["seq"] if len(frames) > 0 else self._seq
+            missed = max(0, first_seq - max(last_seq + 1, 0))
+            if missed > 0:
+                websocket_handler.write_message({
+                    "id": self.messageId,
+                    "participant": self.participant_id,
+                    "type": BackendMessageType.StreamMessage,
+                    "data": {
+                        "choices": [
+                            {
+                                "delta": {
+                                    "nbiContent": {
+                                        "type": ResponseStreamDataType.Markdown,
+                                        "content": f"*{missed} parts of the response were lost while disconnected.*\n\n",
+                                        "reasoning_content": "",
+                                        "detail": None
+                                    },
+                                    "content": "",
+                                    "role": "assistant"
+                                }
+                            }
+                        ]
+                    },
+                    "created": dt.datetime.now().isoformat()
+                })
+            if self._stream_header is not None:
+                websocket_handler.write_message(self._stream_header)
+            for frame in frames:
+                websocket_handler.write_message(frame)
+            return missed
+
+    def _send(self, message: dict) -> None:
+        with self._write_lock:
+            message["seq"] = self._seq
+            self._seq += 1
+            self._replay_buffer.append(message)
+            self.websocket_handler.write_message(message)
+
+    def flush(self) -> None:
+        with self._pending_delta_lock:
+            pending = self._pending_delta
+            self._pending_delta = None
+            if pending is None:
+                return
+            self._write_text_delta(pending["data_type"], pending["field"], "".join(pending["parts"]), pending["created"])
+
+    def _write_text_delta(self, data_type: ResponseStreamDataType, field: str, text: str, created: str) -> None:
+        if self.protocol_version >= 2:
+            if self._stream_id is None:
+                self._stream_id = next(WebsocketCopilotResponseEmitter._stream_ids)
+                # the header isn't numbered, it is sent again on every resume
+                self._stream_header = {
+                    "id": self.messageId,
+                    "type": BackendMessageType.StreamHeader,
+                    "v": 2,
+                    "sid": self._stream_id,
+                    "participant": self.participant_id,
+                    "created": created
+                }
+                with self._write_lock:
+                    self.websocket_handler.write_message(self._stream_header)
+            self._send({
+                "sid": self._stream_id,
+                "kind": STREAM_FRAME_KINDS[(data_type, field)],
+                "text": text
+            })
+            return
+
+        if data_type == ResponseStreamDataType.MarkdownPart:
+            data = {
+                "choices": [
+                    {
+                        "delta": {
+                            "nbiContent": {
+                                "type": ResponseStreamDataType.MarkdownPart,
+                                "content": text if field == "content" else "",
+                                "reasoning_content": text if field == "reasoning_content" else ""
+                            },
+                            "content": "",
+                            "role": "assistant"
+                        }
+                    }
+                ]
+            }
+        else:
+            data = {
+                "choices": [
+                    {
+                        "delta": {
+                            field: text,
+                            "role": "assistant"
+                        }
+                    }
+                ]
+            }
+        self._send({
+            "id": self.messageId,
+            "participant": self.participant_id,
+            "type": BackendMessageType.StreamMessage,
+            "data": data,
+            "created": created
+        })
+
+    @staticmethod
+    def _extract_text_delta(data_type: ResponseStreamDataType, data: Union[ResponseStreamData, dict]) -> Union[tuple[str, str], None]:
+        """
+        Returns (field, text) if data is a plain content or reasoning delta,
+        None otherwise. Deltas carrying both content and reasoning, tool calls
+        or a finish reason are not considered plain text deltas.
+        """
+        if data_type == ResponseStreamDataType.MarkdownPart:
+            fields = {"content": data.content, "reasoning_content": data.reasoning_content}
+        elif data_type == ResponseStreamDataType.LLMRaw:
+            choices = data.get("choices", [])
+            if len(choices) != 1 or choices[0].get("finish_reason") is not None:
+                return None
+            delta = choices[0].get("delta", {})
+            if not set(delta.keys()).issubset({"content", "reasoning_content", "role"}):
+                return None
+            fields = {"content": delta.get("content"), "reasoning_content": delta.get("reasoning_content")}
+        else:
+            return None
+
+        fields = [(key, value) for key, value in fields.items() if value]
+        return fields[0] if len(fields) == 1 else None
+
+    def _coalesce_delta(self, data_type: ResponseStreamDataType, field: str, text: str) -> None:
+        # content and reasoning deltas are not mixed in a single frame
+        with self._pending_delta_lock:
+            pending = self._pending_delta
+            if pending is not None and (pending["data_type"] != data_type or pending["field"] != field):
+                self.flush()
+                pending = None
+            if pending is None:
+                pending = self._pending_delta = {
+                    "data_type": data_type,
+                    "field": field,
+                    "parts": [],
+                    "size": 0,
+                    "started": time.monotonic(),
+                    "created": dt.datetime.now().isoformat()
+                }
+            pending["parts"].append(text)
+            pending["size"] += len(text)
+            if pending["size"] >= self.coalesce_max_bytes or time.monotonic() - pending["started"] >= self.coalesce_interval:
+                self.flush()
+            elif not self._flush_scheduled:
+                self._flush_scheduled = True
+                self._io_loop.add_callback(self._io_loop.call_later, self.coalesce_interval, self._on_flush_timer)
+
+    def _on_flush_timer(self):
+        with self._pending_delta_lock:
+            self._flush_scheduled = False
+        self.flush()
+
     def finish(self) -> None:
-        self.chat_history.add_message(self.chatId, {"role": "assistant", "content": "".join(self.streamed_contents), "reasoning_content": "".join(self.streamed_reasoning_contents)})
+        self.flush()
+        if not self.is_closed:
+            self.chat_history.add_message(self.chatId, {"role": "assistant", "content": "".join(self.streamed_contents), "reasoning_content": "".join(self.streamed_reasoning_contents)})
         self.streamed_contents = []
         self.streamed_reasoning_contents = []
-        self.websocket_handler.write_message({
+        self._send({
             "id": self.messageId,
             "participant": self.participant_id,
             "type": BackendMessageType.StreamEnd,
@@ -984,8 +1406,9 @@ class WebsocketCopilotResponseEmitter(ChatResponse):
         })
 
     async def run_ui_command(self, command: str, args: dict = {}) -> None:
+        self.flush()
         callback_id = str(uuid.uuid4())
-        self.websocket_handler.write_message({
+        self._send({
             "id": self.messageId,
             "participant": self.participant_id,
             "type": BackendMessageType.RunUICommand,
@@ -1011,24 +1434,106 @@ class CancelTokenImpl(CancelToken):
 class MessageCallbackHandlers:
     response_emitter: WebsocketCopilotResponseEmitter
     cancel_token: CancelTokenImpl
+    # chat responses can be resumed by the client after reconnecting
+    resumable: bool = False
+    done: bool = False
+
+@dataclass
+class _DetachedRequest:
+    handlers: MessageCallbackHandlers
+    user: Optional[str]
+    timeout_handle: object
+
+class DetachedRequests:
+    """
+    Requests of closed websocket connections. They keep running for
+    `timeout` seconds so that the client can reconnect and resume their
+    responses, and are cancelled if not resumed in time. Used on the Tornado
+    loop only.
+    """
+    def __init__(self, timeout: float = 60):
+        self.timeout = timeout
+        self._requests: dict[str, _DetachedRequest] = {}
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def detach(self, messageId: str, handlers: MessageCallbackHandlers, user: Optional[str]) -> bool:
+        if self.timeout <= 0:
+            return False
+        timeout_handle = ioloop.IOLoop.current().call_later(self.timeout, self._expire, messageId)
+        self._requests[messageId] = _DetachedRequest(handlers, user, timeout_handle)
+        return True
+
+    def take(self, messageId: str, user: Optional[str]) -> Optional[MessageCallbackHandlers]:
+        request = self._requests.get(messageId)
+        if request is None or request.user != user:
+            return None
+        del self._requests[messageId]
+        ioloop.IOLoop.current().remove_timeout(request.timeout_handle)
+        return request.handlers
+
+    def _expire(self, messageId: str):
+        request = self._requests.pop(messageId, None)
+        if request is None:
+            return
+        request.handlers.response_emitter.close()
+        request.handlers.cancel_token.cancel_request()
+        if not request.handlers.done:
+            log.info(f"Request {messageId} was not resumed in time, cancelled")
+
+detached_requests = DetachedRequests()
 
 class WebsocketCopilotHandler(websocket.WebSocketHandler):
+    # seconds between pings sent to detect dead connections, 0 to use the
+    # server's websocket_ping_interval setting
+    heartbeat_interval = 30
+    # seconds to wait for a pong before the connection is closed
+    heartbeat_timeout = 30
+
     def __init__(self, application, request, context_factory=None, **kwargs):
         super().__init__(application, request, **kwargs)
-        # TODO: cleanup
+        # handlers of in-flight requests, removed when a request is done
         self._messageCallbackHandlers: dict[str, MessageCallbackHandlers] = {}
+        self._closed = False
         self.chat_history = ChatHistory()
         self._context_factory = context_factory or RuleContextFactory()
-        ws_connector = ThreadSafeWebSocketConnector(self)
-        ai_service_manager.websocket_connector = ws_connector
-        github_copilot.websocket_connector = ws_connector
+        self._connection_id = uuid.uuid4().hex
+        self.protocol_version = 1
+        # latest inline completion request id per (chatId, filename)
+        self._inline_completion_requests: dict[tuple[str, str], str] = {}
+        # handlers are created on the Tornado loop, writes from other threads
+        # (request workers) are routed through the hub
+        self._loop_thread_id = threading.get_ident()
+
+    @property
+    def ping_interval(self):
+        if self.heartbeat_interval > 0:
+            return self.heartbeat_interval
+        return super().ping_interval
+
+    @property
+    def ping_timeout(self):
+        if self.heartbeat_interval > 0:
+            return min(self.heartbeat_timeout, self.heartbeat_interval)
+        return super().ping_timeout
 
     def open(self):
-        pass
+        # clients opt in to newer stream protocols with ?protocol=<version>
+        try:
+            requested_version = int(self.get_query_argument("protocol", "1"))
+        except ValueError:
+            requested_version = 1
+        self.protocol_version = max(1, min(requested_version, STREAM_PROTOCOL_VERSION))
+        websocket_hub.register(self)
 
     def on_message(self, message):
         msg = json.loads(message)
+        # requests scheduled while handling the message continue its trace
+        with tracer.span("websocket.on_message", message_type=msg['type']):
+            self._handle_message(msg)
 
+    def _handle_message(self, msg: dict):
         messageId = msg['id']
         messageType = msg['type']
         if messageType == RequestDataType.ChatRequest:
@@ -1046,70 +1551,9 @@ class WebsocketCopilotHandler(websocket.WebSocketHandler):
                 extension_tools=toolSelections.get('extensions', {})
             )
 
-            is_claude_code_mode = ai_service_manager.is_claude_code_mode
-            chat_history = self.chat_history.get_history(chatId)
-            chat_history_initial_size = len(chat_history)
-
-            current_directory = data.get('currentDirectory')
-            if (is_claude_code_mode or chat_mode.id == 'agent') and current_directory is not None:
-                current_directory_file_msg = f"Additional context: Current directory open in Jupyter is: '{current_directory}'"
-                if filename != '':
-                    current_directory_file_msg += f" and current file is: '{filename}'"
-                chat_history.append({"role": "user", "content": current_directory_file_msg})
-
-            token_limit = 100 if ai_service_manager.chat_model is None else ai_service_manager.chat_model.context_window
-            remaining_token_budget = int(0.8 * token_limit)
-
-            for context in additionalContext:
-                is_upload = context.get("isUpload", False)
-                file_path = context["filePath"]
-                if not is_upload:
-                    file_path = path.join(NotebookIntelligence.root_dir, file_path)
-                context_filename = path.basename(file_path)
-                start_line = context["startLine"]
-                end_line = context["endLine"]
-                current_cell_contents = context["currentCellContents"]
-                current_cell_input = current_cell_contents["input"] if current_cell_contents is not None else ""
-                current_cell_output = current_cell_contents["output"] if current_cell_contents is not None else ""
-                current_cell_context = f"This is a Jupyter notebook and currently selected cell input is: ```{current_cell_input}``` and currently selected cell output is: ```{current_cell_output}```. If user asks a question about 'this' cell then assume that user is referring to currently selected cell." if current_cell_contents is not None else ""
-                context_content = context.get("content", "")
-
-                if context_content:
-                    context_content = _truncate_context_content(
-                        context_content,
-                        remaining_token_budget
-                    )
-
-                if context_content == "" and remaining_token_budget <= 0:
-                    break
-
-                # For uploaded binary files (images, PDFs, etc.) where no
-                # text content was extracted, tell Claude to read the file
-                # from disk so it can handle it natively.
-                if is_upload and context_content == "":
-                    context_message = (
-                        f"The user attached a file '{context_filename}' "
-                        f"at path '{file_path}'. Read this file to see its contents."
-                    )
-                else:
-                    context_message = _build_additional_context_message(
-                        file_path=file_path,
-                        context_filename=context_filename,
-                        start_line=start_line,
-                        end_line=end_line,
-                        context_content=context_content,
-                        current_cell_context=current_cell_context
-                    )
-                remaining_token_budget -= len(
-                    tiktoken_encoding.encode(context_message)
-                )
-                chat_history.append({"role": "user", "content": context_message})
-
-            chat_history.append({"role": "user", "content": prompt})
-
-            response_emitter = WebsocketCopilotResponseEmitter(chatId, messageId, self, self.chat_history)
+            response_emitter = WebsocketCopilotResponseEmitter(chatId, messageId, self, self.chat_history, self.protocol_version)
             cancel_token = CancelTokenImpl()
-            self._messageCallbackHandlers[messageId] = MessageCallbackHandlers(response_emitter, cancel_token)
+            self._messageCallbackHandlers[messageId] = MessageCallbackHandlers(response_emitter, cancel_token, resumable=True)
             
             # Create rule context for rule evaluation
             rule_context = self._context_factory.create(
@@ -1119,10 +1563,12 @@ class WebsocketCopilotHandler(websocket.WebSocketHandler):
                 root_dir=NotebookIntelligence.root_dir
             )
 
-            # last prompt is added later
-            request_chat_history = chat_history[chat_history_initial_size:-1] if is_claude_code_mode else chat_history[:-1]
-            thread = threading.Thread(target=asyncio.run, args=(ai_service_manager.handle_chat_request(ChatRequest(chat_mode=chat_mode, tool_selection=tool_selection, prompt=prompt, chat_history=request_chat_history, cancel_token=cancel_token, rule_context=rule_context), response_emitter),))
-            thread.start()
+            chat_request = ChatRequest(chat_mode=chat_mode, tool_selection=tool_selection, prompt=prompt, cancel_token=cancel_token, rule_context=rule_context)
+            self._schedule_request(
+                messageId,
+                self._handle_chat_request(chat_request, chatId, filename, data.get('currentDirectory'), additionalContext, response_emitter),
+                RequestLane.Chat
+            )
         elif messageType == RequestDataType.GenerateCode:
             data = msg['data']
             chatId = data['chatId']
@@ -1134,16 +1580,9 @@ class WebsocketCopilotHandler(websocket.WebSocketHandler):
             filename = data['filename']
             is_claude_code_mode = ai_service_manager.is_claude_code_mode
             chat_mode = ChatMode('inline-chat', 'Inline Chat') if is_claude_code_mode else ChatMode('ask', 'Ask')
-            if prefix != '':
-                self.chat_history.add_message(chatId, {"role": "user", "content": f"This code section comes before the code section you will generate, use as context. Leading content: ```{prefix}```"})
-            if suffix != '':
-                self.chat_history.add_message(chatId, {"role": "user", "content": f"This code section comes after the code section you will generate, use as context. Trailing content: ```{suffix}```"})
-            if existing_code != '':
-                self.chat_history.add_message(chatId, {"role": "user", "content": f"You are asked to modify the existing code. Generate a replacement for this existing code : ```{existing_code}```"})
-            self.chat_history.add_message(chatId, {"role": "user", "content": f"Generate code for: {prompt}"})
-            response_emitter = WebsocketCopilotResponseEmitter(chatId, messageId, self, self.chat_history)
+            response_emitter = WebsocketCopilotResponseEmitter(chatId, messageId, self, self.chat_history, self.protocol_version)
             cancel_token = CancelTokenImpl()
-            self._messageCallbackHandlers[messageId] = MessageCallbackHandlers(response_emitter, cancel_token)
+            self._messageCallbackHandlers[messageId] = MessageCallbackHandlers(response_emitter, cancel_token, resumable=True)
             existing_code_message = " Update the existing code section and return a modified version. Don't just return the update, recreate the existing code section with the update." if existing_code != '' else ''
             
             # Create rule context for rule evaluation
@@ -1155,8 +1594,12 @@ class WebsocketCopilotHandler(websocket.WebSocketHandler):
                 root_dir=NotebookIntelligence.root_dir
             )
             
-            thread = threading.Thread(target=asyncio.run, args=(ai_service_manager.handle_chat_request(ChatRequest(chat_mode=chat_mode, prompt=prompt, chat_history=self.chat_history.get_history(chatId), cancel_token=cancel_token, rule_context=rule_context), response_emitter, options={"system_prompt": f"You are an assistant that generates code for '{language}' language. You generate code between existing leading and trailing code sections.{existing_code_message} Be concise and return only code as a response. Don't include leading content or trailing content in your response, they are provided only for context. You can reuse methods and symbols defined in leading and trailing content."}),))
-            thread.start()
+            chat_request = ChatRequest(chat_mode=chat_mode, prompt=prompt, cancel_token=cancel_token, rule_context=rule_context)
+            self._schedule_request(
+                messageId,
+                self._handle_generate_code_request(chat_request, chatId, prefix, suffix, existing_code, response_emitter, options={"system_prompt": f"You are an assistant that generates code for '{language}' language. You generate code between existing leading and trailing code sections.{existing_code_message} Be concise and return only code as a response. Don't include leading content or trailing content in your response, they are provided only for context. You can reuse methods and symbols defined in leading and trailing content."}),
+                RequestLane.Chat
+            )
         elif messageType == RequestDataType.InlineCompletionRequest:
             data = msg['data']
             chatId = data['chatId']
@@ -1166,12 +1609,24 @@ class WebsocketCopilotHandler(websocket.WebSocketHandler):
             filename = data['filename']
             chat_history = ChatHistory()
 
-            response_emitter = WebsocketCopilotResponseEmitter(chatId, messageId, self, chat_history)
+            response_emitter = WebsocketCopilotResponseEmitter(chatId, messageId, self, chat_history, self.protocol_version)
             cancel_token = CancelTokenImpl()
             self._messageCallbackHandlers[messageId] = MessageCallbackHandlers(response_emitter, cancel_token)
 
-            thread = threading.Thread(target=asyncio.run, args=(WebsocketCopilotHandler.handle_inline_completions(prefix, suffix, language, filename, response_emitter, cancel_token),))
-            thread.start()
+            # a newer request for the same document supersedes the in-flight one
+            inline_request_key = (chatId, filename)
+            superseded_message_id = self._inline_completion_requests.get(inline_request_key)
+            if superseded_message_id is not None:
+                superseded_handlers = self._messageCallbackHandlers.get(superseded_message_id)
+                if superseded_handlers is not None:
+                    superseded_handlers.cancel_token.cancel_request()
+            self._inline_completion_requests[inline_request_key] = messageId
+
+            self._schedule_request(
+                messageId,
+                WebsocketCopilotHandler.handle_inline_completions(prefix, suffix, language, filename, response_emitter, cancel_token),
+                RequestLane.Interactive
+            )
         elif messageType == RequestDataType.ChatUserInput:
             handlers = self._messageCallbackHandlers.get(messageId)
             if handlers is None:
@@ -1194,22 +1649,253 @@ class WebsocketCopilotHandler(websocket.WebSocketHandler):
             if handlers is None:
                 return
             handlers.cancel_token.cancel_request()
+        elif messageType == RequestDataType.ResumeStream:
+            self._resume_request(messageId, msg.get('data', {}).get('lastSeq', -1))
  
     def on_close(self):
-        pass
+        # chat requests still running for the closed connection are kept for
+        # the client to resume, others are cancelled. everything else held for
+        # the connection is released
+        self._closed = True
+        websocket_hub.unregister(self)
+        handlers = list(self._messageCallbackHandlers.items())
+        self._messageCallbackHandlers.clear()
+        self._inline_completion_requests.clear()
+        user = self._get_user_name()
+        detached_count = 0
+        for messageId, message_handlers in handlers:
+            if message_handlers.resumable and detached_requests.detach(messageId, message_handlers, user):
+                detached_count += 1
+                continue
+            message_handlers.response_emitter.close()
+            message_handlers.cancel_token.cancel_request()
+        self.chat_history.clear()
+        if len(handlers) > 0:
+            log.info(f"Websocket connection closed, cancelled {len(handlers) - detached_count} in-flight requests, {detached_count} kept for resuming")
+
+    def write_message(self, message, binary=False):
+        # requests finishing after the connection is closed have nowhere to
+        # send their output
+        if self._closed:
+            return None
+        if threading.get_ident() != self._loop_thread_id:
+            websocket_hub.send(self, message)
+            return None
+        try:
+            return super().write_message(message, binary)
+        except websocket.WebSocketClosedError:
+            return None
+
+    def _resume_request(self, messageId: str, last_seq: int):
+        user = self._get_user_name()
+        handlers = detached_requests.take(messageId, user)
+        if handlers is None:
+            # the old connection may not be detected as closed yet
+            handlers = self._take_request_from_other_connection(messageId, user)
+        if handlers is None:
+            # unknown or expired request, end the response on the client
+            self.write_message({
+                "id": messageId,
+                "type": BackendMessageType.StreamEnd,
+                "data": {"resumeFailed": True}
+            })
+            return
+        self._messageCallbackHandlers[messageId] = handlers
+        missed = handlers.response_emitter.attach(self, self.chat_history, last_seq)
+        # the request may have finished while detached
+        if handlers.done:
+            self._release_request(messageId)
+        log.info(f"Resumed request {messageId} from frame {last_seq + 1}" + (f", {missed} frames were lost" if missed > 0 else ""))
+
+    def _take_request_from_other_connection(self, messageId: str, user: Optional[str]) -> Optional[MessageCallbackHandlers]:
+        for connection in websocket_hub.connections():
+            if connection is self or not isinstance(connection, WebsocketCopilotHandler):
+                continue
+            handlers = connection._messageCallbackHandlers.get(messageId)
+            if handlers is not None and handlers.resumable and connection._get_user_name() == user:
+                connection._release_request(messageId)
+                return handlers
+        return None
+
+    def _release_request(self, messageId: str):
+        self._messageCallbackHandlers.pop(messageId, None)
+        for key, inline_message_id in list(self._inline_completion_requests.items()):
+            if inline_message_id == messageId:
+                self._inline_completion_requests.pop(key, None)
+
+    async def _handle_chat_request(self, request: ChatRequest, chatId: str, filename: str, current_directory: str, additionalContext: list, response_emitter: WebsocketCopilotResponseEmitter):
+        # chat history is assembled here rather than in on_message since
+        # tokenizing attached content can take long for large files
+        is_claude_code_mode = ai_service_manager.is_claude_code_mode
+        chat_history = self.chat_history.get_history(chatId)
+        chat_history_initial_size = len(chat_history)
+
+        if (is_claude_code_mode or request.chat_mode.id == 'agent') and current_directory is not None:
+            current_directory_file_msg = f"Additional context: Current directory open in Jupyter is: '{current_directory}'"
+            if filename != '':
+                current_directory_file_msg += f" and current file is: '{filename}'"
+            chat_history.append({"role": "user", "content": current_directory_file_msg})
+
+        # attached context gets what history and prompt leave of the request budget
+        token_limit = 100 if ai_service_manager.chat_model is None else ai_service_manager.chat_model.context_window
+        remaining_token_budget = int(ChatHistory.REQUEST_CONTEXT_WINDOW_RATIO * token_limit) - \
+            self.chat_history.get_token_count(chatId) - \
+            await tokenizer.acount_tokens(request.prompt) - ChatHistory.MESSAGE_TOKEN_OVERHEAD
+
+        with tracer.span("chat.add_context", context_count=len(additionalContext)):
+            await self._add_additional_context(chat_history, additionalContext, remaining_token_budget)
+
+        chat_history.append({"role": "user", "content": request.prompt})
+
+        # last prompt is added later
+        request.chat_history = chat_history[chat_history_initial_size:-1] if is_claude_code_mode else chat_history[:-1]
+        await ai_service_manager.handle_chat_request(request, response_emitter)
+
+    async def _handle_generate_code_request(self, request: ChatRequest, chatId: str, prefix: str, suffix: str, existing_code: str, response_emitter: WebsocketCopilotResponseEmitter, options: dict):
+        # code sections are added to the chat history here rather than in
+        # on_message since tokenizing them can take long for large notebooks
+        if prefix != '':
+            await self.chat_history.aadd_message(chatId, {"role": "user", "content": f"This code section comes before the code section you will generate, use as context. Leading content: ```{prefix}```"})
+        if suffix != '':
+            await self.chat_history.aadd_message(chatId, {"role": "user", "content": f"This code section comes after the code section you will generate, use as context. Trailing content: ```{suffix}```"})
+        if existing_code != '':
+            await self.chat_history.aadd_message(chatId, {"role": "user", "content": f"You are asked to modify the existing code. Generate a replacement for this existing code : ```{existing_code}```"})
+        await self.chat_history.aadd_message(chatId, {"role": "user", "content": f"Generate code for: {request.prompt}"})
+
+        request.chat_history = self.chat_history.get_history(chatId)
+        await ai_service_manager.handle_chat_request(request, response_emitter, options=options)
+
+    async def _add_additional_context(self, chat_history: list, additionalContext: list, remaining_token_budget: int):
+        for context in additionalContext:
+            is_upload = context.get("isUpload", False)
+            file_path = context["filePath"]
+            if not is_upload:
+                file_path = path.join(NotebookIntelligence.root_dir, file_path)
+            context_filename = path.basename(file_path)
+            start_line = context["startLine"]
+            end_line = context["endLine"]
+            current_cell_contents = context["currentCellContents"]
+            current_cell_input = current_cell_contents["input"] if current_cell_contents is not None else ""
+            current_cell_output = current_cell_contents["output"] if current_cell_contents is not None else ""
+            current_cell_context = f"This is a Jupyter notebook and currently selected cell input is: ```{current_cell_input}``` and currently selected cell output is: ```{current_cell_output}```. If user asks a question about 'this' cell then assume that user is referring to currently selected cell." if current_cell_contents is not None else ""
+            context_content = context.get("content", "")
+
+            if context_content:
+                # the message around the content and the truncation marker
+                # take from the budget as well, with slack for tokens merging
+                # differently at the cut
+                message_frame = _build_additional_context_message(
+                    file_path=file_path,
+                    context_filename=context_filename,
+                    start_line=start_line,
+                    end_line=end_line,
+                    context_content=TRUNCATION_SUFFIX,
+                    current_cell_context=current_cell_context
+                )
+                context_content = await tokenizer.atruncate(
+                    context_content,
+                    remaining_token_budget - await tokenizer.acount_tokens(message_frame) - 2 * ChatHistory.MESSAGE_TOKEN_OVERHEAD
+                )
+
+            if context_content == "" and remaining_token_budget <= 0:
+                break
+
+            # For uploaded binary files (images, PDFs, etc.) where no
+            # text content was extracted, tell Claude to read the file
+            # from disk so it can handle it natively.
+            if is_upload and context_content == "":
+                context_message = (
+                    f"The user attached a file '{context_filename}' "
+                    f"at path '{file_path}'. Read this file to see its contents."
+                )
+            else:
+                context_message = _build_additional_context_message(
+                    file_path=file_path,
+                    context_filename=context_filename,
+                    start_line=start_line,
+                    end_line=end_line,
+                    context_content=context_content,
+                    current_cell_context=current_cell_context
+                )
+            remaining_token_budget -= await tokenizer.acount_tokens(context_message) + ChatHistory.MESSAGE_TOKEN_OVERHEAD
+            chat_history.append({"role": "user", "content": context_message})
+
+    def _get_user_name(self) -> Optional[str]:
+        user = self.current_user
+        if isinstance(user, str) and user != '':
+            return user
+        username = getattr(user, "username", None) or (user.get("name") if isinstance(user, dict) else None)
+        return username if username else None
+
+    def _get_user_key(self) -> str:
+        # fall back to the connection when the server has no user identity
+        return self._get_user_name() or self._connection_id
+
+    def _schedule_request(self, messageId: str, coro, lane: RequestLane):
+        handlers = self._messageCallbackHandlers[messageId]
+        response_emitter = handlers.response_emitter
+        try:
+            request_scheduler.submit(
+                coro,
+                lane=lane,
+                user=self._get_user_key(),
+                cancel_token=handlers.cancel_token,
+                on_discard=response_emitter.finish,
+                on_done=lambda: self._on_request_done(messageId, handlers)
+            )
+        except RequestRejectedError as e:
+            log.warning(f"Rejected {lane.value} request: {e}")
+            if lane == RequestLane.Chat:
+                response_emitter.stream(MarkdownData(f"Unable to process the request: {e}. Please try again shortly."))
+            response_emitter.finish()
+            self._release_request(messageId)
+
+    @staticmethod
+    def _on_request_done(messageId: str, handlers: MessageCallbackHandlers):
+        handlers.done = True
+        # release from the connection the response is currently attached to
+        handlers.response_emitter.websocket_handler._release_request(messageId)
 
     async def handle_inline_completions(prefix, suffix, language, filename, response_emitter, cancel_token):
-        if ai_service_manager.inline_completion_model is None:
+        with metrics.observe(metrics.inline_completion_duration, metrics.inline_completions_in_flight, cancel_token) as observation:
+            await WebsocketCopilotHandler._handle_inline_completions(prefix, suffix, language, filename, response_emitter, cancel_token, observation)
+
+    async def _handle_inline_completions(prefix, suffix, language, filename, response_emitter, cancel_token, observation: metrics.Observation):
+        inline_completion_model = ai_service_manager.inline_completion_model
+        if inline_completion_model is None:
+            observation.outcome = "not_configured"
             response_emitter.finish()
             return
 
-        context = await ai_service_manager.get_completion_context(ContextRequest(ContextRequestType.InlineCompletion, prefix, suffix, language, filename, participant=ai_service_manager.get_chat_participant(prefix), cancel_token=cancel_token))
-
-        if cancel_token.is_cancel_requested:
+        model_key = InlineCompletionCache.model_key(inline_completion_model)
+        completions = inline_completion_cache.get(model_key, filename, prefix, suffix)
+        if completions is not None:
+            observation.outcome = "cache_hit"
+            response_emitter.stream({"completions": completions})
             response_emitter.finish()
             return
 
-        completions = ai_service_manager.inline_completion_model.inline_completions(prefix, suffix, language, filename, context, cancel_token)
+        async def _fetch_completions(shared_cancel_token: CancelToken) -> str:
+            context = await ai_service_manager.get_completion_context(ContextRequest(ContextRequestType.InlineCompletion, prefix, suffix, language, filename, participant=ai_service_manager.get_chat_participant(prefix), cancel_token=shared_cancel_token))
+            if shared_cancel_token.is_cancel_requested:
+                return ''
+            completions = await inline_completion_model.ainline_completions(prefix, suffix, language, filename, context, shared_cancel_token)
+            if shared_cancel_token.is_cancel_requested:
+                return ''
+            inline_completion_cache.put(model_key, filename, prefix, suffix, completions)
+            return completions
+
+        # identical concurrent requests (e.g. same document open in multiple
+        # tabs, or repeated requests while typing) share one provider call
+        flight_key = (model_key, filename, language, InlineCompletionCache.content_key(prefix, suffix))
+        try:
+            completions = await inline_completion_single_flight.run(flight_key, _fetch_completions, cancel_token, default='')
+        except Exception as e:
+            # the call failed for all the requests it was shared by, each of
+            # them gets an empty reply
+            log.error(f"Inline completion request failed: {e}")
+            observation.outcome = "error"
+            completions = ''
         if cancel_token.is_cancel_requested:
             response_emitter.finish()
             return
@@ -1312,19 +1998,276 @@ class NotebookIntelligence(ExtensionApp):
         config=True,
     )
 
+    request_worker_count = Int(
+        default_value=8,
+        help="""
+        Number of worker threads serving chat, inline chat and agent requests.
+        """,
+        config=True,
+    )
+
+    inline_completion_worker_count = Int(
+        default_value=4,
+        help="""
+        Number of worker threads reserved for inline completion requests, so
+        that completions never wait behind long running chat requests.
+        """,
+        config=True,
+    )
+
+    max_request_queue_depth = Int(
+        default_value=64,
+        help="""
+        Maximum number of requests waiting per lane (chat / inline completion).
+        Requests beyond this limit are rejected immediately.
+        """,
+        config=True,
+    )
+
+    max_concurrent_requests_per_user = Int(
+        default_value=4,
+        help="""
+        Maximum number of requests a single user can have running concurrently
+        per lane. Additional requests wait in the queue.
+        """,
+        config=True,
+    )
+
+    requests_per_worker = Int(
+        default_value=8,
+        help="""
+        Maximum number of requests run concurrently on the event loop of a
+        worker thread. Requests waiting for a tool confirmation, a UI command
+        or a model response don't hold a worker of their own.
+        """,
+        config=True,
+    )
+
+    stream_coalesce_interval_ms = Int(
+        default_value=0,
+        help="""
+        Interval in milliseconds over which consecutive streamed text deltas of
+        a chat response are merged into a single websocket message (e.g. 16-50).
+        0 disables coalescing and sends every delta as it arrives.
+        """,
+        config=True,
+    )
+
+    stream_coalesce_max_bytes = Int(
+        default_value=1024,
+        help="""
+        Size of buffered text at which coalesced stream deltas are sent without
+        waiting for the coalescing interval to elapse.
+        """,
+        config=True,
+    )
+
+    inline_completion_cache_size = Int(
+        default_value=256,
+        help="""
+        Maximum number of inline completion results cached. Cached results are
+        reused when the user types the characters of a suggestion already
+        returned. 0 disables the cache.
+        """,
+        config=True,
+    )
+
+    websocket_heartbeat_interval = Int(
+        default_value=30,
+        help="""
+        Interval in seconds at which pings are sent on chat websocket
+        connections to detect dead connections. Requests of a dead connection
+        are cancelled and its state is released. 0 falls back to the server's
+        websocket_ping_interval setting.
+        """,
+        config=True,
+    )
+
+    websocket_heartbeat_timeout = Int(
+        default_value=30,
+        help="""
+        Seconds to wait for a pong before a chat websocket connection is
+        considered dead and closed. Capped at the heartbeat interval.
+        """,
+        config=True,
+    )
+
+    stream_resume_timeout = Int(
+        default_value=60,
+        help="""
+        Seconds chat requests keep running after their websocket connection
+        is closed, waiting for the client to reconnect and resume the
+        response. 0 cancels them when the connection is closed.
+        """,
+        config=True,
+    )
+
+    stream_replay_buffer_size = Int(
+        default_value=256,
+        help="""
+        Number of recent frames kept per chat response for replay to a
+        client resuming the response after reconnecting.
+        """,
+        config=True,
+    )
+
+    upload_quota_mb = Int(
+        default_value=2048,
+        help="""
+        Total size in MB of uploaded chat attachments kept on the server.
+        Least recently uploaded files are deleted once it is exceeded. Also
+        the size limit of a single upload.
+        """,
+        config=True,
+    )
+
+    trace_sample_rate = Float(
+        default_value=0.0,
+        help="""
+        Fraction of requests (0-1) to record traces for. Traces are spans of
+        the stages of a request (rule injection, provider calls, tool calls,
+        ...) exported to trace_file and/or trace_otlp_endpoint. 0 disables
+        tracing.
+        """,
+        config=True,
+    )
+
+    trace_file = Unicode(
+        default_value="",
+        help="""
+        Path of a file to append trace spans to as JSON lines.
+        """,
+        config=True,
+    )
+
+    trace_otlp_endpoint = Unicode(
+        default_value="",
+        help="""
+        URL of an OpenTelemetry collector to send trace spans to using
+        OTLP/HTTP (e.g. http://localhost:4318).
+        """,
+        config=True,
+    )
+
+    copilot_http_pool_size = Int(
+        default_value=10,
+        help="""
+        Number of keep-alive connections kept open per host for GitHub
+        Copilot requests. Requests beyond it open a connection that is closed
+        after use.
+        """,
+        config=True,
+    )
+
+    copilot_http_connect_timeout = Float(
+        default_value=10.0,
+        help="""
+        Seconds to wait for a connection to GitHub Copilot.
+        """,
+        config=True,
+    )
+
+    copilot_http_read_timeout = Float(
+        default_value=300.0,
+        help="""
+        Seconds to wait for the next data of a GitHub Copilot response
+        before the request fails.
+        """,
+        config=True,
+    )
+
+    tool_call_concurrency = Int(
+        default_value=4,
+        help="""
+        Maximum number of tool calls of a model response run concurrently.
+        Only read-only tool calls that need no confirmation are overlapped,
+        other calls run one after another. 1 disables concurrent calls.
+        """,
+        config=True,
+    )
+
+    max_tool_call_rounds = Int(
+        default_value=25,
+        help="""
+        Maximum number of model calls made for a chat request with tools.
+        The agent stops with a notice once the model keeps calling tools
+        beyond it.
+        """,
+        config=True,
+    )
+
+    tool_context_compaction_ratio = Float(
+        default_value=0.75,
+        help="""
+        Fraction of the model context window the messages of an agent request
+        can take. Beyond it, results of earlier tool calls are replaced with
+        stubs naming their stored copy, oldest first.
+        """,
+        config=True,
+    )
+
+    tool_result_token_budget = Int(
+        default_value=8000,
+        help="""
+        Maximum tokens of a tool call result passed to the model. Longer
+        results keep their leading and trailing lines, the full result is
+        stored on the server for the model to page through. 0 disables.
+        """,
+        config=True,
+    )
+
+    tool_result_store_mb = Int(
+        default_value=64,
+        help="""
+        Total MB of full tool call results kept for truncated results. Least
+        recently used results are dropped beyond it.
+        """,
+        config=True,
+    )
+
     def initialize_settings(self):
         pass
 
     def initialize_handlers(self):
         NotebookIntelligence.root_dir = self.serverapp.root_dir
         set_jupyter_root_dir(NotebookIntelligence.root_dir)
+        self.initialize_request_scheduler()
+        self.initialize_inline_completion_cache()
+        self.initialize_tracing()
         server_root_dir = os.path.expanduser(self.serverapp.web_app.settings["server_root_dir"])
         self.initialize_ai_service(server_root_dir)
         self._setup_handlers(self.serverapp.web_app)
         self.serverapp.log.info(f"Registered {self.name} server extension")
 
+    def initialize_request_scheduler(self):
+        global request_scheduler
+        request_scheduler.stop()
+        tokenizer.shutdown()
+        request_scheduler = RequestScheduler(
+            chat_workers=self.request_worker_count,
+            interactive_workers=self.inline_completion_worker_count,
+            max_queue_depth=self.max_request_queue_depth,
+            max_concurrent_per_user=self.max_concurrent_requests_per_user,
+            tasks_per_worker=self.requests_per_worker
+        )
+
+    def initialize_inline_completion_cache(self):
+        global inline_completion_cache
+        inline_completion_cache = InlineCompletionCache(max(0, self.inline_completion_cache_size))
+
+    def initialize_tracing(self):
+        exporters = []
+        if self.trace_file != "":
+            exporters.append(JsonlSpanExporter(os.path.expanduser(self.trace_file)))
+        if self.trace_otlp_endpoint != "":
+            exporters.append(OTLPSpanExporter(self.trace_otlp_endpoint))
+        tracer.configure(self.trace_sample_rate, exporters)
+        if tracer.enabled:
+            log.info(f"Tracing {self.trace_sample_rate:.0%} of requests")
+
     def initialize_ai_service(self, server_root_dir: str):
         global ai_service_manager
+        github_copilot.configure_http_session(self.copilot_http_pool_size, self.copilot_http_connect_timeout, self.copilot_http_read_timeout)
         manifest_source = os.environ.get("NBI_SKILLS_MANIFEST", "").strip() or self.skills_manifest.strip()
         managed_token = (
             os.environ.get("NBI_MANAGED_SKILLS_TOKEN", "").strip()
@@ -1345,6 +2288,9 @@ class NotebookIntelligence(ExtensionApp):
             "skills_manifest_interval": manifest_interval,
             "managed_skills_token": managed_token,
         })
+        ai_service_manager.websocket_connector = websocket_hub
+        github_copilot.websocket_connector = websocket_hub
+        websocket_hub.add_broadcast_listener(_invalidate_capabilities_on_status_change)
 
     def initialize_templates(self):
         pass
@@ -1353,6 +2299,8 @@ class NotebookIntelligence(ExtensionApp):
         log.info(f"Stopping {self.name} extension...")
         github_copilot.handle_stop_request()
         ai_service_manager.handle_stop_request()
+        request_scheduler.stop()
+        tracer.flush()
 
     def _setup_handlers(self, web_app):
         host_pattern = ".*$"
@@ -1382,13 +2330,28 @@ class NotebookIntelligence(ExtensionApp):
         route_pattern_skill_bundle_file = url_path_join(base_url, "notebook-intelligence", "skills", r"(user|project)", skill_name, "files")
         route_pattern_skill_bundle_file_rename = url_path_join(base_url, "notebook-intelligence", "skills", r"(user|project)", skill_name, "files", "rename")
         route_pattern_upload_file = url_path_join(base_url, "notebook-intelligence", "upload-file")
+        route_pattern_upload_file_stream = url_path_join(base_url, "notebook-intelligence", "upload-file-stream")
         route_pattern_claude_sessions = url_path_join(base_url, "notebook-intelligence", "claude-sessions")
         route_pattern_claude_sessions_resume = url_path_join(base_url, "notebook-intelligence", "claude-sessions", "resume")
+        route_pattern_metrics = url_path_join(base_url, "notebook-intelligence", "metrics")
         GetCapabilitiesHandler.disabled_tools = self.disabled_tools
         GetCapabilitiesHandler.allow_enabling_tools_with_env = self.allow_enabling_tools_with_env
         GetCapabilitiesHandler.disabled_providers = self.disabled_providers
         GetCapabilitiesHandler.allow_enabling_providers_with_env = self.allow_enabling_providers_with_env
         GetCapabilitiesHandler.enable_chat_feedback = self.enable_chat_feedback
+        WebsocketCopilotResponseEmitter.coalesce_interval = max(0, self.stream_coalesce_interval_ms) / 1000
+        WebsocketCopilotResponseEmitter.coalesce_max_bytes = self.stream_coalesce_max_bytes
+        WebsocketCopilotHandler.heartbeat_interval = max(0, self.websocket_heartbeat_interval)
+        WebsocketCopilotHandler.heartbeat_timeout = max(1, self.websocket_heartbeat_timeout)
+        WebsocketCopilotResponseEmitter.replay_buffer_size = max(0, self.stream_replay_buffer_size)
+        detached_requests.timeout = self.stream_resume_timeout
+        UploadStore.quota = max(1, self.upload_quota_mb) * 1024 * 1024
+        ChatParticipant.tool_call_concurrency = max(1, self.tool_call_concurrency)
+        ChatParticipant.max_tool_call_rounds = max(1, self.max_tool_call_rounds)
+        ChatParticipant.tool_context_compaction_ratio = min(1.0, max(0.1, self.tool_context_compaction_ratio))
+        # budgets below the note about omitted lines would leave no content
+        ChatParticipant.tool_result_token_budget = 0 if self.tool_result_token_budget <= 0 else max(ToolResultStore.NOTE_TOKENS * 4, self.tool_result_token_budget)
+        ToolResultStore.max_size = max(1, self.tool_result_store_mb) * 1024 * 1024
         NotebookIntelligence.handlers = [
             (route_pattern_capabilities, GetCapabilitiesHandler),
             (route_pattern_config, ConfigHandler),
@@ -1415,8 +2378,10 @@ class NotebookIntelligence(ExtensionApp):
             (route_pattern_skill_rename, SkillRenameHandler),
             (route_pattern_skill_detail, SkillDetailHandler),
             (route_pattern_upload_file, FileUploadHandler),
+            (route_pattern_upload_file_stream, StreamingFileUploadHandler),
             (route_pattern_claude_sessions_resume, ClaudeSessionsResumeHandler),
             (route_pattern_claude_sessions, ClaudeSessionsListHandler),
+            (route_pattern_metrics, MetricsHandler),
             (route_pattern_copilot, WebsocketCopilotHandler),
         ]
         web_app.add_handlers(host_pattern, NotebookIntelligence.handlers)
@@ -6,13 +6,18 @@ import base64
 from dataclasses import dataclass
 from enum import Enum
 import os, json, time, requests, threading
-from typing import Any
+from requests.adapters import HTTPAdapter
+from typing import Any, AsyncIterator, Iterator
 import uuid
 import secrets
 import sseclient
 import datetime as dt
+import httpx
 import logging
 from notebook_intelligence.api import BackendMessageType, CancelToken, ChatResponse, CompletionContext, MarkdownData
+from notebook_intelligence.client_cache import invalidate_clients, loop_client_cache
+from notebook_intelligence.connection_aborter import ConnectionAborter
+from notebook_intelligence.streaming_aggregator import StreamingResponseAggregator
 from notebook_intelligence.util import decrypt_with_password, encrypt_with_password, ThreadSafeWebSocketConnector
 
 from ._version import __version__ as NBI_VERSION
@@ -35,6 +40,15 @@ TOKEN_REFRESH_INTERVAL = 1500
 ACCESS_TOKEN_THREAD_SLEEP_INTERVAL = 5
 TOKEN_THREAD_SLEEP_INTERVAL = 3
 TOKEN_FETCH_INTERVAL = 15
+# keep-alive connections kept per host by the shared HTTP session. set from
+# NotebookIntelligence config with configure_http_session
+HTTP_POOL_SIZE = 10
+HTTP_CONNECT_TIMEOUT = 10
+# seconds to wait for the next bytes of a response, streamed responses can
+# pause for long while a model is reasoning
+HTTP_READ_TIMEOUT = 300
+# client cache key of the async httpx clients
+GITHUB_COPILOT_CLIENT_ID = "github-copilot"
 NL = '\n'
 
 LoginStatus = Enum('LoginStatus', ['NOT_LOGGED_IN', 'ACTIVATING_DEVICE', 'LOGGING_IN', 'LOGGED_IN'])
@@ -59,6 +73,69 @@ github_access_token_provided = None
 websocket_connector: ThreadSafeWebSocketConnector = None
 github_login_status_change_updater_enabled = False
 
+# shared by all requests to GitHub and Copilot so that connections (and their
+# TLS sessions) are reused instead of opened per request
+http_session: requests.Session = None
+http_session_lock = threading.Lock()
+
+def configure_http_session(pool_size: int, connect_timeout: float, read_timeout: float):
+    global HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+    HTTP_POOL_SIZE = max(1, pool_size)
+    HTTP_CONNECT_TIMEOUT = connect_timeout
+    HTTP_READ_TIMEOUT = read_timeout
+    reset_http_session()
+
+def get_http_session() -> requests.Session:
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            http_session = requests.Session()
+            # connections beyond the pool size are opened when needed and
+            # closed after use
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            http_session.mount("https://", adapter)
+            http_session.mount("http://", adapter)
+        return http_session
+
+def reset_http_session():
+    """Closes the pooled connections, requests in flight finish on their connection"""
+    global http_session
+    with http_session_lock:
+        session = http_session
+        http_session = None
+    if session is not None:
+        session.close()
+    invalidate_clients(GITHUB_COPILOT_CLIENT_ID, None, None)
+
+def http_timeout() -> tuple[float, float]:
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+def _async_http_client():
+    """httpx client shared within the running event loop, its connections are bound to the loop"""
+    return loop_client_cache().client(
+        GITHUB_COPILOT_CLIENT_ID, None, None,
+        lambda: httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=HTTP_POOL_SIZE),
+            event_hooks=ConnectionAborter.shared_async_httpx_event_hooks()
+        )
+    )
+
+def _async_http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+async def _aiter_event_data(response: httpx.Response) -> AsyncIterator[str]:
+    """Data of the server-sent events of a streaming response"""
+    data_lines = []
+    async for line in response.aiter_lines():
+        if line == '':
+            if len(data_lines) > 0:
+                yield '\n'.join(data_lines)
+                data_lines = []
+        elif line.startswith('data:'):
+            data_lines.append(line[6:] if line.startswith('data: ') else line[5:])
+    if len(data_lines) > 0:
+        yield '\n'.join(data_lines)
+
 def enable_github_login_status_change_updater(enabled: bool):
     global github_login_status_change_updater_enabled
     github_login_status_change_updater_enabled = enabled
@@ -204,6 +281,7 @@ def logout():
 def handle_stop_request():
     global stop_requested
     stop_requested = True
+    reset_http_session()
 
 def get_device_verification_info():
     global github_auth
@@ -212,7 +290,7 @@ def get_device_verification_info():
         "scope": "read:user"
     }
     try:
-        resp = requests.post(f'{GH_WEB_BASE_URL}/login/device/code',
+        resp = get_http_session().post(f'{GH_WEB_BASE_URL}/login/device/code',
             headers={
                 'accept': 'application/json',
                 'editor-version': EDITOR_VERSION,
@@ -221,7 +299,8 @@ def get_device_verification_info():
                 'user-agent': USER_AGENT,
                 'accept-encoding': 'gzip,deflate,br'
             },
-            data=json.dumps(data)
+            data=json.dumps(data),
+            timeout=http_timeout()
         )
 
         resp_json = resp.json()
@@ -261,7 +340,7 @@ def wait_for_user_access_token_thread_func():
             "grant_type": "urn:ietf:params:oauth:grant-type:device_code"
         }
         try:
-            resp = requests.post(f'{GH_WEB_BASE_URL}/login/oauth/access_token',
+            resp = get_http_session().post(f'{GH_WEB_BASE_URL}/login/oauth/access_token',
                 headers={
                 'accept': 'application/json',
                 'editor-version': EDITOR_VERSION,
@@ -270,7 +349,8 @@ def wait_for_user_access_token_thread_func():
                 'user-agent': USER_AGENT,
                 'accept-encoding': 'gzip,deflate,br'
                 },
-                data=json.dumps(data)
+                data=json.dumps(data),
+                timeout=http_timeout()
             )
 
             resp_json = resp.json()
@@ -299,12 +379,12 @@ def get_token():
     emit_github_login_status_change()
 
     try:
-        resp = requests.get(f'{GH_REST_API_BASE_URL}/copilot_internal/v2/token', headers={
+        resp = get_http_session().get(f'{GH_REST_API_BASE_URL}/copilot_internal/v2/token', headers={
             'authorization': f'token {access_token}',
             'editor-version': EDITOR_VERSION,
             'editor-plugin-version': EDITOR_PLUGIN_VERSION,
             'user-agent': USER_AGENT
-        })
+        }, timeout=http_timeout())
 
         resp_json = resp.json()
 
@@ -331,8 +411,13 @@ def get_token():
         emit_github_login_status_change()
 
         endpoints = resp_json.get('endpoints', {})
-        API_ENDPOINT = endpoints.get('api', API_ENDPOINT)
-        PROXY_ENDPOINT = endpoints.get('proxy', PROXY_ENDPOINT)
+        api_endpoint = endpoints.get('api', API_ENDPOINT)
+        proxy_endpoint = endpoints.get('proxy', PROXY_ENDPOINT)
+        if api_endpoint != API_ENDPOINT or proxy_endpoint != PROXY_ENDPOINT:
+            # don't keep connections to the previous endpoints open
+            API_ENDPOINT = api_endpoint
+            PROXY_ENDPOINT = proxy_endpoint
+            reset_http_session()
         TOKEN_REFRESH_INTERVAL = resp_json.get('refresh_in', TOKEN_REFRESH_INTERVAL)
     except Exception as e:
         log.error(f"Failed to get token from GitHub Copilot: {e}")
@@ -382,15 +467,9 @@ def generate_copilot_headers():
         'vscode-machineid': MACHINE_ID,
     }
 
-def inline_completions(model_id, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
-    global github_auth
-    token = github_auth['token']
-
+def _inline_completions_request_data(prefix, suffix, language, filename, context: CompletionContext) -> dict:
     prompt = f"# Path: {filename}"
 
-    if cancel_token.is_cancel_requested:
-        return ''
-
     if context is not None:
         for item in context.items:
             context_file = f"Compare this snippet from {item.filePath if item.filePath is not None else 'undefined'}:{NL}{item.content}{NL}"
@@ -398,160 +477,230 @@ def inline_completions(model_id, prefix, suffix, language, filename, context: Co
 
     prompt += f"{NL}{prefix}"
 
-    try:
-        if cancel_token.is_cancel_requested:
-            return ''
-        resp = requests.post(f"{PROXY_ENDPOINT}/v1/engines/{model_id}/completions",
-            headers={'authorization': f'Bearer {token}'},
-                json={
-                'prompt': prompt,
-                'suffix': suffix,
-                'min_tokens': 500,
-                'max_tokens': 2000,
-                'temperature': 0,
-                'top_p': 1,
-                'n': 1,
-                'stop': ['<END>', '```'],
-                'nwo': 'NotebookIntelligence',
-                'stream': True,
-                'extra': {
-                    'language': language,
-                    'next_indent': 0,
-                    'trim_by_indentation': True
-                }
-            }
-        )
-    except Exception as e:
-        log.error(f"Failed to get inline completions: {e}")
-        return ''
+    return {
+        'prompt': prompt,
+        'suffix': suffix,
+        'min_tokens': 500,
+        'max_tokens': 2000,
+        'temperature': 0,
+        'top_p': 1,
+        'n': 1,
+        'stop': ['<END>', '```'],
+        'nwo': 'NotebookIntelligence',
+        'stream': True,
+        'extra': {
+            'language': language,
+            'next_indent': 0,
+            'trim_by_indentation': True
+        }
+    }
+
+def _inline_completion_text(line: str) -> str:
+    if line.startswith('data: {'):
+        json_completion = json.loads(line[6:])
+        return json_completion.get('choices')[0].get('text') or ''
+    return ''
+
+def inline_completions(model_id, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
+    global github_auth
+    token = github_auth['token']
 
     if cancel_token.is_cancel_requested:
         return ''
 
-    result = ''
+    data = _inline_completions_request_data(prefix, suffix, language, filename, context)
+
+    with ConnectionAborter(cancel_token) as aborter:
+        try:
+            if aborter.aborted:
+                return ''
+            resp = get_http_session().post(f"{PROXY_ENDPOINT}/v1/engines/{model_id}/completions",
+                headers={'authorization': f'Bearer {token}'},
+                json=data,
+                stream=True,
+                timeout=http_timeout()
+            )
+        except Exception as e:
+            log.error(f"Failed to get inline completions: {e}")
+            return ''
 
-    decoded_response = resp.content.decode()
+        with resp:
+            aborter.track_response(resp)
+            result = ''
+            try:
+                for line in resp.iter_lines():
+                    if aborter.aborted:
+                        return ''
+                    result += _inline_completion_text(line.decode())
+            except Exception:
+                if aborter.aborted:
+                    return ''
+                raise
+
+    if cancel_token.is_cancel_requested:
+        return ''
 
-    resp_text = decoded_response.split('\n')
-    for line in resp_text:
-        if line.startswith('data: {'):
-            json_completion = json.loads(line[6:])
-            completion = json_completion.get('choices')[0].get('text')
-            if completion:
-                result += completion
-            # else:
-            #     result += '\n'
-    
     return result
 
-def _aggregate_streaming_response(client: sseclient.SSEClient) -> dict:
-    final_tool_calls = []
-    final_content = ''
-
-    def _format_llm_response():
-        for tool_call in final_tool_calls:
-            if 'arguments' in tool_call['function'] and tool_call['function']['arguments'] == '':
-                tool_call['function']['arguments'] = '{}'
-
-        # if tool_call doesnt have name remove (Claude Sonnet 4 issue)
-        tool_calls = [tool_call for tool_call in final_tool_calls if 'name' in tool_call['function'] and tool_call['function']]
-
-        return {
-            "choices": [
-                {
-                    "message": {
-                        "tool_calls": tool_calls if len(tool_calls) > 0 else None,
-                        "content": final_content,
-                        "role": "assistant"
-                    }
-                }
-            ]
-        }
+async def ainline_completions(model_id, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
+    token = github_auth['token']
 
-    for event in client.events():
-        if event.data == '[DONE]':
-            return _format_llm_response()
+    if cancel_token.is_cancel_requested:
+        return ''
 
-        chunk = json.loads(event.data)
-        if len(chunk['choices']) == 0:
-            continue
+    data = _inline_completions_request_data(prefix, suffix, language, filename, context)
 
-        content_chunk = chunk['choices'][0]['delta'].get('content')
-        if content_chunk:
-            final_content += content_chunk
+    with ConnectionAborter(cancel_token) as aborter, _async_http_client() as client:
+        if aborter.aborted:
+            return ''
+        result = ''
+        try:
+            async with client.stream("POST", f"{PROXY_ENDPOINT}/v1/engines/{model_id}/completions", headers={'authorization': f'Bearer {token}'}, json=data, timeout=_async_http_timeout()) as resp:
+                async for line in resp.aiter_lines():
+                    if aborter.aborted:
+                        return ''
+                    result += _inline_completion_text(line)
+        except httpx.ConnectError as e:
+            log.error(f"Failed to get inline completions: {e}")
+            return ''
+        except Exception:
+            if aborter.aborted:
+                return ''
+            raise
 
-        for tool_call in chunk['choices'][0]['delta'].get('tool_calls', []):
-            if 'index' not in tool_call:
-                continue
+    if cancel_token.is_cancel_requested:
+        return ''
 
-            index = tool_call['index']
+    return result
 
-            if index >= len(final_tool_calls):
-                tc = tool_call.copy()
-                if 'arguments' not in tc:
-                    tc['function']['arguments'] = ''
-                final_tool_calls.append(tc)
-            else:
-                if 'arguments' in tool_call['function']:
-                    final_tool_calls[index]['function']['arguments'] += tool_call['function']['arguments']
+def _release_connection(resp: requests.Response):
+    # reads the end of the stream after [DONE] so that the connection goes
+    # back to the pool, closing an unfinished response closes its connection
+    resp.raw.drain_conn()
 
-    return _format_llm_response()
+def _aggregate_streaming_response(events: Iterator[sseclient.Event]) -> dict:
+    aggregator = StreamingResponseAggregator()
+    for event in events:
+        if event.data == '[DONE]':
+            break
+        aggregator.add(json.loads(event.data))
+    aggregator.finish()
+    return aggregator.response()
 
-def completions(model_id, messages, tools = None, response: ChatResponse = None, cancel_token: CancelToken = None, options: dict = {}) -> Any:
-    aggregate = response is None
+def _completions_request_data(model_id, messages, tools, options: dict) -> dict:
+    data = {
+        'model': model_id,
+        'messages': messages,
+        'tools': tools,
+        'temperature': 0,
+        'top_p': 1,
+        'n': 1,
+        'nwo': 'NotebookIntelligence',
+        'stream': True
+    }
 
-    try:
-        data = {
-            'model': model_id,
-            'messages': messages,
-            'tools': tools,
-            'temperature': 0,
-            'top_p': 1,
-            'n': 1,
-            'nwo': 'NotebookIntelligence',
-            'stream': True
-        }
+    if not (model_id == 'gpt-5' or model_id == 'gpt-5-mini'):
+        data['stop'] = ['<END>']
 
-        if not (model_id == 'gpt-5' or model_id == 'gpt-5-mini'):
-            data['stop'] = ['<END>']
+    if 'tool_choice' in options:
+        data['tool_choice'] = options['tool_choice']
 
-        if 'tool_choice' in options:
-            data['tool_choice'] = options['tool_choice']
+    return data
 
-        if cancel_token is not None and cancel_token.is_cancel_requested:
-            if response is not None:
-                response.finish()
-            return
+def completions(model_id, messages, tools = None, response: ChatResponse = None, cancel_token: CancelToken = None, options: dict = {}) -> Any:
+    aggregate = response is None
 
-        request = requests.post(
-            f"{API_ENDPOINT}/chat/completions",
-            headers = generate_copilot_headers(),
-            json = data,
-            stream = True
-        )
+    try:
+        data = _completions_request_data(model_id, messages, tools, options)
 
-        if request.status_code != 200:
-            msg = f"Failed to get completions from GitHub Copilot: [{request.status_code}]: {request.text}"
-            log.error(msg)
-            if response is not None:
-                response.stream(MarkdownData(msg))
-                response.finish()
-            raise Exception(msg)
-
-        client = sseclient.SSEClient(request)
-        if aggregate:
-            return _aggregate_streaming_response(client)
-        else:
-            for event in client.events():
-                if cancel_token is not None and cancel_token.is_cancel_requested:
+        with ConnectionAborter(cancel_token) as aborter:
+            if aborter.aborted:
+                if response is not None:
                     response.finish()
-                if event.data == '[DONE]':
-                    response.finish()
-                else:
-                    response.stream(json.loads(event.data))
+                return
+
+            request = get_http_session().post(
+                f"{API_ENDPOINT}/chat/completions",
+                headers = generate_copilot_headers(),
+                json = data,
+                stream = True,
+                timeout = http_timeout()
+            )
+
+            with request:
+                aborter.track_response(request)
+
+                if request.status_code != 200:
+                    msg = f"Failed to get completions from GitHub Copilot: [{request.status_code}]: {request.text}"
+                    log.error(msg)
+                    if response is not None:
+                        response.stream(MarkdownData(msg))
+                        response.finish()
+                    raise Exception(msg)
+
+                # events are read from a single generator kept until the
+                # connection is released, closing it early closes the connection
+                events = sseclient.SSEClient(request).events()
+                try:
+                    if aggregate:
+                        result = _aggregate_streaming_response(events)
+                        if aborter.aborted:
+                            return None
+                        _release_connection(request)
+                        return result
+                    else:
+                        for event in events:
+                            if aborter.aborted:
+                                break
+                            if event.data == '[DONE]':
+                                break
+                            response.stream(json.loads(event.data))
+                        if not aborter.aborted:
+                            _release_connection(request)
+                        response.finish()
+                except Exception:
+                    if not aborter.aborted:
+                        raise
+                    if response is not None:
+                        response.finish()
         return
     except requests.exceptions.ConnectionError:
         raise Exception("Connection error")
     except Exception as e:
         log.error(f"Failed to get completions from GitHub Copilot: {e}")
         raise e
+
+async def acompletions(model_id, messages, tools = None, cancel_token: CancelToken = None, options: dict = {}) -> AsyncIterator[Any]:
+    data = _completions_request_data(model_id, messages, tools, options)
+
+    with ConnectionAborter(cancel_token) as aborter, _async_http_client() as client:
+        if aborter.aborted:
+            return
+        try:
+            async with client.stream("POST", f"{API_ENDPOINT}/chat/completions", headers=generate_copilot_headers(), json=data, timeout=_async_http_timeout()) as resp:
+                if resp.status_code != 200:
+                    body = await resp.aread()
+                    msg = f"Failed to get completions from GitHub Copilot: [{resp.status_code}]: {body.decode(errors='replace')}"
+                    log.error(msg)
+                    yield MarkdownData(msg)
+                    raise Exception(msg)
+
+                done = False
+                async for event_data in _aiter_event_data(resp):
+                    if aborter.aborted:
+                        break
+                    # the rest of the stream is read so that the connection
+                    # goes back to the pool
+                    if done:
+                        continue
+                    if event_data == '[DONE]':
+                        done = True
+                        continue
+                    yield json.loads(event_data)
+        except httpx.ConnectError:
+            if not aborter.aborted:
+                raise Exception("Connection error")
+        except Exception as e:
+            if not aborter.aborted:
+                log.error(f"Failed to get completions from GitHub Copilot: {e}")
+                raise
@@ -0,0 +1,143 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import threading
+from typing import Optional
+
+@dataclass
+class _CacheEntry:
+    key: tuple
+    group: tuple
+    prefix_tail: str
+    prefix_length: int
+    completion: str
+
+class InlineCompletionCache:
+    """
+    LRU cache of inline completion results. Entries are keyed by model,
+    filename, hash of the trailing prefix window and hash of the leading
+    suffix window. A lookup also matches when the user has typed the leading
+    part of a cached completion (new prefix is cached prefix + typed text),
+    in which case the remaining part of the completion is returned.
+    """
+    PREFIX_WINDOW = 2048
+    SUFFIX_WINDOW = 512
+    # most recent entries per (model, filename, suffix) checked for prefix extension
+    MAX_EXTENSION_CANDIDATES = 8
+
+    def __init__(self, max_entries: int = 256):
+        self._max_entries = max_entries
+        self._entries: OrderedDict[tuple, _CacheEntry] = OrderedDict()
+        self._groups: dict[tuple, OrderedDict[tuple, None]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def model_key(model) -> str:
+        """Identifies a model and its configuration (properties) in cache keys"""
+        provider = model.provider
+        parts = [provider.id if provider is not None else '', model.id]
+        parts += [f"{model_property.id}={model_property.value}" for model_property in model.properties]
+        return InlineCompletionCache._hash("\n".join(parts)).hex()
+
+    @staticmethod
+    def content_key(prefix: str, suffix: str) -> str:
+        """Hash of the full prefix and suffix of a request"""
+        return InlineCompletionCache._hash(f"{len(prefix)}:{prefix}{suffix}").hex()
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_entries > 0
+
+    def get(self, model_key: str, filename: str, prefix: str, suffix: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        group = InlineCompletionCache._group_key(model_key, filename, suffix)
+        key = InlineCompletionCache._entry_key(group, prefix)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.prefix_length == len(prefix):
+                self._touch(entry)
+                self.hits += 1
+                return entry.completion
+
+            for candidate_key in reversed(self._groups.get(group, {})):
+                candidate = self._entries[candidate_key]
+                remaining = InlineCompletionCache._remaining_completion(candidate, prefix)
+                if remaining is not None:
+                    self._touch(candidate)
+                    self.hits += 1
+                    return remaining
+
+            self.misses += 1
+            return None
+
+    def put(self, model_key: str, filename: str, prefix: str, suffix: str, completion: str) -> None:
+        if not self.enabled or completion == '':
+            return
+        group = InlineCompletionCache._group_key(model_key, filename, suffix)
+        key = InlineCompletionCache._entry_key(group, prefix)
+        entry = _CacheEntry(key, group, prefix[-InlineCompletionCache.PREFIX_WINDOW:], len(prefix), completion)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            group_keys = self._groups.setdefault(group, OrderedDict())
+            group_keys[key] = None
+            if len(group_keys) > InlineCompletionCache.MAX_EXTENSION_CANDIDATES:
+                self._remove(next(iter(group_keys)))
+            while len(self._entries) > self._max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+    def _touch(self, entry: _CacheEntry):
+        self._entries.move_to_end(entry.key)
+        self._groups[entry.group].move_to_end(entry.key)
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        group_keys = self._groups.get(entry.group)
+        if group_keys is not None:
+            group_keys.pop(key, None)
+            if len(group_keys) == 0:
+                del self._groups[entry.group]
+
+    @staticmethod
+    def _remaining_completion(entry: _CacheEntry, prefix: str) -> Optional[str]:
+        typed_length = len(prefix) - entry.prefix_length
+        if typed_length <= 0 or typed_length >= len(entry.completion):
+            return None
+        typed = prefix[-typed_length:]
+        if not entry.completion.startswith(typed):
+            return None
+        if not prefix[:-typed_length].endswith(entry.prefix_tail):
+            return None
+        return entry.completion[typed_length:]
+
+    @staticmethod
+    def _group_key(model_key: str, filename: str, suffix: str) -> tuple:
+        return (model_key, filename, InlineCompletionCache._hash(suffix[:InlineCompletionCache.SUFFIX_WINDOW]))
+
+    @staticmethod
+    def _entry_key(group: tuple, prefix: str) -> tuple:
+        return group + (InlineCompletionCache._hash(prefix[-InlineCompletionCache.PREFIX_WINDOW:]),)
+
+    @staticmethod
+    def _hash(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
@@ -1,10 +1,11 @@
 # Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
 
-from typing import Any
+from typing import Any, AsyncIterator
 
 import requests
 from notebook_intelligence.api import ChatModel, EmbeddingModel, InlineCompletionModel, LLMProvider, CancelToken, ChatResponse, CompletionContext
-from notebook_intelligence.github_copilot import generate_copilot_headers, completions, inline_completions
+from notebook_intelligence.github_copilot import generate_copilot_headers, acompletions, ainline_completions, completions, inline_completions
+from notebook_intelligence.metrics import instrument_acompletions, instrument_ainline_completions, instrument_completions, instrument_inline_completions
 import logging
 
 log = logging.getLogger(__name__)
@@ -35,9 +36,15 @@ class GitHubCopilotChatModel(ChatModel):
     def supports_tools(self) -> bool:
         return self._supports_tools
 
+    @instrument_completions
     def completions(self, messages: list[dict], tools: list[dict] = None, response: ChatResponse = None, cancel_token: CancelToken = None, options: dict = {}) -> Any:
         return completions(self._model_id, messages, tools, response, cancel_token, options)
 
+    @instrument_acompletions
+    async def acompletions(self, messages: list[dict], tools: list[dict] = None, cancel_token: CancelToken = None, options: dict = {}) -> AsyncIterator[Any]:
+        async for data in acompletions(self._model_id, messages, tools, cancel_token, options):
+            yield data
+
 class GitHubCopilotInlineCompletionModel(InlineCompletionModel):
     def __init__(self, provider: LLMProvider, model_id: str, model_name: str):
         super().__init__(provider)
@@ -56,9 +63,14 @@ class GitHubCopilotInlineCompletionModel(InlineCompletionModel):
     def context_window(self) -> int:
         return 4096
 
+    @instrument_inline_completions
     def inline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
         return inline_completions(self._model_id, prefix, suffix, language, filename, context, cancel_token)
 
+    @instrument_ainline_completions
+    async def ainline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
+        return await ainline_completions(self._model_id, prefix, suffix, language, filename, context, cancel_token)
+
 class GitHubCopilotLLMProvider(LLMProvider):
     def __init__(self):
         self._chat_models = [
@@ -1,12 +1,29 @@
 # Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
 
 import json
-from typing import Any
+from typing import Any, AsyncIterator
 from notebook_intelligence.api import ChatModel, EmbeddingModel, InlineCompletionModel, LLMProvider, CancelToken, ChatResponse, CompletionContext, LLMProviderProperty
+from notebook_intelligence.connection_aborter import ConnectionAborter
+from notebook_intelligence.metrics import instrument_acompletions, instrument_ainline_completions, instrument_completions, instrument_inline_completions
+from notebook_intelligence.streaming_aggregator import StreamingResponseAggregator
 import litellm
 
 DEFAULT_CONTEXT_WINDOW = 4096
 
+def _stream_chunk(delta) -> dict:
+    reasoning = getattr(delta, 'reasoning_content', None) or getattr(delta, 'reasoning', None)
+    if reasoning is not None:
+        reasoning = str(reasoning)
+    chunk_delta = {
+        "role": delta.role,
+        "content": delta.content,
+        "reasoning_content": reasoning
+    }
+    tool_calls = getattr(delta, 'tool_calls', None)
+    if tool_calls:
+        chunk_delta["tool_calls"] = [tool_call.model_dump(exclude_none=True) for tool_call in tool_calls]
+    return {"choices": [{"delta": chunk_delta}]}
+
 class LiteLLMCompatibleChatModel(ChatModel):
     def __init__(self, provider: "LiteLLMCompatibleLLMProvider"):
         super().__init__(provider)
@@ -36,8 +53,11 @@ class LiteLLMCompatibleChatModel(ChatModel):
         except:
             return DEFAULT_CONTEXT_WINDOW
 
+    @instrument_completions
     def completions(self, messages: list[dict], tools: list[dict] = None, response: ChatResponse = None, cancel_token: CancelToken = None, options: dict = {}) -> Any:
-        stream = response is not None
+        # tool call rounds are streamed and aggregated
+        aggregator = StreamingResponseAggregator() if response is None and tools else None
+        stream = response is not None or aggregator is not None
         model_id = self.get_property("model_id").value
         base_url = self.get_property("base_url").value
         api_key_prop = self.get_property("api_key")
@@ -53,22 +73,28 @@ class LiteLLMCompatibleChatModel(ChatModel):
         )
 
         if stream:
-            for chunk in litellm_resp:
-                if len(chunk.choices) == 0:
-                    continue
-                delta = chunk.choices[0].delta
-                reasoning = getattr(delta, 'reasoning_content', None) or getattr(delta, 'reasoning', None)
-                if reasoning is not None:
-                    reasoning = str(reasoning)
-                response.stream({
-                        "choices": [{
-                            "delta": {
-                                "role": delta.role,
-                                "content": delta.content,
-                                "reasoning_content": reasoning
-                            }
-                        }]
-                    })
+            with ConnectionAborter(cancel_token) as aborter:
+                # LiteLLM manages its own HTTP clients, the connection can only be
+                # aborted when the provider stream exposes its HTTP response
+                # (OpenAI compatible providers). Otherwise streaming stops at the
+                # next chunk.
+                aborter.track_response(getattr(getattr(litellm_resp, "completion_stream", None), "response", None))
+                try:
+                    for chunk in litellm_resp:
+                        if aborter.aborted:
+                            break
+                        if len(chunk.choices) == 0:
+                            continue
+                        if aggregator is not None:
+                            aggregator.add(_stream_chunk(chunk.choices[0].delta))
+                        else:
+                            response.stream(_stream_chunk(chunk.choices[0].delta))
+                except Exception:
+                    if not aborter.aborted:
+                        raise
+                if aggregator is not None:
+                    aggregator.finish()
+                    return None if aborter.aborted else aggregator.response()
             response.finish()
             return
         else:
@@ -80,6 +106,37 @@ class LiteLLMCompatibleChatModel(ChatModel):
                 if reasoning:
                     json_resp['choices'][i]['message']['reasoning_content'] = str(reasoning)
             return json_resp 
+
+    @instrument_acompletions
+    async def acompletions(self, messages: list[dict], tools: list[dict] = None, cancel_token: CancelToken = None, options: dict = {}) -> AsyncIterator[dict]:
+        model_id = self.get_property("model_id").value
+        base_url = self.get_property("base_url").value
+        api_key_prop = self.get_property("api_key")
+        api_key = api_key_prop.value if api_key_prop is not None else None
+        litellm_resp = await litellm.acompletion(
+            model=model_id,
+            messages=messages.copy(),
+            tools=tools,
+            tool_choice=options.get("tool_choice", None),
+            api_base=base_url,
+            api_key=api_key,
+            stream=True,
+        )
+
+        with ConnectionAborter(cancel_token) as aborter:
+            # see completions, the connection can only be aborted when the
+            # provider stream exposes its HTTP response
+            aborter.track_response(getattr(getattr(litellm_resp, "completion_stream", None), "response", None))
+            try:
+                async for chunk in litellm_resp:
+                    if aborter.aborted:
+                        break
+                    if len(chunk.choices) == 0:
+                        continue
+                    yield _stream_chunk(chunk.choices[0].delta)
+            except Exception:
+                if not aborter.aborted:
+                    raise
     
 class LiteLLMCompatibleInlineCompletionModel(InlineCompletionModel):
     def __init__(self, provider: "LiteLLMCompatibleLLMProvider"):
@@ -110,7 +167,11 @@ class LiteLLMCompatibleInlineCompletionModel(InlineCompletionModel):
         except:
             return DEFAULT_CONTEXT_WINDOW
 
+    @instrument_inline_completions
     def inline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
+        if cancel_token.is_cancel_requested:
+            return ''
+
         model_id = self.get_property("model_id").value
         base_url = self.get_property("base_url").value
         api_key_prop = self.get_property("api_key")
@@ -124,6 +185,32 @@ class LiteLLMCompatibleInlineCompletionModel(InlineCompletionModel):
             api_key=api_key,
         )
 
+        if cancel_token.is_cancel_requested:
+            return ''
+
+        return litellm_resp.choices[0].message.content
+
+    @instrument_ainline_completions
+    async def ainline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
+        if cancel_token.is_cancel_requested:
+            return ''
+
+        model_id = self.get_property("model_id").value
+        base_url = self.get_property("base_url").value
+        api_key_prop = self.get_property("api_key")
+        api_key = api_key_prop.value if api_key_prop is not None else None
+        litellm_resp = await litellm.acompletion(
+            model=model_id,
+            prompt=prefix,
+            suffix=suffix,
+            stream=False,
+            api_base=base_url,
+            api_key=api_key,
+        )
+
+        if cancel_token.is_cancel_requested:
+            return ''
+
         return litellm_resp.choices[0].message.content
 
 class LiteLLMCompatibleLLMProvider(LLMProvider):
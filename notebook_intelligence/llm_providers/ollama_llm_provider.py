@@ -1,11 +1,15 @@
 # Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
 
 import json
-from typing import Any
+from typing import Any, AsyncIterator
 from notebook_intelligence.api import ChatModel, EmbeddingModel, InlineCompletionModel, LLMProvider, CancelToken, ChatResponse, CompletionContext
 import ollama
 import logging
 
+from notebook_intelligence.client_cache import loop_client_cache
+from notebook_intelligence.connection_aborter import ConnectionAborter
+from notebook_intelligence.metrics import instrument_acompletions, instrument_ainline_completions, instrument_completions, instrument_inline_completions
+from notebook_intelligence.streaming_aggregator import StreamingResponseAggregator
 from notebook_intelligence.util import extract_llm_generated_code
 
 log = logging.getLogger(__name__)
@@ -17,6 +21,52 @@ CODELLAMA_INLINE_COMPL_PROMPT = """<PRE> {prefix} <SUF>{suffix} <MID>"""
 STARCODER_INLINE_COMPL_PROMPT = """<fim_prefix>{prefix}<fim_suffix>{suffix}<fim_middle>"""
 CODESTRAL_INLINE_COMPL_PROMPT = """[SUFFIX]{suffix}[PREFIX]{prefix}"""
 
+def _stream_chunk(chunk) -> dict:
+    delta = chunk['message']
+    reasoning = delta.get('reasoning_content') or delta.get('reasoning')
+    if reasoning is not None:
+        reasoning = str(reasoning)
+    chunk_delta = {
+        "role": delta['role'],
+        "content": delta['content'],
+        "reasoning_content": reasoning
+    }
+    tool_calls = delta.get('tool_calls')
+    if tool_calls:
+        # Ollama streams complete tool calls, without index
+        chunk_delta["tool_calls"] = [
+            {"type": "function", "function": {"name": tool_call.function.name, "arguments": json.dumps(tool_call.function.arguments)}}
+            for tool_call in tool_calls
+        ]
+    return {"choices": [{"delta": chunk_delta}]}
+
+def _generate_args(model_id: str, prompt: str) -> dict:
+    return {
+        "model": model_id,
+        "prompt": prompt,
+        "raw": True,
+        "options": {
+            'num_predict': 128,
+            "temperature": 0,
+            "stop" : [
+                "<|end▁of▁sentence|>",
+                "<｜end▁of▁sentence｜>",
+                "<|EOT|>",
+                "<EOT>",
+                "\\n",
+                "</s>",
+                "<|eot_id|>",
+            ],
+        },
+    }
+
+def _async_client():
+    """Async client shared within the running event loop"""
+    return loop_client_cache().client(
+        "ollama", None, None,
+        lambda: ollama.AsyncClient(event_hooks=ConnectionAborter.shared_async_httpx_event_hooks())
+    )
+
 class OllamaChatModel(ChatModel):
     def __init__(self, provider: LLMProvider, model_id: str, model_name: str, context_window: int):
         super().__init__(provider)
@@ -36,8 +86,11 @@ class OllamaChatModel(ChatModel):
     def context_window(self) -> int:
         return self._context_window
 
+    @instrument_completions
     def completions(self, messages: list[dict], tools: list[dict] = None, response: ChatResponse = None, cancel_token: CancelToken = None, options: dict = {}) -> Any:
-        stream = response is not None
+        # tool call rounds are streamed and aggregated
+        aggregator = StreamingResponseAggregator() if response is None and tools else None
+        stream = response is not None or aggregator is not None
         completion_args = {
             "model": self._model_id, 
             "messages": messages.copy(),
@@ -46,39 +99,64 @@ class OllamaChatModel(ChatModel):
         if tools is not None and len(tools) > 0:
             completion_args["tools"] = tools
 
-        ollama_response = ollama.chat(**completion_args)
-
-        if stream:
-            for chunk in ollama_response:
-                delta = chunk['message']
-                reasoning = delta.get('reasoning_content') or delta.get('reasoning')
-                if reasoning is not None:
-                    reasoning = str(reasoning)
-                response.stream({
-                        "choices": [{
-                            "delta": {
-                                "role": delta['role'],
-                                "content": delta['content'],
-                                "reasoning_content": reasoning
+        with ConnectionAborter(cancel_token) as aborter, ollama.Client(event_hooks=aborter.httpx_event_hooks()) as client:
+            try:
+                ollama_response = client.chat(**completion_args)
+
+                if aggregator is not None:
+                    for chunk in ollama_response:
+                        if aborter.aborted:
+                            return None
+                        aggregator.add(_stream_chunk(chunk))
+                    aggregator.finish()
+                    return aggregator.response()
+                elif stream:
+                    for chunk in ollama_response:
+                        if aborter.aborted:
+                            break
+                        response.stream(_stream_chunk(chunk))
+                    response.finish()
+                    return
+                else:
+                    json_resp = json.loads(ollama_response.model_dump_json())
+                    message = ollama_response.message
+                    reasoning = getattr(message, 'reasoning_content', None) or getattr(message, 'reasoning', None)
+                    if reasoning:
+                        json_resp['message']['reasoning_content'] = str(reasoning)
+
+                    return {
+                        'choices': [
+                            {
+                                'message': json_resp['message']
                             }
-                        }]
-                    })
-            response.finish()
-            return
-        else:
-            json_resp = json.loads(ollama_response.model_dump_json())
-            message = ollama_response.message
-            reasoning = getattr(message, 'reasoning_content', None) or getattr(message, 'reasoning', None)
-            if reasoning:
-                json_resp['message']['reasoning_content'] = str(reasoning)
-
-            return {
-                'choices': [
-                    {
-                        'message': json_resp['message']
+                        ]
                     }
-                ]
-            }
+            except Exception:
+                if not aborter.aborted:
+                    raise
+                if response is not None:
+                    response.finish()
+                return None
+
+    @instrument_acompletions
+    async def acompletions(self, messages: list[dict], tools: list[dict] = None, cancel_token: CancelToken = None, options: dict = {}) -> AsyncIterator[dict]:
+        completion_args = {
+            "model": self._model_id,
+            "messages": messages.copy(),
+            "stream": True,
+        }
+        if tools is not None and len(tools) > 0:
+            completion_args["tools"] = tools
+
+        with ConnectionAborter(cancel_token) as aborter, _async_client() as client:
+            try:
+                async for chunk in await client.chat(**completion_args):
+                    if aborter.aborted:
+                        break
+                    yield _stream_chunk(chunk)
+            except Exception:
+                if not aborter.aborted:
+                    raise
 
 
 class OllamaInlineCompletionModel(InlineCompletionModel):
@@ -101,6 +179,7 @@ class OllamaInlineCompletionModel(InlineCompletionModel):
     def context_window(self) -> int:
         return self._context_window
 
+    @instrument_inline_completions
     def inline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
         has_suffix = suffix.strip() != ""
         if has_suffix:
@@ -109,26 +188,15 @@ class OllamaInlineCompletionModel(InlineCompletionModel):
             prompt = prefix
 
         try:
-            generate_args = {
-                "model": self._model_id, 
-                "prompt": prompt,
-                "raw": True,
-                "options": {
-                    'num_predict': 128,
-                    "temperature": 0,
-                    "stop" : [
-                        "<|end▁of▁sentence|>",
-                        "<｜end▁of▁sentence｜>",
-                        "<|EOT|>",
-                        "<EOT>",
-                        "\\n",
-                        "</s>",
-                        "<|eot_id|>",
-                    ],
-                },
-            }
-
-            ollama_response = ollama.generate(**generate_args)
+            generate_args = _generate_args(self._model_id, prompt)
+
+            with ConnectionAborter(cancel_token) as aborter, ollama.Client(event_hooks=aborter.httpx_event_hooks()) as client:
+                try:
+                    ollama_response = client.generate(**generate_args)
+                except Exception:
+                    if aborter.aborted:
+                        return ""
+                    raise
             code = ollama_response.response
             code = extract_llm_generated_code(code)
 
@@ -137,6 +205,27 @@ class OllamaInlineCompletionModel(InlineCompletionModel):
             log.error(f"Error occurred while generating using completions ollama: {e}")
             return ""
 
+    @instrument_ainline_completions
+    async def ainline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
+        has_suffix = suffix.strip() != ""
+        if has_suffix:
+            prompt = self._prompt_template.format(prefix=prefix, suffix=suffix.strip())
+        else:
+            prompt = prefix
+
+        try:
+            with ConnectionAborter(cancel_token) as aborter, _async_client() as client:
+                try:
+                    ollama_response = await client.generate(**_generate_args(self._model_id, prompt))
+                except Exception:
+                    if aborter.aborted:
+                        return ""
+                    raise
+            return extract_llm_generated_code(ollama_response.response)
+        except Exception as e:
+            log.error(f"Error occurred while generating using completions ollama: {e}")
+            return ""
+
 class OllamaLLMProvider(LLMProvider):
     def __init__(self):
         super().__init__()
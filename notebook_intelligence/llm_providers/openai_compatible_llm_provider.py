@@ -2,13 +2,139 @@
 
 import json
 import re
-from typing import Any
-from notebook_intelligence.api import ChatModel, EmbeddingModel, InlineCompletionModel, LLMProvider, CancelToken, ChatResponse, CompletionContext, LLMProviderProperty
-from openai import OpenAI, omit
+from typing import Any, AsyncIterator, Iterator
+import httpx
+from notebook_intelligence.api import ChatModel, EmbeddingModel, InlineCompletionModel, LLMProvider, CancelToken, ChatResponse, CompletionContext, LLMPropertyProvider, LLMProviderProperty
+from notebook_intelligence.client_cache import client_cache, invalidate_clients, loop_client_cache
+from notebook_intelligence.connection_aborter import ConnectionAborter
+from notebook_intelligence.metrics import instrument_acompletions, instrument_ainline_completions, instrument_completions, instrument_inline_completions
+from notebook_intelligence.streaming_aggregator import StreamingResponseAggregator
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI, omit
 
 INLINE_COMPLETION_SYSTEM_PROMPT = """You are a code completion assistant. Your task is to generate intelligent autocomplete suggestions for the code at the cursor position for given language and active file type. This is not an interactive session, don't ask for clarifying questions, always generate a suggestion. Don't include any explanations for your response, just generate the code. Don't return any thinking or reasoning, just generate the code. You are given a code snippet with a prefix and a suffix. You need to generate a suggestion for the code that fits best in place of <CURSOR/>. You should return only the code that fits best in place of <CURSOR/>. You should provide multiline code if needed. Enclose the code in triple backticks, just return the code in language. You should not return any other text, just the code. DO NOT INCLUDE THE PREFIX OR SUFFIX IN THE RESPONSE. .ipynb files are Jupyter notebook files and for notebook files, you generate suggestions for a cell within the notebook. A cell can be a code cell with code or a markdown cell with markdown text. If the language is markdown, only return markdown text. If you need to install a Python package within a notebook cell code (for .ipynb files), use %pip install <package_name> instead of !pip install <package_name>. Follow the tags very carefully for proper spacing and indentations."""
 
 DEFAULT_CONTEXT_WINDOW = 4096
+OPENAI_COMPATIBLE_PROVIDER_ID = "openai-compatible"
+# most bytes read after the end of an event stream to release its connection
+SSE_DRAIN_LIMIT = 4096
+
+class _SSEDrainingStream(httpx.SyncByteStream):
+    """
+    The OpenAI SDK stops reading an event stream at its [DONE] event and closes
+    the response, before the end of the chunked body is read, which closes the
+    connection. Reads the rest of the body on close after a [DONE] event so
+    that the connection can go back to the pool.
+    """
+    def __init__(self, stream: httpx.SyncByteStream):
+        self._stream = stream
+        self._tail = b""
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._stream:
+            self._tail = (self._tail + chunk)[-64:]
+            yield chunk
+
+    @property
+    def _done(self) -> bool:
+        return self._tail.rstrip().endswith(b"[DONE]")
+
+    def close(self) -> None:
+        try:
+            if self._done:
+                drained = 0
+                for chunk in self._stream:
+                    drained += len(chunk)
+                    if drained > SSE_DRAIN_LIMIT:
+                        break
+        except Exception:
+            pass
+        finally:
+            self._stream.close()
+
+class _AsyncSSEDrainingStream(_SSEDrainingStream, httpx.AsyncByteStream):
+    """_SSEDrainingStream of async clients"""
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self._tail = (self._tail + chunk)[-64:]
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            if self._done:
+                drained = 0
+                async for chunk in self._stream:
+                    drained += len(chunk)
+                    if drained > SSE_DRAIN_LIMIT:
+                        break
+        except Exception:
+            pass
+        finally:
+            await self._stream.aclose()
+
+def _drain_event_stream_on_close(response: httpx.Response) -> None:
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        response.stream = _SSEDrainingStream(response.stream)
+
+async def _adrain_event_stream_on_close(response: httpx.Response) -> None:
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        response.stream = _AsyncSSEDrainingStream(response.stream)
+
+def _client_settings(model: LLMPropertyProvider) -> tuple:
+    base_url_prop = model.get_property("base_url")
+    base_url = base_url_prop.value if base_url_prop is not None else None
+    base_url = base_url if base_url and base_url.strip() != "" else None
+    return base_url, model.get_property("api_key").value
+
+def _cached_client(model: LLMPropertyProvider):
+    """Client for the base URL and API key of the model, shared between calls and models"""
+    base_url, api_key = _client_settings(model)
+
+    def _create_client() -> OpenAI:
+        # connections are tracked for the ConnectionAborter of the calling context
+        event_hooks = ConnectionAborter.shared_httpx_event_hooks()
+        event_hooks["response"].append(_drain_event_stream_on_close)
+        return OpenAI(base_url=base_url, api_key=api_key, http_client=DefaultHttpxClient(event_hooks=event_hooks))
+
+    return client_cache.client(OPENAI_COMPATIBLE_PROVIDER_ID, base_url, api_key, _create_client)
+
+def _async_cached_client(model: LLMPropertyProvider):
+    """Async client for the base URL and API key of the model, shared within the running event loop"""
+    base_url, api_key = _client_settings(model)
+
+    def _create_client() -> AsyncOpenAI:
+        event_hooks = ConnectionAborter.shared_async_httpx_event_hooks()
+        event_hooks["response"].append(_adrain_event_stream_on_close)
+        return AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=DefaultAsyncHttpxClient(event_hooks=event_hooks))
+
+    return loop_client_cache().client(OPENAI_COMPATIBLE_PROVIDER_ID, base_url, api_key, _create_client)
+
+def _stream_chunk(delta) -> dict:
+    reasoning = getattr(delta, 'reasoning_content', None) or getattr(delta, 'reasoning', None)
+    if reasoning is not None:
+        reasoning = str(reasoning)
+    chunk_delta = {
+        "role": delta.role,
+        "content": delta.content,
+        "reasoning_content": reasoning
+    }
+    if delta.tool_calls:
+        chunk_delta["tool_calls"] = [tool_call.model_dump(exclude_none=True) for tool_call in delta.tool_calls]
+    return {"choices": [{"delta": chunk_delta}]}
+
+def _inline_completion_messages(prefix: str, suffix: str, language: str, filename: str) -> list[dict]:
+    return [
+        {"role": "system", "content": INLINE_COMPLETION_SYSTEM_PROMPT},
+        {"role": "user", "content": f"""Generate a single suggestion that fits best in place of cursor. The code is below in between <CODE> tags and <CURSOR/> is the placeholder for the code to be filled in. Current language is {language} and the active file is {filename}.
+
+<CODE><PREFIX>{prefix}</PREFIX><CURSOR/><SUFFIX>{suffix}</SUFFIX></CODE>
+"""}
+    ]
+
+def _set_client_property_value(model: LLMPropertyProvider, property_id: str, value: str) -> None:
+    old_settings = _client_settings(model)
+    LLMPropertyProvider.set_property_value(model, property_id, value)
+    if _client_settings(model) != old_settings:
+        invalidate_clients(OPENAI_COMPATIBLE_PROVIDER_ID, *old_settings)
 
 class OpenAICompatibleChatModel(ChatModel):
     def __init__(self, provider: "OpenAICompatibleLLMProvider"):
@@ -39,52 +165,88 @@ class OpenAICompatibleChatModel(ChatModel):
         except:
             return DEFAULT_CONTEXT_WINDOW
 
+    def set_property_value(self, property_id: str, value: str):
+        _set_client_property_value(self, property_id, value)
+
+    @instrument_completions
     def completions(self, messages: list[dict], tools: list[dict] = None, response: ChatResponse = None, cancel_token: CancelToken = None, options: dict = {}) -> Any:
-        stream = response is not None
+        # tool call rounds are streamed and aggregated
+        aggregator = StreamingResponseAggregator() if response is None and tools else None
+        stream = response is not None or aggregator is not None
         model_id = self.get_property("model_id").value
-        base_url_prop = self.get_property("base_url")
-        base_url = base_url_prop.value if base_url_prop is not None else None
-        base_url = base_url if base_url.strip() != "" else None
-        api_key = self.get_property("api_key").value
-
-        client = OpenAI(base_url=base_url, api_key=api_key)
-        resp = client.chat.completions.create(
-            model=model_id,
-            messages=messages.copy(),
-            tools=tools or omit,
-            tool_choice=options.get("tool_choice", omit),
-            stream=stream,
-        )
-
-        if stream:
-            for chunk in resp:
-                if len(chunk.choices) == 0:
-                    continue
-                delta = chunk.choices[0].delta
-                reasoning = getattr(delta, 'reasoning_content', None) or getattr(delta, 'reasoning', None)
-                if reasoning is not None:
-                    reasoning = str(reasoning)
-                response.stream({
-                        "choices": [{
-                            "delta": {
-                                "role": delta.role,
-                                "content": delta.content,
-                                "reasoning_content": reasoning
-                            }
-                        }]
-                    })
-            response.finish()
-            return
-        else:
-            json_resp = json.loads(resp.model_dump_json())
-            # Capture reasoning fields if they exist as extra attributes
-            for i, choice in enumerate(resp.choices):
-                message = choice.message
-                reasoning = getattr(message, 'reasoning_content', None) or getattr(message, 'reasoning', None)
-                if reasoning:
-                    json_resp['choices'][i]['message']['reasoning_content'] = str(reasoning)
-            return json_resp
-    
+
+        with ConnectionAborter(cancel_token) as aborter, _cached_client(self) as client:
+            resp = None
+            try:
+                resp = client.chat.completions.create(
+                    model=model_id,
+                    messages=messages.copy(),
+                    tools=tools or omit,
+                    tool_choice=options.get("tool_choice", omit),
+                    stream=stream,
+                )
+
+                if aggregator is not None:
+                    for chunk in resp:
+                        if aborter.aborted:
+                            return None
+                        if len(chunk.choices) > 0:
+                            aggregator.add(_stream_chunk(chunk.choices[0].delta))
+                    aggregator.finish()
+                    return aggregator.response()
+                elif stream:
+                    for chunk in resp:
+                        if aborter.aborted:
+                            break
+                        if len(chunk.choices) == 0:
+                            continue
+                        response.stream(_stream_chunk(chunk.choices[0].delta))
+                    response.finish()
+                    return
+                else:
+                    json_resp = json.loads(resp.model_dump_json())
+                    # Capture reasoning fields if they exist as extra attributes
+                    for i, choice in enumerate(resp.choices):
+                        message = choice.message
+                        reasoning = getattr(message, 'reasoning_content', None) or getattr(message, 'reasoning', None)
+                        if reasoning:
+                            json_resp['choices'][i]['message']['reasoning_content'] = str(reasoning)
+                    return json_resp
+            except Exception:
+                if not aborter.aborted:
+                    raise
+                if response is not None:
+                    response.finish()
+                return None
+            finally:
+                # release the connection of an unfinished stream back to the pool
+                if stream and resp is not None:
+                    resp.close()
+
+    @instrument_acompletions
+    async def acompletions(self, messages: list[dict], tools: list[dict] = None, cancel_token: CancelToken = None, options: dict = {}) -> AsyncIterator[dict]:
+        model_id = self.get_property("model_id").value
+
+        with ConnectionAborter(cancel_token) as aborter, _async_cached_client(self) as client:
+            try:
+                resp = await client.chat.completions.create(
+                    model=model_id,
+                    messages=messages.copy(),
+                    tools=tools or omit,
+                    tool_choice=options.get("tool_choice", omit),
+                    stream=True,
+                )
+                async with resp:
+                    async for chunk in resp:
+                        if aborter.aborted:
+                            break
+                        if len(chunk.choices) == 0:
+                            continue
+                        yield _stream_chunk(chunk.choices[0].delta)
+            except Exception:
+                if not aborter.aborted:
+                    raise
+
 class OpenAICompatibleInlineCompletionModel(InlineCompletionModel):
     def __init__(self, provider: "OpenAICompatibleLLMProvider"):
         super().__init__(provider)
@@ -114,6 +276,9 @@ class OpenAICompatibleInlineCompletionModel(InlineCompletionModel):
         except:
             return DEFAULT_CONTEXT_WINDOW
 
+    def set_property_value(self, property_id: str, value: str):
+        _set_client_property_value(self, property_id, value)
+
     def _extract_llm_generated_code(self, text: str) -> str:
         tags = ["<CODE>", "</CODE>", "<PREFIX>", "</PREFIX>", "<SUFFIX>", "</SUFFIX>", "<CURSOR>", "</CURSOR>"]
         for tag in tags:
@@ -133,29 +298,55 @@ class OpenAICompatibleInlineCompletionModel(InlineCompletionModel):
         
         return text
 
+    @instrument_inline_completions
     def inline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
         if cancel_token.is_cancel_requested:
             return ''
 
         model_id = self.get_property("model_id").value
-        base_url_prop = self.get_property("base_url")
-        base_url = base_url_prop.value if base_url_prop is not None else None
-        base_url = base_url if base_url and base_url.strip() != "" else None
-        api_key = self.get_property("api_key").value
-
-        client = OpenAI(base_url=base_url, api_key=api_key)
-        resp = client.chat.completions.create(
-            model=model_id,
-            messages=[
-                {"role": "system", "content": INLINE_COMPLETION_SYSTEM_PROMPT},
-                {"role": "user", "content": f"""Generate a single suggestion that fits best in place of cursor. The code is below in between <CODE> tags and <CURSOR/> is the placeholder for the code to be filled in. Current language is {language} and the active file is {filename}.
 
-<CODE><PREFIX>{prefix}</PREFIX><CURSOR/><SUFFIX>{suffix}</SUFFIX></CODE>
-"""}
-            ],
-            max_tokens=1000,
-            stream=False,
-        )
+        with ConnectionAborter(cancel_token) as aborter, _cached_client(self) as client:
+            # no retries, a retried suggestion would arrive too late to be useful and
+            # the backoff would delay returning from an aborted request
+            client = client.with_options(max_retries=0)
+            try:
+                resp = client.chat.completions.create(
+                    model=model_id,
+                    messages=_inline_completion_messages(prefix, suffix, language, filename),
+                    max_tokens=1000,
+                    stream=False,
+                )
+            except Exception:
+                if aborter.aborted:
+                    return ''
+                raise
+
+        if cancel_token.is_cancel_requested:
+            return ''
+
+        content = resp.choices[0].message.content or ''
+        return self._extract_llm_generated_code(content)
+
+    @instrument_ainline_completions
+    async def ainline_completions(self, prefix, suffix, language, filename, context: CompletionContext, cancel_token: CancelToken) -> str:
+        if cancel_token.is_cancel_requested:
+            return ''
+
+        model_id = self.get_property("model_id").value
+
+        with ConnectionAborter(cancel_token) as aborter, _async_cached_client(self) as client:
+            client = client.with_options(max_retries=0)
+            try:
+                resp = await client.chat.completions.create(
+                    model=model_id,
+                    messages=_inline_completion_messages(prefix, suffix, language, filename),
+                    max_tokens=1000,
+                    stream=False,
+                )
+            except Exception:
+                if aborter.aborted:
+                    return ''
+                raise
 
         if cancel_token.is_cancel_requested:
             return ''
@@ -171,7 +362,7 @@ class OpenAICompatibleLLMProvider(LLMProvider):
 
     @property
     def id(self) -> str:
-        return "openai-compatible"
+        return OPENAI_COMPATIBLE_PROVIDER_ID
     
     @property
     def name(self) -> str:
@@ -22,6 +22,8 @@ from fastmcp import Client
 from ._version import __version__ as NBI_VERSION
 EDITOR_VERSION = f"NotebookIntelligence/{NBI_VERSION}"
 
+from notebook_intelligence.metrics import mcp_tool_call_duration, mcp_tool_calls_in_flight, observe
+from notebook_intelligence.tracing import tracer
 from notebook_intelligence.util import ThreadSafeWebSocketConnector
 
 log = logging.getLogger(__name__)
@@ -30,6 +32,18 @@ MCP_ICON_SRC = 'iVBORw0KGgoAAAANSUhEUgAAAMgAAADICAIAAAAiOjnJAAAPBUlEQVR4nOydf2wT
 MCP_ICON_URL = f"data:image/png;base64,{MCP_ICON_SRC}"
 MCP_SERVER_RESPONSE_TIMEOUT = float(os.getenv("NBI_MCP_SERVER_RESPONSE_TIMEOUT", "30"))
 
+def describe_tools(tools: list[Tool]) -> list[dict]:
+    """Tool list of an MCP server as listed in the capabilities"""
+    return [{"name": tool.name, "description": tool.description} for tool in tools]
+
+def describe_prompts(prompts: list[MCPPrompt]) -> list[dict]:
+    """Prompt list of an MCP server as listed in the capabilities"""
+    return [{
+        "name": prompt.name,
+        "description": prompt.description,
+        "arguments": [{"name": argument.name, "description": argument.description, "required": argument.required} for argument in prompt.arguments]
+    } for prompt in prompts]
+
 class MCPServerEventType(str, Enum):
     ListTools = 'list-tools'
     CallTool = 'call-tool'
@@ -37,14 +51,20 @@ class MCPServerEventType(str, Enum):
     ListPrompts = 'list-prompts'
     GetPromptValue = 'get-prompt-value'
 
+def _is_read_only(tool) -> bool:
+    # servers declare tools that don't modify their environment with readOnlyHint
+    annotations = getattr(tool, "annotations", None)
+    return bool(getattr(annotations, "readOnlyHint", False))
+
 class MCPTool(Tool):
-    def __init__(self, server: 'MCPServer', name, description, schema, auto_approve=False):
+    def __init__(self, server: 'MCPServer', name, description, schema, auto_approve=False, read_only=False):
         super().__init__()
         self._server = server
         self._name = name
         self._description = description
         self._schema = schema
         self._auto_approve = auto_approve
+        self._read_only = read_only
 
     @property
     def name(self) -> str:
@@ -73,6 +93,10 @@ class MCPTool(Tool):
                 "parameters": self._schema
             },
         }
+
+    @property
+    def read_only(self) -> bool:
+        return self._read_only
     
     def pre_invoke(self, request: ChatRequest, tool_args: dict) -> Union[ToolPreInvokeResponse, None]:
         confirmationTitle = None
@@ -90,7 +114,8 @@ class MCPTool(Tool):
                 call_args[key] = tool_args.get(key)
 
         try:
-            result = self._server.call_tool(self.name, call_args)
+            # waits for the MCP client thread, without blocking the event loop
+            result = await asyncio.to_thread(self._server.call_tool, self.name, call_args)
             if hasattr(result, "content") and isinstance(result.content, list):
                 if len(result.content) > 0:
                     text_contents = []
@@ -239,12 +264,19 @@ class MCPServerImpl(MCPServer):
             self.update_tool_list()
             self.update_prompts_list()
     
-    def _set_status(self, status: MCPServerStatus):
+    def _set_status(self, status: MCPServerStatus, tools_changed: bool = False, prompts_changed: bool = False):
         self._status = status
         if self._manager.websocket_connector is not None:
-            self._manager.websocket_connector.write_message({
+            # the event carries the changed state so that clients can patch
+            # their capabilities. bursts for a server are merged
+            data = {"server": self.name, "status": status}
+            if tools_changed:
+                data["tools"] = describe_tools(self.get_tools())
+            if prompts_changed:
+                data["prompts"] = describe_prompts(self.get_prompts())
+            self._manager.websocket_connector.write_message_debounced((BackendMessageType.MCPServerStatusChange, self.name), {
                 "type": BackendMessageType.MCPServerStatusChange,
-                "data": {}
+                "data": data
             })
 
     async def _client_thread_func(self):
@@ -378,20 +410,26 @@ class MCPServerImpl(MCPServer):
             return
         self._set_status(MCPServerStatus.UpdatingToolList)
         response = self._send_mcp_request(MCPServerEventType.ListTools)
+        tools_changed = False
         if response["success"]:
+            tools_changed = response["data"] != self._mcp_tools
             self._mcp_tools = response["data"]
         else:
             log.error(f"MCP server '{self.name}' failed to update tool list: {response['error']}")
-        self._set_status(MCPServerStatus.UpdatedToolList)
+        self._set_status(MCPServerStatus.UpdatedToolList, tools_changed=tools_changed)
 
     def call_tool(self, tool_name: str, tool_args: dict):
         if not self.is_connected():
             return f"MCP server '{self.name}' is not connected"
 
-        response = self._send_mcp_request(MCPServerEventType.CallTool, {
-            "tool_name": tool_name,
-            "tool_args": tool_args
-        })
+        with tracer.span("mcp.call_tool", server=self.name, tool=tool_name), \
+             observe(mcp_tool_call_duration, mcp_tool_calls_in_flight.labels(server=self.name), server=self.name) as observation:
+            response = self._send_mcp_request(MCPServerEventType.CallTool, {
+                "tool_name": tool_name,
+                "tool_args": tool_args
+            })
+            if not response["success"]:
+                observation.outcome = "error"
 
         if response["success"]:
             return response["data"]
@@ -401,7 +439,7 @@ class MCPServerImpl(MCPServer):
 
     # TODO: optimize this
     def get_tools(self) -> list[Tool]:
-        return [MCPTool(self, tool.name, tool.description, tool.inputSchema, auto_approve=(tool.name in self._auto_approve_tools)) for tool in self._mcp_tools]
+        return [MCPTool(self, tool.name, tool.description, tool.inputSchema, auto_approve=(tool.name in self._auto_approve_tools), read_only=_is_read_only(tool)) for tool in self._mcp_tools]
 
     def get_tool(self, tool_name: str) -> Tool:
         for tool in self.get_tools():
@@ -414,11 +452,13 @@ class MCPServerImpl(MCPServer):
             return
         self._set_status(MCPServerStatus.UpdatingPromptList)
         response = self._send_mcp_request(MCPServerEventType.ListPrompts)
+        prompts_changed = False
         if response["success"]:
+            prompts_changed = response["data"] != self._mcp_prompts
             self._mcp_prompts = response["data"]
         else:
             log.error(f"MCP server '{self.name}' failed to update prompts: {response['error']}")
-        self._set_status(MCPServerStatus.UpdatedPromptList)
+        self._set_status(MCPServerStatus.UpdatedPromptList, prompts_changed=prompts_changed)
 
     def get_prompts(self) -> list[MCPPrompt]:
         prompts = []
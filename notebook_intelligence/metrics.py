@@ -0,0 +1,280 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+import asyncio
+from contextlib import contextmanager
+import functools
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+from notebook_intelligence.tokenizer import tokenizer
+from notebook_intelligence.tracing import tracer
+
+if TYPE_CHECKING:
+    # api.py uses this module
+    from notebook_intelligence.api import CancelToken, ChatResponse
+
+# metrics of the extension, served by the /notebook-intelligence/metrics
+# handler. kept out of the default prometheus registry so that they don't mix
+# with the metrics of jupyter_server
+registry = CollectorRegistry()
+
+# chat requests and tool calls of agents can take minutes
+LONG_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+# inline completions are expected to return well within a few seconds
+SHORT_LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10)
+
+chat_request_duration = Histogram("nbi_chat_request_duration_seconds", "Duration of chat requests", ["participant", "outcome"], buckets=LONG_LATENCY_BUCKETS, registry=registry)
+chat_requests_in_flight = Gauge("nbi_chat_requests_in_flight", "Chat requests in progress", registry=registry)
+
+inline_completion_duration = Histogram("nbi_inline_completion_duration_seconds", "Duration of inline completion requests", ["outcome"], buckets=SHORT_LATENCY_BUCKETS, registry=registry)
+inline_completions_in_flight = Gauge("nbi_inline_completions_in_flight", "Inline completion requests in progress", registry=registry)
+
+provider_request_duration = Histogram("nbi_provider_request_duration_seconds", "Duration of LLM provider calls", ["provider", "model", "kind", "outcome"], buckets=LONG_LATENCY_BUCKETS, registry=registry)
+provider_time_to_first_token = Histogram("nbi_provider_time_to_first_token_seconds", "Time until the first streamed part of a chat completion", ["provider", "model"], buckets=SHORT_LATENCY_BUCKETS, registry=registry)
+provider_output_tokens = Counter("nbi_provider_output_tokens", "Tokens generated by LLM providers, estimated for streamed responses", ["provider", "model", "kind"], registry=registry)
+provider_errors = Counter("nbi_provider_errors", "Failed LLM provider calls", ["provider", "model", "kind"], registry=registry)
+provider_requests_in_flight = Gauge("nbi_provider_requests_in_flight", "LLM provider calls in progress", ["provider", "kind"], registry=registry)
+
+tool_call_duration = Histogram("nbi_tool_call_duration_seconds", "Duration of tool calls made by chat participants", ["tool", "outcome"], buckets=LONG_LATENCY_BUCKETS, registry=registry)
+tool_calls_in_flight = Gauge("nbi_tool_calls_in_flight", "Tool calls in progress", registry=registry)
+
+mcp_tool_call_duration = Histogram("nbi_mcp_tool_call_duration_seconds", "Duration of MCP server tool calls", ["server", "outcome"], buckets=LONG_LATENCY_BUCKETS, registry=registry)
+mcp_tool_calls_in_flight = Gauge("nbi_mcp_tool_calls_in_flight", "MCP server tool calls in progress", ["server"], registry=registry)
+
+claude_query_duration = Histogram("nbi_claude_query_duration_seconds", "Duration of Claude agent queries", ["outcome"], buckets=LONG_LATENCY_BUCKETS, registry=registry)
+claude_queries_in_flight = Gauge("nbi_claude_queries_in_flight", "Claude agent queries in progress", registry=registry)
+
+class Observation:
+    """
+    A timed operation, see observe(). `outcome` defaults to "success", is set
+    to "error" if the operation raises and to "cancelled" if its cancel token
+    is cancelled. Labels can be updated until the operation ends.
+    """
+    def __init__(self, labels: dict):
+        self.labels = labels
+        self.outcome = "success"
+        self.started_at = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+@contextmanager
+def observe(histogram: Histogram, in_flight: Optional[Gauge] = None, cancel_token: Optional['CancelToken'] = None, **labels):
+    """
+    Records the duration of the block in histogram, labeled with labels and
+    the outcome. in_flight is incremented while the block runs.
+
+    Usage:
+        with observe(tool_call_duration, tool_calls_in_flight, tool=name) as observation:
+            ...
+            if failed: observation.outcome = "error"
+    """
+    observation = Observation(labels)
+    if in_flight is not None:
+        in_flight.inc()
+    try:
+        yield observation
+    except (GeneratorExit, asyncio.CancelledError):
+        # the consumer stopped, e.g. an async generator closed on cancel
+        observation.outcome = "cancelled"
+        raise
+    except BaseException:
+        observation.outcome = "error"
+        raise
+    finally:
+        if in_flight is not None:
+            in_flight.dec()
+        if observation.outcome == "success" and cancel_token is not None and cancel_token.is_cancel_requested:
+            observation.outcome = "cancelled"
+        histogram.labels(outcome=observation.outcome, **observation.labels).observe(observation.elapsed)
+
+def generate() -> tuple[bytes, str]:
+    """Returns the metrics in the Prometheus text format and its content type"""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def _model_labels(model, provider_id: Optional[str]) -> tuple[str, str]:
+    if provider_id is None:
+        provider_id = model.provider.id if model.provider is not None else "unknown"
+    return provider_id, model.id
+
+def _streamed_text(data: Any) -> str:
+    if isinstance(data, dict):
+        text = ""
+        for choice in data.get("choices") or []:
+            delta = choice.get("delta") or {}
+            text += (delta.get("content") or "") + (delta.get("reasoning_content") or "")
+        return text
+    # MarkdownData
+    content = getattr(data, "content", None)
+    if isinstance(content, str):
+        return content + (getattr(data, "reasoning_content", None) or "")
+    return ""
+
+def _completion_tokens(result: Any) -> int:
+    if not isinstance(result, dict):
+        return 0
+    usage = result.get("usage")
+    if isinstance(usage, dict) and isinstance(usage.get("completion_tokens"), int):
+        return usage["completion_tokens"]
+    content = ""
+    for choice in result.get("choices") or []:
+        message = choice.get("message") or {}
+        content += message.get("content") or ""
+    return tokenizer.count_tokens(content) if isinstance(content, str) else 0
+
+class _MeteredChatResponse:
+    """
+    ChatResponse wrapper passed to providers, recording the time to the first
+    streamed part and the number of streamed tokens. Token counts are
+    estimated per part, encoding every part would slow down streaming.
+    """
+    def __init__(self, response: 'ChatResponse'):
+        self._response = response
+        self.started_at = time.monotonic()
+        self.first_part_at: Optional[float] = None
+        self.tokens = 0
+
+    def stream(self, data, *args, **kwargs):
+        if self.first_part_at is None:
+            self.first_part_at = time.monotonic()
+        text = _streamed_text(data)
+        if text:
+            self.tokens += tokenizer.estimate_tokens(text)
+        return self._response.stream(data, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+def instrument_completions(completions: Callable = None, *, provider_id: Optional[str] = None):
+    """
+    Decorator for ChatModel.completions recording latency, time to first
+    token (streamed calls), output tokens and errors of the provider call,
+    and a trace span for it. provider_id is needed for models without a
+    provider.
+    """
+    if completions is None:
+        return functools.partial(instrument_completions, provider_id=provider_id)
+
+    @functools.wraps(completions)
+    def wrapper(self, messages: list[dict], tools: list[dict] = None, response: 'ChatResponse' = None, cancel_token: 'CancelToken' = None, options: dict = {}) -> Any:
+        provider, model = _model_labels(self, provider_id)
+        metered_response = _MeteredChatResponse(response) if response is not None else None
+        result = None
+        in_flight = provider_requests_in_flight.labels(provider=provider, kind="chat")
+        with tracer.span("provider.completions", provider=provider, model=model, stream=response is not None) as span:
+            try:
+                with observe(provider_request_duration, in_flight, cancel_token, provider=provider, model=model, kind="chat"):
+                    result = completions(self, messages, tools, metered_response, cancel_token, options)
+            except Exception:
+                provider_errors.labels(provider=provider, model=model, kind="chat").inc()
+                raise
+            finally:
+                if metered_response is not None:
+                    tokens = metered_response.tokens
+                    if metered_response.first_part_at is not None:
+                        time_to_first_token = metered_response.first_part_at - metered_response.started_at
+                        provider_time_to_first_token.labels(provider=provider, model=model).observe(time_to_first_token)
+                        span.set_attribute("time_to_first_token_ms", round(time_to_first_token * 1000, 3))
+                else:
+                    tokens = _completion_tokens(result)
+                provider_output_tokens.labels(provider=provider, model=model, kind="chat").inc(tokens)
+                span.set_attribute("output_tokens", tokens)
+        return result
+
+    return wrapper
+
+def instrument_inline_completions(inline_completions: Callable = None, *, provider_id: Optional[str] = None):
+    """
+    Decorator for InlineCompletionModel.inline_completions recording latency,
+    output tokens and errors of the provider call, and a trace span for it.
+    """
+    if inline_completions is None:
+        return functools.partial(instrument_inline_completions, provider_id=provider_id)
+
+    @functools.wraps(inline_completions)
+    def wrapper(self, prefix, suffix, language, filename, context, cancel_token: 'CancelToken') -> str:
+        provider, model = _model_labels(self, provider_id)
+        in_flight = provider_requests_in_flight.labels(provider=provider, kind="inline")
+        with tracer.span("provider.inline_completions", provider=provider, model=model) as span:
+            try:
+                with observe(provider_request_duration, in_flight, cancel_token, provider=provider, model=model, kind="inline"):
+                    result = inline_completions(self, prefix, suffix, language, filename, context, cancel_token)
+            except Exception:
+                provider_errors.labels(provider=provider, model=model, kind="inline").inc()
+                raise
+            if isinstance(result, str):
+                tokens = tokenizer.count_tokens(result)
+                provider_output_tokens.labels(provider=provider, model=model, kind="inline").inc(tokens)
+                span.set_attribute("output_tokens", tokens)
+        return result
+
+    return wrapper
+
+def instrument_acompletions(acompletions: Callable = None, *, provider_id: Optional[str] = None):
+    """
+    Decorator for native ChatModel.acompletions implementations, recording
+    the same metrics and trace span as instrument_completions.
+    """
+    if acompletions is None:
+        return functools.partial(instrument_acompletions, provider_id=provider_id)
+
+    @functools.wraps(acompletions)
+    async def wrapper(self, messages: list[dict], tools: list[dict] = None, cancel_token: 'CancelToken' = None, options: dict = {}) -> AsyncIterator[Any]:
+        provider, model = _model_labels(self, provider_id)
+        started_at = time.monotonic()
+        first_part_at = None
+        tokens = 0
+        in_flight = provider_requests_in_flight.labels(provider=provider, kind="chat")
+        with tracer.span("provider.completions", provider=provider, model=model, stream=True, native_async=True) as span:
+            try:
+                with observe(provider_request_duration, in_flight, cancel_token, provider=provider, model=model, kind="chat"):
+                    async for data in acompletions(self, messages, tools, cancel_token, options):
+                        if first_part_at is None:
+                            first_part_at = time.monotonic()
+                        text = _streamed_text(data)
+                        if text:
+                            tokens += tokenizer.estimate_tokens(text)
+                        yield data
+            except Exception:
+                provider_errors.labels(provider=provider, model=model, kind="chat").inc()
+                raise
+            finally:
+                if first_part_at is not None:
+                    time_to_first_token = first_part_at - started_at
+                    provider_time_to_first_token.labels(provider=provider, model=model).observe(time_to_first_token)
+                    span.set_attribute("time_to_first_token_ms", round(time_to_first_token * 1000, 3))
+                provider_output_tokens.labels(provider=provider, model=model, kind="chat").inc(tokens)
+                span.set_attribute("output_tokens", tokens)
+
+    return wrapper
+
+def instrument_ainline_completions(ainline_completions: Callable = None, *, provider_id: Optional[str] = None):
+    """
+    Decorator for native InlineCompletionModel.ainline_completions
+    implementations, recording the same metrics and trace span as
+    instrument_inline_completions.
+    """
+    if ainline_completions is None:
+        return functools.partial(instrument_ainline_completions, provider_id=provider_id)
+
+    @functools.wraps(ainline_completions)
+    async def wrapper(self, prefix, suffix, language, filename, context, cancel_token: 'CancelToken') -> str:
+        provider, model = _model_labels(self, provider_id)
+        in_flight = provider_requests_in_flight.labels(provider=provider, kind="inline")
+        with tracer.span("provider.inline_completions", provider=provider, model=model, native_async=True) as span:
+            try:
+                with observe(provider_request_duration, in_flight, cancel_token, provider=provider, model=model, kind="inline"):
+                    result = await ainline_completions(self, prefix, suffix, language, filename, context, cancel_token)
+            except Exception:
+                provider_errors.labels(provider=provider, model=model, kind="inline").inc()
+                raise
+            if isinstance(result, str):
+                tokens = tokenizer.count_tokens(result)
+                provider_output_tokens.labels(provider=provider, model=model, kind="inline").inc(tokens)
+                span.set_attribute("output_tokens", tokens)
+        return result
+
+    return wrapper
@@ -0,0 +1,309 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+import asyncio
+from collections import deque
+import contextvars
+from dataclasses import dataclass, field
+from enum import Enum
+import logging
+import threading
+import time
+from typing import Callable, Coroutine, Optional
+
+from notebook_intelligence.api import CancelToken
+from notebook_intelligence.tracing import tracer
+
+log = logging.getLogger(__name__)
+
+class RequestLane(str, Enum):
+    # latency sensitive requests (inline completions). served by a dedicated
+    # set of workers so they never wait behind long running chat requests
+    Interactive = 'interactive'
+    # chat, inline chat and agent requests
+    Chat = 'chat'
+    # fire-and-forget work (telemetry events), kept off the chat workers
+    Background = 'background'
+
+class RequestRejectedError(Exception):
+    """Raised when a request cannot be admitted to the scheduler."""
+
+@dataclass
+class LaneConfig:
+    workers: int
+    max_queue_depth: int
+    # requests run concurrently on the event loop of a worker
+    tasks_per_worker: int = 1
+
+@dataclass
+class _ScheduledRequest:
+    coro: Coroutine
+    user: str
+    cancel_token: Optional[CancelToken] = None
+    on_discard: Optional[Callable[[], None]] = None
+    on_done: Optional[Callable[[], None]] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # context of the submitter, the request runs in it (e.g. to continue its trace)
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+    def discard(self):
+        self.coro.close()
+        if self.on_discard is not None:
+            try:
+                self.on_discard()
+            except Exception as e:
+                log.error(f"Error discarding scheduled request: {e}")
+        self.done()
+
+    def done(self):
+        if self.on_done is not None:
+            try:
+                self.on_done()
+            except Exception as e:
+                log.error(f"Error completing scheduled request: {e}")
+
+class _Lane:
+    def __init__(self, name: RequestLane, config: LaneConfig):
+        self.name = name
+        self.config = config
+        self.queue: deque[_ScheduledRequest] = deque()
+        self.running_per_user: dict[str, int] = {}
+        self.running = 0
+        self.rejected = 0
+        self.completed = 0
+        self.workers: list["_Worker"] = []
+
+class _Worker:
+    def __init__(self, lane_state: _Lane):
+        self.lane_state = lane_state
+        self.thread: Optional[threading.Thread] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # set (from any thread) when the worker may be able to take a request
+        self.wakeup: Optional[asyncio.Event] = None
+        self.in_flight = 0
+
+    def wake(self):
+        # called with the scheduler condition held
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+class RequestScheduler:
+    """
+    Runs request coroutines on a fixed pool of worker threads. Each worker owns
+    a long lived event loop and runs up to `tasks_per_worker` requests on it
+    concurrently, so requests waiting on the user (tool confirmations, UI
+    commands) or on the network do not hold a worker each. Requests are
+    assigned to lanes, each lane has its own workers and bounded queue.
+    A user can have at most `max_concurrent_per_user` requests running in a
+    lane; additional requests wait in the queue until a slot frees up.
+    """
+    def __init__(
+        self,
+        chat_workers: int = 8,
+        interactive_workers: int = 4,
+        max_queue_depth: int = 64,
+        max_concurrent_per_user: int = 4,
+        tasks_per_worker: int = 8,
+        background_workers: int = 1
+    ):
+        tasks_per_worker = max(1, tasks_per_worker)
+        self._lanes: dict[RequestLane, _Lane] = {
+            RequestLane.Interactive: _Lane(RequestLane.Interactive, LaneConfig(max(1, interactive_workers), max_queue_depth, tasks_per_worker)),
+            RequestLane.Chat: _Lane(RequestLane.Chat, LaneConfig(max(1, chat_workers), max_queue_depth, tasks_per_worker)),
+            RequestLane.Background: _Lane(RequestLane.Background, LaneConfig(max(1, background_workers), max_queue_depth, tasks_per_worker)),
+        }
+        self._max_concurrent_per_user = max(1, max_concurrent_per_user)
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    @property
+    def max_concurrent_per_user(self) -> int:
+        return self._max_concurrent_per_user
+
+    def submit(
+        self,
+        coro: Coroutine,
+        lane: RequestLane = RequestLane.Chat,
+        user: str = '',
+        cancel_token: Optional[CancelToken] = None,
+        on_discard: Optional[Callable[[], None]] = None,
+        on_done: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        Queue a coroutine for execution. Raises RequestRejectedError without
+        blocking if the lane queue is full or the scheduler is stopped; the
+        coroutine is closed in that case. `on_discard` is called if the request
+        is cancelled (via `cancel_token`) before a worker picks it up.
+        `on_done` is called once the request has run or has been discarded.
+        """
+        lane_state = self._lanes[lane]
+        with self._condition:
+            if self._stopped:
+                coro.close()
+                raise RequestRejectedError("Request scheduler is stopped")
+            if len(lane_state.queue) >= lane_state.config.max_queue_depth:
+                lane_state.rejected += 1
+                coro.close()
+                raise RequestRejectedError(f"Server is busy, too many pending {lane.value} requests")
+            request = _ScheduledRequest(coro, user, cancel_token, on_discard, on_done)
+            lane_state.queue.append(request)
+            self._ensure_workers(lane_state)
+            self._wake_workers(lane_state)
+
+        if cancel_token is not None:
+            cancel_token.cancellation_signal.connect(lambda: self._on_request_cancelled(lane_state, request))
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                lane.value: {
+                    "workers": lane_state.config.workers,
+                    "tasks_per_worker": lane_state.config.tasks_per_worker,
+                    "queued": len(lane_state.queue),
+                    "running": lane_state.running,
+                    "completed": lane_state.completed,
+                    "rejected": lane_state.rejected,
+                } for lane, lane_state in self._lanes.items()
+            }
+
+    def stop(self, timeout: float = 5) -> None:
+        with self._condition:
+            self._stopped = True
+            pending = []
+            for lane_state in self._lanes.values():
+                pending.extend(lane_state.queue)
+                lane_state.queue.clear()
+                self._wake_workers(lane_state)
+        for request in pending:
+            request.discard()
+        # workers finish their running requests before exiting. wait for them
+        # up to `timeout` seconds in total; they are daemon threads otherwise
+        deadline = time.monotonic() + timeout
+        for lane_state in self._lanes.values():
+            for worker in lane_state.workers:
+                worker.thread.join(max(0, deadline - time.monotonic()))
+
+    def _on_request_cancelled(self, lane_state: _Lane, request: _ScheduledRequest):
+        # release queue slots of requests cancelled before they started.
+        # running requests handle cancellation themselves.
+        with self._condition:
+            if request not in lane_state.queue:
+                return
+            lane_state.queue.remove(request)
+        request.discard()
+
+    def _ensure_workers(self, lane_state: _Lane):
+        # workers are started lazily so that importing / constructing the
+        # scheduler does not spawn threads
+        if len(lane_state.workers) > 0:
+            return
+        for i in range(lane_state.config.workers):
+            worker = _Worker(lane_state)
+            worker.thread = threading.Thread(
+                target=self._worker_main,
+                args=(worker,),
+                name=f"nbi-{lane_state.name.value}-worker-{i}",
+                daemon=True
+            )
+            lane_state.workers.append(worker)
+            worker.thread.start()
+
+    def _wake_workers(self, lane_state: _Lane):
+        # called with the condition held
+        for worker in lane_state.workers:
+            worker.wake()
+
+    def _take_next(self, lane_state: _Lane) -> tuple[Optional[_ScheduledRequest], list[_ScheduledRequest]]:
+        # called with the condition held. returns the oldest request whose
+        # user is under the concurrency cap, dropping cancelled ones.
+        discarded = []
+        selected = None
+        for request in list(lane_state.queue):
+            if request.cancel_token is not None and request.cancel_token.is_cancel_requested:
+                lane_state.queue.remove(request)
+                discarded.append(request)
+                continue
+            if lane_state.running_per_user.get(request.user, 0) >= self._max_concurrent_per_user:
+                continue
+            lane_state.queue.remove(request)
+            selected = request
+            break
+        return selected, discarded
+
+    def _worker_main(self, worker: _Worker):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._worker_run(worker, loop))
+        except Exception as e:
+            log.exception(f"Request scheduler worker failed: {e}")
+        finally:
+            try:
+                pending = asyncio.all_tasks(loop)
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                with self._condition:
+                    worker.loop = None
+                loop.close()
+
+    async def _worker_run(self, worker: _Worker, loop: asyncio.AbstractEventLoop):
+        lane_state = worker.lane_state
+        tasks = set()
+        with self._condition:
+            worker.wakeup = asyncio.Event()
+            worker.loop = loop
+        while True:
+            with self._condition:
+                if self._stopped:
+                    break
+                request, discarded = None, []
+                if worker.in_flight < lane_state.config.tasks_per_worker:
+                    request, discarded = self._take_next(lane_state)
+                if request is not None:
+                    worker.in_flight += 1
+                    lane_state.running += 1
+                    lane_state.running_per_user[request.user] = lane_state.running_per_user.get(request.user, 0) + 1
+                elif len(discarded) == 0:
+                    # cleared with the condition held, wakeups after it are not lost
+                    worker.wakeup.clear()
+
+            for discarded_request in discarded:
+                discarded_request.discard()
+
+            if request is None:
+                if len(discarded) == 0:
+                    await worker.wakeup.wait()
+                continue
+
+            request.context.run(tracer.record_span, "scheduler.queued", time.monotonic() - request.enqueued_at, lane=lane_state.name.value)
+            # the task running the request copies the context of the submitter
+            task = request.context.run(loop.create_task, self._run_request(worker, request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        # requests that are running are completed before the worker exits
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_request(self, worker: _Worker, request: _ScheduledRequest):
+        lane_state = worker.lane_state
+        try:
+            await request.coro
+        except Exception as e:
+            log.exception(f"Error running scheduled request: {e}")
+        finally:
+            with self._condition:
+                worker.in_flight -= 1
+                lane_state.running -= 1
+                lane_state.completed += 1
+                user_running = lane_state.running_per_user.get(request.user, 1) - 1
+                if user_running <= 0:
+                    lane_state.running_per_user.pop(request.user, None)
+                else:
+                    lane_state.running_per_user[request.user] = user_running
+                # a worker slot and a user slot are free
+                self._wake_workers(lane_state)
+            request.done()
@@ -2,6 +2,7 @@
 
 from notebook_intelligence.api import ChatRequest
 from notebook_intelligence.rule_manager import RuleManager
+from notebook_intelligence.tracing import tracer
 
 
 class RuleInjector:
@@ -9,6 +10,10 @@ class RuleInjector:
     
     def inject_rules(self, base_prompt: str, request: ChatRequest) -> str:
         """Inject applicable rules into system prompt based on request context."""
+        with tracer.span("rules.inject"):
+            return self._inject_rules(base_prompt, request)
+
+    def _inject_rules(self, base_prompt: str, request: ChatRequest) -> str:
         if not request.rule_context:
             return base_prompt
             
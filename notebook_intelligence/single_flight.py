@@ -0,0 +1,94 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+import asyncio
+import concurrent.futures
+from dataclasses import dataclass, field
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+from notebook_intelligence.api import CancelToken, SignalImpl
+
+log = logging.getLogger(__name__)
+
+class _SharedCancelToken(CancelToken):
+    def __init__(self):
+        super().__init__()
+        self._cancellation_signal = SignalImpl()
+
+    def cancel_request(self) -> None:
+        self._cancellation_requested = True
+        self._cancellation_signal.emit()
+
+@dataclass
+class _Flight:
+    future: concurrent.futures.Future = field(default_factory=concurrent.futures.Future)
+    cancel_token: _SharedCancelToken = field(default_factory=_SharedCancelToken)
+    waiters: int = 0
+
+class SingleFlight:
+    """
+    Merges identical concurrent calls into one. The first caller for a key
+    runs the call, callers arriving while it is in flight wait for its result.
+    Calls may come from different threads / event loops. The call gets a
+    shared cancel token which is cancelled once all callers have cancelled.
+    """
+    def __init__(self):
+        self._flights: dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.merged = 0
+
+    async def run(self, key: Hashable, fn: Callable[[CancelToken], Awaitable[Any]], cancel_token: CancelToken, default: Any = None) -> Any:
+        """
+        Run fn(shared_cancel_token) or wait for the in-flight call with the same
+        key. Returns `default` if cancel_token is cancelled while waiting.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.merged += 1
+            flight.waiters += 1
+
+        cancelled = threading.Event()
+        def _on_cancel():
+            if cancelled.is_set():
+                return
+            cancelled.set()
+            with self._lock:
+                flight.waiters -= 1
+                cancel_shared = flight.waiters == 0
+            if cancel_shared:
+                flight.cancel_token.cancel_request()
+        cancel_token.cancellation_signal.connect(_on_cancel)
+        if cancel_token.is_cancel_requested:
+            _on_cancel()
+
+        if is_leader:
+            try:
+                result = await fn(flight.cancel_token)
+                flight.future.set_result(result)
+            except BaseException as e:
+                flight.future.set_exception(e)
+            finally:
+                with self._lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+            if cancelled.is_set():
+                return default
+            return flight.future.result()
+
+        result_future = asyncio.wrap_future(flight.future)
+        loop = asyncio.get_running_loop()
+        cancel_future = loop.create_future()
+        cancel_token.cancellation_signal.connect(lambda: loop.call_soon_threadsafe(lambda: cancel_future.done() or cancel_future.set_result(None)))
+        if cancelled.is_set():
+            cancel_future.set_result(None)
+        await asyncio.wait([result_future, cancel_future], return_when=asyncio.FIRST_COMPLETED)
+        if not cancel_future.done():
+            cancel_future.cancel()
+        if cancelled.is_set() or not result_future.done():
+            return default
+        return result_future.result()
@@ -0,0 +1,257 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+from dataclasses import dataclass
+import json
+import logging
+from typing import Optional, Union
+import uuid
+
+log = logging.getLogger(__name__)
+
+@dataclass
+class ContentDelta:
+    content: str = ''
+    reasoning_content: str = ''
+
+@dataclass
+class ToolCallCompleted:
+    index: int
+    tool_call: dict
+
+StreamingEvent = Union[ContentDelta, ToolCallCompleted]
+
+def _reasoning_text(raw_reasoning) -> str:
+    # Some models use 'reasoning', some use 'reasoning_content', as text or dict
+    if not raw_reasoning:
+        return ''
+    if isinstance(raw_reasoning, dict):
+        return (raw_reasoning.get('text') or
+                raw_reasoning.get('content') or
+                raw_reasoning.get('thought') or
+                str(raw_reasoning))
+    return str(raw_reasoning)
+
+_CLOSING_BRACKETS = {'{': '}', '[': ']'}
+
+class _JSONObjectScanner:
+    """
+    Tells when streamed JSON text forms a complete object, scanning each
+    character once. It also keeps the state needed to close partial text.
+    """
+    def __init__(self):
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._offset = 0
+        # (offset, open brackets) of the last point the text can be cut and closed at
+        self._last_cut = None
+        self.complete = False
+
+    def feed(self, text: str) -> None:
+        for char in text:
+            if self.complete:
+                return
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._stack.append(char)
+                self._last_cut = (self._offset + 1, ''.join(self._stack))
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                self.complete = len(self._stack) == 0
+            elif char == ',':
+                self._last_cut = (self._offset, ''.join(self._stack))
+            self._offset += 1
+
+    def closed_candidates(self, text: str) -> list[str]:
+        """Partial text completed into JSON candidates, the most complete first"""
+        if self.complete:
+            return [text]
+        candidates = []
+        if self._in_string:
+            candidates.append((text[:-1] if self._escaped else text) + '"' + _closing(self._stack))
+        else:
+            candidates.append(text + _closing(self._stack))
+        if self._last_cut is not None:
+            offset, stack = self._last_cut
+            candidates.append(text[:offset] + _closing(stack))
+        return candidates
+
+def _closing(stack) -> str:
+    return ''.join(_CLOSING_BRACKETS[bracket] for bracket in reversed(stack))
+
+class _ToolCallBuffer:
+    def __init__(self, index: int):
+        self.index = index
+        self.id = None
+        self.type = 'function'
+        self.name = None
+        self.arguments = []
+        self.scanner = _JSONObjectScanner()
+        self.completed = False
+
+    def add(self, tool_call: dict) -> None:
+        if tool_call.get('id'):
+            self.id = tool_call['id']
+        if tool_call.get('type'):
+            self.type = tool_call['type']
+        function = tool_call.get('function') or {}
+        if function.get('name'):
+            self.name = function['name']
+        arguments = function.get('arguments')
+        if isinstance(arguments, dict):
+            # complete arguments (e.g. Ollama)
+            arguments = json.dumps(arguments)
+        if arguments:
+            self.arguments.append(arguments)
+            self.scanner.feed(arguments)
+
+    def tool_call(self) -> dict:
+        tool_call = {
+            'type': self.type,
+            'function': {'name': self.name, 'arguments': ''.join(self.arguments) or '{}'}
+        }
+        if self.id is not None:
+            tool_call['id'] = self.id
+        return tool_call
+
+class StreamingResponseAggregator:
+    """
+    Assembles the chunks of a streamed chat completion (OpenAI format, used
+    by all providers) into the assistant message while they arrive. Content
+    is kept in buffers joined once at the end, tool call arguments are
+    tracked by index and a ToolCallCompleted event is returned as soon as
+    the arguments of a tool call form a complete JSON object, or the next
+    tool call starts, or the stream finishes. Tool calls streamed without an
+    id get one when they are completed.
+
+    Tool calls streamed without a name (Claude Sonnet 4 issue) are dropped.
+
+    Usage:
+        aggregator = StreamingResponseAggregator()
+        for chunk in chunks:
+            for event in aggregator.add(chunk):
+                ...
+        events = aggregator.finish()
+        message = aggregator.message()
+    """
+    def __init__(self):
+        self._contents = []
+        self._reasoning_contents = []
+        self._tool_calls: dict[int, _ToolCallBuffer] = {}
+
+    @property
+    def content(self) -> str:
+        return ''.join(self._contents)
+
+    @property
+    def reasoning_content(self) -> str:
+        return ''.join(self._reasoning_contents)
+
+    def add(self, chunk: dict) -> list[StreamingEvent]:
+        """
+        Adds a chunk, returns the events it produced. Complete responses
+        (choices with a message, from calls that are not streamed) are
+        accepted as a single chunk.
+        """
+        choices = chunk.get('choices') or []
+        if len(choices) == 0:
+            return []
+        choice = choices[0]
+        delta = choice.get('delta') or choice.get('message') or {}
+        events = []
+
+        content = delta.get('content') or ''
+        if not isinstance(content, str):
+            content = str(content)
+        reasoning = _reasoning_text(delta.get('reasoning_content') or delta.get('reasoning'))
+        if content:
+            self._contents.append(content)
+        if reasoning:
+            self._reasoning_contents.append(reasoning)
+        if content or reasoning:
+            events.append(ContentDelta(content, reasoning))
+
+        for tool_call in delta.get('tool_calls') or []:
+            # tool calls without index are complete (not streamed) tool calls
+            index = tool_call.get('index')
+            if index is None:
+                index = max(self._tool_calls.keys(), default=-1) + 1
+            buffer = self._tool_calls.get(index)
+            if buffer is None:
+                # tool calls are streamed one after the other
+                events.extend(self._complete_tool_calls())
+                buffer = self._tool_calls[index] = _ToolCallBuffer(index)
+            buffer.add(tool_call)
+            if buffer.scanner.complete:
+                events.extend(self._complete_tool_call(buffer))
+
+        if choice.get('finish_reason') is not None:
+            events.extend(self._complete_tool_calls())
+
+        return events
+
+    def finish(self) -> list[StreamingEvent]:
+        """Marks the end of the stream, returns the events of the tool calls it completed"""
+        return self._complete_tool_calls()
+
+    def partial_arguments(self, index: int) -> Optional[dict]:
+        """Parses the arguments streamed so far for the tool call, None if there are none yet"""
+        buffer = self._tool_calls.get(index)
+        if buffer is None or len(buffer.arguments) == 0:
+            return None
+        for candidate in buffer.scanner.closed_candidates(''.join(buffer.arguments)):
+            try:
+                arguments = json.loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(arguments, dict):
+                return arguments
+        return None
+
+    @property
+    def tool_calls(self) -> list[dict]:
+        return [buffer.tool_call() for buffer in self._tool_calls.values() if buffer.name]
+
+    def message(self) -> dict:
+        """The assistant message, to append to the messages of the next request"""
+        tool_calls = self.tool_calls
+        return {
+            "role": "assistant",
+            "content": self.content,
+            "tool_calls": tool_calls if len(tool_calls) > 0 else None
+        }
+
+    def response(self) -> dict:
+        """The aggregated response in the format of a chat completion that is not streamed"""
+        message = self.message()
+        reasoning_content = self.reasoning_content
+        if reasoning_content:
+            message["reasoning_content"] = reasoning_content
+        return {"choices": [{"message": message}]}
+
+    def _complete_tool_calls(self) -> list[StreamingEvent]:
+        events = []
+        for buffer in self._tool_calls.values():
+            events.extend(self._complete_tool_call(buffer))
+        return events
+
+    def _complete_tool_call(self, buffer: _ToolCallBuffer) -> list[StreamingEvent]:
+        if buffer.completed:
+            return []
+        buffer.completed = True
+        if not buffer.name:
+            log.debug(f"Dropping streamed tool call without name at index {buffer.index}")
+            return []
+        if buffer.id is None:
+            # the result of the call refers to it by id
+            buffer.id = uuid.uuid4().hex
+        return [ToolCallCompleted(buffer.index, buffer.tool_call())]
@@ -0,0 +1,149 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ENCODING_NAME = "o200k_base"
+TRUNCATION_SUFFIX = "\n...[truncated]"
+
+class Tokenizer:
+    """
+    Token counting and truncation shared by the extension. The tiktoken
+    encoding is loaded on first use; if it cannot be loaded (tiktoken not
+    installed, BPE file not downloadable on air-gapped hosts) counts fall back
+    to a character based estimate. Very large inputs are never fully encoded,
+    counts are estimated and truncation only encodes the prefix that can fit
+    in the budget. Exact counts are cached by content hash.
+
+    Set NBI_TIKTOKEN_CACHE_DIR (or TIKTOKEN_CACHE_DIR) to a directory
+    containing a pre-downloaded BPE file to load the encoding offline.
+    """
+    # average characters per token used for estimates
+    CHARS_PER_TOKEN = 4
+    # upper bound of characters per token, used to cut inputs before encoding
+    MAX_CHARS_PER_TOKEN = 8
+    # inputs longer than this are estimated instead of encoded
+    MAX_EXACT_COUNT_CHARS = 200_000
+
+    def __init__(self, encoding_name: str = DEFAULT_ENCODING_NAME, max_workers: int = 2, cache_size: int = 4096):
+        self._encoding_name = encoding_name
+        self._encoding = None
+        self._encoding_unavailable = False
+        self._encoding_lock = threading.Lock()
+        self._max_workers = max_workers
+        self._executor: ThreadPoolExecutor = None
+        self._executor_lock = threading.Lock()
+        self._cache_size = cache_size
+        self._cache: OrderedDict[bytes, int] = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        """tiktoken encoding, or None if it is unavailable."""
+        if self._encoding is not None or self._encoding_unavailable:
+            return self._encoding
+        with self._encoding_lock:
+            if self._encoding is None and not self._encoding_unavailable:
+                self._encoding = self._load_encoding()
+                self._encoding_unavailable = self._encoding is None
+        return self._encoding
+
+    def _load_encoding(self):
+        cache_dir = os.getenv("NBI_TIKTOKEN_CACHE_DIR")
+        if cache_dir and "TIKTOKEN_CACHE_DIR" not in os.environ:
+            os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+        try:
+            import tiktoken
+            return tiktoken.get_encoding(self._encoding_name)
+        except Exception as e:
+            log.warning(f"Failed to load tokenizer encoding '{self._encoding_name}', token counts will be estimated: {e}")
+            return None
+
+    def estimate_tokens(self, content: str) -> int:
+        return (len(content) + Tokenizer.CHARS_PER_TOKEN - 1) // Tokenizer.CHARS_PER_TOKEN
+
+    def count_tokens(self, content: str) -> int:
+        if content == '':
+            return 0
+        if len(content) > Tokenizer.MAX_EXACT_COUNT_CHARS:
+            return self.estimate_tokens(content)
+        encoding = self.encoding
+        if encoding is None:
+            return self.estimate_tokens(content)
+
+        key = hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        with self._cache_lock:
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+                return count
+
+        count = len(encoding.encode(content, disallowed_special=()))
+
+        with self._cache_lock:
+            self._cache[key] = count
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    def truncate(self, content: str, token_budget: int) -> str:
+        """
+        Truncate content to fit in token_budget tokens. A truncation marker is
+        appended if content is truncated.
+        """
+        if token_budget <= 0 or content == '':
+            return ''
+
+        # cheap checks before encoding: content fits if it has fewer
+        # characters than the budget, and content beyond the characters
+        # the budget can possibly cover is never encoded
+        if len(content) <= token_budget:
+            return content
+        max_chars = token_budget * Tokenizer.MAX_CHARS_PER_TOKEN
+        head = content[:max_chars]
+
+        encoding = self.encoding
+        if encoding is None:
+            max_chars = token_budget * Tokenizer.CHARS_PER_TOKEN
+            if len(content) <= max_chars:
+                return content
+            truncated = content[:max_chars].rstrip()
+        else:
+            encoded = encoding.encode(head, disallowed_special=())
+            if len(encoded) <= token_budget and len(head) == len(content):
+                return content
+            truncated = encoding.decode(encoded[:token_budget]).rstrip()
+
+        if truncated == '':
+            return ''
+
+        return truncated + TRUNCATION_SUFFIX
+
+    async def acount_tokens(self, content: str) -> int:
+        """count_tokens on the tokenizer worker pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), self.count_tokens, content)
+
+    async def atruncate(self, content: str, token_budget: int) -> str:
+        """truncate on the tokenizer worker pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), self.truncate, content, token_budget)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="nbi-tokenizer")
+            return self._executor
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+tokenizer = Tokenizer()
@@ -0,0 +1,186 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+import asyncio
+from collections import OrderedDict
+import hashlib
+import logging
+import threading
+from typing import Optional
+import uuid
+
+from notebook_intelligence.tokenizer import tokenizer
+
+log = logging.getLogger(__name__)
+
+class ToolResultStore:
+    """
+    Keeps the full results of tool calls that were truncated before being
+    passed to the model. A truncated result keeps its leading and trailing
+    lines within the token budget, the omitted lines are replaced with a note
+    naming the handle the full result is stored under, which the model can
+    page through with the read_tool_result tool. Results compacted out of
+    the messages of a long agent request are replaced with a stub naming
+    their handle. Once the total size exceeds `max_size`, least recently
+    used results are dropped.
+    """
+    # maximum total size of stored results in characters. set from
+    # NotebookIntelligence config
+    max_size: int = 64 * 1024 * 1024
+    # share of the token budget for the leading lines, the rest is for the trailing lines
+    HEAD_RATIO = 0.7
+    # tokens reserved for the note about omitted lines
+    NOTE_TOKENS = 64
+
+    def __init__(self):
+        # handle -> result, least recently used first
+        self._results: OrderedDict[str, str] = OrderedDict()
+        # hash of the text a result was truncated to -> handle, and back
+        self._handles: dict[bytes, str] = {}
+        self._truncated_keys: dict[str, bytes] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._size
+
+    def put(self, content: str) -> str:
+        handle = f"result-{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self._results[handle] = content
+            self._size += len(content)
+            # the latest result is kept even if it is larger than max_size
+            while self._size > ToolResultStore.max_size and len(self._results) > 1:
+                dropped_handle, dropped = self._results.popitem(last=False)
+                self._size -= len(dropped)
+                key = self._truncated_keys.pop(dropped_handle, None)
+                if key is not None:
+                    self._handles.pop(key, None)
+        return handle
+
+    def get(self, handle: str) -> Optional[str]:
+        with self._lock:
+            content = self._results.get(handle)
+            if content is not None:
+                self._results.move_to_end(handle)
+            return content
+
+    def truncate(self, content: str, token_budget: int) -> str:
+        """
+        Returns content if it fits in token_budget tokens, otherwise stores it
+        and returns its leading and trailing lines with a note about the
+        omitted lines in between.
+        """
+        if token_budget <= 0 or len(content) <= token_budget:
+            return content
+        if tokenizer.count_tokens(content) <= token_budget:
+            return content
+
+        lines = content.split('\n')
+        line_budget = max(1, token_budget - ToolResultStore.NOTE_TOKENS)
+        head_budget = int(line_budget * ToolResultStore.HEAD_RATIO)
+        head = []
+        token_count = 0
+        # the first line is cut if it alone exceeds the budget (e.g. base64 image data)
+        first_line_cut = False
+        for line in lines:
+            line_tokens = tokenizer.count_tokens(line) + 1
+            if token_count + line_tokens > head_budget:
+                if len(head) == 0:
+                    head.append(tokenizer.truncate(line, head_budget))
+                    first_line_cut = True
+                    token_count = head_budget
+                break
+            head.append(line)
+            token_count += line_tokens
+
+        tail = []
+        for line in reversed(lines[len(head):]):
+            line_tokens = tokenizer.count_tokens(line) + 1
+            if token_count + line_tokens > line_budget:
+                break
+            tail.append(line)
+            token_count += line_tokens
+        tail.reverse()
+
+        first_omitted = len(head) if first_line_cut else len(head) + 1
+        last_omitted = len(lines) - len(tail)
+        if first_omitted > last_omitted:
+            # line counts add up to less than the count of the whole content
+            return content
+
+        handle = self.put(content)
+        note = (
+            f"...[lines {first_omitted}-{last_omitted} of {len(lines)} omitted. The full result is stored as "
+            f"'{handle}', call read_tool_result with this handle and start_line={first_omitted} to read them]"
+        )
+        truncated = '\n'.join(head + [note] + tail)
+        key = ToolResultStore._key(truncated)
+        with self._lock:
+            if handle in self._results:
+                self._handles[key] = handle
+                self._truncated_keys[handle] = key
+        return truncated
+
+    async def atruncate(self, content: str, token_budget: int) -> str:
+        """truncate in a worker thread"""
+        return await asyncio.to_thread(self.truncate, content, token_budget)
+
+    def compact(self, content: str) -> str:
+        """
+        Returns a short stub to replace content with, naming the handle of
+        the full result. A result truncated by this store keeps its handle,
+        other content is stored under a new one.
+        """
+        with self._lock:
+            handle = self._handles.get(ToolResultStore._key(content))
+            full_content = self._results.get(handle) if handle is not None else None
+        if full_content is None:
+            full_content = content
+            handle = self.put(content)
+        line_count = full_content.count('\n') + 1
+        lines = f"{line_count} lines" if line_count > 1 else "1 line"
+        return (
+            f"[Result of an earlier tool call, removed to save context. It is stored as '{handle}' ({lines}), "
+            f"call read_tool_result with this handle to read it again]"
+        )
+
+    def read_lines(self, handle: str, start_line: int, line_count: int, token_budget: int) -> str:
+        """
+        Returns up to line_count lines of a stored result starting at the
+        1-based start_line, within token_budget tokens (0 for no limit).
+        """
+        content = self.get(handle)
+        if content is None:
+            return f"Error! No stored tool result '{handle}', it may have been dropped. Call the tool again."
+
+        lines = content.split('\n')
+        start_line = max(1, start_line)
+        if start_line > len(lines):
+            return f"Error! start_line {start_line} is beyond the last line {len(lines)} of '{handle}'"
+
+        line_budget = max(1, token_budget - ToolResultStore.NOTE_TOKENS) if token_budget > 0 else None
+        selected = []
+        token_count = 0
+        for line in lines[start_line - 1:start_line - 1 + max(1, line_count)]:
+            if line_budget is not None:
+                line_tokens = tokenizer.count_tokens(line) + 1
+                if token_count + line_tokens > line_budget:
+                    if len(selected) == 0:
+                        selected.append(tokenizer.truncate(line, line_budget))
+                    break
+                token_count += line_tokens
+            selected.append(line)
+
+        end_line = start_line + len(selected) - 1
+        note = f"[lines {start_line}-{end_line} of {len(lines)}"
+        if end_line < len(lines):
+            note += f", continue with start_line={end_line + 1}"
+        return '\n'.join(selected + [note + "]"])
+
+    @staticmethod
+    def _key(content: str) -> bytes:
+        return hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+tool_result_store = ToolResultStore()
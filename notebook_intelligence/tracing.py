@@ -0,0 +1,243 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+
+log = logging.getLogger(__name__)
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    # unix time in nanoseconds
+    start_time: int
+    end_time: int = 0
+    attributes: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": (self.end_time - self.start_time) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+class _NonRecordingSpan:
+    """Span of a trace that is not sampled"""
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+NON_RECORDING_SPAN = _NonRecordingSpan()
+
+# span of the running operation. tasks and scheduled requests inherit it with
+# their context
+_current_span: ContextVar = ContextVar("nbi_current_span", default=None)
+
+def _reset_current_span(token) -> None:
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # exited in another context, e.g. an async generator finalized by
+        # the event loop
+        pass
+
+class SpanExporter:
+    def export(self, spans: list[Span]) -> None:
+        raise NotImplemented
+
+class JsonlSpanExporter(SpanExporter):
+    """Appends spans to a file, one JSON object per line"""
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def export(self, spans: list[Span]) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.file_path)), exist_ok=True)
+        with open(self.file_path, "a", encoding="utf-8") as file:
+            for span in spans:
+                file.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+class OTLPSpanExporter(SpanExporter):
+    """Sends spans to an OpenTelemetry collector using OTLP/HTTP with JSON encoding"""
+    def __init__(self, endpoint: str, headers: dict = None, timeout: float = 10):
+        endpoint = endpoint.rstrip("/")
+        self.endpoint = endpoint if endpoint.endswith("/v1/traces") else f"{endpoint}/v1/traces"
+        self.headers = headers or {}
+        self.timeout = timeout
+
+    def export(self, spans: list[Span]) -> None:
+        resp = requests.post(self.endpoint, json=OTLPSpanExporter.encode(spans), headers=self.headers, timeout=self.timeout)
+        resp.raise_for_status()
+
+    @staticmethod
+    def encode(spans: list[Span]) -> dict:
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [OTLPSpanExporter._attribute("service.name", "notebook-intelligence")]},
+                "scopeSpans": [{
+                    "scope": {"name": "notebook_intelligence"},
+                    "spans": [OTLPSpanExporter._encode_span(span) for span in spans]
+                }]
+            }]
+        }
+
+    @staticmethod
+    def _encode_span(span: Span) -> dict:
+        encoded = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            # internal
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_time),
+            "endTimeUnixNano": str(span.end_time),
+            "attributes": [OTLPSpanExporter._attribute(key, value) for key, value in span.attributes.items()],
+            # STATUS_CODE_ERROR / STATUS_CODE_UNSET
+            "status": {"code": 2, "message": span.error} if span.error is not None else {"code": 0},
+        }
+        if span.parent_id is not None:
+            encoded["parentSpanId"] = span.parent_id
+        return encoded
+
+    @staticmethod
+    def _attribute(key: str, value) -> dict:
+        if isinstance(value, bool):
+            encoded_value = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded_value = {"doubleValue": value}
+        else:
+            encoded_value = {"stringValue": str(value)}
+        return {"key": key, "value": encoded_value}
+
+class Tracer:
+    """
+    Records spans of sampled requests. The sampling decision is made when a
+    trace starts (a span without a parent) and applies to all of its spans,
+    unsampled traces only cost a context variable lookup per span. Finished
+    spans are exported in batches from a background thread.
+
+    Usage:
+        with tracer.span("provider.completions", model=model_id) as span:
+            ...
+            span.set_attribute("tokens", tokens)
+    """
+    # seconds between exports
+    export_interval: float = 5
+    # spans are dropped if exporters fall behind this much
+    max_pending_spans: int = 4096
+
+    def __init__(self):
+        self._sample_rate = 0.0
+        self._exporters: list[SpanExporter] = []
+        self._pending: list[Span] = []
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._export_thread: Optional[threading.Thread] = None
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._sample_rate > 0 and len(self._exporters) > 0
+
+    def configure(self, sample_rate: float, exporters: list[SpanExporter]) -> None:
+        self.flush()
+        self._sample_rate = min(1.0, max(0.0, sample_rate))
+        self._exporters = list(exporters)
+
+    def current_span(self):
+        span = _current_span.get()
+        return span if span is not None else NON_RECORDING_SPAN
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = _current_span.get()
+        if parent is NON_RECORDING_SPAN:
+            yield parent
+            return
+        if parent is None and (not self.enabled or random.random() >= self._sample_rate):
+            token = _current_span.set(NON_RECORDING_SPAN)
+            try:
+                yield NON_RECORDING_SPAN
+            finally:
+                _reset_current_span(token)
+            return
+
+        span = self._start_span(name, parent, time.time_ns(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _reset_current_span(token)
+            span.end_time = time.time_ns()
+            self._on_end(span)
+
+    def record_span(self, name: str, duration: float, **attributes) -> None:
+        """Records a span of the current trace that ended now and took `duration` seconds"""
+        parent = _current_span.get()
+        if parent is None or parent is NON_RECORDING_SPAN:
+            return
+        end_time = time.time_ns()
+        span = self._start_span(name, parent, end_time - int(duration * 1e9), attributes)
+        span.end_time = end_time
+        self._on_end(span)
+
+    def flush(self) -> None:
+        """Exports pending spans"""
+        with self._export_lock:
+            with self._lock:
+                spans = self._pending
+                self._pending = []
+            if len(spans) == 0:
+                return
+            for exporter in self._exporters:
+                try:
+                    exporter.export(spans)
+                except Exception as e:
+                    log.warning(f"Failed to export {len(spans)} spans with {type(exporter).__name__}: {e}")
+
+    def _start_span(self, name: str, parent: Optional[Span], start_time: int, attributes: dict) -> Span:
+        trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        parent_id = parent.span_id if parent is not None else None
+        return Span(name, trace_id, os.urandom(8).hex(), parent_id, start_time, attributes=attributes)
+
+    def _on_end(self, span: Span) -> None:
+        with self._lock:
+            if len(self._pending) >= Tracer.max_pending_spans:
+                self.dropped += 1
+                return
+            self._pending.append(span)
+            if self._export_thread is None:
+                self._export_thread = threading.Thread(target=self._export_main, name="nbi-trace-exporter", daemon=True)
+                self._export_thread.start()
+
+    def _export_main(self) -> None:
+        while True:
+            time.sleep(Tracer.export_interval)
+            self.flush()
+
+tracer = Tracer()
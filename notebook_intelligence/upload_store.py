@@ -0,0 +1,125 @@
+# Copyright (c) Mehmet Bektas <mbektasgh@outlook.com>
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+from os import path
+import shutil
+import threading
+import uuid
+
+log = logging.getLogger(__name__)
+
+class UploadQuotaExceededError(Exception):
+    pass
+
+class UploadWriter:
+    """Writes an upload to a temporary file while hashing its content"""
+    def __init__(self, store: "UploadStore", filename: str):
+        self._store = store
+        self.filename = filename
+        self.size = 0
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._temp_path = path.join(store.incoming_dir, uuid.uuid4().hex)
+        self._file = open(self._temp_path, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self._store.quota:
+            self.abort()
+            raise UploadQuotaExceededError(f"File is larger than the upload quota of {self._store.quota} bytes")
+        self._file.write(chunk)
+        self._hash.update(chunk)
+
+    def commit(self) -> str:
+        """Stores the upload and returns its path"""
+        self._file.close()
+        return self._store._commit(self._temp_path, self._hash.hexdigest(), self.filename, self.size)
+
+    def abort(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+class UploadStore:
+    """
+    Content addressed store for uploaded files. Each distinct content is kept
+    once under <root>/<content hash>/, uploads of the same content with
+    another filename are hard links to it. Once the total size exceeds
+    `quota`, least recently uploaded contents are deleted.
+    """
+    # maximum total size of stored uploads in bytes, also the size limit of
+    # a single upload. set from NotebookIntelligence config
+    quota: int = 2 * 1024 * 1024 * 1024
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self.incoming_dir = path.join(root_dir, ".incoming")
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        # content hash -> size, least recently used first
+        self._contents: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.deduplicated = 0
+
+    @property
+    def total_size(self) -> int:
+        with self._lock:
+            return sum(self._contents.values())
+
+    def begin(self, filename: str) -> UploadWriter:
+        return UploadWriter(self, UploadStore.safe_filename(filename))
+
+    def put(self, filename: str, data: bytes) -> str:
+        writer = self.begin(filename)
+        try:
+            writer.write(data)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    @staticmethod
+    def safe_filename(filename: str) -> str:
+        # keep only the basename to prevent path traversal
+        safe_name = path.basename(filename or "")
+        return safe_name if safe_name not in ("", ".", "..") else "upload"
+
+    def _commit(self, temp_path: str, content_hash: str, filename: str, size: int) -> str:
+        content_dir = path.join(self.root_dir, content_hash)
+        dest_path = path.join(content_dir, filename)
+        with self._lock:
+            if content_hash in self._contents and path.isdir(content_dir):
+                self.deduplicated += 1
+                os.remove(temp_path)
+                if not path.exists(dest_path):
+                    UploadStore._link_or_copy(path.join(content_dir, os.listdir(content_dir)[0]), dest_path)
+                self._contents.move_to_end(content_hash)
+            else:
+                os.makedirs(content_dir, exist_ok=True)
+                os.replace(temp_path, dest_path)
+                self._contents[content_hash] = size
+            self._collect_garbage(keep=content_hash)
+        return dest_path
+
+    def _collect_garbage(self, keep: str) -> None:
+        # called with the lock held
+        total_size = sum(self._contents.values())
+        for content_hash in list(self._contents.keys()):
+            if total_size <= self.quota:
+                break
+            if content_hash == keep:
+                continue
+            total_size -= self._contents.pop(content_hash)
+            shutil.rmtree(path.join(self.root_dir, content_hash), ignore_errors=True)
+            log.debug(f"Removed upload {content_hash} to stay within the upload quota")
+
+    @staticmethod
+    def _link_or_copy(source: str, dest: str) -> None:
+        try:
+            os.link(source, dest)
+        except OSError:
+            shutil.copyfile(source, dest)
@@ -2,6 +2,9 @@
 
 import os
 import base64
+import json
+import logging
+import threading
 from typing import Set
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
@@ -9,6 +12,8 @@ from cryptography.fernet import Fernet
 import asyncio
 from tornado import ioloop
 
+log = logging.getLogger(__name__)
+
 _jupyter_root_dir: str = None
 _enabled_tools: Set[str] = None
 
@@ -110,3 +115,126 @@ class ThreadSafeWebSocketConnector():
   def schedule(self, callback, *args):
     """Schedule a callback on the Tornado asyncio loop from any thread."""
     self.io_loop.asyncio_loop.call_soon_threadsafe(callback, *args)
+
+  def write_message_debounced(self, key, message: dict):
+    self.write_message(message)
+
+class WebSocketHub(ThreadSafeWebSocketConnector):
+    """
+    Tracks every open websocket connection. Messages written to the hub are
+    global events and broadcast to all connections; `send` delivers a message
+    to a single connection. Writes may come from any thread and are queued
+    and written in batches on the Tornado loop. A broadcast is serialized
+    once for all connections and identical broadcasts queued one after the
+    other (e.g. repeated status change events) are sent once.
+    """
+    # seconds debounced broadcasts wait for more messages with the same key
+    debounce_delay = 0.1
+
+    def __init__(self):
+        self.io_loop: ioloop.IOLoop = None
+        self._connections: list = []
+        self._pending: list[tuple[object, object]] = []
+        self._flush_scheduled = False
+        self._broadcast_listeners: list = []
+        self._debounced: dict[object, dict] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def connection_count(self) -> int:
+        with self._lock:
+            return len(self._connections)
+
+    def connections(self) -> list:
+        with self._lock:
+            return list(self._connections)
+
+    def register(self, websocket_handler) -> None:
+        """Must be called on the Tornado loop"""
+        with self._lock:
+            if self.io_loop is None:
+                self.io_loop = ioloop.IOLoop.current()
+            if websocket_handler not in self._connections:
+                self._connections.append(websocket_handler)
+
+    def unregister(self, websocket_handler) -> None:
+        with self._lock:
+            if websocket_handler in self._connections:
+                self._connections.remove(websocket_handler)
+
+    def add_broadcast_listener(self, listener) -> None:
+        """listener(message) is called for every broadcast, on the writing thread"""
+        self._broadcast_listeners.append(listener)
+
+    def write_message(self, message: dict) -> None:
+        for listener in list(self._broadcast_listeners):
+            try:
+                listener(message)
+            except Exception as e:
+                log.error(f"Websocket broadcast listener failed: {e}")
+        encoded = json.dumps(message)
+        with self._lock:
+            if len(self._connections) == 0:
+                return
+            # only a repeat of the last queued message is dropped, the
+            # latest state must be written last
+            if len(self._pending) > 0 and self._pending[-1] == (None, encoded):
+                return
+            self._pending.append((None, encoded))
+            self._schedule_flush()
+
+    def write_message_debounced(self, key, message: dict) -> None:
+        """
+        Broadcast the message after `debounce_delay`, merging messages with
+        the same key written in the meantime into it. Data of later messages
+        updates the data of the pending one.
+        """
+        with self._lock:
+            pending = self._debounced.get(key)
+            if pending is not None:
+                pending["data"].update(message.get("data", {}))
+                return
+            debounce = self.io_loop is not None and self.debounce_delay > 0
+            if debounce:
+                self._debounced[key] = dict(message, data=dict(message.get("data", {})))
+                self.io_loop.add_callback(self.io_loop.call_later, self.debounce_delay, self._flush_debounced, key)
+        if not debounce:
+            self.write_message(message)
+
+    def _flush_debounced(self, key) -> None:
+        with self._lock:
+            message = self._debounced.pop(key, None)
+        if message is not None:
+            self.write_message(message)
+
+    def send(self, websocket_handler, message) -> None:
+        with self._lock:
+            self._pending.append((websocket_handler, message))
+            self._schedule_flush()
+
+    def schedule(self, callback, *args) -> None:
+        if self.io_loop is None:
+            log.debug("No websocket connection opened yet, dropping scheduled callback")
+            return
+        self.io_loop.add_callback(callback, *args)
+
+    def _schedule_flush(self) -> None:
+        # called with the lock held
+        if self._flush_scheduled or self.io_loop is None:
+            return
+        self._flush_scheduled = True
+        self.io_loop.add_callback(self._flush)
+
+    def _flush(self) -> None:
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            self._flush_scheduled = False
+            connections = list(self._connections)
+        for websocket_handler, message in pending:
+            targets = connections if websocket_handler is None else [websocket_handler]
+            for target in targets:
+                try:
+                    target.write_message(message)
+                except Exception as e:
+                    log.error(f"Failed to write websocket message: {e}")
@@ -14,9 +14,19 @@ import {
   IToolSelections,
   RequestDataType,
   BackendMessageType,
+  ResponseStreamDataType,
   AssistantMode
 } from './tokens';
 
+// stream protocol requested from the server. v2 sends text deltas as compact
+// {sid, seq, kind, text} frames following a per-message stream header
+const STREAM_PROTOCOL_VERSION = 2;
+
+interface IStreamHeader {
+  id: string;
+  participant: string;
+}
+
 export enum GitHubCopilotLoginStatus {
   NotLoggedIn = 'NOT_LOGGED_IN',
   ActivatingDevice = 'ACTIVATING_DEVICE',
@@ -230,6 +240,9 @@ export class NBIAPI {
   };
   static _webSocket: WebSocket;
   static _messageReceived = new Signal<unknown, any>(this);
+  static _streamHeaders = new Map<number, IStreamHeader>();
+  // last received frame seq of responses still streaming, by message id
+  static _activeStreams = new Map<string, number>();
   static config = new NBIConfig();
   static configChanged = this.config.changed;
   static githubLoginStatusChanged = new Signal<unknown, void>(this);
@@ -242,12 +255,15 @@ export class NBIAPI {
     NBIAPI.initializeWebsocket();
 
     this._messageReceived.connect((_, msg) => {
-      msg = JSON.parse(msg);
-      if (
-        msg.type === BackendMessageType.MCPServerStatusChange ||
-        msg.type === BackendMessageType.ClaudeCodeStatusChange
-      ) {
-        this.fetchCapabilities();
+      if (msg.type === BackendMessageType.MCPServerStatusChange) {
+        if (!this._patchMCPServerStatus(msg.data)) {
+          this.fetchCapabilities();
+        }
+      } else if (msg.type === BackendMessageType.ClaudeCodeStatusChange) {
+        // only server info changes alter the capabilities
+        if (msg.data?.serverInfoChanged !== false) {
+          this.fetchCapabilities();
+        }
       } else if (
         msg.type === BackendMessageType.GitHubCopilotLoginStatusChange
       ) {
@@ -262,15 +278,30 @@ export class NBIAPI {
 
   static async initializeWebsocket() {
     const serverSettings = ServerConnection.makeSettings();
-    const wsUrl = URLExt.join(
-      serverSettings.wsUrl,
-      'notebook-intelligence',
-      'copilot'
-    );
+    const wsUrl =
+      URLExt.join(serverSettings.wsUrl, 'notebook-intelligence', 'copilot') +
+      URLExt.objectToQueryString({ protocol: STREAM_PROTOCOL_VERSION });
 
+    this._streamHeaders.clear();
     this._webSocket = new serverSettings.WebSocket(wsUrl);
     this._webSocket.onmessage = msg => {
-      this._messageReceived.emit(msg.data);
+      const decoded = this._decodeMessage(JSON.parse(msg.data));
+      if (decoded) {
+        this._messageReceived.emit(decoded);
+      }
+    };
+
+    this._webSocket.onopen = () => {
+      // resume responses interrupted by a dropped connection
+      for (const [messageId, lastSeq] of this._activeStreams) {
+        this._webSocket.send(
+          JSON.stringify({
+            id: messageId,
+            type: RequestDataType.ResumeStream,
+            data: { lastSeq }
+          })
+        );
+      }
     };
 
     this._webSocket.onerror = msg => {
@@ -286,6 +317,60 @@ export class NBIAPI {
     };
   }
 
+  /**
+   * Expand stream protocol v2 frames into the StreamMessage shape consumers
+   * expect. Stream headers are consumed here; other messages pass through.
+   */
+  static _decodeMessage(msg: any): any {
+    if (msg.type === BackendMessageType.StreamHeader) {
+      this._streamHeaders.set(msg.sid, {
+        id: msg.id,
+        participant: msg.participant
+      });
+      return null;
+    }
+    if (msg.sid === undefined) {
+      if (msg.type === BackendMessageType.StreamEnd) {
+        for (const [sid, header] of this._streamHeaders) {
+          if (header.id === msg.id) {
+            this._streamHeaders.delete(sid);
+          }
+        }
+      }
+      return msg;
+    }
+
+    const header = this._streamHeaders.get(msg.sid);
+    if (!header) {
+      return null;
+    }
+    const isReasoning = msg.kind === 'md-r' || msg.kind === 'raw-r';
+    const isMarkdownPart = msg.kind === 'md' || msg.kind === 'md-r';
+    const delta = isMarkdownPart
+      ? {
+          nbiContent: {
+            type: ResponseStreamDataType.MarkdownPart,
+            content: isReasoning ? '' : msg.text,
+            reasoning_content: isReasoning ? msg.text : ''
+          },
+          content: '',
+          role: 'assistant'
+        }
+      : {
+          [isReasoning ? 'reasoning_content' : 'content']: msg.text,
+          role: 'assistant'
+        };
+
+    return {
+      id: header.id,
+      seq: msg.seq,
+      participant: header.participant,
+      type: BackendMessageType.StreamMessage,
+      data: { choices: [{ delta }] },
+      created: new Date().toISOString()
+    };
+  }
+
   static getLoginStatus(): GitHubCopilotLoginStatus {
     return this._loginStatus;
   }
@@ -377,6 +462,30 @@ export class NBIAPI {
     });
   }
 
+  /**
+   * Apply an MCP server status event to the local capabilities. Returns
+   * false if the server is unknown and the capabilities need a refetch.
+   */
+  static _patchMCPServerStatus(data: any): boolean {
+    const server = data?.server
+      ? this.config.toolConfig?.mcpServers?.find(
+          (mcpServer: any) => mcpServer.id === data.server
+        )
+      : undefined;
+    if (!server) {
+      return false;
+    }
+    server.status = data.status;
+    if (data.tools !== undefined) {
+      server.tools = data.tools;
+    }
+    if (data.prompts !== undefined) {
+      server.prompts = data.prompts;
+    }
+    this.configChanged.emit();
+    return true;
+  }
+
   static async fetchCapabilities(): Promise<void> {
     return new Promise<void>((resolve, reject) => {
       requestAPI<any>('capabilities', { method: 'GET' })
@@ -691,16 +800,24 @@ export class NBIAPI {
     messageId: string,
     responseEmitter: IChatCompletionResponseEmitter
   ): void {
-    const handler = (_: unknown, msg: any) => {
-      const parsed = JSON.parse(msg);
+    const handler = (_: unknown, parsed: any) => {
       if (parsed.id !== messageId) {
         return;
       }
+      if (parsed.seq !== undefined) {
+        // frames replayed on resume may already have been received
+        if (parsed.seq <= (this._activeStreams.get(messageId) ?? -1)) {
+          return;
+        }
+        this._activeStreams.set(messageId, parsed.seq);
+      }
       responseEmitter.emit(parsed);
       if (parsed.type === BackendMessageType.StreamEnd) {
+        this._activeStreams.delete(messageId);
         this._messageReceived.disconnect(handler);
       }
     };
+    this._activeStreams.set(messageId, -1);
     this._messageReceived.connect(handler);
   }
 
@@ -826,12 +943,15 @@ export class NBIAPI {
   static async uploadFile(
     file: File
   ): Promise<{ serverPath: string; filename: string }> {
-    const formData = new FormData();
-    formData.append('file', file, file.name);
-    return requestAPI<{ serverPath: string; filename: string }>('upload-file', {
-      method: 'POST',
-      body: formData
-    });
+    // the raw body is streamed to disk by the server
+    return requestAPI<{ serverPath: string; filename: string }>(
+      `upload-file-stream?filename=${encodeURIComponent(file.name)}`,
+      {
+        method: 'POST',
+        body: file,
+        headers: { 'Content-Type': 'application/octet-stream' }
+      }
+    );
   }
 
   static async listClaudeSessions(): Promise<IClaudeSessionInfo[]> {
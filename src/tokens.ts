@@ -25,12 +25,14 @@ export enum RequestDataType {
   GenerateCode = 'generate-code',
   CancelChatRequest = 'cancel-chat-request',
   InlineCompletionRequest = 'inline-completion-request',
-  CancelInlineCompletionRequest = 'cancel-inline-completion-request'
+  CancelInlineCompletionRequest = 'cancel-inline-completion-request',
+  ResumeStream = 'resume-stream'
 }
 
 export enum BackendMessageType {
   StreamMessage = 'stream-message',
   StreamEnd = 'stream-end',
+  StreamHeader = 'stream-header',
   RunUICommand = 'run-ui-command',
   GitHubCopilotLoginStatusChange = 'github-copilot-login-status-change',
   MCPServerStatusChange = 'mcp-server-status-change',
@@ -0,0 +1,161 @@
+"""Tests for the async acompletions/ainline_completions model contract."""
+
+import asyncio
+from contextvars import ContextVar
+import time
+from unittest.mock import patch
+
+import pytest
+
+from benchmarks.fake_llm_server import FakeLLMConfig, FakeLLMServer
+from notebook_intelligence import github_copilot
+from notebook_intelligence.api import ChatModel, InlineCompletionModel, MarkdownData
+from notebook_intelligence.extension import CancelTokenImpl
+from notebook_intelligence.llm_providers.openai_compatible_llm_provider import OpenAICompatibleLLMProvider
+
+_request_id: ContextVar = ContextVar("test_request_id", default=None)
+
+
+class _SyncChatModel(ChatModel):
+    """Third-party style model implementing only the sync contract"""
+    def __init__(self, parts=(), error=None, finish=True):
+        super().__init__(None)
+        self._parts = parts
+        self._error = error
+        self._finish = finish
+        self.request_ids = []
+
+    @property
+    def id(self):
+        return "sync-chat-model"
+
+    def completions(self, messages, tools=None, response=None, cancel_token=None, options={}):
+        self.request_ids.append(_request_id.get())
+        for part in self._parts:
+            response.stream(part)
+        if self._error is not None:
+            raise self._error
+        if self._finish:
+            response.finish()
+
+
+class _SyncInlineCompletionModel(InlineCompletionModel):
+    def __init__(self):
+        super().__init__(None)
+
+    def inline_completions(self, prefix, suffix, language, filename, context, cancel_token):
+        return f"{prefix}{suffix}"
+
+
+async def _collect(parts):
+    return [part async for part in parts]
+
+
+def _configure(model, base_url):
+    model.set_property_value("model_id", "fake-model")
+    model.set_property_value("api_key", "key")
+    model.set_property_value("base_url", base_url)
+    return model
+
+
+@pytest.fixture
+def fake_llm_server():
+    with FakeLLMServer(FakeLLMConfig(ttft=0.3, tokens_per_second=0, response_tokens=3, inline_response_tokens=2)) as server:
+        yield server
+
+
+class TestCompatibilityShim:
+    def test_streams_parts_of_sync_completions(self):
+        parts = [{"choices": [{"delta": {"content": "Hello"}}]}, MarkdownData("world")]
+        model = _SyncChatModel(parts=parts)
+
+        async def _run():
+            _request_id.set("request-1")
+            return await _collect(model.acompletions([], cancel_token=CancelTokenImpl()))
+
+        assert asyncio.run(_run()) == parts
+        # runs in the context of the caller
+        assert model.request_ids == ["request-1"]
+
+    @pytest.mark.parametrize("finish", [True, False])
+    def test_completions_returning_without_finish(self, finish):
+        model = _SyncChatModel(parts=[{"choices": []}], finish=finish)
+        assert len(asyncio.run(_collect(model.acompletions([])))) == 1
+
+    def test_error_is_raised(self):
+        model = _SyncChatModel(parts=[{"choices": []}], error=ValueError("failed"))
+        with pytest.raises(ValueError):
+            asyncio.run(_collect(model.acompletions([])))
+
+    def test_astream_completions_finishes_response(self):
+        from unittest.mock import Mock
+        response = Mock()
+        model = _SyncChatModel(parts=[{"choices": []}], finish=False)
+
+        asyncio.run(model.astream_completions([], response))
+
+        response.stream.assert_called_once_with({"choices": []})
+        response.finish.assert_called_once()
+
+    def test_ainline_completions(self):
+        model = _SyncInlineCompletionModel()
+        assert asyncio.run(model.ainline_completions("a", "b", "python", "a.py", None, CancelTokenImpl())) == "ab"
+
+
+class TestOpenAICompatibleAsync:
+    def test_requests_are_multiplexed_on_one_loop(self, fake_llm_server):
+        provider = OpenAICompatibleLLMProvider()
+        chat_model = _configure(provider.chat_models[0], fake_llm_server.base_url)
+        inline_model = _configure(provider.inline_completion_models[0], fake_llm_server.base_url)
+
+        async def _run():
+            # the first request creates the client of the loop
+            await _collect(chat_model.acompletions([{"role": "user", "content": "Hi"}]))
+            started_at = time.monotonic()
+            results = await asyncio.gather(
+                *[_collect(chat_model.acompletions([{"role": "user", "content": "Hi"}], cancel_token=CancelTokenImpl())) for _ in range(4)],
+                *[inline_model.ainline_completions("def f(", "", "python", "a.py", None, CancelTokenImpl()) for _ in range(4)]
+            )
+            return results, time.monotonic() - started_at
+
+        results, elapsed = asyncio.run(_run())
+
+        for parts in results[:4]:
+            assert "".join(part["choices"][0]["delta"]["content"] or "" for part in parts) == "tok0 tok1 tok2 "
+        assert results[4:] == ["tok0 tok1 "] * 4
+        # eight requests waiting 0.3s each for their first token overlap instead of taking 2.4s
+        assert elapsed < 1.5
+        assert fake_llm_server.stats.requests == 9
+
+    def test_streams_tool_call_deltas(self):
+        config = FakeLLMConfig(ttft=0, tokens_per_second=0, tool_calls=[{"name": "search", "arguments": {"query": "x"}}])
+        tools = [{"type": "function", "function": {"name": "search", "parameters": {}}}]
+        with FakeLLMServer(config) as server:
+            chat_model = _configure(OpenAICompatibleLLMProvider().chat_models[0], server.base_url)
+            parts = asyncio.run(_collect(chat_model.acompletions([{"role": "user", "content": "Hi"}], tools=tools)))
+
+        tool_calls = [tool_call for part in parts for tool_call in part["choices"][0]["delta"].get("tool_calls", [])]
+        assert tool_calls[0]["function"] == {"name": "search", "arguments": '{"query": "x"}'}
+
+
+class TestGitHubCopilotAsync:
+    def test_acompletions(self, fake_llm_server):
+        with patch.object(github_copilot, "API_ENDPOINT", fake_llm_server.base_url), \
+             patch.object(github_copilot, "generate_copilot_headers", return_value={}):
+            parts = asyncio.run(_collect(github_copilot.acompletions("gpt-4o", [{"role": "user", "content": "Hi"}], cancel_token=CancelTokenImpl())))
+
+        assert "".join(part["choices"][0]["delta"].get("content") or "" for part in parts) == "tok0 tok1 tok2 "
+
+    def test_acompletions_error_status(self, fake_llm_server):
+        with patch.object(github_copilot, "API_ENDPOINT", fake_llm_server.base_url + "/missing"), \
+             patch.object(github_copilot, "generate_copilot_headers", return_value={}):
+            parts = []
+
+            async def _run():
+                async for part in github_copilot.acompletions("gpt-4o", [{"role": "user", "content": "Hi"}]):
+                    parts.append(part)
+
+            with pytest.raises(Exception, match="404"):
+                asyncio.run(_run())
+
+        assert isinstance(parts[0], MarkdownData)
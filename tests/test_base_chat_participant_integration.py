@@ -1,7 +1,7 @@
 import asyncio
 from unittest.mock import Mock, AsyncMock
 from notebook_intelligence.base_chat_participant import BaseChatParticipant
-from notebook_intelligence.api import ChatRequest, ChatResponse, ChatMode, CancelToken
+from notebook_intelligence.api import ChatRequest, ChatResponse, ChatMode, CancelToken, RequestToolSelection
 from notebook_intelligence.ruleset import RuleContext
 from notebook_intelligence.rule_injector import RuleInjector
 
@@ -47,7 +47,7 @@ class TestBaseChatParticipantIntegration:
         mock_chat_model.provider.name = "test-provider"
         mock_chat_model.provider.id = "test-provider"
         mock_chat_model.name = "test-model"
-        mock_chat_model.completions = Mock()
+        mock_chat_model.astream_completions = AsyncMock()
 
         mock_host = Mock()
         mock_host.chat_model = mock_chat_model
@@ -78,8 +78,8 @@ class TestBaseChatParticipantIntegration:
         mock_injector.inject_rules.assert_called_once()
 
         # Verify chat model was called with enhanced prompt
-        mock_chat_model.completions.assert_called_once()
-        call_args = mock_chat_model.completions.call_args[0]
+        mock_chat_model.astream_completions.assert_awaited_once()
+        call_args = mock_chat_model.astream_completions.call_args[0]
         messages = call_args[0]
 
         # Check that the system message contains the enhanced prompt
@@ -149,3 +149,26 @@ class TestBaseChatParticipantIntegration:
         
         assert "system_prompt" in options
         assert options["system_prompt"] == "Enhanced agent prompt"
+
+    def test_concurrent_requests_keep_their_tools(self):
+        """Test that requests handled concurrently each see the tools of their own chat mode."""
+        participant = BaseChatParticipant()
+        agent_request = ChatRequest(chat_mode=ChatMode("agent", "Agent"), tool_selection=RequestToolSelection([], {}, {}), host=Mock())
+        ask_request = ChatRequest(chat_mode=ChatMode("ask", "Ask"))
+        agent_tools = []
+
+        async def _handle_agent_request():
+            participant._current_chat_request = agent_request
+            await asyncio.sleep(0.01)
+            agent_tools.extend(participant.tools)
+
+        async def _handle_ask_request():
+            participant._current_chat_request = ask_request
+            assert len(participant.tools) > 0
+
+        async def _run():
+            await asyncio.gather(asyncio.create_task(_handle_agent_request()), asyncio.create_task(_handle_ask_request()))
+
+        asyncio.run(_run())
+
+        assert agent_tools == []
@@ -0,0 +1,112 @@
+"""Tests for the cached capabilities snapshot and its ETag handling."""
+
+from unittest.mock import MagicMock, Mock, patch
+
+import pytest
+from tornado.httputil import HTTPHeaders
+from tornado.web import RequestHandler
+
+import notebook_intelligence.extension as ext_module
+from notebook_intelligence.api import BackendMessageType
+from notebook_intelligence.capabilities_snapshot import CapabilitiesSnapshot
+from notebook_intelligence.extension import GetCapabilitiesHandler
+
+
+@pytest.fixture
+def nbi_config(tmp_path):
+    config = Mock()
+    config.env_config_file = str(tmp_path / "env" / "config.json")
+    config.user_config_file = str(tmp_path / "config.json")
+    config.env_mcp_file = str(tmp_path / "env" / "mcp.json")
+    config.user_mcp_file = str(tmp_path / "mcp.json")
+    config.deprecated_env_config_file = str(tmp_path / "env" / "nbi-config.json")
+    config.deprecated_user_config_file = str(tmp_path / "nbi-config.json")
+    return config
+
+
+class TestCapabilitiesSnapshot:
+    def test_built_once_while_unchanged(self, nbi_config):
+        snapshot = CapabilitiesSnapshot()
+        build = Mock(return_value={"chat_models": []})
+
+        first = snapshot.get(nbi_config, build)
+        second = snapshot.get(nbi_config, build)
+
+        assert first == second
+        assert first[1] == '{"chat_models": []}'
+        build.assert_called_once()
+
+    def test_rebuilt_when_config_file_changes(self, nbi_config):
+        snapshot = CapabilitiesSnapshot()
+        build = Mock(side_effect=[{"chat_model": "a"}, {"chat_model": "b"}])
+        first_etag, _ = snapshot.get(nbi_config, build)
+
+        with open(nbi_config.user_config_file, "w") as file:
+            file.write('{"chat_model": "b"}')
+        etag, body = snapshot.get(nbi_config, build)
+
+        assert build.call_count == 2
+        assert etag != first_etag
+        assert body == '{"chat_model": "b"}'
+
+    def test_rebuilt_after_invalidate(self, nbi_config):
+        snapshot = CapabilitiesSnapshot()
+        build = Mock(return_value={})
+        etag, _ = snapshot.get(nbi_config, build)
+
+        snapshot.invalidate()
+
+        # same content keeps the same ETag
+        assert snapshot.get(nbi_config, build)[0] == etag
+        assert build.call_count == 2
+
+    def test_invalidate_during_build_not_lost(self, nbi_config):
+        snapshot = CapabilitiesSnapshot()
+
+        def _build():
+            snapshot.invalidate()
+            return {}
+        build = Mock(side_effect=_build)
+
+        snapshot.get(nbi_config, build)
+        build.side_effect = None
+        build.return_value = {}
+        snapshot.get(nbi_config, build)
+
+        assert build.call_count == 2
+
+
+class TestGetCapabilitiesHandler:
+    def _get(self, build, if_none_match=None):
+        handler = MagicMock(spec=GetCapabilitiesHandler)
+        handler._build_capabilities = build
+        handler._headers = HTTPHeaders()
+        handler.set_header.side_effect = lambda name, value: handler._headers.__setitem__(name, value)
+        handler.request = MagicMock()
+        handler.request.headers = HTTPHeaders({"If-None-Match": if_none_match} if if_none_match else {})
+        handler.check_etag_header = lambda: RequestHandler.check_etag_header(handler)
+        GetCapabilitiesHandler.get.__wrapped__(handler)
+        return handler
+
+    def test_unchanged_capabilities_return_304(self, nbi_config):
+        snapshot = CapabilitiesSnapshot()
+        with patch.object(ext_module, "capabilities_snapshot", snapshot), \
+             patch.object(ext_module, "ai_service_manager") as mock_asm:
+            mock_asm.nbi_config = nbi_config
+            build = Mock(return_value={"chat_models": []})
+            handler = self._get(build)
+            etag = handler._headers["Etag"]
+            handler.finish.assert_called_once_with('{"chat_models": []}')
+
+            handler = self._get(build, if_none_match=etag)
+            handler.set_status.assert_called_once_with(304)
+            handler.finish.assert_called_once_with()
+
+            # status changes rebuild the snapshot
+            ext_module._invalidate_capabilities_on_status_change({"type": BackendMessageType.MCPServerStatusChange, "data": {}})
+            build.return_value = {"chat_models": ["gpt-4o"]}
+            handler = self._get(build, if_none_match=etag)
+            handler.set_status.assert_not_called()
+            assert handler._headers["Etag"] != etag
+
+        assert build.call_count == 2
@@ -0,0 +1,165 @@
+"""Tests for the token-budgeted ChatHistory in the websocket handler."""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from notebook_intelligence.ai_service_manager import AIServiceManager
+from notebook_intelligence.extension import ChatHistory, WebsocketCopilotHandler
+from notebook_intelligence.tokenizer import tokenizer
+
+
+def _ai_service_manager(context_window):
+    manager = Mock()
+    manager.chat_model.context_window = context_window
+    return manager
+
+
+@pytest.fixture
+def small_window():
+    # history budget is half of the context window
+    with patch("notebook_intelligence.extension.ai_service_manager", _ai_service_manager(200)):
+        yield
+
+
+def _message(role, tokens):
+    # "word " is a single token for the gpt-4o tokenizer
+    return {"role": role, "content": "word " * tokens}
+
+
+class TestChatHistory:
+    def test_evicts_oldest_messages_over_token_budget(self, small_window):
+        history = ChatHistory()
+        for i in range(4):
+            history.add_message("chat", _message("user", 20))
+            history.add_message("chat", _message("assistant", 20))
+
+        messages = history.get_history("chat")
+        assert history.get_token_count("chat") <= history.get_token_budget() == 100
+        assert len(messages) == 4
+        assert messages[0]["role"] == "user"
+
+    def test_larger_window_keeps_more_turns(self):
+        with patch("notebook_intelligence.extension.ai_service_manager", _ai_service_manager(128000)):
+            history = ChatHistory()
+            for i in range(20):
+                history.add_message("chat", _message("user", 5))
+                history.add_message("chat", _message("assistant", 5))
+
+        assert len(history.get_history("chat")) == 40
+
+    def test_message_count_upper_bound(self):
+        with patch("notebook_intelligence.extension.ai_service_manager", _ai_service_manager(10**7)):
+            history = ChatHistory()
+            for i in range(ChatHistory.MAX_MESSAGES + 10):
+                history.add_message("chat", _message("user", 1))
+
+        assert len(history.get_history("chat")) == ChatHistory.MAX_MESSAGES
+
+    def test_latest_message_kept_even_if_over_budget(self, small_window):
+        history = ChatHistory()
+        history.add_message("chat", _message("user", 10))
+        history.add_message("chat", _message("assistant", 500))
+
+        messages = history.get_history("chat")
+        assert len(messages) == 1
+        assert messages[0]["role"] == "assistant"
+
+    def test_eviction_does_not_leave_leading_assistant_message(self, small_window):
+        history = ChatHistory()
+        history.add_message("chat", _message("user", 40))
+        history.add_message("chat", _message("assistant", 40))
+        history.add_message("chat", _message("user", 40))
+
+        messages = history.get_history("chat")
+        assert [m["role"] for m in messages] == ["user"]
+
+    def test_participant_change_clears_history(self, small_window):
+        history = ChatHistory()
+        history.add_message("chat", {"role": "user", "content": "@mcp list tools"})
+        history.add_message("chat", {"role": "assistant", "content": "tools"})
+        history.add_message("chat", {"role": "user", "content": "hello"})
+
+        assert history.get_history("chat") == [{"role": "user", "content": "hello"}]
+
+    def test_prompt_parsed_once_per_message(self, small_window):
+        history = ChatHistory()
+        with patch.object(AIServiceManager, "parse_prompt", wraps=AIServiceManager.parse_prompt) as parse_prompt:
+            for i in range(5):
+                history.add_message("chat", _message("user", 1))
+                history.add_message("chat", _message("assistant", 1))
+
+        assert parse_prompt.call_count == 5
+
+    def test_directly_appended_messages_are_counted(self, small_window):
+        history = ChatHistory()
+        history.add_message("chat", _message("user", 10))
+        history.get_history("chat").append(_message("user", 30))
+
+        assert history.get_token_count("chat") == tokenizer.count_tokens("word " * 10) + tokenizer.count_tokens("word " * 30) + 2 * ChatHistory.MESSAGE_TOKEN_OVERHEAD
+
+    def test_clear(self, small_window):
+        history = ChatHistory()
+        history.add_message("a", _message("user", 1))
+        history.add_message("b", _message("user", 1))
+
+        assert history.clear("a") is True
+        assert history.get_history("a") == []
+        assert history.get_token_count("a") == 0
+        assert history.clear("missing") is False
+        assert history.clear() is True
+        assert history.get_history("b") == []
+
+
+class TestAttachedContextBudget:
+    def test_attached_context_uses_what_history_leaves(self):
+        manager = _ai_service_manager(400)
+        manager.is_claude_code_mode = False
+        manager.handle_chat_request = AsyncMock()
+        history = ChatHistory()
+        handler = SimpleNamespace(chat_history=history)
+        handler._add_additional_context = lambda *args: WebsocketCopilotHandler._add_additional_context(handler, *args)
+        request = Mock(prompt="word " * 10)
+        request.chat_mode.id = "ask"
+        attachment = {"isUpload": True, "filePath": "/tmp/notes.txt", "startLine": 1, "endLine": 1, "currentCellContents": None, "content": "word " * 500}
+
+        with patch("notebook_intelligence.extension.ai_service_manager", manager):
+            for _ in range(2):
+                history.add_message("chat", _message("user", 20))
+                history.add_message("chat", _message("assistant", 20))
+            asyncio.run(WebsocketCopilotHandler._handle_chat_request(handler, request, "chat", "", None, [attachment], Mock()))
+
+        messages = request.chat_history + [{"role": "user", "content": request.prompt}]
+        token_count = sum(tokenizer.count_tokens(message["content"]) + ChatHistory.MESSAGE_TOKEN_OVERHEAD for message in messages)
+        # the attachment is truncated to fit next to the history in the request budget
+        assert "[truncated]" in request.chat_history[-1]["content"]
+        assert token_count <= int(ChatHistory.REQUEST_CONTEXT_WINDOW_RATIO * 400)
+
+
+class TestGenerateCodeHistory:
+    def test_code_sections_are_tokenized_in_the_scheduled_request(self):
+        manager = _ai_service_manager(128000)
+        manager.is_claude_code_mode = False
+        manager.handle_chat_request = AsyncMock()
+        with patch("notebook_intelligence.extension.ai_service_manager", manager):
+            application = Mock()
+            application.ui_methods = {}
+            application.ui_modules = {}
+            handler = WebsocketCopilotHandler(application, Mock())
+            handler._schedule_request = Mock()
+            data = {"chatId": "chat", "prompt": "add a test", "prefix": "import os", "suffix": "print(1)", "existingCode": "",
+                    "language": "python", "filename": "a.py"}
+
+            with patch.object(tokenizer, "count_tokens", wraps=tokenizer.count_tokens) as count_tokens:
+                handler._handle_message({"id": "1", "type": "generate-code", "data": data})
+                # nothing is tokenized on the IOLoop
+                count_tokens.assert_not_called()
+                asyncio.run(handler._schedule_request.call_args[0][1])
+
+        request = manager.handle_chat_request.call_args[0][0]
+        assert [message["content"][:30] for message in request.chat_history] == [
+            "This code section comes before", "This code section comes after ", "Generate code for: add a test",
+        ]
+        assert handler.chat_history.get_token_count("chat") > 0
@@ -77,6 +77,29 @@ class TestIsConnected:
             thread.join(timeout=1)
 
 
+class TestStatusEvents:
+    def _events(self, client):
+        return [call[0][1]["data"] for call in client._websocket_connector.write_message_debounced.call_args_list]
+
+    def test_reports_server_info_changes(self):
+        client = _make_client()
+        client._websocket_connector = Mock()
+        client._ensure_connected = Mock(return_value=True)
+        client._send_claude_agent_request = Mock(return_value={"success": True, "data": {"commands": []}})
+
+        client.update_server_info()
+        client.update_server_info()
+        client._mark_as_disconnected()
+
+        assert self._events(client) == [
+            {"status": ClaudeAgentClientStatus.UpdatingServerInfo, "serverInfoChanged": False},
+            {"status": ClaudeAgentClientStatus.UpdatedServerInfo, "serverInfoChanged": True},
+            {"status": ClaudeAgentClientStatus.UpdatingServerInfo, "serverInfoChanged": False},
+            {"status": ClaudeAgentClientStatus.UpdatedServerInfo, "serverInfoChanged": False},
+            {"status": ClaudeAgentClientStatus.NotConnected, "serverInfoChanged": True},
+        ]
+
+
 class TestClientThreadEventLoop:
     def test_windows_uses_proactor_loop_without_changing_global_policy(self, monkeypatch):
         client = _make_client()
@@ -0,0 +1,119 @@
+"""Tests for the process wide LLM SDK client cache."""
+
+from unittest.mock import Mock
+
+import pytest
+
+from notebook_intelligence.client_cache import ClientCache, client_cache
+from notebook_intelligence.llm_providers.openai_compatible_llm_provider import OpenAICompatibleLLMProvider
+
+
+def _factory():
+    return Mock()
+
+
+class TestClientCache:
+    def test_reuses_client_for_same_settings(self):
+        cache = ClientCache()
+        with cache.client("openai-compatible", "http://a", "key", _factory) as first:
+            pass
+        with cache.client("openai-compatible", "http://a", "key", _factory) as second:
+            pass
+
+        assert first is second
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    @pytest.mark.parametrize("settings", [
+        ("claude", "http://a", "key"),
+        ("openai-compatible", "http://b", "key"),
+        ("openai-compatible", "http://a", "other-key"),
+    ])
+    def test_separate_clients_per_key(self, settings):
+        cache = ClientCache()
+        with cache.client("openai-compatible", "http://a", "key", _factory) as first:
+            pass
+        with cache.client(*settings, _factory) as second:
+            pass
+
+        assert first is not second
+        assert cache.size == 2
+
+    def test_key_does_not_contain_api_key(self):
+        assert "secret" not in repr(ClientCache.key("openai-compatible", None, "secret"))
+
+    def test_invalidate_closes_idle_client(self):
+        cache = ClientCache()
+        with cache.client("openai-compatible", "http://a", "key", _factory) as client:
+            pass
+        cache.invalidate("openai-compatible", "http://a", "key")
+
+        client.close.assert_called_once()
+        assert cache.size == 0
+
+    def test_invalidated_client_closed_after_last_release(self):
+        cache = ClientCache()
+        with cache.client("openai-compatible", "http://a", "key", _factory) as client:
+            with cache.client("openai-compatible", "http://a", "key", _factory):
+                cache.invalidate("openai-compatible", "http://a", "key")
+            client.close.assert_not_called()
+            with cache.client("openai-compatible", "http://a", "key", _factory) as new_client:
+                assert new_client is not client
+        client.close.assert_called_once()
+        new_client.close.assert_not_called()
+
+    def test_evicts_least_recently_used(self):
+        cache = ClientCache(max_clients=2)
+        with cache.client("openai-compatible", "http://a", "key", _factory) as client_a:
+            pass
+        with cache.client("openai-compatible", "http://b", "key", _factory) as client_b:
+            pass
+        with cache.client("openai-compatible", "http://a", "key", _factory):
+            pass
+        with cache.client("openai-compatible", "http://c", "key", _factory):
+            pass
+
+        client_b.close.assert_called_once()
+        client_a.close.assert_not_called()
+        assert cache.size == 2
+
+
+class TestOpenAICompatibleClientCache:
+    @pytest.fixture(autouse=True)
+    def _empty_cache(self):
+        client_cache.clear()
+        yield
+        client_cache.clear()
+
+    def _configure(self, model, base_url="http://127.0.0.1:1/v1", api_key="key"):
+        model.set_property_value("model_id", "test-model")
+        model.set_property_value("api_key", api_key)
+        model.set_property_value("base_url", base_url)
+
+    def _client(self, model):
+        from notebook_intelligence.llm_providers.openai_compatible_llm_provider import _cached_client
+        with _cached_client(model) as client:
+            return client
+
+    def test_chat_and_inline_models_share_client(self):
+        provider = OpenAICompatibleLLMProvider()
+        chat_model = provider.chat_models[0]
+        inline_model = provider.inline_completion_models[0]
+        self._configure(chat_model)
+        self._configure(inline_model)
+
+        assert self._client(chat_model) is self._client(inline_model)
+
+    def test_property_change_invalidates_client(self):
+        chat_model = OpenAICompatibleLLMProvider().chat_models[0]
+        self._configure(chat_model)
+        client = self._client(chat_model)
+
+        chat_model.set_property_value("model_id", "other-model")
+        assert self._client(chat_model) is client
+
+        chat_model.set_property_value("api_key", "new-key")
+        new_client = self._client(chat_model)
+        assert new_client is not client
+        assert client.is_closed()
+        assert client_cache.size == 1
@@ -0,0 +1,369 @@
+"""Tests for aborting provider HTTP connections on cancellation."""
+
+import http.server
+import json
+import socketserver
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import httpx
+import pytest
+
+from notebook_intelligence import github_copilot
+from notebook_intelligence.client_cache import client_cache
+from notebook_intelligence.connection_aborter import ConnectionAborter
+from notebook_intelligence.extension import CancelTokenImpl
+from notebook_intelligence.llm_providers.ollama_llm_provider import OllamaChatModel
+from notebook_intelligence.llm_providers.openai_compatible_llm_provider import OpenAICompatibleLLMProvider
+
+# cancellation must release the connection well within this time
+RELEASE_TIMEOUT = 0.5
+
+
+def _openai_chunk(content):
+    return "data: " + json.dumps({
+        "id": "chunk", "object": "chat.completion.chunk", "created": 0, "model": "test-model",
+        "choices": [{"index": 0, "delta": {"role": "assistant", "content": content}}]
+    }) + "\n\n"
+
+
+class _StallingHandler(http.server.BaseHTTPRequestHandler):
+    """Sends the first chunk of a streaming response and then stalls until the client disconnects"""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        server.requests += 1
+        if server.delay_headers:
+            self._wait_for_disconnect()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", server.content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        data = server.first_chunk.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+        self._wait_for_disconnect()
+
+    def _wait_for_disconnect(self):
+        self.connection.settimeout(10)
+        try:
+            self.connection.recv(1)
+        except OSError:
+            return
+        self.server.disconnected_at = time.monotonic()
+        self.server.disconnected.set()
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stalling_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _StallingHandler)
+    server.daemon_threads = True
+    server.requests = 0
+    server.delay_headers = False
+    server.content_type = "text/event-stream"
+    server.first_chunk = _openai_chunk("Hello")
+    server.disconnected = threading.Event()
+    server.disconnected_at = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _cancel_after_first_chunk(response, cancel_token):
+    """Cancels the request once the first streamed chunk arrives, returns the cancel time"""
+    cancelled_at = []
+
+    def _stream(data):
+        if not cancelled_at:
+            cancelled_at.append(time.monotonic())
+            cancel_token.cancel_request()
+    response.stream.side_effect = _stream
+    return cancelled_at
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def _run_in_thread(fn):
+    result = {}
+
+    def _target():
+        try:
+            result["value"] = fn()
+        except BaseException as e:
+            result["error"] = e
+        result["finished_at"] = time.monotonic()
+    thread = threading.Thread(target=_target, daemon=True)
+    thread.start()
+    return thread, result
+
+
+class TestConnectionAborter:
+    def test_shuts_down_tracked_sockets_on_cancel(self):
+        cancel_token = CancelTokenImpl()
+        sock = Mock()
+        with patch("socket.socket.shutdown") as shutdown:
+            with ConnectionAborter(cancel_token) as aborter:
+                aborter.track_socket(sock)
+                shutdown.assert_not_called()
+                cancel_token.cancel_request()
+                assert aborter.aborted
+                shutdown.assert_called_once()
+
+            # no longer subscribed after the block
+            assert len(cancel_token.cancellation_signal._listeners) == 0
+
+    def test_already_cancelled_token_aborts_new_sockets(self):
+        cancel_token = CancelTokenImpl()
+        cancel_token.cancel_request()
+        with patch("socket.socket.shutdown") as shutdown:
+            with ConnectionAborter(cancel_token) as aborter:
+                assert aborter.aborted
+                aborter.track_socket(Mock())
+                shutdown.assert_called_once()
+
+    def test_no_cancel_token(self):
+        with ConnectionAborter(None) as aborter:
+            aborter.track_socket(Mock())
+            assert not aborter.aborted
+
+    def test_aborts_wait_for_response_headers(self, stalling_server):
+        stalling_server.delay_headers = True
+        cancel_token = CancelTokenImpl()
+
+        def _request():
+            with ConnectionAborter(cancel_token) as aborter:
+                with httpx.Client(event_hooks=aborter.httpx_event_hooks()) as client:
+                    return client.post(stalling_server.url, json={})
+
+        thread, result = _run_in_thread(_request)
+        _wait_for(lambda: stalling_server.requests == 1)
+        cancelled_at = time.monotonic()
+        cancel_token.cancel_request()
+        thread.join(RELEASE_TIMEOUT)
+
+        assert not thread.is_alive()
+        assert isinstance(result["error"], httpx.HTTPError)
+        assert stalling_server.disconnected.wait(RELEASE_TIMEOUT)
+        assert stalling_server.disconnected_at - cancelled_at < RELEASE_TIMEOUT
+
+
+class TestProviderCancellation:
+    def _assert_released(self, stalling_server, thread, result, cancelled_at):
+        _wait_for(lambda: len(cancelled_at) > 0)
+        thread.join(RELEASE_TIMEOUT)
+        assert not thread.is_alive()
+        assert "error" not in result
+        assert result["finished_at"] - cancelled_at[0] < RELEASE_TIMEOUT
+        assert stalling_server.disconnected.wait(RELEASE_TIMEOUT)
+        assert stalling_server.disconnected_at - cancelled_at[0] < RELEASE_TIMEOUT
+
+    def test_openai_compatible_stream(self, stalling_server):
+        chat_model = OpenAICompatibleLLMProvider().chat_models[0]
+        chat_model.get_property("model_id").value = "test-model"
+        chat_model.get_property("api_key").value = "key"
+        chat_model.get_property("base_url").value = stalling_server.url
+        cancel_token = CancelTokenImpl()
+        response = Mock()
+        cancelled_at = _cancel_after_first_chunk(response, cancel_token)
+
+        thread, result = _run_in_thread(lambda: chat_model.completions([{"role": "user", "content": "Hi"}], response=response, cancel_token=cancel_token))
+
+        self._assert_released(stalling_server, thread, result, cancelled_at)
+        response.finish.assert_called_once()
+        # the aborted request is not retried
+        assert stalling_server.requests == 1
+
+    def test_ollama_stream(self, stalling_server, monkeypatch):
+        monkeypatch.setenv("OLLAMA_HOST", stalling_server.url)
+        stalling_server.content_type = "application/x-ndjson"
+        stalling_server.first_chunk = json.dumps({"model": "llama", "message": {"role": "assistant", "content": "Hello"}, "done": False}) + "\n"
+        chat_model = OllamaChatModel(Mock(), "llama", "llama", 4096)
+        cancel_token = CancelTokenImpl()
+        response = Mock()
+        cancelled_at = _cancel_after_first_chunk(response, cancel_token)
+
+        thread, result = _run_in_thread(lambda: chat_model.completions([{"role": "user", "content": "Hi"}], response=response, cancel_token=cancel_token))
+
+        self._assert_released(stalling_server, thread, result, cancelled_at)
+        response.finish.assert_called_once()
+
+    def test_github_copilot_stream(self, stalling_server):
+        cancel_token = CancelTokenImpl()
+        response = Mock()
+        cancelled_at = _cancel_after_first_chunk(response, cancel_token)
+
+        with patch.object(github_copilot, "API_ENDPOINT", stalling_server.url), \
+             patch.object(github_copilot, "generate_copilot_headers", return_value={}):
+            thread, result = _run_in_thread(lambda: github_copilot.completions("gpt-4o", [{"role": "user", "content": "Hi"}], response=response, cancel_token=cancel_token))
+            self._assert_released(stalling_server, thread, result, cancelled_at)
+
+        response.finish.assert_called_once()
+
+    def test_github_copilot_inline_completions(self, stalling_server):
+        stalling_server.first_chunk = "data: " + json.dumps({"choices": [{"text": "return a"}]}) + "\n"
+        cancel_token = CancelTokenImpl()
+
+        with patch.object(github_copilot, "PROXY_ENDPOINT", stalling_server.url):
+            thread, result = _run_in_thread(lambda: github_copilot.inline_completions("copilot-codex", "def f(a):\n    ", "", "python", "a.py", None, cancel_token))
+            _wait_for(lambda: stalling_server.requests == 1)
+            time.sleep(0.1)
+            cancelled_at = [time.monotonic()]
+            cancel_token.cancel_request()
+            self._assert_released(stalling_server, thread, result, cancelled_at)
+
+        assert result["value"] == ""
+
+
+class _CompletingHandler(http.server.BaseHTTPRequestHandler):
+    """Streams a complete chat completion response on a keep-alive connection"""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in [_openai_chunk("Hello"), "data: [DONE]\n\n"]:
+            data = event.encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def completing_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _CompletingHandler)
+    server.daemon_threads = True
+    server.connections = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestCopilotHTTPSession:
+    @pytest.fixture(autouse=True)
+    def _new_session(self):
+        github_copilot.reset_http_session()
+        yield
+        github_copilot.reset_http_session()
+
+    @pytest.mark.parametrize("streamed", [True, False])
+    def test_completions_reuse_connection(self, completing_server, streamed):
+        with patch.object(github_copilot, "API_ENDPOINT", completing_server.url), \
+             patch.object(github_copilot, "generate_copilot_headers", return_value={}):
+            for _ in range(3):
+                response = Mock() if streamed else None
+                result = github_copilot.completions("gpt-4o", [{"role": "user", "content": "Hi"}], response=response, cancel_token=CancelTokenImpl())
+                if streamed:
+                    response.finish.assert_called_once()
+                else:
+                    assert result["choices"][0]["message"]["content"] == "Hello"
+
+        assert len(completing_server.connections) == 1
+
+    def test_released_connection_not_aborted(self):
+        # the connection went back to the pool and may be used by another request
+        response = Mock(spec=["raw"])
+        response.raw.connection = None
+        cancel_token = CancelTokenImpl()
+        with patch("socket.socket.shutdown") as shutdown:
+            with ConnectionAborter(cancel_token) as aborter:
+                aborter.track_response(response)
+                cancel_token.cancel_request()
+            shutdown.assert_not_called()
+
+    def test_endpoint_change_resets_session(self):
+        session = github_copilot.get_http_session()
+        token_response = Mock(status_code=200)
+        token_response.json.return_value = {
+            "token": "token",
+            "expires_at": None,
+            "endpoints": {"api": "https://api.individual.githubcopilot.com", "proxy": github_copilot.PROXY_ENDPOINT},
+        }
+
+        with patch.dict(github_copilot.github_auth, {"access_token": "access-token"}), \
+             patch.object(github_copilot, "API_ENDPOINT", github_copilot.API_ENDPOINT), \
+             patch.object(github_copilot, "emit_github_login_status_change"), \
+             patch.object(session, "get", return_value=token_response), \
+             patch.object(session, "close") as close:
+            github_copilot.get_token()
+            assert github_copilot.API_ENDPOINT == "https://api.individual.githubcopilot.com"
+            close.assert_called_once()
+
+        assert github_copilot.get_http_session() is not session
+
+
+class TestOpenAICompatibleCachedClient:
+    @pytest.fixture(autouse=True)
+    def _empty_cache(self):
+        client_cache.clear()
+        yield
+        client_cache.clear()
+
+    def _chat_model(self, url):
+        chat_model = OpenAICompatibleLLMProvider().chat_models[0]
+        chat_model.set_property_value("model_id", "test-model")
+        chat_model.set_property_value("api_key", "key")
+        chat_model.set_property_value("base_url", url)
+        return chat_model
+
+    def test_completions_reuse_connection(self, completing_server):
+        chat_model = self._chat_model(completing_server.url)
+        for _ in range(3):
+            response = Mock()
+            chat_model.completions([{"role": "user", "content": "Hi"}], response=response, cancel_token=CancelTokenImpl())
+            response.finish.assert_called_once()
+
+        assert len(completing_server.connections) == 1
+
+    def test_cancel_with_cached_client(self, stalling_server):
+        chat_model = self._chat_model(stalling_server.url)
+        for _ in range(2):
+            stalling_server.disconnected.clear()
+            cancel_token = CancelTokenImpl()
+            response = Mock()
+            cancelled_at = _cancel_after_first_chunk(response, cancel_token)
+
+            thread, result = _run_in_thread(lambda: chat_model.completions([{"role": "user", "content": "Hi"}], response=response, cancel_token=cancel_token))
+
+            TestProviderCancellation()._assert_released(stalling_server, thread, result, cancelled_at)
+            response.finish.assert_called_once()
+
+        assert stalling_server.requests == 2
+        assert client_cache.size == 1
+
+    def test_cancel_does_not_abort_other_request(self, completing_server):
+        # connections of another call's aborter are not tracked by the shared client
+        chat_model = self._chat_model(completing_server.url)
+        cancel_token = CancelTokenImpl()
+        with patch("socket.socket.shutdown") as shutdown:
+            with ConnectionAborter(cancel_token):
+                response = Mock()
+                chat_model.completions([{"role": "user", "content": "Hi"}], response=response, cancel_token=CancelTokenImpl())
+                cancel_token.cancel_request()
+            shutdown.assert_not_called()
+        response.finish.assert_called_once()
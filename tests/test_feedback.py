@@ -212,9 +212,9 @@ class TestEmitTelemetryEventHandler:
             return handler
 
     @patch("notebook_intelligence.extension.ai_service_manager")
-    @patch("notebook_intelligence.extension.threading.Thread")
-    def test_post_dispatches_feedback_event(self, mock_thread_cls, mock_ai_manager, mock_handler):
-        """POST with a feedback event should spawn a thread to emit it."""
+    @patch("notebook_intelligence.extension.request_scheduler")
+    def test_post_dispatches_feedback_event(self, mock_scheduler, mock_ai_manager, mock_handler):
+        """POST with a feedback event should schedule emitting it."""
         event = _make_feedback_event("positive")
         mock_handler.request.body = json.dumps(event).encode()
 
@@ -224,17 +224,16 @@ class TestEmitTelemetryEventHandler:
 
         mock_handler.post()
 
-        # Thread should be started
-        mock_thread_cls.assert_called_once()
-        call_kwargs = mock_thread_cls.call_args
-        assert call_kwargs[1]["target"] == asyncio.run
+        # Event emission should be scheduled
+        mock_scheduler.submit.assert_called_once()
+        mock_ai_manager.emit_telemetry_event.assert_called_once_with(event)
 
         # Finish should be called with empty JSON
         mock_handler.finish.assert_called_once_with(json.dumps({}))
 
     @patch("notebook_intelligence.extension.ai_service_manager")
-    @patch("notebook_intelligence.extension.threading.Thread")
-    def test_post_logs_feedback_event(self, mock_thread_cls, mock_ai_manager, mock_handler, caplog):
+    @patch("notebook_intelligence.extension.request_scheduler")
+    def test_post_logs_feedback_event(self, mock_scheduler, mock_ai_manager, mock_handler, caplog):
         """POST should log the feedback event type and data at INFO level."""
         event = _make_feedback_event("positive")
         mock_handler.request.body = json.dumps(event).encode()
@@ -258,8 +257,8 @@ class TestEmitTelemetryEventHandler:
         assert '"sentiment": "positive"' in log_message or '"sentiment":"positive"' in log_message
 
     @patch("notebook_intelligence.extension.ai_service_manager")
-    @patch("notebook_intelligence.extension.threading.Thread")
-    def test_post_logs_negative_feedback_sentiment(self, mock_thread_cls, mock_ai_manager, mock_handler, caplog):
+    @patch("notebook_intelligence.extension.request_scheduler")
+    def test_post_logs_negative_feedback_sentiment(self, mock_scheduler, mock_ai_manager, mock_handler, caplog):
         """Verify negative sentiment is captured in the log output."""
         event = _make_feedback_event("negative")
         mock_handler.request.body = json.dumps(event).encode()
@@ -278,8 +277,8 @@ class TestEmitTelemetryEventHandler:
         assert '"sentiment": "negative"' in feedback_logs[0].message or '"sentiment":"negative"' in feedback_logs[0].message
 
     @patch("notebook_intelligence.extension.ai_service_manager")
-    @patch("notebook_intelligence.extension.threading.Thread")
-    def test_post_logs_feedback_data_fields(self, mock_thread_cls, mock_ai_manager, mock_handler, caplog):
+    @patch("notebook_intelligence.extension.request_scheduler")
+    def test_post_logs_feedback_data_fields(self, mock_scheduler, mock_ai_manager, mock_handler, caplog):
         """Verify the log captures chatId, messageId, model, and timestamp."""
         event = _make_feedback_event("positive")
         mock_handler.request.body = json.dumps(event).encode()
@@ -305,8 +304,8 @@ class TestEmitTelemetryEventHandler:
         assert "anthropic" in log_message  # provider from _make_feedback_event
 
     @patch("notebook_intelligence.extension.ai_service_manager")
-    @patch("notebook_intelligence.extension.threading.Thread")
-    def test_post_log_level_is_info(self, mock_thread_cls, mock_ai_manager, mock_handler, caplog):
+    @patch("notebook_intelligence.extension.request_scheduler")
+    def test_post_log_level_is_info(self, mock_scheduler, mock_ai_manager, mock_handler, caplog):
         """The telemetry log entry should be at INFO level."""
         event = _make_feedback_event("positive")
         mock_handler.request.body = json.dumps(event).encode()
@@ -3,17 +3,21 @@
 Covers:
 - Temp directory creation and cleanup
 - FileUploadHandler: successful uploads, missing file, path traversal protection
+- StreamingFileUploadHandler: chunked writes, quota, aborted uploads
+- UploadStore: deduplication by content hash, LRU garbage collection
 """
 
 import json
 import os
 import shutil
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import pytest
+import tornado.web
 
 import notebook_intelligence.extension as ext
-from notebook_intelligence.extension import FileUploadHandler, _get_upload_dir
+from notebook_intelligence.extension import FileUploadHandler, StreamingFileUploadHandler, _get_upload_dir, _get_upload_store
+from notebook_intelligence.upload_store import UploadQuotaExceededError, UploadStore
 
 
 @pytest.fixture
@@ -141,3 +145,120 @@ class TestFileUploadHandler:
         assert len(set(paths)) == 3
         for p in paths:
             assert os.path.isfile(p)
+
+    def test_identical_uploads_deduplicated(self, upload_dir):
+        paths = []
+        for _ in range(2):
+            handler = _make_handler(files={
+                "file": [{"filename": "same.txt", "body": b"same content"}]
+            })
+            FileUploadHandler.post(handler)
+            paths.append(_parse_response(handler)["serverPath"])
+
+        assert paths[0] == paths[1]
+        assert _get_upload_store().deduplicated == 1
+
+
+# ---------------------------------------------------------------------------
+# StreamingFileUploadHandler
+# ---------------------------------------------------------------------------
+
+class TestStreamingFileUploadHandler:
+    def _make_handler(self, filename):
+        handler = MagicMock(spec=StreamingFileUploadHandler)
+        handler.request = MagicMock()
+        handler._writer = _get_upload_store().begin(filename)
+        return handler
+
+    def test_chunks_written_to_store(self, upload_dir):
+        handler = self._make_handler("data.parquet")
+        for chunk in [b"a" * 10, b"b" * 10]:
+            StreamingFileUploadHandler.data_received(handler, chunk)
+
+        StreamingFileUploadHandler.post.__wrapped__(handler)
+
+        response = _parse_response(handler)
+        assert response["filename"] == "data.parquet"
+        assert response["serverPath"].startswith(upload_dir)
+        with open(response["serverPath"], "rb") as f:
+            assert f.read() == b"a" * 10 + b"b" * 10
+        assert os.listdir(os.path.join(upload_dir, ".incoming")) == []
+
+    def test_upload_larger_than_quota_rejected(self, upload_dir):
+        with patch.object(UploadStore, "quota", 15):
+            handler = self._make_handler("data.parquet")
+            StreamingFileUploadHandler.data_received(handler, b"a" * 10)
+            with pytest.raises(tornado.web.HTTPError) as error:
+                StreamingFileUploadHandler.data_received(handler, b"b" * 10)
+
+        assert error.value.status_code == 413
+        assert os.listdir(os.path.join(upload_dir, ".incoming")) == []
+
+    def test_body_of_other_method_ignored(self, upload_dir):
+        handler = MagicMock(spec=StreamingFileUploadHandler)
+        handler.request = MagicMock(method="PUT")
+        # prepare() only begins an upload for POST
+        handler._writer = None
+
+        StreamingFileUploadHandler.data_received(handler, b"data")
+
+        assert _get_upload_store().total_size == 0
+
+    def test_chunks_after_rejected_upload_ignored(self, upload_dir):
+        with patch.object(UploadStore, "quota", 15):
+            handler = self._make_handler("data.parquet")
+            with pytest.raises(tornado.web.HTTPError):
+                StreamingFileUploadHandler.data_received(handler, b"a" * 20)
+            StreamingFileUploadHandler.data_received(handler, b"b" * 10)
+
+        assert handler._writer is None
+        assert os.listdir(os.path.join(upload_dir, ".incoming")) == []
+        assert _get_upload_store().total_size == 0
+
+    def test_interrupted_upload_removed(self, upload_dir):
+        handler = self._make_handler("data.parquet")
+        StreamingFileUploadHandler.data_received(handler, b"partial")
+
+        StreamingFileUploadHandler.on_connection_close(handler)
+
+        assert os.listdir(os.path.join(upload_dir, ".incoming")) == []
+        assert _get_upload_store().total_size == 0
+
+
+# ---------------------------------------------------------------------------
+# UploadStore
+# ---------------------------------------------------------------------------
+
+class TestUploadStore:
+    def test_same_content_with_other_name_shares_storage(self, tmp_path):
+        store = UploadStore(str(tmp_path))
+        first = store.put("a.csv", b"1,2,3")
+        second = store.put("b.csv", b"1,2,3")
+
+        assert os.path.dirname(first) == os.path.dirname(second)
+        assert os.path.basename(second) == "b.csv"
+        with open(second, "rb") as f:
+            assert f.read() == b"1,2,3"
+        assert store.total_size == 5
+
+    def test_least_recently_uploaded_removed_over_quota(self, tmp_path):
+        with patch.object(UploadStore, "quota", 10):
+            store = UploadStore(str(tmp_path))
+            first = store.put("first.txt", b"1111")
+            second = store.put("second.txt", b"2222")
+            # uploading the first file again makes it the most recently used
+            store.put("first.txt", b"1111")
+            third = store.put("third.txt", b"3333")
+
+        assert os.path.exists(first)
+        assert not os.path.exists(second)
+        assert os.path.exists(third)
+        assert store.total_size == 8
+
+    def test_upload_larger_than_quota_rejected(self, tmp_path):
+        with patch.object(UploadStore, "quota", 4):
+            store = UploadStore(str(tmp_path))
+            with pytest.raises(UploadQuotaExceededError):
+                store.put("big.bin", b"12345")
+
+        assert os.listdir(store.incoming_dir) == []
@@ -0,0 +1,103 @@
+"""Tests for the inline completion result cache."""
+
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+from notebook_intelligence.api import LLMProviderProperty
+from notebook_intelligence.extension import CancelTokenImpl, WebsocketCopilotHandler
+from notebook_intelligence.inline_completion_cache import InlineCompletionCache
+
+
+MODEL = "model-key"
+
+
+class TestInlineCompletionCache:
+    def test_exact_hit(self):
+        cache = InlineCompletionCache()
+        cache.put(MODEL, "a.py", "def add(a, b):\n    ", "\n", "return a + b")
+
+        assert cache.get(MODEL, "a.py", "def add(a, b):\n    ", "\n") == "return a + b"
+        assert cache.stats() == {"entries": 1, "hits": 1, "misses": 0}
+
+    def test_prefix_extension_returns_rest_of_completion(self):
+        cache = InlineCompletionCache()
+        cache.put(MODEL, "a.py", "def add(a, b):\n    ", "\n", "return a + b")
+
+        assert cache.get(MODEL, "a.py", "def add(a, b):\n    ret", "\n") == "urn a + b"
+        assert cache.get(MODEL, "a.py", "def add(a, b):\n    return a", "\n") == " + b"
+
+    def test_typed_text_must_match_completion(self):
+        cache = InlineCompletionCache()
+        cache.put(MODEL, "a.py", "def add(a, b):\n    ", "\n", "return a + b")
+
+        assert cache.get(MODEL, "a.py", "def add(a, b):\n    pass", "\n") is None
+        # fully typed completion leaves nothing to suggest
+        assert cache.get(MODEL, "a.py", "def add(a, b):\n    return a + b", "\n") is None
+        assert cache.stats()["misses"] == 2
+
+    def test_key_includes_model_filename_and_suffix(self):
+        cache = InlineCompletionCache()
+        cache.put(MODEL, "a.py", "x = ", "\n", "1")
+
+        assert cache.get("other-model", "a.py", "x = ", "\n") is None
+        assert cache.get(MODEL, "b.py", "x = ", "\n") is None
+        assert cache.get(MODEL, "a.py", "x = ", "\ny = 2") is None
+        assert cache.get(MODEL, "a.py", "x = ", "\n") == "1"
+
+    def test_empty_completions_not_cached(self):
+        cache = InlineCompletionCache()
+        cache.put(MODEL, "a.py", "x = ", "", "")
+
+        assert cache.get(MODEL, "a.py", "x = ", "") is None
+        assert cache.stats()["entries"] == 0
+
+    def test_lru_eviction(self):
+        cache = InlineCompletionCache(max_entries=2)
+        cache.put(MODEL, "a.py", "a", "", "1")
+        cache.put(MODEL, "b.py", "b", "", "2")
+        assert cache.get(MODEL, "a.py", "a", "") == "1"
+        cache.put(MODEL, "c.py", "c", "", "3")
+
+        assert cache.get(MODEL, "b.py", "b", "") is None
+        assert cache.get(MODEL, "a.py", "a", "") == "1"
+        assert cache.get(MODEL, "c.py", "c", "") == "3"
+
+    def test_disabled(self):
+        cache = InlineCompletionCache(max_entries=0)
+        cache.put(MODEL, "a.py", "a", "", "1")
+
+        assert cache.get(MODEL, "a.py", "a", "") is None
+
+    def test_model_key_reflects_properties(self):
+        model = Mock()
+        model.provider.id = "openai-compatible"
+        model.id = "inline-model"
+        model.properties = [LLMProviderProperty("model_id", "Model", "", "gpt-4o-mini")]
+        key = InlineCompletionCache.model_key(model)
+
+        model.properties = [LLMProviderProperty("model_id", "Model", "", "gpt-4o")]
+        assert InlineCompletionCache.model_key(model) != key
+
+
+class TestHandleInlineCompletionsCache:
+    def _run(self, prefix, suffix="\n"):
+        emitter = Mock()
+        asyncio.run(WebsocketCopilotHandler.handle_inline_completions(prefix, suffix, "python", "a.py", emitter, CancelTokenImpl()))
+        return emitter.stream.call_args[0][0]["completions"]
+
+    def test_provider_not_called_when_typing_cached_completion(self):
+        model = Mock()
+        model.provider.id = "ollama"
+        model.id = "codellama"
+        model.properties = []
+        model.ainline_completions = AsyncMock(return_value="return a + b")
+        manager = Mock()
+        manager.inline_completion_model = model
+        manager.get_completion_context = AsyncMock(return_value=None)
+
+        with patch("notebook_intelligence.extension.ai_service_manager", manager), \
+             patch("notebook_intelligence.extension.inline_completion_cache", InlineCompletionCache()):
+            assert self._run("def add(a, b):\n    ") == "return a + b"
+            assert self._run("def add(a, b):\n    return") == " a + b"
+
+        model.ainline_completions.assert_awaited_once()
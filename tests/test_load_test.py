@@ -0,0 +1,36 @@
+"""Smoke test of the load test harness, run against the local fake LLM server."""
+
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestLoadTest:
+    def test_runs_all_scenarios(self, tmp_path):
+        results_file = tmp_path / "results.json"
+        result = subprocess.run(
+            [
+                sys.executable, "-m", "benchmarks.load_test",
+                "--clients", "3", "--requests", "4", "--mix", "chat=1,agent=1,inline=1",
+                "--ttft", "0.01", "--tokens-per-second", "0", "--tool-rounds", "2",
+                "--tool-latency", "0", "--timeout", "60", "--json", str(results_file),
+            ],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            timeout=300,
+        )
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        results = json.loads(results_file.read_text())
+        scenarios = results["scenarios"]
+        assert sum(summary["completed"] for summary in scenarios.values()) == 12
+        assert all(summary["errors"] == 0 for summary in scenarios.values())
+        # every agent request makes two tool calls before the final answer
+        assert results["llm_server"]["tool_call_responses"] == 2 * scenarios["agent"]["completed"]
+        assert results["threads"]["peak"] > 1
+        assert results["rss_mb"]["peak"] > 0
+        assert "p95" in result.stdout
@@ -0,0 +1,62 @@
+"""Tests for MCP server status events."""
+
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from notebook_intelligence.api import MCPServerStatus
+from notebook_intelligence.mcp_manager import MCPServerImpl
+
+
+def _make_server(name="files"):
+    """Build an ``MCPServerImpl`` without invoking ``__init__`` / ``connect``."""
+    server = MCPServerImpl.__new__(MCPServerImpl)
+    server._manager = Mock()
+    server._name = name
+    server._auto_approve_tools = set()
+    server._mcp_tools = []
+    server._mcp_prompts = []
+    server._status = MCPServerStatus.NotConnected
+    server._client_thread = object()
+    return server
+
+
+def _events(server):
+    return [call[0] for call in server._manager.websocket_connector.write_message_debounced.call_args_list]
+
+
+class TestMCPServerStatusEvents:
+    def test_status_event_carries_server_and_status(self):
+        server = _make_server()
+        server._set_status(MCPServerStatus.Connecting)
+
+        [(key, message)] = _events(server)
+        assert key == ("mcp-server-status-change", "files")
+        assert message == {"type": "mcp-server-status-change", "data": {"server": "files", "status": "connecting"}}
+
+    def test_changed_tool_list_included(self):
+        server = _make_server()
+        tool = SimpleNamespace(name="read_file", description="Read a file", inputSchema={})
+        server._send_mcp_request = Mock(return_value={"success": True, "data": [tool]})
+
+        server.update_tool_list()
+        server.update_tool_list()
+
+        updated = [message["data"] for _, message in _events(server) if message["data"]["status"] == MCPServerStatus.UpdatedToolList]
+        assert updated[0]["tools"] == [{"name": "read_file", "description": "Read a file"}]
+        # unchanged on the second update
+        assert "tools" not in updated[1]
+
+    def test_changed_prompt_list_included(self):
+        server = _make_server()
+        argument = SimpleNamespace(name="path", description="File path", required=True)
+        prompt = SimpleNamespace(name="summarize", title="Summarize", description="Summarize a file", arguments=[argument])
+        server._send_mcp_request = Mock(return_value={"success": True, "data": [prompt]})
+
+        server.update_prompts_list()
+
+        _, message = _events(server)[-1]
+        assert message["data"]["prompts"] == [{
+            "name": "summarize",
+            "description": "Summarize a file",
+            "arguments": [{"name": "path", "description": "File path", "required": True}]
+        }]
@@ -0,0 +1,194 @@
+"""Tests for the Prometheus metrics of chat, inline completion, provider and tool calls."""
+
+import asyncio
+from unittest.mock import MagicMock, Mock, patch
+
+import pytest
+
+import notebook_intelligence.extension as ext_module
+from notebook_intelligence import metrics
+from notebook_intelligence.api import ChatModel, InlineCompletionModel, MarkdownData
+from notebook_intelligence.extension import CancelTokenImpl, MetricsHandler, WebsocketCopilotHandler
+from notebook_intelligence.inline_completion_cache import InlineCompletionCache
+from notebook_intelligence.mcp_manager import MCPServerImpl
+from notebook_intelligence.single_flight import SingleFlight
+
+
+def _sample(name, **labels):
+    return metrics.registry.get_sample_value(name, labels) or 0
+
+
+class _ChatModel(ChatModel):
+    def __init__(self, result=None, parts=(), error=None):
+        super().__init__(Mock(id="test-provider"))
+        self._result = result
+        self._parts = parts
+        self._error = error
+
+    @property
+    def id(self):
+        return "test-model"
+
+    @metrics.instrument_completions
+    def completions(self, messages, tools=None, response=None, cancel_token=None, options={}):
+        if self._error is not None:
+            raise self._error
+        if response is not None:
+            for part in self._parts:
+                response.stream(part)
+            response.finish()
+            return
+        return self._result
+
+
+class _AsyncChatModel(ChatModel):
+    def __init__(self, parts=()):
+        super().__init__(Mock(id="test-provider"))
+        self._parts = parts
+
+    @property
+    def id(self):
+        return "test-model"
+
+    @metrics.instrument_acompletions
+    async def acompletions(self, messages, tools=None, cancel_token=None, options={}):
+        for part in self._parts:
+            yield part
+
+
+class _InlineCompletionModel(InlineCompletionModel):
+    def __init__(self, cancel=False):
+        super().__init__(None)
+        self._cancel = cancel
+
+    @property
+    def id(self):
+        return "inline-model"
+
+    @metrics.instrument_inline_completions(provider_id="test-inline-provider")
+    def inline_completions(self, prefix, suffix, language, filename, context, cancel_token):
+        if self._cancel:
+            cancel_token.cancel_request()
+            return ''
+        return "return a + b"
+
+
+class TestProviderMetrics:
+    def _chat_sample(self, name, **labels):
+        return _sample(name, provider="test-provider", model="test-model", **labels)
+
+    def test_streamed_completions(self):
+        count = self._chat_sample("nbi_provider_request_duration_seconds_count", kind="chat", outcome="success")
+        ttft_count = self._chat_sample("nbi_provider_time_to_first_token_seconds_count")
+        tokens = self._chat_sample("nbi_provider_output_tokens_total", kind="chat")
+        response = Mock()
+        parts = [{"choices": [{"delta": {"content": "12345678"}}]}, MarkdownData("1234")]
+
+        _ChatModel(parts=parts).completions([], response=response)
+
+        # the provider streams to the wrapped response
+        assert [call.args[0] for call in response.stream.call_args_list] == parts
+        response.finish.assert_called_once()
+        assert self._chat_sample("nbi_provider_request_duration_seconds_count", kind="chat", outcome="success") == count + 1
+        assert self._chat_sample("nbi_provider_time_to_first_token_seconds_count") == ttft_count + 1
+        assert self._chat_sample("nbi_provider_output_tokens_total", kind="chat") == tokens + 3
+        assert _sample("nbi_provider_requests_in_flight", provider="test-provider", kind="chat") == 0
+
+    def test_completions_usage_tokens(self):
+        tokens = self._chat_sample("nbi_provider_output_tokens_total", kind="chat")
+        result = {"choices": [{"message": {"content": "Hello"}}], "usage": {"completion_tokens": 7}}
+
+        assert _ChatModel(result=result).completions([]) is result
+        assert self._chat_sample("nbi_provider_output_tokens_total", kind="chat") == tokens + 7
+
+    def test_completions_error(self):
+        errors = self._chat_sample("nbi_provider_errors_total", kind="chat")
+        count = self._chat_sample("nbi_provider_request_duration_seconds_count", kind="chat", outcome="error")
+
+        with pytest.raises(ValueError):
+            _ChatModel(error=ValueError("failed")).completions([], response=Mock())
+
+        assert self._chat_sample("nbi_provider_errors_total", kind="chat") == errors + 1
+        assert self._chat_sample("nbi_provider_request_duration_seconds_count", kind="chat", outcome="error") == count + 1
+        assert _sample("nbi_provider_requests_in_flight", provider="test-provider", kind="chat") == 0
+
+    def test_acompletions_closed_in_another_context(self):
+        count = self._chat_sample("nbi_provider_request_duration_seconds_count", kind="chat", outcome="cancelled")
+        errors = self._chat_sample("nbi_provider_errors_total", kind="chat")
+        parts = [{"choices": [{"delta": {"content": "Hello"}}]}, {"choices": [{"delta": {"content": " world"}}]}]
+
+        async def consume(stream):
+            async for _ in stream:
+                break
+
+        async def run():
+            stream = _AsyncChatModel(parts=parts).acompletions([])
+            # the consumer stops in a task, the generator is closed outside of its context
+            await asyncio.create_task(consume(stream))
+            await stream.aclose()
+
+        asyncio.run(run())
+
+        assert self._chat_sample("nbi_provider_request_duration_seconds_count", kind="chat", outcome="cancelled") == count + 1
+        assert self._chat_sample("nbi_provider_errors_total", kind="chat") == errors
+        assert _sample("nbi_provider_requests_in_flight", provider="test-provider", kind="chat") == 0
+
+    @pytest.mark.parametrize("cancel, outcome", [(False, "success"), (True, "cancelled")])
+    def test_inline_completions(self, cancel, outcome):
+        labels = {"provider": "test-inline-provider", "model": "inline-model", "kind": "inline"}
+        count = _sample("nbi_provider_request_duration_seconds_count", outcome=outcome, **labels)
+
+        _InlineCompletionModel(cancel=cancel).inline_completions("def f(a, b):\n    ", "", "python", "a.py", None, CancelTokenImpl())
+
+        assert _sample("nbi_provider_request_duration_seconds_count", outcome=outcome, **labels) == count + 1
+
+
+class TestRequestMetrics:
+    def test_inline_completion_cache_hit(self):
+        model = Mock()
+        model.provider.id = "provider"
+        model.id = "model"
+        model.properties = []
+        cache = InlineCompletionCache()
+        cache.put(InlineCompletionCache.model_key(model), "a.py", "def f():\n    ", "", "return 1")
+        count = _sample("nbi_inline_completion_duration_seconds_count", outcome="cache_hit")
+
+        with patch.object(ext_module, "ai_service_manager") as mock_asm, \
+             patch.object(ext_module, "inline_completion_cache", cache), \
+             patch.object(ext_module, "inline_completion_single_flight", SingleFlight()):
+            mock_asm.inline_completion_model = model
+            asyncio.run(WebsocketCopilotHandler.handle_inline_completions("def f():\n    ", "", "python", "a.py", Mock(), CancelTokenImpl()))
+
+        assert _sample("nbi_inline_completion_duration_seconds_count", outcome="cache_hit") == count + 1
+        assert _sample("nbi_inline_completions_in_flight") == 0
+
+    def test_mcp_call_tool(self):
+        server = MCPServerImpl.__new__(MCPServerImpl)
+        server._name = "test-server"
+        server.is_connected = Mock(return_value=True)
+        server._send_mcp_request = Mock(side_effect=[
+            {"success": True, "data": "ok", "error": None},
+            {"success": False, "data": None, "error": "failed"},
+        ])
+        success = _sample("nbi_mcp_tool_call_duration_seconds_count", server="test-server", outcome="success")
+        error = _sample("nbi_mcp_tool_call_duration_seconds_count", server="test-server", outcome="error")
+
+        assert server.call_tool("tool", {}) == "ok"
+        assert server.call_tool("tool", {}) == "failed"
+
+        assert _sample("nbi_mcp_tool_call_duration_seconds_count", server="test-server", outcome="success") == success + 1
+        assert _sample("nbi_mcp_tool_call_duration_seconds_count", server="test-server", outcome="error") == error + 1
+
+
+class TestMetricsHandler:
+    def test_serves_prometheus_text(self):
+        handler = MagicMock(spec=MetricsHandler)
+        with patch.object(ext_module, "websocket_hub") as mock_hub:
+            mock_hub.connection_count = 3
+            MetricsHandler.get.__wrapped__(handler)
+
+        handler.set_header.assert_called_once_with("Content-Type", metrics.CONTENT_TYPE_LATEST)
+        body = handler.finish.call_args.args[0].decode()
+        assert "# TYPE nbi_chat_request_duration_seconds histogram" in body
+        assert 'nbi_scheduler_workers{lane="chat"}' in body
+        assert "nbi_websocket_connections 3.0" in body
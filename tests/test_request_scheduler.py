@@ -0,0 +1,232 @@
+"""Tests for the bounded request scheduler used by the websocket handler."""
+
+import asyncio
+import threading
+import time
+
+from unittest.mock import Mock
+
+import pytest
+
+from notebook_intelligence.api import ChatResponse, SignalImpl
+from notebook_intelligence.extension import CancelTokenImpl
+from notebook_intelligence.request_scheduler import (
+    RequestLane,
+    RequestRejectedError,
+    RequestScheduler,
+)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = RequestScheduler(chat_workers=2, interactive_workers=1, max_queue_depth=2, max_concurrent_per_user=1)
+    yield scheduler
+    scheduler.stop(timeout=2)
+
+
+async def _wait_for(event: threading.Event):
+    while not event.is_set():
+        await asyncio.sleep(0.01)
+
+
+def _wait_until_running(scheduler, lane: RequestLane, count: int):
+    deadline = time.monotonic() + 2
+    while scheduler.stats()[lane.value]["running"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestRequestScheduler:
+    def test_runs_requests_on_long_lived_worker_loops(self, scheduler):
+        loops = []
+        threads = []
+        done = threading.Semaphore(0)
+
+        async def _request():
+            loops.append(asyncio.get_running_loop())
+            threads.append(threading.current_thread())
+            done.release()
+
+        for _ in range(3):
+            scheduler.submit(_request(), lane=RequestLane.Interactive)
+            assert done.acquire(timeout=2)
+
+        # single interactive worker reuses its thread and event loop
+        assert len(set(threads)) == 1
+        assert len(set(id(loop) for loop in loops)) == 1
+        assert not loops[0].is_closed()
+
+    def test_interactive_lane_not_blocked_by_chat_lane(self, scheduler):
+        release = threading.Event()
+        completed = threading.Event()
+
+        scheduler.submit(_wait_for(release), lane=RequestLane.Chat, user="a")
+        scheduler.submit(_wait_for(release), lane=RequestLane.Chat, user="b")
+
+        async def _completion():
+            completed.set()
+
+        scheduler.submit(_completion(), lane=RequestLane.Interactive, user="a")
+        try:
+            assert completed.wait(timeout=2)
+        finally:
+            release.set()
+
+    def test_rejects_when_queue_is_full(self, scheduler):
+        release = threading.Event()
+        try:
+            # occupy both chat workers, then fill the queue
+            scheduler.submit(_wait_for(release), user="a")
+            scheduler.submit(_wait_for(release), user="b")
+            _wait_until_running(scheduler, RequestLane.Chat, 2)
+            scheduler.submit(_wait_for(release), user="a")
+            scheduler.submit(_wait_for(release), user="b")
+
+            with pytest.raises(RequestRejectedError):
+                scheduler.submit(_wait_for(release), user="c")
+            assert scheduler.stats()["chat"]["rejected"] == 1
+        finally:
+            release.set()
+
+    def test_per_user_concurrency_cap(self, scheduler):
+        release = threading.Event()
+        other_user_done = threading.Event()
+        started = []
+
+        async def _blocking(name):
+            started.append(name)
+            await _wait_for(release)
+
+        async def _other_user():
+            other_user_done.set()
+
+        try:
+            scheduler.submit(_blocking("first"), user="a")
+            _wait_until_running(scheduler, RequestLane.Chat, 1)
+            scheduler.submit(_blocking("second"), user="a")
+            scheduler.submit(_other_user(), user="b")
+
+            # user b is served by the free worker while user a's second request waits
+            assert other_user_done.wait(timeout=2)
+            assert started == ["first"]
+            assert scheduler.stats()["chat"]["queued"] == 1
+        finally:
+            release.set()
+
+    def test_cancelled_queued_request_is_discarded(self, scheduler):
+        release = threading.Event()
+        discarded = threading.Event()
+        ran = []
+
+        async def _request():
+            ran.append(True)
+
+        try:
+            scheduler.submit(_wait_for(release), user="a")
+            _wait_until_running(scheduler, RequestLane.Chat, 1)
+            cancel_token = CancelTokenImpl()
+            scheduler.submit(_request(), user="a", cancel_token=cancel_token, on_discard=discarded.set)
+            cancel_token.cancel_request()
+
+            assert discarded.is_set()
+            assert scheduler.stats()["chat"]["queued"] == 0
+        finally:
+            release.set()
+        assert ran == []
+
+    def test_submit_after_stop_is_rejected(self):
+        scheduler = RequestScheduler()
+        scheduler.stop()
+
+        async def _request():
+            pass
+
+        with pytest.raises(RequestRejectedError):
+            scheduler.submit(_request())
+
+    def test_failing_request_does_not_kill_worker(self, scheduler):
+        done = threading.Event()
+
+        async def _failing():
+            raise RuntimeError("boom")
+
+        async def _ok():
+            done.set()
+
+        scheduler.submit(_failing(), lane=RequestLane.Interactive)
+        scheduler.submit(_ok(), lane=RequestLane.Interactive)
+        assert done.wait(timeout=2)
+
+    def test_on_done_called_after_run_and_discard(self, scheduler):
+        release = threading.Event()
+        done = []
+        completed = threading.Event()
+
+        async def _request():
+            pass
+
+        try:
+            scheduler.submit(_wait_for(release), user="a", on_done=lambda: done.append("running"))
+            _wait_until_running(scheduler, RequestLane.Chat, 1)
+            cancel_token = CancelTokenImpl()
+            scheduler.submit(_request(), user="a", cancel_token=cancel_token, on_done=lambda: done.append("discarded"))
+            cancel_token.cancel_request()
+            assert done == ["discarded"]
+        finally:
+            release.set()
+
+        scheduler.submit(_request(), user="a", on_done=completed.set)
+        assert completed.wait(timeout=2)
+        assert done == ["discarded", "running"]
+
+    def test_requests_waiting_for_confirmation_do_not_hold_workers(self):
+        scheduler = RequestScheduler(chat_workers=2, max_queue_depth=16, max_concurrent_per_user=4)
+        responses = []
+        confirmed = []
+        other_user_done = threading.Event()
+
+        async def _waiting_for_confirmation():
+            response = Mock(is_closed=False, user_input_signal=SignalImpl())
+            responses.append(response)
+            confirmed.append(await ChatResponse.wait_for_chat_user_input(response, "call-1"))
+
+        async def _chat():
+            other_user_done.set()
+
+        try:
+            # two users with four pending approvals each, more than the two workers
+            for user in ["a", "b"]:
+                for _ in range(4):
+                    scheduler.submit(_waiting_for_confirmation(), user=user)
+            _wait_until_running(scheduler, RequestLane.Chat, 8)
+            scheduler.submit(_chat(), user="c")
+
+            assert other_user_done.wait(timeout=2)
+        finally:
+            for response in responses:
+                response.user_input_signal.emit({"callback_id": "call-1", "data": {"confirmed": True}})
+            scheduler.stop(timeout=2)
+        assert confirmed == [{"confirmed": True}] * 8
+
+    def test_telemetry_lane_is_separate(self, scheduler):
+        release = threading.Event()
+        done = threading.Event()
+
+        async def _telemetry():
+            done.set()
+
+        try:
+            # the chat lane is running and has a full queue
+            scheduler.submit(_wait_for(release), user="a")
+            scheduler.submit(_wait_for(release), user="b")
+            _wait_until_running(scheduler, RequestLane.Chat, 2)
+            scheduler.submit(_wait_for(release), user="a")
+            scheduler.submit(_wait_for(release), user="b")
+            with pytest.raises(RequestRejectedError):
+                scheduler.submit(_wait_for(release), user="c")
+            scheduler.submit(_telemetry(), lane=RequestLane.Background)
+
+            assert done.wait(timeout=2)
+            assert scheduler.stats()["background"]["completed"] == 1
+        finally:
+            release.set()
@@ -0,0 +1,260 @@
+"""Tests for stream framing (coalescing, protocol v2) in WebsocketCopilotResponseEmitter."""
+
+import asyncio
+from unittest.mock import MagicMock, Mock, patch
+
+import pytest
+
+from notebook_intelligence.api import ChatResponse, ChatResponseClosedError, MarkdownPartData, ProgressData
+from notebook_intelligence.extension import ChatHistory, WebsocketCopilotResponseEmitter
+
+
+def _make_emitter(io_loop=None, protocol_version=1):
+    handler = Mock()
+    with patch("notebook_intelligence.extension.ioloop.IOLoop.current", return_value=io_loop or MagicMock()):
+        emitter = WebsocketCopilotResponseEmitter("chat-1", "msg-1", handler, ChatHistory(), protocol_version)
+    return emitter, handler
+
+
+def _sent(handler):
+    return [call[0][0] for call in handler.write_message.call_args_list]
+
+
+def _nbi_content(message):
+    return message["data"]["choices"][0]["delta"]["nbiContent"]
+
+
+def _raw_delta(content=None, reasoning_content=None, **extra):
+    delta = {"role": "assistant"}
+    if content is not None:
+        delta["content"] = content
+    if reasoning_content is not None:
+        delta["reasoning_content"] = reasoning_content
+    delta.update(extra)
+    return {"choices": [{"delta": delta}]}
+
+
+@pytest.fixture
+def coalescing():
+    with patch.object(WebsocketCopilotResponseEmitter, "coalesce_interval", 60), \
+         patch.object(WebsocketCopilotResponseEmitter, "coalesce_max_bytes", 1024):
+        yield
+
+
+class TestDeltaCoalescing:
+    def test_disabled_by_default_sends_every_delta(self):
+        emitter, handler = _make_emitter()
+        emitter.stream(MarkdownPartData("Hello"))
+        emitter.stream(MarkdownPartData(" world"))
+
+        assert [_nbi_content(m)["content"] for m in _sent(handler)] == ["Hello", " world"]
+
+    def test_markdown_parts_merged_until_finish(self, coalescing):
+        emitter, handler = _make_emitter()
+        emitter.stream(MarkdownPartData("Hello"))
+        emitter.stream(MarkdownPartData(" world"))
+        assert handler.write_message.call_count == 0
+
+        emitter.finish()
+
+        sent = _sent(handler)
+        assert [m["type"] for m in sent] == ["stream-message", "stream-end"]
+        assert _nbi_content(sent[0])["content"] == "Hello world"
+        assert emitter.chat_history.get_history("chat-1")[-1]["content"] == "Hello world"
+
+    def test_llm_raw_deltas_keep_raw_shape(self, coalescing):
+        emitter, handler = _make_emitter()
+        emitter.stream(_raw_delta(content="def "))
+        emitter.stream(_raw_delta(content="f():"))
+        emitter.flush()
+
+        sent = _sent(handler)
+        assert len(sent) == 1
+        assert sent[0]["data"]["choices"][0]["delta"]["content"] == "def f():"
+
+    def test_content_and_reasoning_not_mixed(self, coalescing):
+        emitter, handler = _make_emitter()
+        emitter.stream(_raw_delta(reasoning_content="think"))
+        emitter.stream(_raw_delta(reasoning_content="ing"))
+        emitter.stream(_raw_delta(content="answer"))
+        emitter.flush()
+
+        deltas = [m["data"]["choices"][0]["delta"] for m in _sent(handler)]
+        assert deltas == [
+            {"reasoning_content": "thinking", "role": "assistant"},
+            {"content": "answer", "role": "assistant"},
+        ]
+
+    def test_other_data_flushes_pending_deltas_first(self, coalescing):
+        emitter, handler = _make_emitter()
+        emitter.stream(MarkdownPartData("Working"))
+        emitter.stream(ProgressData("Running tool"))
+
+        sent = _sent(handler)
+        assert [_nbi_content(m)["type"] for m in sent] == ["markdown-part", "progress"]
+
+    def test_tool_call_deltas_are_not_merged(self, coalescing):
+        emitter, handler = _make_emitter()
+        emitter.stream(_raw_delta(content="a"))
+        emitter.stream(_raw_delta(tool_calls=[{"index": 0}]))
+
+        sent = _sent(handler)
+        assert len(sent) == 2
+        assert sent[0]["data"]["choices"][0]["delta"]["content"] == "a"
+        assert "tool_calls" in sent[1]["data"]["choices"][0]["delta"]
+
+    def test_byte_threshold_flushes(self, coalescing):
+        with patch.object(WebsocketCopilotResponseEmitter, "coalesce_max_bytes", 8):
+            emitter, handler = _make_emitter()
+            emitter.stream(MarkdownPartData("1234"))
+            assert handler.write_message.call_count == 0
+            emitter.stream(MarkdownPartData("5678"))
+
+        assert [_nbi_content(m)["content"] for m in _sent(handler)] == ["12345678"]
+
+    def test_stalled_stream_flushed_by_io_loop_timer(self, coalescing):
+        io_loop = MagicMock()
+        emitter, handler = _make_emitter(io_loop)
+        emitter.stream(MarkdownPartData("a"))
+        emitter.stream(MarkdownPartData("b"))
+
+        # a single timer is scheduled on the server IOLoop
+        io_loop.add_callback.assert_called_once()
+        call_later, delay, callback = io_loop.add_callback.call_args[0]
+        assert call_later is io_loop.call_later
+        assert delay == 60
+
+        callback()
+        assert [_nbi_content(m)["content"] for m in _sent(handler)] == ["ab"]
+
+    def test_run_ui_command_flushes_pending_deltas(self, coalescing):
+        emitter, handler = _make_emitter()
+        emitter.stream(MarkdownPartData("before"))
+
+        with patch("notebook_intelligence.extension.ChatResponse.wait_for_run_ui_command_response", return_value="ok"):
+            asyncio.run(emitter.run_ui_command("test:command"))
+
+        sent = _sent(handler)
+        assert [m["type"] for m in sent] == ["stream-message", "run-ui-command"]
+
+
+class TestStreamProtocolV2:
+    def test_header_sent_once_then_compact_frames(self):
+        emitter, handler = _make_emitter(protocol_version=2)
+        emitter.participant_id = "default"
+        emitter.stream(MarkdownPartData("Hello"))
+        emitter.stream(MarkdownPartData(reasoning_content="hmm"))
+        emitter.stream(_raw_delta(content=" world"))
+
+        header, *frames = _sent(handler)
+        assert header["type"] == "stream-header"
+        assert header["id"] == "msg-1"
+        assert header["participant"] == "default"
+        assert header["v"] == 2
+        assert frames == [
+            {"sid": header["sid"], "seq": 0, "kind": "md", "text": "Hello"},
+            {"sid": header["sid"], "seq": 1, "kind": "md-r", "text": "hmm"},
+            {"sid": header["sid"], "seq": 2, "kind": "raw", "text": " world"},
+        ]
+
+    def test_non_text_data_uses_full_envelope(self):
+        emitter, handler = _make_emitter(protocol_version=2)
+        emitter.stream(ProgressData("Running tool"))
+        emitter.finish()
+
+        sent = _sent(handler)
+        assert [m["type"] for m in sent] == ["stream-message", "stream-end"]
+        assert _nbi_content(sent[0])["type"] == "progress"
+
+    def test_streams_get_distinct_ids(self):
+        first, first_handler = _make_emitter(protocol_version=2)
+        second, second_handler = _make_emitter(protocol_version=2)
+        first.stream(MarkdownPartData("a"))
+        second.stream(MarkdownPartData("b"))
+
+        assert _sent(first_handler)[0]["sid"] != _sent(second_handler)[0]["sid"]
+
+    def test_history_collects_streamed_text(self):
+        emitter, handler = _make_emitter(protocol_version=2)
+        emitter.stream(MarkdownPartData("Hello"))
+        emitter.stream(MarkdownPartData(" world"))
+        emitter.finish()
+
+        assert emitter.chat_history.get_history("chat-1")[-1]["content"] == "Hello world"
+
+    def test_coalesced_frames(self, coalescing):
+        emitter, handler = _make_emitter(protocol_version=2)
+        emitter.stream(MarkdownPartData("Hello"))
+        emitter.stream(MarkdownPartData(" world"))
+        emitter.flush()
+
+        header, frame = _sent(handler)
+        assert frame == {"sid": header["sid"], "seq": 0, "kind": "md", "text": "Hello world"}
+
+
+class TestClosedResponse:
+    def test_waiting_for_user_input_ends_when_closed(self):
+        emitter, handler = _make_emitter()
+
+        async def _wait():
+            wait = asyncio.ensure_future(ChatResponse.wait_for_chat_user_input(emitter, "callback-1"))
+            await asyncio.sleep(0.01)
+            emitter.close()
+            return await asyncio.wait_for(wait, timeout=1)
+
+        assert asyncio.run(_wait()) == {"confirmed": False}
+
+    def test_waiting_for_ui_command_raises_when_closed(self):
+        emitter, handler = _make_emitter()
+        emitter.close()
+
+        with pytest.raises(ChatResponseClosedError):
+            asyncio.run(asyncio.wait_for(emitter.run_ui_command("docmanager:save"), timeout=1))
+
+
+class TestStreamReplay:
+    def test_frames_numbered_across_message_types(self):
+        emitter, handler = _make_emitter()
+        emitter.stream(MarkdownPartData("Hello"))
+        emitter.stream(ProgressData("Running tool"))
+        emitter.finish()
+
+        assert [m["seq"] for m in _sent(handler)] == [0, 1, 2]
+
+    def test_attach_replays_frames_after_last_seq(self):
+        emitter, handler = _make_emitter()
+        for text in ["a", "b", "c"]:
+            emitter.stream(MarkdownPartData(text))
+
+        new_handler = Mock()
+        assert emitter.attach(new_handler, ChatHistory(), 0) == 0
+        assert [_nbi_content(m)["content"] for m in _sent(new_handler)] == ["b", "c"]
+
+        emitter.finish()
+        assert _sent(new_handler)[-1]["type"] == "stream-end"
+        assert handler.write_message.call_count == 3
+
+    def test_attach_resends_stream_header(self):
+        emitter, handler = _make_emitter(protocol_version=2)
+        emitter.stream(MarkdownPartData("Hello"))
+        emitter.stream(MarkdownPartData(" world"))
+
+        new_handler = Mock()
+        emitter.attach(new_handler, ChatHistory(), 0)
+
+        header, frame = _sent(new_handler)
+        assert header == _sent(handler)[0]
+        assert frame == {"sid": header["sid"], "seq": 1, "kind": "md", "text": " world"}
+
+    def test_attach_reports_frames_no_longer_buffered(self):
+        with patch.object(WebsocketCopilotResponseEmitter, "replay_buffer_size", 2):
+            emitter, handler = _make_emitter()
+        for text in ["a", "b", "c", "d"]:
+            emitter.stream(MarkdownPartData(text))
+
+        new_handler = Mock()
+        assert emitter.attach(new_handler, ChatHistory(), 0) == 1
+
+        notice, *frames = _sent(new_handler)
+        assert "lost" in _nbi_content(notice)["content"]
+        assert [m["seq"] for m in frames] == [2, 3]
@@ -0,0 +1,155 @@
+"""Tests for merging identical concurrent calls."""
+
+import asyncio
+import threading
+from unittest.mock import Mock, patch
+
+from notebook_intelligence.extension import CancelTokenImpl, WebsocketCopilotHandler
+from notebook_intelligence.inline_completion_cache import InlineCompletionCache
+from notebook_intelligence.single_flight import SingleFlight
+
+
+class TestSingleFlight:
+    def test_concurrent_identical_calls_are_merged(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def _fetch(cancel_token):
+            calls.append(cancel_token)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def _run():
+            return await asyncio.gather(
+                single_flight.run("key", _fetch, CancelTokenImpl()),
+                single_flight.run("key", _fetch, CancelTokenImpl()),
+                single_flight.run("other", _fetch, CancelTokenImpl())
+            )
+
+        assert asyncio.run(_run()) == ["result", "result", "result"]
+        assert len(calls) == 2
+        assert single_flight.merged == 1
+
+    def test_completed_call_is_not_reused(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def _fetch(cancel_token):
+            calls.append(cancel_token)
+            return len(calls)
+
+        assert asyncio.run(single_flight.run("key", _fetch, CancelTokenImpl())) == 1
+        assert asyncio.run(single_flight.run("key", _fetch, CancelTokenImpl())) == 2
+
+    def test_merges_calls_from_different_threads(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        async def _fetch(cancel_token):
+            started.set()
+            await asyncio.get_running_loop().run_in_executor(None, release.wait)
+            return "result"
+
+        def _leader():
+            results.append(asyncio.run(single_flight.run("key", _fetch, CancelTokenImpl())))
+
+        leader = threading.Thread(target=_leader)
+        leader.start()
+        started.wait(5)
+
+        async def _follower():
+            asyncio.get_running_loop().call_later(0.05, release.set)
+            return await single_flight.run("key", _fetch, CancelTokenImpl())
+
+        results.append(asyncio.run(_follower()))
+        leader.join(5)
+
+        assert results == ["result", "result"]
+        assert single_flight.merged == 1
+
+    def test_cancelled_follower_gets_default_without_cancelling_call(self):
+        single_flight = SingleFlight()
+        shared_tokens = []
+
+        async def _fetch(cancel_token):
+            shared_tokens.append(cancel_token)
+            await asyncio.sleep(0.1)
+            return "result"
+
+        async def _run():
+            follower_token = CancelTokenImpl()
+            asyncio.get_running_loop().call_later(0.02, follower_token.cancel_request)
+            return await asyncio.gather(
+                single_flight.run("key", _fetch, CancelTokenImpl(), default=''),
+                single_flight.run("key", _fetch, follower_token, default='')
+            )
+
+        assert asyncio.run(_run()) == ["result", ""]
+        assert shared_tokens[0].is_cancel_requested is False
+
+    def test_shared_token_cancelled_when_all_callers_cancel(self):
+        single_flight = SingleFlight()
+        shared_tokens = []
+
+        async def _fetch(cancel_token):
+            shared_tokens.append(cancel_token)
+            while not cancel_token.is_cancel_requested:
+                await asyncio.sleep(0.01)
+            return "partial"
+
+        async def _run():
+            tokens = [CancelTokenImpl(), CancelTokenImpl()]
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.02, tokens[0].cancel_request)
+            loop.call_later(0.04, tokens[1].cancel_request)
+            return await asyncio.gather(*[single_flight.run("key", _fetch, token, default='') for token in tokens])
+
+        assert asyncio.run(_run()) == ["", ""]
+        assert shared_tokens[0].is_cancel_requested is True
+
+
+class TestInlineCompletionRequests:
+    def test_failed_call_replies_empty_to_merged_requests(self):
+        calls = []
+
+        async def _failing_completions(*args):
+            calls.append(args)
+            await asyncio.sleep(0.05)
+            raise RuntimeError("provider unavailable")
+
+        model = Mock()
+        model.provider.id = "ollama"
+        model.id = "codellama"
+        model.properties = []
+        model.ainline_completions = _failing_completions
+        manager = Mock()
+        manager.inline_completion_model = model
+
+        async def _get_completion_context(request):
+            return None
+        manager.get_completion_context = _get_completion_context
+
+        single_flight = SingleFlight()
+        emitters = [Mock(), Mock()]
+
+        async def _run():
+            await asyncio.gather(*[
+                WebsocketCopilotHandler.handle_inline_completions("def f():\n    ", "", "python", "a.py", emitter, CancelTokenImpl())
+                for emitter in emitters
+            ])
+
+        with patch("notebook_intelligence.extension.ai_service_manager", manager), \
+             patch("notebook_intelligence.extension.inline_completion_cache", InlineCompletionCache()), \
+             patch("notebook_intelligence.extension.inline_completion_single_flight", single_flight):
+            asyncio.run(_run())
+            assert single_flight.merged == 1
+            for emitter in emitters:
+                emitter.stream.assert_called_once_with({"completions": ""})
+                emitter.finish.assert_called_once()
+
+            # the failed call is not in flight anymore
+            asyncio.run(_run())
+
+        assert len(calls) == 2
@@ -0,0 +1,134 @@
+"""Tests for the streaming response aggregator shared by the LLM providers."""
+
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from benchmarks.fake_llm_server import FakeLLMConfig, FakeLLMServer
+from notebook_intelligence.llm_providers.ollama_llm_provider import OllamaChatModel
+from notebook_intelligence.llm_providers.openai_compatible_llm_provider import OpenAICompatibleLLMProvider
+from notebook_intelligence.streaming_aggregator import ContentDelta, StreamingResponseAggregator, ToolCallCompleted
+
+
+def _delta(finish_reason=None, **delta):
+    return {"choices": [{"delta": delta, "finish_reason": finish_reason}]}
+
+
+def _tool_call_delta(index, id=None, name=None, arguments=None):
+    function = {}
+    if name is not None:
+        function["name"] = name
+    if arguments is not None:
+        function["arguments"] = arguments
+    tool_call = {"index": index, "function": function}
+    if id is not None:
+        tool_call["id"] = id
+        tool_call["type"] = "function"
+    return _delta(tool_calls=[tool_call])
+
+
+class TestStreamingResponseAggregator:
+    def test_aggregates_content_and_reasoning(self):
+        aggregator = StreamingResponseAggregator()
+
+        assert aggregator.add(_delta(role="assistant", reasoning_content="Think")) == [ContentDelta(reasoning_content="Think")]
+        assert aggregator.add(_delta(reasoning={"text": "ing"})) == [ContentDelta(reasoning_content="ing")]
+        assert aggregator.add(_delta(content="Hello ")) == [ContentDelta(content="Hello ")]
+        assert aggregator.add(_delta(content="world")) == [ContentDelta(content="world")]
+        assert aggregator.add({"choices": []}) == []
+        assert aggregator.finish() == []
+
+        assert aggregator.response() == {
+            "choices": [{"message": {"role": "assistant", "content": "Hello world", "tool_calls": None, "reasoning_content": "Thinking"}}]
+        }
+
+    def test_tool_call_completed_when_arguments_are_complete(self):
+        aggregator = StreamingResponseAggregator()
+
+        assert aggregator.add(_tool_call_delta(0, id="call-1", name="search", arguments="")) == []
+        assert aggregator.partial_arguments(0) is None
+        assert aggregator.add(_tool_call_delta(0, arguments='{"query": ')) == []
+        assert aggregator.partial_arguments(0) == {}
+        assert aggregator.add(_tool_call_delta(0, arguments='"a}')) == []
+        assert aggregator.partial_arguments(0) == {"query": "a}"}
+        assert aggregator.add(_tool_call_delta(0, arguments=' \\" {", "n": [1]')) == []
+        events = aggregator.add(_tool_call_delta(0, arguments="}"))
+
+        tool_call = {"id": "call-1", "type": "function", "function": {"name": "search", "arguments": '{"query": "a} \\" {", "n": [1]}'}}
+        assert events == [ToolCallCompleted(0, tool_call)]
+        assert json.loads(tool_call["function"]["arguments"]) == {"query": 'a} " {', "n": [1]}
+        # not completed again
+        assert aggregator.finish() == []
+        assert aggregator.message()["tool_calls"] == [tool_call]
+
+    def test_tool_calls_tracked_by_index(self):
+        aggregator = StreamingResponseAggregator()
+
+        aggregator.add(_tool_call_delta(0, id="call-1", name="first", arguments='{"a": '))
+        # the next tool call completes the previous one
+        events = aggregator.add(_tool_call_delta(1, id="call-2", name="second"))
+        assert [event.tool_call["function"]["name"] for event in events] == ["first"]
+        events = aggregator.add(_delta(finish_reason="tool_calls"))
+        assert events == [ToolCallCompleted(1, {"id": "call-2", "type": "function", "function": {"name": "second", "arguments": "{}"}})]
+
+        assert [tool_call["function"]["arguments"] for tool_call in aggregator.tool_calls] == ['{"a": ', "{}"]
+
+    def test_partial_arguments(self):
+        aggregator = StreamingResponseAggregator()
+
+        aggregator.add(_tool_call_delta(0, id="call-1", name="edit", arguments='{"cells": [{"source": "x = \\'))
+        assert aggregator.partial_arguments(0) == {"cells": [{"source": "x = "}]}
+        aggregator.add(_tool_call_delta(0, arguments='n"}, {"source": tr'))
+        assert aggregator.partial_arguments(0) == {"cells": [{"source": "x = \n"}, {}]}
+
+    def test_drops_tool_calls_without_name(self):
+        aggregator = StreamingResponseAggregator()
+
+        aggregator.add(_tool_call_delta(0, arguments="{}"))
+
+        assert aggregator.finish() == []
+        assert aggregator.message() == {"role": "assistant", "content": "", "tool_calls": None}
+
+    def test_complete_message(self):
+        aggregator = StreamingResponseAggregator()
+        tool_calls = [
+            {"id": "call-1", "type": "function", "function": {"name": "first", "arguments": {"a": 1}}},
+            {"id": "call-2", "type": "function", "function": {"name": "second", "arguments": '{"b": 2}'}},
+        ]
+
+        events = aggregator.add({"choices": [{"message": {"role": "assistant", "content": "Calling", "tool_calls": tool_calls}}]})
+
+        assert events[0] == ContentDelta(content="Calling")
+        assert [(event.index, event.tool_call["function"]["arguments"]) for event in events[1:]] == [(0, '{"a": 1}'), (1, '{"b": 2}')]
+
+
+class TestProviderAggregation:
+    def test_openai_compatible_tool_call_round_is_streamed(self):
+        config = FakeLLMConfig(ttft=0, tokens_per_second=0, tool_calls=[{"name": "search", "arguments": {"query": "x"}}])
+        tools = [{"type": "function", "function": {"name": "search", "parameters": {}}}]
+        with FakeLLMServer(config) as server:
+            chat_model = OpenAICompatibleLLMProvider().chat_models[0]
+            chat_model.set_property_value("model_id", "fake-model")
+            chat_model.set_property_value("api_key", "key")
+            chat_model.set_property_value("base_url", server.base_url)
+            result = chat_model.completions([{"role": "user", "content": "Hi"}], tools=tools)
+
+        tool_calls = result["choices"][0]["message"]["tool_calls"]
+        assert [(tool_call["function"]["name"], json.loads(tool_call["function"]["arguments"])) for tool_call in tool_calls] == [("search", {"query": "x"})]
+
+    def test_ollama_tool_call_round_is_streamed(self):
+        def _chunk(content="", tool_calls=None):
+            return {"message": {"role": "assistant", "content": content, "tool_calls": tool_calls}}
+
+        def _tool_call(name, arguments):
+            return SimpleNamespace(function=SimpleNamespace(name=name, arguments=arguments))
+
+        chunks = [_chunk("Let me "), _chunk("check", [_tool_call("first", {"a": 1})]), _chunk(tool_calls=[_tool_call("second", {})])]
+        chat_model = OllamaChatModel(None, "model", "Model", 4096)
+        with patch("ollama.Client.chat", return_value=iter(chunks)) as chat:
+            result = chat_model.completions([{"role": "user", "content": "Hi"}], tools=[{"type": "function"}])
+
+        assert chat.call_args.kwargs["stream"] is True
+        message = result["choices"][0]["message"]
+        assert message["content"] == "Let me check"
+        assert [(tool_call["function"]["name"], tool_call["function"]["arguments"]) for tool_call in message["tool_calls"]] == [("first", '{"a": 1}'), ("second", "{}")]
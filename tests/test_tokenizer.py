@@ -0,0 +1,120 @@
+"""Tests for the shared tokenizer service."""
+
+import asyncio
+import threading
+from unittest.mock import Mock, patch
+
+import tiktoken
+
+from notebook_intelligence.tokenizer import TRUNCATION_SUFFIX, Tokenizer
+
+
+def _mock_encoding():
+    # one token per character
+    encoding = Mock()
+    encoding.encode.side_effect = lambda text, **kwargs: list(text)
+    encoding.decode.side_effect = lambda tokens: "".join(tokens)
+    return encoding
+
+
+class TestTokenizer:
+    def test_encoding_loaded_lazily(self):
+        with patch.object(tiktoken, "get_encoding") as get_encoding:
+            tokenizer = Tokenizer()
+            get_encoding.assert_not_called()
+
+            tokenizer.count_tokens("hello world")
+            tokenizer.count_tokens("hello again")
+            get_encoding.assert_called_once_with("o200k_base")
+
+    def test_counts_with_tiktoken(self):
+        tokenizer = Tokenizer()
+        encoding = tiktoken.get_encoding("o200k_base")
+
+        assert tokenizer.count_tokens("def greet(name):\n    return name") == len(encoding.encode("def greet(name):\n    return name"))
+        assert tokenizer.count_tokens("") == 0
+
+    def test_special_tokens_in_content_are_counted(self):
+        tokenizer = Tokenizer()
+        assert tokenizer.count_tokens("<|endoftext|>") > 0
+
+    def test_falls_back_to_estimate_when_encoding_unavailable(self):
+        with patch.object(tiktoken, "get_encoding", side_effect=OSError("offline")) as get_encoding:
+            tokenizer = Tokenizer()
+            assert tokenizer.count_tokens("a" * 40) == 10
+            assert tokenizer.truncate("a" * 40, 5) == "a" * 20 + TRUNCATION_SUFFIX
+            # loading is not retried
+            tokenizer.count_tokens("b" * 40)
+            get_encoding.assert_called_once()
+
+    def test_counts_cached_by_content(self):
+        tokenizer = Tokenizer()
+        tokenizer._encoding = _mock_encoding()
+
+        assert tokenizer.count_tokens("abc") == 3
+        assert tokenizer.count_tokens("abc") == 3
+        assert tokenizer._encoding.encode.call_count == 1
+
+    def test_cache_is_bounded(self):
+        tokenizer = Tokenizer(cache_size=2)
+        tokenizer._encoding = _mock_encoding()
+
+        for text in ["a", "b", "c"]:
+            tokenizer.count_tokens(text)
+        tokenizer.count_tokens("a")
+
+        assert tokenizer._encoding.encode.call_count == 4
+
+    def test_huge_input_is_estimated(self):
+        tokenizer = Tokenizer()
+        tokenizer._encoding = _mock_encoding()
+        content = "x" * (Tokenizer.MAX_EXACT_COUNT_CHARS + 4)
+
+        assert tokenizer.count_tokens(content) == len(content) // Tokenizer.CHARS_PER_TOKEN
+        tokenizer._encoding.encode.assert_not_called()
+
+    def test_truncate_only_encodes_prefix(self):
+        tokenizer = Tokenizer()
+        tokenizer._encoding = _mock_encoding()
+        content = "y" * 20_000_000
+
+        truncated = tokenizer.truncate(content, 100)
+
+        assert truncated == "y" * 100 + TRUNCATION_SUFFIX
+        encoded_text = tokenizer._encoding.encode.call_args[0][0]
+        assert len(encoded_text) == 100 * Tokenizer.MAX_CHARS_PER_TOKEN
+
+    def test_truncate_keeps_content_within_budget(self):
+        tokenizer = Tokenizer()
+
+        assert tokenizer.truncate("short text", 100) == "short text"
+        assert tokenizer.truncate("", 100) == ""
+        assert tokenizer.truncate("some text", 0) == ""
+        long_text = "word " * 500
+        truncated = tokenizer.truncate(long_text, 50)
+        assert truncated.endswith(TRUNCATION_SUFFIX)
+        assert tokenizer.count_tokens(truncated[:-len(TRUNCATION_SUFFIX)]) <= 50
+
+    def test_async_calls_run_on_worker_pool(self):
+        tokenizer = Tokenizer()
+        tokenizer._encoding = _mock_encoding()
+        calling_thread = threading.current_thread()
+        encode_threads = []
+
+        def _encode(text, **kwargs):
+            encode_threads.append(threading.current_thread())
+            return list(text)
+        tokenizer._encoding.encode.side_effect = _encode
+
+        async def _run():
+            return await tokenizer.acount_tokens("abcd"), await tokenizer.atruncate("a" * 100, 10)
+
+        try:
+            count, truncated = asyncio.run(_run())
+        finally:
+            tokenizer.shutdown()
+
+        assert count == 4
+        assert truncated == "a" * 10 + TRUNCATION_SUFFIX
+        assert len(encode_threads) == 2
+        assert all(thread is not calling_thread for thread in encode_threads)
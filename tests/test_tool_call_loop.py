@@ -0,0 +1,548 @@
+"""Tests for the agent tool call loop of ChatParticipant."""
+
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+
+from notebook_intelligence.api import ChatModel, ChatParticipant, ChatRequest, MarkdownData, MarkdownPartData, SignalImpl, Tool, ToolPreInvokeResponse
+from notebook_intelligence.mcp_manager import MCPServerImpl
+from notebook_intelligence.tool_result_store import tool_result_store
+from notebook_intelligence.extension import CancelTokenImpl
+
+
+def _delta(**delta):
+    return {"choices": [{"delta": delta}]}
+
+
+def _tool_call_delta(index, id=None, name=None, arguments=None):
+    function = {}
+    if name is not None:
+        function["name"] = name
+    if arguments is not None:
+        function["arguments"] = arguments
+    tool_call = {"index": index, "function": function}
+    if id is not None:
+        tool_call["id"] = id
+        tool_call["type"] = "function"
+    return _delta(tool_calls=[tool_call])
+
+
+class _EchoTool(Tool):
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+        self.calls = []
+
+    @property
+    def name(self):
+        return "echo"
+
+    @property
+    def schema(self):
+        return {
+            "type": "function",
+            "function": {
+                "name": "echo",
+                "description": "Echoes the text",
+                "parameters": {"type": "object", "properties": {"text": {"type": "string"}}},
+            },
+        }
+
+    async def handle_tool_call(self, request, response, tool_context, tool_args):
+        self.events.append("tool")
+        self.calls.append(tool_args)
+        return f"echo: {tool_args['text']}"
+
+
+class _SleepTool(Tool):
+    """Records the number of its calls running at the same time"""
+    def __init__(self, name, read_only=True, confirm=False, state=None):
+        super().__init__()
+        self._name = name
+        self._read_only = read_only
+        self._confirm = confirm
+        self.state = state if state is not None else {"running": 0, "peak": 0}
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def read_only(self):
+        return self._read_only
+
+    @property
+    def schema(self):
+        return {"type": "function", "function": {"name": self._name, "parameters": {"type": "object", "properties": {"delay": {"type": "number"}}}}}
+
+    def pre_invoke(self, request, tool_args):
+        if self._confirm:
+            return ToolPreInvokeResponse(f"Calling {self._name}", confirmationTitle="Approve", confirmationMessage="Sure?")
+        return None
+
+    async def handle_tool_call(self, request, response, tool_context, tool_args):
+        self.state["running"] += 1
+        self.state["peak"] = max(self.state["peak"], self.state["running"])
+        await asyncio.sleep(tool_args["delay"])
+        self.state["running"] -= 1
+        return f"{self._name} {tool_args['delay']}"
+
+
+def _tool_calls_round(*calls):
+    return [
+        _delta(tool_calls=[{"index": i, "id": f"call-{i}", "type": "function", "function": {"name": name, "arguments": f'{{"delay": {delay}}}'}}])
+        for i, (name, delay) in enumerate(calls)
+    ]
+
+
+class _Participant(ChatParticipant):
+    def __init__(self, tools):
+        super().__init__()
+        self._tools = tools
+
+    @property
+    def id(self):
+        return "test"
+
+    @property
+    def tools(self):
+        return self._tools
+
+
+class _StreamingChatModel(ChatModel):
+    """Streams the parts of one round per call, a round can be a function of the messages"""
+    def __init__(self, rounds):
+        super().__init__(None)
+        self._rounds = list(rounds)
+        self.messages = []
+
+    async def acompletions(self, messages, tools=None, cancel_token=None, options={}):
+        self.messages.append([message.copy() for message in messages])
+        parts = self._rounds.pop(0)
+        for part in (parts(messages) if callable(parts) else parts):
+            yield part
+
+
+class _CancelledStreamChatModel(ChatModel):
+    """Cancels the request after the first part, records the task its stream was closed in"""
+    def __init__(self):
+        super().__init__(None)
+        self.started_in = None
+        self.closed_in = None
+
+    async def acompletions(self, messages, tools=None, cancel_token=None, options={}):
+        self.started_in = asyncio.current_task()
+        try:
+            yield _delta(content="Let me ")
+            cancel_token.cancel_request()
+            yield _delta(content="check.")
+            yield _delta(content="Done.")
+        finally:
+            self.closed_in = asyncio.current_task()
+
+
+class _SlowStreamChatModel(_StreamingChatModel):
+    """Waits before each part of a round, like a model generating slowly"""
+    async def acompletions(self, messages, tools=None, cancel_token=None, options={}):
+        async for part in super().acompletions(messages, tools, cancel_token, options):
+            await asyncio.sleep(0.05)
+            yield part
+
+
+class _SyncToolCallModel(ChatModel):
+    """Third-party style model returning the complete message of a round"""
+    def __init__(self, messages):
+        super().__init__(None)
+        self._messages = list(messages)
+
+    def completions(self, messages, tools=None, response=None, cancel_token=None, options={}):
+        return {"choices": [{"message": self._messages.pop(0)}]}
+
+
+def _run_loop(chat_model, tool, events):
+    return _run_tools_loop(chat_model, [tool], events)
+
+
+def _run_tools_loop(chat_model, tools, events):
+    response = Mock()
+    response.message_id = "message-1"
+    response.stream.side_effect = lambda data: events.append(data)
+    response.finish.side_effect = lambda: events.append("finish")
+    response.is_closed = False
+    response.user_input_signal = SignalImpl()
+    host = Mock()
+    host.chat_model = chat_model
+    request = ChatRequest(host=host, prompt="Hi", chat_history=[{"role": "user", "content": "Hi"}], cancel_token=CancelTokenImpl())
+
+    if any(getattr(tool, "_confirm", False) for tool in tools):
+        response.stream.side_effect = lambda data: (events.append(data), _confirm(response, data))
+    asyncio.run(_Participant(tools).handle_chat_request_with_tools(request, response))
+    return response
+
+
+def _confirm(response, data):
+    if type(data).__name__ == "ConfirmationData":
+        confirm_args = data.confirmArgs["data"]
+        asyncio.get_running_loop().call_soon(lambda: response.user_input_signal.emit(confirm_args))
+
+
+class TestToolCallLoop:
+    def test_streams_text_before_tool_calls_complete(self):
+        events = []
+        tool = _EchoTool(events)
+        chat_model = _StreamingChatModel([
+            [
+                _delta(role="assistant", reasoning_content="Thinking"),
+                _delta(content="Let me "),
+                _delta(content="check."),
+                _tool_call_delta(0, id="call-1", name="echo", arguments=""),
+                _tool_call_delta(0, arguments='{"te'),
+                _tool_call_delta(0, arguments='xt": "hi"}'),
+            ],
+            [_delta(content="Done.")],
+        ])
+
+        _run_loop(chat_model, tool, events)
+
+        assert events == [
+            MarkdownPartData(reasoning_content="Thinking"),
+            MarkdownPartData(content="Let me "),
+            MarkdownPartData(content="check."),
+            "tool",
+            MarkdownPartData(content="Done."),
+            "finish",
+        ]
+        assert tool.calls == [{"text": "hi"}]
+        assert chat_model.messages[1][1:] == [
+            {
+                "role": "assistant",
+                "content": "Let me check.",
+                "tool_calls": [{"id": "call-1", "type": "function", "function": {"name": "echo", "arguments": '{"text": "hi"}'}}],
+            },
+            {"role": "tool", "content": "echo: hi", "tool_call_id": "call-1"},
+        ]
+
+    def test_drops_tool_calls_without_name(self):
+        events = []
+        tool = _EchoTool(events)
+        chat_model = _StreamingChatModel([
+            [_delta(content="Done."), _tool_call_delta(0, arguments="")],
+        ])
+
+        _run_loop(chat_model, tool, events)
+
+        assert tool.calls == []
+        assert events == [MarkdownPartData(content="Done."), "finish"]
+
+    def test_stream_data_parts_are_forwarded(self):
+        events = []
+        chat_model = _StreamingChatModel([[MarkdownData("Request failed")]])
+
+        _run_loop(chat_model, _EchoTool(events), events)
+
+        assert events == [MarkdownData("Request failed"), "finish"]
+
+    def test_stream_is_closed_on_cancel(self):
+        events = []
+        chat_model = _CancelledStreamChatModel()
+
+        _run_loop(chat_model, _EchoTool(events), events)
+
+        assert events == [MarkdownPartData(content="Let me ")]
+        # closed by the loop, not finalized later by the event loop
+        assert chat_model.closed_in is chat_model.started_in
+
+    def test_sync_model_returning_message(self):
+        events = []
+        tool = _EchoTool(events)
+        chat_model = _SyncToolCallModel([
+            {
+                "role": "assistant",
+                "content": "Calling",
+                "tool_calls": [{"id": "call-1", "type": "function", "function": {"name": "echo", "arguments": '{"text": "hi"}'}}],
+            },
+            {"role": "assistant", "content": "Done."},
+        ])
+
+        _run_loop(chat_model, tool, events)
+
+        assert tool.calls == [{"text": "hi"}]
+        assert events == [MarkdownPartData(content="Calling"), "tool", MarkdownPartData(content="Done."), "finish"]
+
+
+class TestConcurrentToolCalls:
+    @pytest.fixture(autouse=True)
+    def _concurrency(self):
+        with patch.object(ChatParticipant, "tool_call_concurrency", 2):
+            yield
+
+    def test_read_only_calls_run_concurrently_in_order(self):
+        tool = _SleepTool("read")
+        chat_model = _StreamingChatModel([_tool_calls_round(("read", 0.3), ("read", 0.1), ("read", 0.2)), [_delta(content="Done.")]])
+
+        started_at = time.monotonic()
+        _run_tools_loop(chat_model, [tool], [])
+        elapsed = time.monotonic() - started_at
+
+        # limited to two calls at a time
+        assert tool.state["peak"] == 2
+        assert elapsed < 0.55
+        results = [message for message in chat_model.messages[1] if message["role"] == "tool"]
+        assert [(message["tool_call_id"], message["content"]) for message in results] == [
+            ("call-0", "read 0.3"), ("call-1", "read 0.1"), ("call-2", "read 0.2")
+        ]
+
+    def test_read_only_calls_start_while_response_streams(self):
+        class _ReadOnlyEchoTool(_EchoTool):
+            @property
+            def read_only(self):
+                return True
+
+        events = []
+        tool = _ReadOnlyEchoTool(events)
+        chat_model = _SlowStreamChatModel([
+            [
+                _tool_call_delta(0, name="echo", arguments='{"text": '),
+                _tool_call_delta(0, arguments='"hi"}'),
+                _tool_call_delta(1, id="call-1", name="echo", arguments='{"text": "there"}'),
+                _delta(content="Still streaming."),
+            ],
+            [_delta(content="Done.")],
+        ])
+
+        _run_loop(chat_model, tool, events)
+
+        # both calls started before the rest of the response arrived
+        assert events[:3] == ["tool", "tool", MarkdownPartData(content="Still streaming.")]
+        assert tool.calls == [{"text": "hi"}, {"text": "there"}]
+        results = [message for message in chat_model.messages[1] if message["role"] == "tool"]
+        assert [message["content"] for message in results] == ["echo: hi", "echo: there"]
+        # a call streamed without id gets one its result refers to
+        tool_call_ids = [tool_call["id"] for tool_call in chat_model.messages[1][1]["tool_calls"]]
+        assert [message["tool_call_id"] for message in results] == tool_call_ids
+
+    def test_state_changing_and_confirmed_calls_run_alone(self):
+        state = {"running": 0, "peak": 0}
+        read, write, confirmed = _SleepTool("read", state=state), _SleepTool("write", read_only=False, state=state), _SleepTool("confirmed", confirm=True, state=state)
+        chat_model = _StreamingChatModel([
+            _tool_calls_round(("read", 0.05), ("write", 0.05), ("read", 0.05), ("confirmed", 0.05), ("read", 0.05)),
+            [_delta(content="Done.")],
+        ])
+
+        _run_tools_loop(chat_model, [read, write, confirmed], [])
+
+        assert state["peak"] == 1
+        results = [message["content"] for message in chat_model.messages[1] if message["role"] == "tool"]
+        assert results == ["read 0.05", "write 0.05", "read 0.05", "confirmed 0.05", "read 0.05"]
+
+    def test_error_of_concurrent_call(self):
+        class _FailingTool(_SleepTool):
+            async def handle_tool_call(self, request, response, tool_context, tool_args):
+                raise ValueError("failed")
+
+        events = []
+        chat_model = _StreamingChatModel([_tool_calls_round(("read", 0.05), ("fail", 0))])
+
+        _run_tools_loop(chat_model, [_SleepTool("read"), _FailingTool("fail")], events)
+
+        assert "problem generating response with tools" in events[-2].content
+        assert events[-1] == "finish"
+
+
+class _SmallContextChatModel(_StreamingChatModel):
+    @property
+    def context_window(self):
+        return 1000
+
+
+class _LinesTool(Tool):
+    @property
+    def name(self):
+        return "lines"
+
+    @property
+    def schema(self):
+        return {"type": "function", "function": {"name": "lines", "parameters": {"type": "object", "properties": {"count": {"type": "integer"}}}}}
+
+    async def handle_tool_call(self, request, response, tool_context, tool_args):
+        return "\n".join(f"line {i}" for i in range(1, tool_args["count"] + 1))
+
+
+def _lines_round(id, count):
+    return [_delta(tool_calls=[{"index": 0, "id": id, "type": "function", "function": {"name": "lines", "arguments": json.dumps({"count": count})}}])]
+
+
+def _handle(content):
+    return content.split("stored as '")[1].split("'")[0]
+
+
+def _echo_round(id, text):
+    return [_delta(tool_calls=[{"index": 0, "id": id, "type": "function", "function": {"name": "echo", "arguments": json.dumps({"text": text})}}])]
+
+
+class TestToolCallRounds:
+    def test_stops_after_max_rounds(self):
+        events = []
+        tool = _EchoTool(events)
+        chat_model = _StreamingChatModel([_echo_round("call-1", "a"), _echo_round("call-2", "b"), [_delta(content="Done.")]])
+
+        with patch.object(ChatParticipant, "max_tool_call_rounds", 2):
+            _run_loop(chat_model, tool, events)
+
+        assert tool.calls == [{"text": "a"}, {"text": "b"}]
+        assert len(chat_model.messages) == 2
+        assert "Stopped after 2 rounds" in events[-2].content
+        assert events[-1] == "finish"
+
+    def test_compacts_tool_results_of_earlier_rounds(self):
+        events = []
+        long_text = "word " * 1000
+        chat_model = _SmallContextChatModel([_echo_round("call-1", long_text), _echo_round("call-2", long_text), [_delta(content="Done.")]])
+
+        _run_loop(chat_model, _EchoTool(events), events)
+
+        # the result of the latest round is kept
+        assert chat_model.messages[1][2]["content"] == f"echo: {long_text}"
+        first_result, second_result = [message for message in chat_model.messages[2] if message["role"] == "tool"]
+        assert first_result["tool_call_id"] == "call-1"
+        assert first_result["content"].startswith("[Result of an earlier tool call, removed to save context. It is stored as")
+        # the full result can be read again
+        assert tool_result_store.get(_handle(first_result["content"])) == f"echo: {long_text}"
+        assert second_result["content"] == f"echo: {long_text}"
+        assert events[-1] == "finish"
+
+    def test_compacted_truncated_result_is_read_back(self):
+        events = []
+
+        def _read_compacted_result(messages):
+            stub = next(message["content"] for message in messages if message["role"] == "tool" and "removed to save context" in message["content"])
+            arguments = json.dumps({"handle": _handle(stub), "start_line": 1500, "line_count": 2})
+            return [_delta(tool_calls=[{"index": 0, "id": "call-3", "type": "function", "function": {"name": "read_tool_result", "arguments": arguments}}])]
+
+        chat_model = _SmallContextChatModel([_lines_round("call-1", 3000), _lines_round("call-2", 3000), _read_compacted_result, [_delta(content="Done.")]])
+        with patch.object(ChatParticipant, "tool_result_token_budget", 500):
+            _run_loop(chat_model, _LinesTool(), events)
+
+        # truncated in the first round, compacted in the third keeping the handle of the full result
+        truncated = chat_model.messages[1][-1]["content"]
+        assert "omitted" in truncated
+        stub = chat_model.messages[2][2]["content"]
+        assert _handle(stub) == _handle(truncated)
+        assert "(3000 lines)" in stub
+        assert chat_model.messages[3][-1]["content"] == "line 1500\nline 1501\n[lines 1500-1501 of 3000, continue with start_line=1502]"
+        assert events[-1] == "finish"
+
+
+class TestToolResultTruncation:
+    def test_long_result_is_truncated_and_paged(self):
+        class _PagingChatModel(_StreamingChatModel):
+            """Reads two of the omitted lines named in the truncated result"""
+            async def acompletions(self, messages, tools=None, cancel_token=None, options={}):
+                self.messages.append([message.copy() for message in messages])
+                parts = self._rounds.pop(0)
+                if parts is None:
+                    truncated = messages[-1]["content"]
+                    handle = truncated.split("stored as '")[1].split("'")[0]
+                    start_line = int(truncated.split("start_line=")[1].split(" ")[0])
+                    arguments = json.dumps({"handle": handle, "start_line": start_line, "line_count": 2})
+                    parts = [_delta(tool_calls=[{"index": 0, "id": "call-2", "type": "function", "function": {"name": "read_tool_result", "arguments": arguments}}])]
+                for part in parts:
+                    yield part
+
+        events = []
+        lines = "\n".join(f"line {i}" for i in range(1, 3001))
+        chat_model = _PagingChatModel([_echo_round("call-1", lines), None, [_delta(content="Done.")]])
+
+        with patch.object(ChatParticipant, "tool_result_token_budget", 500):
+            _run_loop(chat_model, _EchoTool(events), events)
+
+        truncated = chat_model.messages[1][-1]["content"]
+        assert truncated.startswith("echo: line 1\n")
+        assert truncated.endswith("\nline 3000")
+        start_line = int(truncated.split("start_line=")[1].split(" ")[0])
+        assert chat_model.messages[2][-1]["content"] == f"line {start_line}\nline {start_line + 1}\n[lines {start_line}-{start_line + 1} of 3000, continue with start_line={start_line + 2}]"
+        assert events[-1] == "finish"
+
+    def test_omitted_lines_are_read_after_compaction(self):
+        events = []
+
+        def _read_omitted_lines(messages):
+            # the model follows the note of the first truncated result, which is compacted by now
+            truncated = chat_model.messages[1][-1]["content"]
+            start_line = int(truncated.split("start_line=")[1].split(" ")[0])
+            arguments = json.dumps({"handle": _handle(truncated), "start_line": start_line, "line_count": 1})
+            return [_delta(tool_calls=[{"index": 0, "id": "call-4", "type": "function", "function": {"name": "read_tool_result", "arguments": arguments}}])]
+
+        chat_model = _SmallContextChatModel([
+            _lines_round("call-1", 3000), _lines_round("call-2", 3000), _lines_round("call-3", 3000),
+            _read_omitted_lines, [_delta(content="Done.")],
+        ])
+        with patch.object(ChatParticipant, "tool_result_token_budget", 500):
+            _run_loop(chat_model, _LinesTool(), events)
+
+        start_line = int(chat_model.messages[1][-1]["content"].split("start_line=")[1].split(" ")[0])
+        results = {message["tool_call_id"]: message["content"] for message in chat_model.messages[4] if message["role"] == "tool"}
+        # results before the latest round were compacted
+        assert all("removed to save context" in results[id] for id in ["call-1", "call-2", "call-3"])
+        assert results["call-4"] == f"line {start_line}\n[lines {start_line}-{start_line} of 3000, continue with start_line={start_line + 1}]"
+        assert events[-1] == "finish"
+
+    def test_tool_result_token_budget_of_tool(self):
+        class _SmallResultTool(_EchoTool):
+            @property
+            def result_token_budget(self):
+                return 300
+
+        events = []
+        chat_model = _StreamingChatModel([_echo_round("call-1", "word\n" * 1000), [_delta(content="Done.")]])
+
+        _run_loop(chat_model, _SmallResultTool(events), events)
+
+        assert "omitted" in chat_model.messages[1][-1]["content"]
+        assert len(chat_model.messages[1][-1]["content"]) < 1500
+
+
+class TestReadOnlyTools:
+    def test_built_in_read_only_tools(self):
+        from notebook_intelligence.built_in_toolsets import get_cell_output, read_file, write_to_file
+
+        assert get_cell_output.read_only and read_file.read_only
+        assert not write_to_file.read_only
+
+    def test_built_in_read_only_tools_do_not_block_the_loop(self):
+        from notebook_intelligence import built_in_toolsets
+
+        def _blocking_read(file_path, start_line, end_line):
+            time.sleep(0.3)
+            return f"Content of '{file_path}'"
+
+        chat_model = _StreamingChatModel([
+            [
+                _tool_call_delta(0, id="call-0", name="read_file", arguments='{"file_path": "a.py"}'),
+                _tool_call_delta(1, id="call-1", name="read_file", arguments='{"file_path": "b.py"}'),
+            ],
+            [_delta(content="Done.")],
+        ])
+        # approved, so that the calls run concurrently
+        with patch.object(built_in_toolsets, "_read_file", _blocking_read), patch.object(built_in_toolsets.read_file, "_auto_approve", True), \
+                patch.object(ChatParticipant, "tool_call_concurrency", 2):
+            started_at = time.monotonic()
+            _run_tools_loop(chat_model, [built_in_toolsets.read_file], [])
+            elapsed = time.monotonic() - started_at
+
+        results = [message["content"] for message in chat_model.messages[1] if message["role"] == "tool"]
+        assert results == ["Content of 'a.py'", "Content of 'b.py'"]
+        assert elapsed < 0.55
+
+    def test_mcp_read_only_hint(self):
+        server = MCPServerImpl(Mock(), "server")
+        server._mcp_tools = [
+            SimpleNamespace(name="query", description="", inputSchema={}, annotations=SimpleNamespace(readOnlyHint=True)),
+            SimpleNamespace(name="update", description="", inputSchema={}, annotations=None),
+        ]
+
+        assert [tool.read_only for tool in server.get_tools()] == [True, False]
@@ -0,0 +1,115 @@
+"""Tests for the store of truncated tool call results."""
+
+from unittest.mock import patch
+
+from notebook_intelligence.tokenizer import tokenizer
+from notebook_intelligence.tool_result_store import ToolResultStore
+
+
+def _lines(count):
+    return "\n".join(f"line {i}: {'x' * 40}" for i in range(1, count + 1))
+
+
+def _handle(truncated):
+    return truncated.split("stored as '")[1].split("'")[0]
+
+
+class TestTruncate:
+    def test_content_within_budget_is_kept(self):
+        store = ToolResultStore()
+        content = _lines(10)
+
+        assert store.truncate(content, 1000) == content
+        assert store.truncate(content, 0) == content
+        assert store.size == 0
+
+    def test_keeps_leading_and_trailing_lines(self):
+        store = ToolResultStore()
+        content = _lines(1000)
+
+        truncated = store.truncate(content, 500)
+
+        assert tokenizer.count_tokens(truncated) <= 500
+        lines = truncated.split("\n")
+        assert lines[0] == content.split("\n")[0]
+        assert lines[-1] == "line 1000: " + "x" * 40
+        # whole lines are kept, leading lines get most of the budget
+        note_index = next(i for i, line in enumerate(lines) if "omitted" in line)
+        assert note_index > len(lines) - note_index - 1
+        assert all(line.startswith("line ") for line in lines[:note_index] + lines[note_index + 1:])
+        first_omitted = int(lines[note_index - 1].split(":")[0].split()[1]) + 1
+        assert f"lines {first_omitted}-" in lines[note_index]
+        assert store.get(_handle(truncated)) == content
+
+    def test_long_first_line_is_cut(self):
+        store = ToolResultStore()
+        content = "data:image/png;base64," + "A" * 50000 + "\nend"
+
+        truncated = store.truncate(content, 300)
+
+        assert tokenizer.count_tokens(truncated) <= 300
+        assert truncated.startswith("data:image/png;base64,AAA")
+        assert "lines 1-1 of 2 omitted" in truncated
+        assert truncated.endswith("\nend")
+
+    def test_least_recently_used_results_are_dropped(self):
+        store = ToolResultStore()
+        with patch.object(ToolResultStore, "max_size", 250):
+            first = store.put("a" * 100)
+            second = store.put("b" * 100)
+            store.get(first)
+            third = store.put("c" * 100)
+
+        assert store.get(second) is None
+        assert store.get(first) == "a" * 100
+        assert store.get(third) == "c" * 100
+        assert store.size == 200
+
+
+class TestCompact:
+    def test_truncated_result_keeps_its_handle(self):
+        store = ToolResultStore()
+        content = _lines(1000)
+        truncated = store.truncate(content, 500)
+
+        stub = store.compact(truncated)
+
+        assert _handle(stub) == _handle(truncated)
+        assert "(1000 lines)" in stub
+
+    def test_other_content_is_stored(self):
+        store = ToolResultStore()
+        content = _lines(5)
+
+        stub = store.compact(content)
+
+        assert store.get(_handle(stub)) == content
+        assert "(5 lines)" in stub
+
+
+class TestReadLines:
+    def test_pages_through_result(self):
+        store = ToolResultStore()
+        handle = store.put(_lines(30))
+
+        page = store.read_lines(handle, 11, 10, 1000)
+
+        assert page.split("\n")[0].startswith("line 11:")
+        assert page.split("\n")[-1] == "[lines 11-20 of 30, continue with start_line=21]"
+        assert store.read_lines(handle, 21, 100, 1000).split("\n")[-1] == "[lines 21-30 of 30]"
+
+    def test_page_is_limited_to_token_budget(self):
+        store = ToolResultStore()
+        handle = store.put(_lines(1000))
+
+        page = store.read_lines(handle, 1, 1000, 400)
+
+        assert tokenizer.count_tokens(page) <= 400
+        assert "continue with start_line=" in page
+
+    def test_errors(self):
+        store = ToolResultStore()
+        handle = store.put(_lines(3))
+
+        assert store.read_lines("result-missing", 1, 10, 0).startswith("Error! No stored tool result")
+        assert store.read_lines(handle, 5, 10, 0).startswith("Error! start_line 5 is beyond the last line 3")
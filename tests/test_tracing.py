@@ -0,0 +1,161 @@
+"""Tests for request tracing spans, sampling and span exporters."""
+
+import json
+import threading
+from unittest.mock import Mock, patch
+
+import pytest
+
+from notebook_intelligence.request_scheduler import RequestLane, RequestScheduler
+from notebook_intelligence.tracing import NON_RECORDING_SPAN, JsonlSpanExporter, OTLPSpanExporter, Tracer
+
+
+class _MemoryExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def exporter():
+    return _MemoryExporter()
+
+
+@pytest.fixture
+def tracer(exporter):
+    tracer = Tracer()
+    tracer.configure(1.0, [exporter])
+    return tracer
+
+
+class TestTracer:
+    def test_nested_spans_share_trace(self, tracer, exporter):
+        with tracer.span("request", chat_mode="agent") as root:
+            with tracer.span("provider.completions") as child:
+                child.set_attribute("output_tokens", 12)
+        tracer.flush()
+
+        assert [span.name for span in exporter.spans] == ["provider.completions", "request"]
+        assert child.trace_id == root.trace_id
+        assert child.parent_id == root.span_id
+        assert root.parent_id is None
+        assert root.attributes == {"chat_mode": "agent"}
+        assert child.attributes == {"output_tokens": 12}
+        assert root.start_time <= child.start_time <= child.end_time <= root.end_time
+
+    def test_error_recorded(self, tracer, exporter):
+        with pytest.raises(ValueError):
+            with tracer.span("tool.call"):
+                raise ValueError("failed")
+        tracer.flush()
+
+        assert exporter.spans[0].error == "ValueError: failed"
+
+    def test_unsampled_trace_records_nothing(self, exporter):
+        tracer = Tracer()
+        tracer.configure(0.5, [exporter])
+        with patch("random.random", return_value=0.9):
+            with tracer.span("request") as root:
+                with tracer.span("provider.completions") as child:
+                    child.set_attribute("output_tokens", 12)
+        tracer.record_span("scheduler.queued", 0.1)
+        tracer.flush()
+
+        assert root is NON_RECORDING_SPAN
+        assert child is NON_RECORDING_SPAN
+        assert exporter.spans == []
+
+    def test_disabled_without_exporters(self):
+        tracer = Tracer()
+        tracer.configure(1.0, [])
+        assert not tracer.enabled
+        with tracer.span("request") as span:
+            assert span is NON_RECORDING_SPAN
+
+    def test_failing_exporter_does_not_block_others(self, exporter):
+        failing_exporter = Mock()
+        failing_exporter.export.side_effect = OSError("unreachable")
+        tracer = Tracer()
+        tracer.configure(1.0, [failing_exporter, exporter])
+        with tracer.span("request"):
+            pass
+        tracer.flush()
+
+        assert len(exporter.spans) == 1
+
+    def test_pending_spans_are_bounded(self, tracer, exporter):
+        with patch.object(Tracer, "max_pending_spans", 2):
+            for _ in range(3):
+                with tracer.span("request"):
+                    pass
+        tracer.flush()
+
+        assert len(exporter.spans) == 2
+        assert tracer.dropped == 1
+
+
+class TestScheduledRequestTracing:
+    def test_scheduled_request_continues_trace(self, tracer, exporter):
+        scheduler = RequestScheduler(chat_workers=1, interactive_workers=1)
+        done = threading.Event()
+
+        async def _request():
+            with tracer.span("chat.handle_request"):
+                pass
+
+        with patch("notebook_intelligence.request_scheduler.tracer", tracer):
+            with tracer.span("websocket.on_message") as root:
+                scheduler.submit(_request(), lane=RequestLane.Chat, on_done=done.set)
+            assert done.wait(5)
+        scheduler.stop()
+        tracer.flush()
+
+        spans = {span.name: span for span in exporter.spans}
+        assert set(spans.keys()) == {"websocket.on_message", "scheduler.queued", "chat.handle_request"}
+        assert spans["scheduler.queued"].attributes == {"lane": "chat"}
+        for name in ["scheduler.queued", "chat.handle_request"]:
+            assert spans[name].trace_id == root.trace_id
+            assert spans[name].parent_id == root.span_id
+
+
+class TestSpanExporters:
+    def test_jsonl_exporter(self, tracer, tmp_path):
+        trace_file = tmp_path / "traces" / "nbi.jsonl"
+        tracer.configure(1.0, [JsonlSpanExporter(str(trace_file))])
+        with tracer.span("request", participant="default"):
+            pass
+        with tracer.span("request"):
+            pass
+        tracer.flush()
+
+        records = [json.loads(line) for line in trace_file.read_text().splitlines()]
+        assert len(records) == 2
+        assert records[0]["name"] == "request"
+        assert records[0]["attributes"] == {"participant": "default"}
+        assert records[0]["duration_ms"] >= 0
+        assert records[0]["trace_id"] != records[1]["trace_id"]
+
+    def test_otlp_exporter(self, tracer, exporter):
+        with tracer.span("request"):
+            with tracer.span("tool.call", tool="search", confirmed=True, tokens=3, ratio=0.5):
+                pass
+        tracer.flush()
+        child, root = exporter.spans
+
+        otlp_exporter = OTLPSpanExporter("http://localhost:4318/")
+        with patch("notebook_intelligence.tracing.requests.post") as post:
+            otlp_exporter.export([child, root])
+
+        assert post.call_args.args[0] == "http://localhost:4318/v1/traces"
+        spans = post.call_args.kwargs["json"]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        assert spans[0]["parentSpanId"] == root.span_id
+        assert "parentSpanId" not in spans[1]
+        assert spans[0]["startTimeUnixNano"] == str(child.start_time)
+        assert spans[0]["attributes"] == [
+            {"key": "tool", "value": {"stringValue": "search"}},
+            {"key": "confirmed", "value": {"boolValue": True}},
+            {"key": "tokens", "value": {"intValue": "3"}},
+            {"key": "ratio", "value": {"doubleValue": 0.5}},
+        ]
@@ -1,11 +1,21 @@
+import asyncio
 import pytest
 import json
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch, MagicMock
 from tornado.httputil import HTTPServerRequest
 from tornado.web import Application
-from notebook_intelligence.extension import WebsocketCopilotHandler
+from notebook_intelligence.extension import DetachedRequests, WebsocketCopilotHandler
 from notebook_intelligence.context_factory import RuleContextFactory
 from notebook_intelligence.ruleset import RuleContext
+from notebook_intelligence.request_scheduler import RequestLane, RequestRejectedError
+
+
+def _close_submitted(mock_scheduler):
+    """Close coroutines handed to the mocked scheduler, they never run."""
+    for call in mock_scheduler.submit.call_args_list:
+        coro = call[0][0]
+        if asyncio.iscoroutine(coro):
+            coro.close()
 
 
 class TestWebsocketHandlerIntegration:
@@ -24,7 +34,7 @@ class TestWebsocketHandlerIntegration:
     
     def test_init_with_default_context_factory(self):
         """Test WebsocketCopilotHandler initialization with default context factory."""
-        with patch('notebook_intelligence.extension.ThreadSafeWebSocketConnector'), \
+        with patch('notebook_intelligence.extension.websocket_hub'), \
              patch('notebook_intelligence.extension.ai_service_manager') as mock_ai_manager, \
              patch('notebook_intelligence.extension.github_copilot') as mock_copilot:
             handler = WebsocketCopilotHandler(
@@ -39,7 +49,7 @@ class TestWebsocketHandlerIntegration:
         """Test WebsocketCopilotHandler initialization with custom context factory."""
         mock_factory = Mock(spec=RuleContextFactory)
         
-        with patch('notebook_intelligence.extension.ThreadSafeWebSocketConnector'), \
+        with patch('notebook_intelligence.extension.websocket_hub'), \
              patch('notebook_intelligence.extension.ai_service_manager') as mock_ai_manager, \
              patch('notebook_intelligence.extension.github_copilot') as mock_copilot:
             handler = WebsocketCopilotHandler(
@@ -52,8 +62,8 @@ class TestWebsocketHandlerIntegration:
     
     @patch('notebook_intelligence.extension.ai_service_manager')
     @patch('notebook_intelligence.extension.NotebookIntelligence')
-    @patch('notebook_intelligence.extension.threading.Thread')
-    def test_on_message_chat_request_creates_context(self, mock_thread, mock_nb_intel, mock_ai_manager):
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_on_message_chat_request_creates_context(self, mock_scheduler, mock_nb_intel, mock_ai_manager):
         """Test that ChatRequest message creates RuleContext."""
         # Setup mocks
         mock_nb_intel.root_dir = "/workspace"
@@ -63,7 +73,7 @@ class TestWebsocketHandlerIntegration:
         mock_context = Mock(spec=RuleContext)
         mock_factory.create.return_value = mock_context
         
-        with patch('notebook_intelligence.extension.ThreadSafeWebSocketConnector'):
+        with patch('notebook_intelligence.extension.websocket_hub'):
             handler = WebsocketCopilotHandler(
                 self._create_mock_application(),
                 self._create_mock_request(),
@@ -96,22 +106,16 @@ class TestWebsocketHandlerIntegration:
             root_dir='/workspace'
         )
         
-        # Verify thread was started
-        mock_thread.assert_called_once()
-        
-        # Verify the ChatRequest was created with rule_context
-        thread_call_args = mock_thread.call_args[1]['args']
-        chat_request_call = thread_call_args[0]
-        
-        # The chat request should be passed to handle_chat_request
-        # We can't easily inspect the ChatRequest object, but we can verify
-        # that the thread was created with the right target
-        assert mock_thread.call_args[1]['target'] is not None
+        # Verify request was scheduled on the chat lane
+        mock_scheduler.submit.assert_called_once()
+        assert mock_scheduler.submit.call_args[1]['lane'] == RequestLane.Chat
+        assert mock_scheduler.submit.call_args[1]['cancel_token'] is handler._messageCallbackHandlers['test-message-id'].cancel_token
+        _close_submitted(mock_scheduler)
     
     @patch('notebook_intelligence.extension.ai_service_manager')
     @patch('notebook_intelligence.extension.NotebookIntelligence')
-    @patch('notebook_intelligence.extension.threading.Thread')
-    def test_on_message_generate_code_creates_context(self, mock_thread, mock_nb_intel, mock_ai_manager):
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_on_message_generate_code_creates_context(self, mock_scheduler, mock_nb_intel, mock_ai_manager):
         """Test that GenerateCode message creates RuleContext."""
         # Setup mocks
         mock_nb_intel.root_dir = "/workspace"
@@ -121,7 +125,7 @@ class TestWebsocketHandlerIntegration:
         mock_context = Mock(spec=RuleContext)
         mock_factory.create.return_value = mock_context
         
-        with patch('notebook_intelligence.extension.ThreadSafeWebSocketConnector'):
+        with patch('notebook_intelligence.extension.websocket_hub'):
             handler = WebsocketCopilotHandler(
                 self._create_mock_application(),
                 self._create_mock_request(),
@@ -154,13 +158,14 @@ class TestWebsocketHandlerIntegration:
             root_dir='/workspace'
         )
         
-        # Verify thread was started
-        mock_thread.assert_called_once()
+        # Verify request was scheduled
+        mock_scheduler.submit.assert_called_once()
+        _close_submitted(mock_scheduler)
     
     @patch('notebook_intelligence.extension.ai_service_manager')
     @patch('notebook_intelligence.extension.NotebookIntelligence')
-    @patch('notebook_intelligence.extension.threading.Thread')
-    def test_on_message_agent_mode_creates_context(self, mock_thread, mock_nb_intel, mock_ai_manager):
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_on_message_agent_mode_creates_context(self, mock_scheduler, mock_nb_intel, mock_ai_manager):
         """Test that agent mode ChatRequest creates proper context."""
         # Setup mocks
         mock_nb_intel.root_dir = "/workspace"
@@ -170,7 +175,7 @@ class TestWebsocketHandlerIntegration:
         mock_context = Mock(spec=RuleContext)
         mock_factory.create.return_value = mock_context
         
-        with patch('notebook_intelligence.extension.ThreadSafeWebSocketConnector'):
+        with patch('notebook_intelligence.extension.websocket_hub'):
             handler = WebsocketCopilotHandler(
                 self._create_mock_application(),
                 self._create_mock_request(),
@@ -207,16 +212,17 @@ class TestWebsocketHandlerIntegration:
             root_dir='/workspace'
         )
         
-        # Verify thread was started
-        mock_thread.assert_called_once()
+        # Verify request was scheduled
+        mock_scheduler.submit.assert_called_once()
+        _close_submitted(mock_scheduler)
 
     @patch('notebook_intelligence.extension.ai_service_manager')
     @patch('notebook_intelligence.extension.NotebookIntelligence')
-    @patch('notebook_intelligence.extension.threading.Thread')
-    def test_on_message_additional_context_includes_file_contents(self, mock_thread, mock_nb_intel, mock_ai_manager):
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_on_message_additional_context_includes_file_contents(self, mock_scheduler, mock_nb_intel, mock_ai_manager):
         """Test that additional context file contents are forwarded into chat history."""
         mock_nb_intel.root_dir = "/workspace"
-        mock_ai_manager.handle_chat_request = Mock()
+        mock_ai_manager.handle_chat_request = AsyncMock()
         mock_ai_manager.is_claude_code_mode = False
         mock_ai_manager.chat_model = Mock()
         mock_ai_manager.chat_model.context_window = 4096
@@ -224,7 +230,7 @@ class TestWebsocketHandlerIntegration:
         mock_factory = Mock(spec=RuleContextFactory)
         mock_factory.create.return_value = Mock(spec=RuleContext)
 
-        with patch('notebook_intelligence.extension.ThreadSafeWebSocketConnector'):
+        with patch('notebook_intelligence.extension.websocket_hub'):
             handler = WebsocketCopilotHandler(
                 self._create_mock_application(),
                 self._create_mock_request(),
@@ -255,6 +261,10 @@ class TestWebsocketHandlerIntegration:
 
         handler.on_message(json.dumps(message))
 
+        # chat history is assembled by the scheduled request
+        mock_ai_manager.handle_chat_request.assert_not_called()
+        asyncio.run(mock_scheduler.submit.call_args[0][0])
+
         mock_ai_manager.handle_chat_request.assert_called_once()
         chat_request = mock_ai_manager.handle_chat_request.call_args[0][0]
 
@@ -264,3 +274,329 @@ class TestWebsocketHandlerIntegration:
         assert "File contents:" in context_message
         assert 'def greet()' in context_message
         assert 'return "hi"' in context_message
+
+    @patch('notebook_intelligence.extension.ai_service_manager')
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_on_message_inline_completion_uses_interactive_lane(self, mock_scheduler, mock_ai_manager):
+        """Inline completions are scheduled on the dedicated interactive lane."""
+        with patch('notebook_intelligence.extension.websocket_hub'):
+            handler = WebsocketCopilotHandler(
+                self._create_mock_application(),
+                self._create_mock_request()
+            )
+
+        message = {
+            'id': 'test-message-id',
+            'type': 'inline-completion-request',
+            'data': {
+                'chatId': 'test-chat-id',
+                'prefix': 'def ',
+                'suffix': '',
+                'language': 'python',
+                'filename': 'script.py'
+            }
+        }
+
+        handler.on_message(json.dumps(message))
+
+        mock_scheduler.submit.assert_called_once()
+        assert mock_scheduler.submit.call_args[1]['lane'] == RequestLane.Interactive
+        _close_submitted(mock_scheduler)
+
+    @patch('notebook_intelligence.extension.ai_service_manager')
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_on_message_inline_completion_supersedes_previous_request(self, mock_scheduler, mock_ai_manager):
+        """A newer inline completion request for the same document cancels the previous one."""
+        with patch('notebook_intelligence.extension.websocket_hub'):
+            handler = WebsocketCopilotHandler(
+                self._create_mock_application(),
+                self._create_mock_request()
+            )
+
+        def _message(message_id, filename, prefix):
+            return json.dumps({
+                'id': message_id,
+                'type': 'inline-completion-request',
+                'data': {
+                    'chatId': 'test-chat-id',
+                    'prefix': prefix,
+                    'suffix': '',
+                    'language': 'python',
+                    'filename': filename
+                }
+            })
+
+        handler.on_message(_message('first', 'script.py', 'de'))
+        handler.on_message(_message('other-file', 'other.py', 'im'))
+        handler.on_message(_message('second', 'script.py', 'def'))
+
+        cancel_tokens = [call[1]['cancel_token'] for call in mock_scheduler.submit.call_args_list]
+        assert [token.is_cancel_requested for token in cancel_tokens] == [True, False, False]
+        _close_submitted(mock_scheduler)
+
+    @patch('notebook_intelligence.extension.ai_service_manager')
+    @patch('notebook_intelligence.extension.NotebookIntelligence')
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_on_message_rejected_request_finishes_stream(self, mock_scheduler, mock_nb_intel, mock_ai_manager):
+        """A request rejected by admission control is finished immediately with an error."""
+        mock_nb_intel.root_dir = "/workspace"
+        mock_ai_manager.handle_chat_request = Mock()
+        mock_scheduler.submit.side_effect = RequestRejectedError("Server is busy")
+
+        with patch('notebook_intelligence.extension.websocket_hub'):
+            handler = WebsocketCopilotHandler(
+                self._create_mock_application(),
+                self._create_mock_request(),
+                context_factory=Mock(spec=RuleContextFactory)
+            )
+        handler.write_message = Mock()
+
+        message = {
+            'id': 'test-message-id',
+            'type': 'chat-request',
+            'data': {
+                'chatId': 'test-chat-id',
+                'prompt': 'Test prompt',
+                'language': 'python',
+                'filename': 'test.ipynb',
+                'chatMode': 'ask',
+                'toolSelections': {},
+                'additionalContext': []
+            }
+        }
+
+        handler.on_message(json.dumps(message))
+
+        sent_types = [call[0][0]['type'] for call in handler.write_message.call_args_list]
+        assert sent_types == ['stream-message', 'stream-end']
+        error_content = handler.write_message.call_args_list[0][0][0]['data']['choices'][0]['delta']['nbiContent']['content']
+        assert "Server is busy" in error_content
+        _close_submitted(mock_scheduler)
+
+    @pytest.mark.parametrize("requested, negotiated", [("2", 2), ("1", 1), ("99", 2), ("abc", 1)])
+    def test_open_negotiates_stream_protocol(self, requested, negotiated):
+        """Clients opt in to the compact stream protocol with a query argument."""
+        with patch('notebook_intelligence.extension.websocket_hub'), \
+             patch('notebook_intelligence.extension.ai_service_manager'):
+            handler = WebsocketCopilotHandler(
+                self._create_mock_application(),
+                self._create_mock_request()
+            )
+        assert handler.protocol_version == 1
+
+        handler.get_query_argument = Mock(return_value=requested)
+        handler.open()
+
+        assert handler.protocol_version == negotiated
+
+    @patch('notebook_intelligence.extension.ai_service_manager')
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_completed_request_releases_its_handlers(self, mock_scheduler, mock_ai_manager):
+        """Callback handlers of a request are dropped once the scheduler is done with it."""
+        with patch('notebook_intelligence.extension.websocket_hub'):
+            handler = WebsocketCopilotHandler(
+                self._create_mock_application(),
+                self._create_mock_request()
+            )
+
+        handler.on_message(json.dumps({
+            'id': 'test-message-id',
+            'type': 'inline-completion-request',
+            'data': {'chatId': 'test-chat-id', 'prefix': 'def ', 'suffix': '', 'language': 'python', 'filename': 'script.py'}
+        }))
+        assert 'test-message-id' in handler._messageCallbackHandlers
+
+        mock_scheduler.submit.call_args[1]['on_done']()
+
+        assert handler._messageCallbackHandlers == {}
+        assert handler._inline_completion_requests == {}
+        _close_submitted(mock_scheduler)
+
+    @patch('notebook_intelligence.extension.ai_service_manager')
+    @patch('notebook_intelligence.extension.NotebookIntelligence')
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_on_close_cancels_requests_and_releases_state(self, mock_scheduler, mock_nb_intel, mock_ai_manager):
+        """Closing the connection cancels its in-flight requests and drops their state."""
+        mock_nb_intel.root_dir = "/workspace"
+        handler = self._create_handler()
+
+        handler.on_message(self._chat_request_message('chat-message-id'))
+        handler.chat_history.add_message('test-chat-id', {'role': 'user', 'content': 'Test prompt'})
+        handlers = handler._messageCallbackHandlers['chat-message-id']
+
+        # resuming disabled
+        with patch('notebook_intelligence.extension.detached_requests', DetachedRequests(timeout=0)):
+            handler.on_close()
+
+        assert handlers.cancel_token.is_cancel_requested
+        assert handlers.response_emitter.is_closed
+        assert handler._messageCallbackHandlers == {}
+        assert handler.chat_history.get_history('test-chat-id') == []
+
+        # a request finishing after the close writes nothing and keeps no history
+        with patch('tornado.websocket.WebSocketHandler.write_message') as write_message:
+            handlers.response_emitter.stream({'choices': [{'delta': {'content': 'late'}}]})
+            handlers.response_emitter.finish()
+            write_message.assert_not_called()
+        assert handler.chat_history.get_history('test-chat-id') == []
+        _close_submitted(mock_scheduler)
+
+    def _create_handler(self, user='test-user'):
+        with patch('notebook_intelligence.extension.websocket_hub'):
+            handler = WebsocketCopilotHandler(
+                self._create_mock_application(),
+                self._create_mock_request(),
+                context_factory=Mock(spec=RuleContextFactory)
+            )
+        handler._current_user = user
+        return handler
+
+    def _chat_request_message(self, message_id):
+        return json.dumps({
+            'id': message_id,
+            'type': 'chat-request',
+            'data': {
+                'chatId': 'test-chat-id',
+                'prompt': 'Test prompt',
+                'language': 'python',
+                'filename': 'test.ipynb',
+                'chatMode': 'ask',
+                'toolSelections': {},
+                'additionalContext': []
+            }
+        })
+
+    def _resume_message(self, message_id, last_seq):
+        return json.dumps({'id': message_id, 'type': 'resume-stream', 'data': {'lastSeq': last_seq}})
+
+    @patch('notebook_intelligence.extension.ai_service_manager')
+    @patch('notebook_intelligence.extension.NotebookIntelligence')
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_chat_request_resumed_on_new_connection(self, mock_scheduler, mock_nb_intel, mock_ai_manager):
+        """A chat request of a closed connection keeps running and is resumed by the reconnected client."""
+        mock_nb_intel.root_dir = "/workspace"
+        io_loop = Mock()
+        with patch('notebook_intelligence.extension.detached_requests', DetachedRequests(timeout=60)) as detached, \
+             patch('notebook_intelligence.extension.ioloop.IOLoop.current', return_value=io_loop):
+            handler = self._create_handler()
+            handler.write_message = Mock()
+            handler.on_message(self._chat_request_message('chat-message-id'))
+            handlers = handler._messageCallbackHandlers['chat-message-id']
+            emitter = handlers.response_emitter
+            emitter.stream({'choices': [{'delta': {'content': 'Hello'}}]})
+
+            handler.on_close()
+            # sent while disconnected
+            emitter.stream({'choices': [{'delta': {'content': ' world'}}]})
+
+            assert not handlers.cancel_token.is_cancel_requested
+            assert not emitter.is_closed
+            assert len(detached) == 1
+
+            new_handler = self._create_handler()
+            new_handler.write_message = Mock()
+            new_handler.on_message(self._resume_message('chat-message-id', 0))
+
+            replayed = [call[0][0] for call in new_handler.write_message.call_args_list]
+            assert [m['seq'] for m in replayed] == [1]
+            assert replayed[0]['data']['choices'][0]['delta']['content'] == ' world'
+            assert new_handler._messageCallbackHandlers['chat-message-id'] is handlers
+            assert len(detached) == 0
+            io_loop.remove_timeout.assert_called_once()
+
+            # live output goes to the new connection, completion releases it there
+            emitter.finish()
+            assert new_handler.write_message.call_args[0][0]['type'] == 'stream-end'
+            mock_scheduler.submit.call_args[1]['on_done']()
+            assert new_handler._messageCallbackHandlers == {}
+        _close_submitted(mock_scheduler)
+
+    @patch('notebook_intelligence.extension.ai_service_manager')
+    @patch('notebook_intelligence.extension.NotebookIntelligence')
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_detached_request_cancelled_when_not_resumed(self, mock_scheduler, mock_nb_intel, mock_ai_manager):
+        """A detached request is cancelled once the resume timeout expires."""
+        mock_nb_intel.root_dir = "/workspace"
+        io_loop = Mock()
+        with patch('notebook_intelligence.extension.detached_requests', DetachedRequests(timeout=60)) as detached, \
+             patch('notebook_intelligence.extension.ioloop.IOLoop.current', return_value=io_loop):
+            handler = self._create_handler()
+            handler.on_message(self._chat_request_message('chat-message-id'))
+            handlers = handler._messageCallbackHandlers['chat-message-id']
+            handler.on_close()
+
+            timeout, expire, message_id = io_loop.call_later.call_args[0]
+            assert timeout == 60
+            expire(message_id)
+
+            assert handlers.cancel_token.is_cancel_requested
+            assert handlers.response_emitter.is_closed
+            assert len(detached) == 0
+        _close_submitted(mock_scheduler)
+
+    @patch('notebook_intelligence.extension.ai_service_manager')
+    @patch('notebook_intelligence.extension.NotebookIntelligence')
+    @patch('notebook_intelligence.extension.request_scheduler')
+    def test_resume_request_of_connection_not_yet_closed(self, mock_scheduler, mock_nb_intel, mock_ai_manager):
+        """A client may reconnect before the server notices the old connection is dead."""
+        mock_nb_intel.root_dir = "/workspace"
+        old_handler = self._create_handler()
+        old_handler.write_message = Mock()
+        old_handler.on_message(self._chat_request_message('chat-message-id'))
+        handlers = old_handler._messageCallbackHandlers['chat-message-id']
+        new_handler = self._create_handler()
+        new_handler.write_message = Mock()
+
+        with patch('notebook_intelligence.extension.websocket_hub') as hub:
+            hub.connections.return_value = [old_handler, new_handler]
+            new_handler.on_message(self._resume_message('chat-message-id', -1))
+
+        assert old_handler._messageCallbackHandlers == {}
+        assert new_handler._messageCallbackHandlers['chat-message-id'] is handlers
+        assert handlers.response_emitter.websocket_handler is new_handler
+        _close_submitted(mock_scheduler)
+
+    @pytest.mark.parametrize("user", ['test-user', 'other-user'])
+    def test_resume_unknown_request_ends_stream(self, user):
+        """Expired, unknown or another user's requests can't be resumed."""
+        detached = DetachedRequests(timeout=60)
+        handlers = Mock(done=False)
+        handlers.response_emitter.attach.return_value = 0
+        with patch('notebook_intelligence.extension.ioloop.IOLoop.current'):
+            detached.detach('chat-message-id', handlers, 'other-user')
+
+        with patch('notebook_intelligence.extension.detached_requests', detached), \
+             patch('notebook_intelligence.extension.ioloop.IOLoop.current'), \
+             patch('notebook_intelligence.extension.websocket_hub') as hub:
+            hub.connections.return_value = []
+            handler = self._create_handler(user)
+            handler.write_message = Mock()
+            handler.on_message(self._resume_message('unknown-message-id', -1))
+            handler.on_message(self._resume_message('chat-message-id', -1))
+
+        if user == 'other-user':
+            handlers.response_emitter.attach.assert_called_once()
+            sent = [call[0][0] for call in handler.write_message.call_args_list]
+            assert sent == [{'id': 'unknown-message-id', 'type': 'stream-end', 'data': {'resumeFailed': True}}]
+        else:
+            handlers.response_emitter.attach.assert_not_called()
+            assert handler.write_message.call_count == 2
+            assert len(detached) == 1
+
+    def test_heartbeat_pings(self):
+        """Pings detect dead connections, falling back to the server setting when disabled."""
+        with patch('notebook_intelligence.extension.websocket_hub'), \
+             patch('notebook_intelligence.extension.ai_service_manager'):
+            handler = WebsocketCopilotHandler(
+                self._create_mock_application(),
+                self._create_mock_request()
+            )
+        handler.application.settings = {'websocket_ping_interval': 60}
+
+        with patch.object(WebsocketCopilotHandler, 'heartbeat_interval', 10), \
+             patch.object(WebsocketCopilotHandler, 'heartbeat_timeout', 30):
+            assert handler.ping_interval == 10
+            assert handler.ping_timeout == 10
+
+        with patch.object(WebsocketCopilotHandler, 'heartbeat_interval', 0):
+            assert handler.ping_interval == 60
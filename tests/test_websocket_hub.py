@@ -0,0 +1,198 @@
+"""Tests for routing websocket messages to multiple connections."""
+
+import json
+import threading
+from unittest.mock import Mock, patch
+
+import pytest
+
+from notebook_intelligence.extension import WebsocketCopilotHandler
+from notebook_intelligence.util import WebSocketHub
+
+
+class _FakeIOLoop:
+    def __init__(self):
+        self.callbacks = []
+        self.timers = []
+
+    def add_callback(self, callback, *args):
+        self.callbacks.append((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        self.timers.append((callback, args))
+
+    def run_timers(self):
+        timers, self.timers = self.timers, []
+        for callback, args in timers:
+            callback(*args)
+
+    def run_callbacks(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback, args in callbacks:
+            callback(*args)
+
+
+@pytest.fixture
+def io_loop():
+    io_loop = _FakeIOLoop()
+    with patch("notebook_intelligence.util.ioloop.IOLoop.current", return_value=io_loop):
+        yield io_loop
+
+
+def _written(connection):
+    return [call[0][0] for call in connection.write_message.call_args_list]
+
+
+class TestWebSocketHub:
+    def test_broadcast_reaches_every_connection(self, io_loop):
+        hub = WebSocketHub()
+        connections = [Mock(), Mock()]
+        for connection in connections:
+            hub.register(connection)
+
+        hub.write_message({"type": "mcp-server-status-change", "data": {}})
+        io_loop.run_callbacks()
+
+        for connection in connections:
+            assert [json.loads(message) for message in _written(connection)] == [{"type": "mcp-server-status-change", "data": {}}]
+
+    def test_broadcast_listeners_see_every_broadcast(self, io_loop):
+        hub = WebSocketHub()
+        listener = Mock()
+        failing_listener = Mock(side_effect=RuntimeError("failed"))
+        hub.add_broadcast_listener(failing_listener)
+        hub.add_broadcast_listener(listener)
+
+        # also without connections
+        hub.write_message({"type": "claude-code-status-change", "data": {}})
+
+        listener.assert_called_once_with({"type": "claude-code-status-change", "data": {}})
+
+    def test_broadcasts_batched_and_deduplicated(self, io_loop):
+        hub = WebSocketHub()
+        connection = Mock()
+        hub.register(connection)
+
+        with patch("notebook_intelligence.util.json.dumps", wraps=json.dumps) as dumps:
+            for _ in range(3):
+                hub.write_message({"type": "mcp-server-status-change", "data": {}})
+            hub.write_message({"type": "skills-reloaded", "data": {}})
+
+        # one flush for the whole batch, each event serialized once
+        assert len(io_loop.callbacks) == 1
+        assert dumps.call_count == 4
+        io_loop.run_callbacks()
+        assert [json.loads(message)["type"] for message in _written(connection)] == ["mcp-server-status-change", "skills-reloaded"]
+
+    def test_repeated_earlier_broadcast_is_sent_again(self, io_loop):
+        hub = WebSocketHub()
+        connection = Mock()
+        hub.register(connection)
+
+        for status in ["a", "b", "a"]:
+            hub.write_message({"type": "claude-code-status-change", "data": {"status": status}})
+        io_loop.run_callbacks()
+
+        # clients end on the latest state
+        assert [json.loads(message)["data"]["status"] for message in _written(connection)] == ["a", "b", "a"]
+
+    def test_debounced_broadcasts_merged_per_key(self, io_loop):
+        hub = WebSocketHub()
+        connection = Mock()
+        hub.register(connection)
+
+        hub.write_message_debounced("a", {"type": "mcp-server-status-change", "data": {"server": "a", "status": "connecting"}})
+        hub.write_message_debounced("b", {"type": "mcp-server-status-change", "data": {"server": "b", "status": "connecting"}})
+        hub.write_message_debounced("a", {"type": "mcp-server-status-change", "data": {"server": "a", "status": "updated-tool-list", "tools": []}})
+        hub.write_message_debounced("a", {"type": "mcp-server-status-change", "data": {"server": "a", "status": "updated-prompt-list"}})
+        io_loop.run_callbacks()
+        assert _written(connection) == []
+
+        io_loop.run_timers()
+        io_loop.run_callbacks()
+        assert [json.loads(message)["data"] for message in _written(connection)] == [
+            {"server": "a", "status": "updated-prompt-list", "tools": []},
+            {"server": "b", "status": "connecting"},
+        ]
+
+    def test_debounced_broadcast_before_first_connection_not_delayed(self):
+        hub = WebSocketHub()
+        listener = Mock()
+        hub.add_broadcast_listener(listener)
+
+        hub.write_message_debounced("a", {"type": "claude-code-status-change", "data": {}})
+
+        listener.assert_called_once()
+
+    def test_send_targets_a_single_connection_in_order(self, io_loop):
+        hub = WebSocketHub()
+        owner, other = Mock(), Mock()
+        hub.register(owner)
+        hub.register(other)
+
+        hub.send(owner, {"id": "1", "type": "stream-message"})
+        hub.write_message({"type": "skills-reloaded", "data": {}})
+        hub.send(owner, {"id": "1", "type": "stream-end"})
+        io_loop.run_callbacks()
+
+        owner_messages = _written(owner)
+        assert owner_messages[0] == {"id": "1", "type": "stream-message"}
+        assert json.loads(owner_messages[1])["type"] == "skills-reloaded"
+        assert owner_messages[2] == {"id": "1", "type": "stream-end"}
+        assert len(_written(other)) == 1
+
+    def test_unregistered_connection_gets_no_broadcasts(self, io_loop):
+        hub = WebSocketHub()
+        connection = Mock()
+        hub.register(connection)
+        hub.unregister(connection)
+
+        hub.write_message({"type": "skills-reloaded", "data": {}})
+        io_loop.run_callbacks()
+
+        connection.write_message.assert_not_called()
+        assert hub.connection_count == 0
+
+    def test_failing_connection_does_not_block_others(self, io_loop):
+        hub = WebSocketHub()
+        failing, healthy = Mock(), Mock()
+        failing.write_message.side_effect = RuntimeError("closed")
+        hub.register(failing)
+        hub.register(healthy)
+
+        hub.write_message({"type": "skills-reloaded", "data": {}})
+        io_loop.run_callbacks()
+
+        assert len(_written(healthy)) == 1
+
+
+class TestHandlerRouting:
+    def test_writes_from_worker_threads_go_through_hub(self):
+        mock_hub = Mock()
+        with patch("notebook_intelligence.extension.websocket_hub", mock_hub), \
+             patch("notebook_intelligence.extension.ai_service_manager"):
+            application = Mock()
+            application.ui_methods = {}
+            application.ui_modules = {}
+            handler = WebsocketCopilotHandler(application, Mock())
+
+            worker = threading.Thread(target=handler.write_message, args=({"id": "1", "type": "stream-end"},))
+            worker.start()
+            worker.join()
+
+        mock_hub.send.assert_called_once_with(handler, {"id": "1", "type": "stream-end"})
+
+    def test_open_and_close_register_with_hub(self):
+        mock_hub = Mock()
+        with patch("notebook_intelligence.extension.websocket_hub", mock_hub), \
+             patch("notebook_intelligence.extension.ai_service_manager"):
+            application = Mock()
+            application.ui_methods = {}
+            application.ui_modules = {}
+            handler = WebsocketCopilotHandler(application, Mock())
+            handler.get_query_argument = Mock(return_value="2")
+
+            handler.open()
+            mock_hub.register.assert_called_once_with(handler)
+            handler.on_close()
+            mock_hub.unregister.assert_called_once_with(handler)